@@ -1,18 +1,48 @@
 # backend/app.py
-from flask import Flask, jsonify
-from flask_cors import CORS
 from .config import Config
+from .startup_profile import ImportTimer, StartupProfiler
+_import_timer = ImportTimer().start() if Config.STARTUP_PROFILE else None # Started before the imports it measures
+from flask import Flask, jsonify, request, Response
+from flask.helpers import get_debug_flag
+from werkzeug.serving import is_running_from_reloader
+import click
+from flask_cors import CORS
 from .services.db_service import init_app as init_db_app
 from .services.s3_service import S3Service
 from .services.textract_service import TextractService
 from .services.db_service import DbService
 from .services.openai_service import OpenAIService
+from .services.ingestion_service import IngestionService
+from .services.textract_poller import TextractPoller
+from .services.bulk_upload_service import BulkUploadService
+from .commands import register_commands
+from .services.cache_service import CacheService
+from .services.insight_service import InsightService
+from .services.nlu_service import NluService
+from .services.report_service import ReportService
+from .services.pdf_render_service import PdfRenderService
+from .services.tracing import Tracer
+from .services.metrics import MetricsService, CONTENT_TYPE as METRICS_CONTENT_TYPE
 import logging
 import sys 
 
+def _should_start_background_workers(app):
+    """
+    The ingestion workers and Textract poller run only where INGESTION_WORKERS_ENABLED is set, and never inside a
+    `flask <command>` CLI run (reparse, backfills, ...). Under `flask run` with the reloader they run in the serving
+    child only, not in the file-watching parent.
+    """
+    if app.config.get('FLASK_ENV') == 'testing' or not app.config.get('INGESTION_WORKERS_ENABLED'): return False
+    cli_context = click.get_current_context(silent=True)
+    if cli_context is None: return True # WSGI server (gunicorn, ...)
+    if cli_context.command.name != 'run': return False
+    reload = cli_context.params.get('reload')
+    return not (get_debug_flag() if reload is None else reload) or is_running_from_reloader()
+
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
+    profiler = StartupProfiler(app.config.get('STARTUP_PROFILE'), _import_timer)
 
     log_level = logging.DEBUG if app.debug else logging.INFO
     for handler in logging.root.handlers[:]: logging.root.removeHandler(handler) # Clear previous handlers
@@ -27,7 +57,9 @@ def create_app(config_class=Config):
         'backend.routes.chat_routes', 'backend.services.openai_service',
         'backend.services.db_service', 'backend.services.s3_service',
         'backend.services.textract_service', 'backend.routes.invoice_routes',
-        'backend.routes.analytics_routes', 'backend.routes.report_routes' # ADDED
+        'backend.routes.analytics_routes', 'backend.routes.report_routes', # ADDED
+        'backend.services.ingestion_service', 'backend.services.local_aws_stubs', 'backend.services.db_pool', 'backend.services.bulk_upload_service',
+        'backend.services.textract_poller', 'backend.services.textract_documents', 'backend.services.cache_service', 'backend.services.insight_service', 'backend.services.nlu_service', 'backend.services.report_service', 'backend.services.pdf_render_service', 'backend.services.tracing', 'backend.services.metrics'
     ]
     for logger_name in loggers_to_set: logging.getLogger(logger_name).setLevel(log_level)
     for lib_logger_name in ['botocore', 'boto3', 'urllib3', 's3transfer']: logging.getLogger(lib_logger_name).setLevel(logging.WARNING)
@@ -37,18 +69,60 @@ def create_app(config_class=Config):
     app.logger.info(f"FLASK_ENV: {app.config.get('FLASK_ENV')}, App Debug Mode: {app.debug}")
     app.logger.info(f"Root logging level effective: {logging.getLevelName(logging.getLogger().getEffectiveLevel())}")
     
-    CORS(app, resources={r"/api/*": {"origins": "*"}})
+    CORS(app, resources={r"/api/*": {"origins": "*"}}, expose_headers=["X-Next-Cursor", "Retry-After", "X-Request-ID", "Server-Timing"])
     init_db_app(app)
+    profiler.mark("flask app, logging, CORS")
 
     if not hasattr(app, 'extensions'): app.extensions = {}
     service_init_errors_list = [] 
+    try: app.extensions['tracer'] = Tracer(app.config); app.extensions['tracer'].init_app(app) # First, so background workers started below are traced too
+    except Exception as e: app.logger.error(f"Error initializing Tracer, requests will not be traced: {e}", exc_info=True); service_init_errors_list.append("Tracer:FAILED_INIT")
+    profiler.mark("Tracer")
+    try: app.extensions['metrics_service'] = MetricsService(app.config); app.extensions['metrics_service'].init_app(app)
+    except Exception as e: app.logger.error(f"Error initializing MetricsService, /api/metrics is unavailable: {e}", exc_info=True); service_init_errors_list.append("MetricsService:FAILED_INIT")
+    profiler.mark("MetricsService")
     
     try: app.extensions['db_service'] = DbService(app.config); app.logger.info("DbService instance created.")
     except Exception as e: app.logger.error(f"Error initializing DbService: {e}", exc_info=True); service_init_errors_list.append("DbService:FAILED_INIT")
-    try: app.extensions['s3_service'] = S3Service(app.config); app.logger.info("S3Service instance created.")
+    profiler.mark("DbService")
+    try: app.extensions['cache_service'] = CacheService(app.config, version_store=app.extensions.get('db_service')) # Data version shared through the DB
+    except Exception as e: # e.g. CACHE_BACKEND=redis without the redis package: run uncached rather than not at all
+        app.logger.error(f"Error initializing CacheService, analytics reads will not be cached: {e}", exc_info=True); service_init_errors_list.append("CacheService:FAILED_INIT")
+    if app.extensions.get('db_service') and app.extensions.get('cache_service'): app.extensions['db_service'].attach_cache(app.extensions['cache_service'])
+    profiler.mark("CacheService")
+    if app.config.get('USE_LOCAL_AWS_STUBS'):
+        from .services.local_aws_stubs import LocalS3Service, LocalTextractService
+        s3_service_class, textract_service_class = LocalS3Service, LocalTextractService
+        app.logger.warning("USE_LOCAL_AWS_STUBS is enabled: S3 and Textract are replaced by local stand-ins.")
+    else: s3_service_class, textract_service_class = S3Service, TextractService
+    try: app.extensions['s3_service'] = s3_service_class(app.config); app.logger.info("S3Service instance created.")
     except Exception as e: app.logger.error(f"Error initializing S3Service: {e}", exc_info=True); service_init_errors_list.append("S3Service:FAILED_INIT")
-    try: app.extensions['textract_service'] = TextractService(app.config); app.logger.info("TextractService instance created.")
+    profiler.mark("S3Service")
+    try: app.extensions['textract_service'] = textract_service_class(app.config); app.logger.info("TextractService instance created.")
     except Exception as e: app.logger.error(f"Error initializing TextractService: {e}", exc_info=True); service_init_errors_list.append("TextractService:FAILED_INIT")
+    profiler.mark("TextractService")
+
+    start_background_workers = _should_start_background_workers(app)
+    if not start_background_workers: app.logger.info("Background ingestion workers are not started in this process (INGESTION_WORKERS_ENABLED, CLI or reloader parent).")
+    if app.extensions.get('db_service') and app.extensions.get('textract_service'):
+        try:
+            app.extensions['textract_poller'] = TextractPoller(app.config, app.extensions['db_service'], app.extensions['textract_service'])
+            if start_background_workers: app.extensions['textract_poller'].start()
+            app.logger.info("TextractPoller instance created.")
+        except Exception as e: app.logger.error(f"Error initializing TextractPoller: {e}", exc_info=True); service_init_errors_list.append("TextractPoller:FAILED_INIT")
+        profiler.mark("TextractPoller")
+    if all(app.extensions.get(name) for name in ['db_service', 's3_service', 'textract_service', 'textract_poller']):
+        try:
+            app.extensions['ingestion_service'] = IngestionService(app.config, app.extensions['db_service'], app.extensions['s3_service'], app.extensions['textract_service'], app.extensions['textract_poller'])
+            if start_background_workers: app.extensions['ingestion_service'].start()
+            app.logger.info("IngestionService instance created.")
+        except Exception as e: app.logger.error(f"Error initializing IngestionService: {e}", exc_info=True); service_init_errors_list.append("IngestionService:FAILED_INIT")
+        profiler.mark("IngestionService")
+    else: app.logger.warning("IngestionService not initialized: requires DbService, S3Service, TextractService and TextractPoller.")
+    if app.extensions.get('ingestion_service'):
+        try: app.extensions['bulk_upload_service'] = BulkUploadService(app.config, app.extensions['db_service'], app.extensions['s3_service'], app.extensions['ingestion_service']); app.logger.info("BulkUploadService instance created.")
+        except Exception as e: app.logger.error(f"Error initializing BulkUploadService: {e}", exc_info=True); service_init_errors_list.append("BulkUploadService:FAILED_INIT")
+        profiler.mark("BulkUploadService")
 
     openai_api_key = app.config.get('OPENAI_API_KEY')
     if openai_api_key and openai_api_key != 'sk-YOUR_ACTUAL_OPENAI_API_KEY_HERE':
@@ -62,6 +136,28 @@ def create_app(config_class=Config):
     else:
         app.logger.warning("OpenAIService not initialized: OPENAI_API_KEY is missing or is placeholder.")
         app.extensions['openai_service'] = None
+    profiler.mark("OpenAIService")
+    if app.extensions.get('db_service'): # Stored insights/reports stay servable even when OpenAI is not configured
+        try: app.extensions['insight_service'] = InsightService(app.config, app.extensions['db_service'], app.extensions.get('openai_service')); app.logger.info("InsightService instance created.")
+        except Exception as e: app.logger.error(f"Error initializing InsightService: {e}", exc_info=True); service_init_errors_list.append("InsightService:FAILED_INIT")
+        profiler.mark("InsightService")
+        try: app.extensions['report_service'] = ReportService(app.config, app.extensions['db_service'], app.extensions.get('openai_service')); app.logger.info("ReportService instance created.")
+        except Exception as e: app.logger.error(f"Error initializing ReportService: {e}", exc_info=True); service_init_errors_list.append("ReportService:FAILED_INIT")
+        profiler.mark("ReportService")
+    try: app.extensions['pdf_render_service'] = PdfRenderService(app.config, job_store=app.extensions.get('db_service')); app.logger.info("PdfRenderService instance created.") # Job state shared through the DB
+    except Exception as e: app.logger.error(f"Error initializing PdfRenderService: {e}", exc_info=True); service_init_errors_list.append("PdfRenderService:FAILED_INIT")
+    profiler.mark("PdfRenderService")
+    try: app.extensions['nlu_service'] = NluService(app.config, app.extensions.get('db_service')); app.logger.info("NluService instance created.")
+    except Exception as e: app.logger.error(f"Error initializing NluService: {e}", exc_info=True); service_init_errors_list.append("NluService:FAILED_INIT")
+    profiler.mark("NluService")
+    
+    if app.config.get('PRELOAD_CLIENTS'): # SDK clients are otherwise built on first use (see services/lazy_client.py)
+        for service_name, client_attribute in (('s3_service', 's3_client'), ('textract_service', 'textract_client'), ('openai_service', 'client')):
+            service = app.extensions.get(service_name)
+            if service is None or not hasattr(type(service), client_attribute): continue
+            try: getattr(service, client_attribute)
+            except Exception as e: app.logger.error(f"Error preloading {service_name}.{client_attribute}: {e}", exc_info=True); service_init_errors_list.append(f"{type(service).__name__}:CLIENT_PRELOAD_FAILED")
+        profiler.mark("client preload")
     
     if service_init_errors_list: app.logger.error(f"Services failed to initialize: {', '.join(service_init_errors_list)}")
     else: app.logger.info("All configured InvoxAI services appear to have initialized successfully.")
@@ -76,15 +172,14 @@ def create_app(config_class=Config):
     app.register_blueprint(analytics_bp, url_prefix='/api/analytics')
     app.register_blueprint(report_bp, url_prefix='/api/reports') # <-- REGISTER IT
     app.logger.info("Blueprints registered.")
+    register_commands(app)
+    profiler.mark("blueprints, CLI commands")
 
     @app.route('/api/health', methods=['GET'])
     def health_check():
-        from .services.db_service import get_db; db_ok = False; db_error = None
-        try:
-            conn = get_db();
-            if conn and conn.is_connected(): cursor = conn.cursor(); cursor.execute("SELECT 1"); cursor.fetchone(); cursor.close(); db_ok = True
-            else: db_error = "DB connection not active or failed to get."
-        except Exception as e: db_error = str(e); app.logger.error(f"Health check DB error: {e}", exc_info=True)
+        db_service = app.extensions.get('db_service'); db_ok = False; db_error = None
+        if db_service: db_ok, db_error = db_service.check_connection(max_age_seconds=app.config.get('HEALTH_DB_PROBE_TTL_SECONDS', 5))
+        else: db_error = "DbService not initialized."
         current_service_status = {
             "db_service": "OK" if app.extensions.get('db_service') else "FAIL",
             "s3_service": "OK" if app.extensions.get('s3_service') else "FAIL",
@@ -92,7 +187,40 @@ def create_app(config_class=Config):
             "openai_service": "OK" if app.extensions.get('openai_service') else ("NOT_CONFIGURED" if not app.config.get('OPENAI_API_KEY') or app.config.get('OPENAI_API_KEY') == 'sk-YOUR_ACTUAL_OPENAI_API_KEY_HERE' else "FAIL_CONFIGURED")
         }
         overall_status = "healthy" if db_ok and all(s == "OK" or "NOT_CONFIGURED" in s for s in current_service_status.values()) else "degraded"
-        return jsonify({"status": overall_status, "message": "InvoxAI Backend is running!", "database_connected": db_ok, "database_error": db_error, "services": current_service_status}), 200
+        db_pool_stats = db_service.get_pool_stats() if db_service else None
+        vendor_index_stats = db_service.get_vendor_index_stats() if db_service else None
+        ingestion_service = app.extensions.get('ingestion_service')
+        ingestion_stats = ingestion_service.stats() if ingestion_service else None
+        textract_poller = app.extensions.get('textract_poller')
+        poller_stats = textract_poller.stats() if textract_poller else None
+        bulk_upload_service = app.extensions.get('bulk_upload_service')
+        bulk_upload_stats = bulk_upload_service.stats() if bulk_upload_service else None
+        cache_service = app.extensions.get('cache_service')
+        cache_stats = cache_service.stats() if cache_service else None
+        insight_service = app.extensions.get('insight_service')
+        insight_stats = insight_service.stats() if insight_service else None
+        nlu_service = app.extensions.get('nlu_service')
+        nlu_stats = nlu_service.stats() if nlu_service else None
+        report_service = app.extensions.get('report_service')
+        report_stats = report_service.stats() if report_service else None
+        pdf_render_service = app.extensions.get('pdf_render_service')
+        pdf_render_stats = pdf_render_service.stats() if pdf_render_service else None
+        tracer = app.extensions.get('tracer')
+        tracing_stats = tracer.stats() if tracer else None
+        metrics_service = app.extensions.get('metrics_service')
+        metrics_stats = metrics_service.stats() if metrics_service else None
+        return jsonify({"status": overall_status, "message": "InvoxAI Backend is running!", "database_connected": db_ok, "database_error": db_error, "database_pool": db_pool_stats, "vendor_index": vendor_index_stats, "ingestion_queue": ingestion_stats, "textract_poller": poller_stats, "bulk_uploads": bulk_upload_stats, "cache": cache_stats, "ai_insights": insight_stats, "chat_nlu": nlu_stats, "reports": report_stats, "pdf_render": pdf_render_stats, "tracing": tracing_stats, "metrics": metrics_stats, "services": current_service_status}), 200
+
+
+    @app.route('/api/metrics', methods=['GET'])
+    def metrics():
+        metrics_service = app.extensions.get('metrics_service')
+        if not metrics_service or not metrics_service.enabled: return jsonify({"error": "Metrics are not enabled."}), 404
+        if metrics_service.bearer_token and request.headers.get('Authorization') != f"Bearer {metrics_service.bearer_token}":
+            return jsonify({"error": "Unauthorized."}), 401
+        return Response(metrics_service.render(app.extensions), content_type=METRICS_CONTENT_TYPE)
 
+    profiler.mark("health and metrics routes")
+    profiler.report(app.logger)
     app.logger.info("InvoxAI App setup complete. Ready for requests.")
     return app
\ No newline at end of file
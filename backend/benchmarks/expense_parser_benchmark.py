@@ -0,0 +1,124 @@
+# backend/benchmarks/expense_parser_benchmark.py
+# Replays recorded GetExpenseAnalysis responses through the Textract expense parser: documents/sec and per-field accuracy.
+# Run from the project root: python -m backend.benchmarks.expense_parser_benchmark [--fixtures DIR] [--repeat 200] [--aliases ...] [--locale-hints]
+# Also times amount/date normalisation (services/textract_values.py) over the corpus values: the general rules and dateutil
+# for every value (what the parser did before the fast paths), fast paths without the memo, and fast paths + memo.
+# A fixture is a recorded response `<name>.json` (ExpenseDocuments, as LOCAL_TEXTRACT_FIXTURE uses) with the hand-checked
+# values in `<name>.expected.json`: any parsed field name, plus `line_item_count`. Fixtures without one are only timed.
+import os
+import sys
+import glob
+import json
+import time
+import logging
+import argparse
+from dateutil import parser as date_parser
+from backend.services import textract_values
+from backend.services.expense_parser import ExpenseFieldMapper, SUMMARY_FIELD_ALIASES, LINE_ITEM_FIELD_ALIASES, normalize_summary_key, normalize_line_item_key
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'textract')
+
+def load_corpus(fixtures_dir):
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(fixtures_dir, '*.json'))):
+        if path.endswith('.expected.json'): continue
+        with open(path, 'r', encoding='utf-8') as fixture_file: response = json.load(fixture_file)
+        expected_path = path[:-len('.json')] + '.expected.json'
+        expected = None
+        if os.path.exists(expected_path):
+            with open(expected_path, 'r', encoding='utf-8') as expected_file: expected = json.load(expected_file)
+        corpus.append((os.path.basename(path)[:-len('.json')], response.get('ExpenseDocuments', []), expected))
+    return corpus
+
+def field_value(parsed, field):
+    if field == 'line_item_count': return len(parsed.get('line_items') or [])
+    value = parsed.get(field)
+    return None if value is None else str(value)
+
+def corpus_values(corpus):
+    """(amount strings, date strings) of every summary and line item field the parser normalises, in document order."""
+    amount_keys = {key for field in ("total_amount", "subtotal", "tax") for key in SUMMARY_FIELD_ALIASES[field]}
+    date_keys = {key for field in ("invoice_date", "due_date") for key in SUMMARY_FIELD_ALIASES[field]}
+    line_amount_keys = {key for field in ("amount", "quantity", "unit_price") for key in LINE_ITEM_FIELD_ALIASES[field]}
+    amounts, dates = [], []
+    for _, expense_documents, _ in corpus:
+        for doc in expense_documents[:1]:
+            for field in doc.get('SummaryFields', []):
+                key, value = normalize_summary_key(field.get('Type', {}).get('Text') or ''), field.get('ValueDetection', {}).get('Text')
+                if value and key in amount_keys: amounts.append(value)
+                elif value and key in date_keys: dates.append(value)
+            for group in doc.get('LineItemGroups', []):
+                for line_item in group.get('LineItems', []):
+                    for field in line_item.get('LineItemExpenseFields', []):
+                        value = field.get('ValueDetection', {}).get('Text')
+                        if value and normalize_line_item_key(field.get('Type', {}).get('Text') or '') in line_amount_keys: amounts.append(value)
+    return amounts, dates
+
+def baseline_amount(value_text):
+    cleaned_val = textract_values.clean_amount_text(value_text.replace('$', '').replace('£', '').replace('€', '').strip())
+    return textract_values.Decimal(cleaned_val) if cleaned_val not in ('', '-', '.') else None
+
+def baseline_date(raw_date_str):
+    return date_parser.parse(raw_date_str, dayfirst='/' in raw_date_str).strftime('%Y-%m-%d')
+
+def time_values(label, amounts, dates, parse_amount, parse_date, repeat):
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        results = [parse_amount(value) for value in amounts] + [parse_date(value) for value in dates]
+    elapsed = time.perf_counter() - started_at
+    count = repeat * (len(amounts) + len(dates))
+    print(f"  {label:<22} {count / elapsed:>12,.0f} values/s")
+    return results
+
+def benchmark_values(corpus, repeat):
+    amounts, dates = corpus_values(corpus)
+    if not amounts and not dates: return
+    print(f"Normalisation: {len(amounts)} amounts, {len(dates)} dates per pass ({len(set(amounts))} distinct amounts)")
+    baseline = time_values("general rules/dateutil", amounts, dates, baseline_amount, baseline_date, repeat)
+    fast = time_values("fast paths", amounts, dates, lambda v: textract_values._normalize_amount.__wrapped__(v, False)[0],
+                       lambda v: textract_values._normalize_date.__wrapped__(v, '/' in v)[0], repeat)
+    textract_values.clear_caches()
+    memoised = time_values("fast paths + memo", amounts, dates, textract_values.parse_amount, textract_values.parse_date, repeat)
+    if not baseline == fast == memoised: sys.exit("Normalisation results differ between modes")
+    print(f"  memo: {textract_values.cache_stats()['amounts']['hits']:,} amount hits, {textract_values.cache_stats()['dates']['hits']:,} date hits")
+
+def main():
+    parser = argparse.ArgumentParser(description="Textract expense parser throughput and accuracy on recorded fixtures.")
+    parser.add_argument('--fixtures', default=DEFAULT_FIXTURES, help="Directory of recorded GetExpenseAnalysis JSON responses.")
+    parser.add_argument('--repeat', type=int, default=200, help="Passes over the corpus for the timing run.")
+    parser.add_argument('--aliases', default='', help="Extra key aliases, same format as TEXTRACT_FIELD_ALIASES.")
+    parser.add_argument('--locale-hints', action='store_true', help="Parse with per-document locale hints (TEXTRACT_LOCALE_HINTS).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR) # Keep the parser's per-document INFO lines out of the timing
+    corpus = load_corpus(args.fixtures)
+    if not corpus: sys.exit(f"No fixtures found in {args.fixtures}")
+    mapper = ExpenseFieldMapper(args.aliases, locale_hints=args.locale_hints)
+
+    field_hits, field_totals, mismatches = {}, {}, []
+    for name, expense_documents, expected in corpus:
+        if not expected: continue
+        parsed = mapper.parse(expense_documents)
+        for field, expected_value in expected.items():
+            actual = field_value(parsed, field)
+            expected_value = expected_value if field == 'line_item_count' or expected_value is None else str(expected_value)
+            field_totals[field] = field_totals.get(field, 0) + 1
+            if actual == expected_value: field_hits[field] = field_hits.get(field, 0) + 1
+            else: mismatches.append(f"{name}.{field}: expected {expected_value!r}, got {actual!r}")
+
+    line_items = sum(len(group.get('LineItems', [])) for _, docs, _ in corpus for doc in docs[:1] for group in doc.get('LineItemGroups', []))
+    started_at = time.perf_counter()
+    for _ in range(args.repeat):
+        for _, expense_documents, _ in corpus: mapper.parse(expense_documents)
+    elapsed = time.perf_counter() - started_at
+    documents = args.repeat * len(corpus)
+    print(f"{len(corpus)} fixture(s), {line_items} line items per pass, {args.repeat} passes")
+    print(f"{documents} documents in {elapsed:.2f}s -> {documents / elapsed:,.0f} documents/s, {elapsed / documents * 1e6:,.0f} us/document")
+    if field_totals:
+        print("Per-field accuracy:")
+        for field, total in field_totals.items(): print(f"  {field:<20} {field_hits.get(field, 0)}/{total}")
+    for mismatch in mismatches: print(f"  MISMATCH {mismatch}")
+    benchmark_values(corpus, max(1, args.repeat // 10))
+    if mismatches: sys.exit(1)
+
+if __name__ == '__main__':
+    main()
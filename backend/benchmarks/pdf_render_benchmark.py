@@ -0,0 +1,71 @@
+# backend/benchmarks/pdf_render_benchmark.py
+# PDF export throughput for a synthetic multi-page monthly report.
+# Run from the project root: python -m backend.benchmarks.pdf_render_benchmark [--pages 50] [--renders 6] [--workers 2]
+#   cold - what the export route used to do per request: new FontConfiguration, CSS re-parsed, Markdown converter built
+#   warm - one WarmPdfRenderer reused in this process (what each pool worker does)
+#   pool - PdfRenderService with --workers processes, all renders submitted at once
+import time
+import argparse
+import markdown
+from backend.services.pdf_render_service import PdfRenderService, WarmPdfRenderer, REPORT_PDF_CSS, MARKDOWN_EXTENSIONS
+
+ROWS_PER_PAGE = 28 # Invoice table rows that fit on an A4 page with the report stylesheet (approximate)
+
+def build_report_markdown(pages):
+    """A report shaped like the AI monthly report: summary sections followed by a long invoice appendix table."""
+    parts = ["# Monthly Expense Report - May 2024", "## Executive Summary",
+             "Total spend for the month was $1,234,567.89 across the invoices below. " * 6,
+             "## Top Vendors by Spend", "| Vendor | Total Spent | # Invoices |", "|---|---|---|"]
+    parts += [f"| Vendor {i:03d} | ${(i * 137.31) % 9000:,.2f} | {i % 17 + 1} |" for i in range(20)]
+    parts += ["## Invoice Detail Summary (Appendix)", "| ID | Vendor | Date | Total Amount | Category |", "|---|---|---|---|---|"]
+    parts += [f"| {1000 + i} | Vendor {i % 97:03d} Supplies Ltd | 2024-05-{i % 28 + 1:02d} | ${(i * 71.13) % 5000:,.2f} | Office **{i % 9}** |" for i in range(pages * ROWS_PER_PAGE)]
+    return "\n".join(parts)
+
+def render_cold(report_markdown):
+    from weasyprint import HTML, CSS
+    try: from weasyprint.text.fonts import FontConfiguration
+    except ImportError: from weasyprint.fonts import FontConfiguration
+    font_config = FontConfiguration()
+    html_content = markdown.markdown(report_markdown, extensions=MARKDOWN_EXTENSIONS)
+    document = HTML(string=f"<html><head><meta charset='utf-8'></head><body>{html_content}</body></html>", base_url=".").render(
+        stylesheets=[CSS(string=REPORT_PDF_CSS, font_config=font_config)], font_config=font_config)
+    document.write_pdf()
+    return len(document.pages)
+
+def report(label, pages, seconds, renders):
+    print(f"{label:<6} {renders} render(s), {pages} page(s) in {seconds:.2f}s -> {pages / seconds:.1f} pages/s, {seconds / renders * 1000:.0f} ms/render")
+
+def wait_for(service, jobs):
+    while any(service.get_job(job['job_id'])['status'] == "queued" for job in jobs): time.sleep(0.01)
+    return [service.get_job(job['job_id']) for job in jobs]
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF export throughput for a synthetic multi-page report.")
+    parser.add_argument('--pages', type=int, default=50, help="Target pages per report.")
+    parser.add_argument('--renders', type=int, default=6, help="Renders per mode.")
+    parser.add_argument('--workers', type=int, default=2, help="Render processes for the pool mode.")
+    args = parser.parse_args()
+    report_markdown = build_report_markdown(args.pages)
+    print(f"Synthetic report: {len(report_markdown):,} chars of Markdown, target {args.pages} pages.")
+
+    started_at = time.perf_counter(); pages = sum(render_cold(report_markdown) for _ in range(args.renders))
+    report("cold", pages, time.perf_counter() - started_at, args.renders)
+
+    renderer = WarmPdfRenderer() # Warm-up cost (fonts, stylesheet) is paid once, outside the timed loop, as in a pool worker
+    renderer.render("# warm-up", "warm-up")
+    started_at = time.perf_counter(); pages = sum(renderer.render(report_markdown, "bench")['pages'] for _ in range(args.renders))
+    report("warm", pages, time.perf_counter() - started_at, args.renders)
+
+    service = PdfRenderService({'PDF_RENDER_WORKERS': args.workers, 'PDF_RENDER_MAX_PENDING': args.renders + args.workers, 'PDF_RENDER_TIMEOUT_SECONDS': 600})
+    try:
+        wait_for(service, [service.submit("# warm-up", "warm-up") for _ in range(args.workers)]) # Spawn and warm the workers before timing
+        started_at = time.perf_counter()
+        jobs = wait_for(service, [service.submit(report_markdown, f"bench-{i}") for i in range(args.renders)])
+        elapsed = time.perf_counter() - started_at
+        failed = [job['error'] for job in jobs if job['status'] != "done"]
+        if failed: raise SystemExit(f"Pool renders failed: {failed[0]}")
+        report("pool", sum(job['pages'] for job in jobs), elapsed, args.renders)
+    finally: service.shutdown()
+
+if __name__ == '__main__':
+    main()
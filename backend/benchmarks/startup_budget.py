@@ -0,0 +1,44 @@
+# backend/benchmarks/startup_budget.py
+# Import-time budget check for the backend; tests/test_startup_budget.py runs it (python -m pytest tests).
+# Run from the project root: python -m backend.benchmarks.startup_budget [--budget-ms 600] [--top 10]
+# Fails (exit 1) if importing backend.app plus create_app() exceeds the budget, or if a heavy SDK that should only be
+# imported on first use (see services/lazy_client.py) was pulled in during startup.
+import os
+import sys
+import time
+import argparse
+from backend.startup_profile import ImportTimer
+
+DEFERRED_MODULES = ('openai', 'httpx', 'boto3', 'weasyprint', 'markdown') # Imported by the first request that needs them
+
+def main():
+    parser = argparse.ArgumentParser(description="Fails if backend startup exceeds an import-time budget.")
+    parser.add_argument('--budget-ms', type=float, default=600.0, help="Maximum time for importing backend.app and running create_app().")
+    parser.add_argument('--top', type=int, default=10, help="Slowest packages to print.")
+    args = parser.parse_args()
+    os.environ.setdefault('FLASK_ENV', 'testing') # No background pollers/workers
+    os.environ.setdefault('PRELOAD_CLIENTS', 'false')
+    already_loaded = [name for name in DEFERRED_MODULES if name in sys.modules]
+
+    import_timer = ImportTimer().start(); started_at = time.perf_counter()
+    try:
+        from backend.app import create_app
+        imported_at = time.perf_counter()
+        create_app()
+    finally: import_timer.stop()
+    finished_at = time.perf_counter()
+
+    total_ms = (finished_at - started_at) * 1000
+    print(f"Startup: import {(imported_at - started_at) * 1000:.0f} ms + create_app {(finished_at - imported_at) * 1000:.0f} ms = {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    for package, seconds in list(import_timer.by_package().items())[:args.top]: print(f"  {package:<28} {seconds * 1000:8.1f} ms")
+
+    failures = []
+    if total_ms > args.budget_ms: failures.append(f"startup took {total_ms:.0f} ms, over the {args.budget_ms:.0f} ms budget")
+    eager = [name for name in DEFERRED_MODULES if name in sys.modules and name not in already_loaded]
+    if eager: failures.append(f"imported at startup but should be deferred to first use: {', '.join(eager)}")
+    for failure in failures: print(f"FAIL: {failure}")
+    if failures: sys.exit(1)
+    print("OK")
+
+if __name__ == '__main__':
+    main()
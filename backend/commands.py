@@ -0,0 +1,211 @@
+# backend/commands.py
+# Maintenance commands, run with: flask invoices <command> (FLASK_APP="backend.app:create_app()")
+import os
+import json
+import time
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+import click
+from mysql.connector import Error
+from flask import current_app
+from flask.cli import AppGroup
+from .services.db_service import DbService
+from .services.ingestion_service import PARSED_FIELDS_TO_PERSIST
+from .services import reparse
+
+invoices_cli = AppGroup('invoices', help="Invoice data maintenance commands.")
+
+LEGACY_DOCUMENT_COLUMNS = ('parsed_data', 'full_textract_response') # Old JSON columns on the invoices table
+# invoices columns the re-parse can rewrite: what ingestion stores from the parser (see persist_expense_documents)
+REPARSE_COLUMNS = [key for key in PARSED_FIELDS_TO_PERSIST if key in DbService.INVOICE_TABLE_PARSED_COLUMNS]
+
+def _get_db_service():
+    db_service = current_app.extensions.get('db_service')
+    if not db_service: raise click.ClickException("DbService is not available, check the database configuration.")
+    return db_service
+
+@invoices_cli.command('backfill-documents')
+@click.option('--batch-size', default=200, show_default=True, help="Invoices per batch.")
+@click.option('--keep-legacy', is_flag=True, help="Copy only; leave the legacy columns populated.")
+@click.option('--drop-columns', is_flag=True, help="Drop the legacy columns once every row is copied.")
+def backfill_documents_command(batch_size, keep_legacy, drop_columns):
+    """Moves parsed_data / full_textract_response out of invoices into compressed invoice_documents rows."""
+    if drop_columns and keep_legacy: raise click.ClickException("--drop-columns cannot be combined with --keep-legacy.")
+    try: _backfill_documents(_get_db_service(), batch_size, keep_legacy, drop_columns)
+    except Error as e: raise click.ClickException(f"Database error during backfill (safe to rerun): {e}")
+
+def _backfill_documents(db_service, batch_size, keep_legacy, drop_columns):
+    existing_columns = {row['Field'] for row in (db_service.execute_query("SHOW COLUMNS FROM invoices", fetch_all=True) or [])}
+    legacy_columns = [c for c in LEGACY_DOCUMENT_COLUMNS if c in existing_columns]
+    if not legacy_columns: click.echo("No legacy document columns on invoices, nothing to backfill."); return
+
+    not_null = " OR ".join(f"`{c}` IS NOT NULL" for c in legacy_columns)
+    last_id = 0; invoices_done = 0; raw_total = 0; stored_total = 0; started_at = time.monotonic()
+    while True:
+        rows = db_service.execute_query(f"SELECT id, {', '.join(f'`{c}`' for c in legacy_columns)} FROM invoices WHERE id > %s AND ({not_null}) ORDER BY id ASC LIMIT %s",
+                                        (last_id, batch_size), fetch_all=True) or []
+        if not rows: break
+        document_rows = []
+        for row in rows:
+            for column in legacy_columns:
+                value = row.get(column)
+                if value is None: continue
+                try: payload = json.loads(value) if isinstance(value, (str, bytes, bytearray)) else value
+                except ValueError: click.echo(f"Invoice {row['id']}: {column} is not valid JSON, skipped.", err=True); continue
+                document_row = db_service.build_invoice_document_row(row['id'], column, payload)
+                raw_total += document_row[4]; stored_total += document_row[5]
+                document_rows.append(document_row)
+        if document_rows and not db_service.save_invoice_document_rows(document_rows):
+            raise click.ClickException(f"Failed to write documents for invoices {rows[0]['id']}..{rows[-1]['id']}; rerun to resume.")
+        ids = [row['id'] for row in rows]
+        if not keep_legacy:
+            placeholders = ", ".join(["%s"] * len(ids))
+            db_service.execute_query(f"UPDATE invoices SET {', '.join(f'`{c}` = NULL' for c in legacy_columns)} WHERE id IN ({placeholders})", tuple(ids))
+        last_id = ids[-1]; invoices_done += len(ids)
+        click.echo(f"Backfilled {invoices_done} invoice(s) (last id {last_id}).")
+
+    ratio = f"{stored_total / raw_total:.1%}" if raw_total else "n/a"
+    click.echo(f"Done: {invoices_done} invoice(s) in {time.monotonic() - started_at:.1f}s, {raw_total} -> {stored_total} bytes ({ratio} after pruning + compression).")
+    if drop_columns:
+        db_service.execute_query(f"ALTER TABLE invoices {', '.join(f'DROP COLUMN `{c}`' for c in legacy_columns)}")
+        click.echo(f"Dropped legacy column(s): {', '.join(legacy_columns)}.")
+
+@invoices_cli.command('rollups-rebuild')
+def rollups_rebuild_command():
+    """Recomputes invoice_rollups from a full scan of invoices."""
+    db_service = _get_db_service()
+    try: rollup_rows = db_service.rebuild_invoice_rollups()
+    except Error as e: raise click.ClickException(f"Rollup rebuild failed: {e}")
+    click.echo(f"Rebuilt invoice_rollups: {rollup_rows} row(s).")
+
+@invoices_cli.command('rollups-verify')
+@click.option('--rebuild-on-mismatch', is_flag=True, help="Rebuild the rollup if it differs from the full scan.")
+def rollups_verify_command(rebuild_on_mismatch):
+    """Checks invoice_rollups against a full GROUP BY scan of invoices (exit code 1 on mismatch)."""
+    db_service = _get_db_service()
+    try: mismatches = db_service.verify_invoice_rollups()
+    except Error as e: raise click.ClickException(f"Rollup verification failed: {e}")
+    if not mismatches: click.echo("invoice_rollups matches a full scan of invoices."); return
+    for mismatch in mismatches[:50]:
+        click.echo(f"{mismatch['key']}: expected (count, total, amount_count)={mismatch['expected']}, rollup={mismatch['actual']}")
+    click.echo(f"{len(mismatches)} rollup row(s) differ from the full scan.", err=True)
+    if rebuild_on_mismatch:
+        click.echo(f"Rebuilt invoice_rollups: {db_service.rebuild_invoice_rollups()} row(s).")
+    else: raise SystemExit(1)
+
+@invoices_cli.command('vendors-backfill')
+@click.option('--batch-size', default=500, show_default=True, help="Vendor names per UPDATE batch.")
+def vendors_backfill_command(batch_size):
+    """Resolves vendor_name to a canonical vendor_id for invoices that have none, then rebuilds invoice_rollups."""
+    db_service = _get_db_service()
+    try: _backfill_vendors(db_service, batch_size)
+    except Error as e: raise click.ClickException(f"Database error during vendor backfill (safe to rerun): {e}")
+
+def _backfill_vendors(db_service, batch_size):
+    rows = db_service.execute_query("SELECT DISTINCT vendor_name FROM invoices WHERE vendor_id IS NULL AND vendor_name IS NOT NULL AND vendor_name <> ''", fetch_all=True) or []
+    started_at = time.monotonic(); stats_before = db_service.get_vendor_index_stats()
+    updates = []
+    for row in rows:
+        vendor_id = db_service.resolve_vendor_id(row['vendor_name'])
+        if vendor_id is not None: updates.append((vendor_id, row['vendor_name']))
+    stats = db_service.get_vendor_index_stats(); new = {outcome: stats.get(f'resolved_{outcome}', 0) - stats_before.get(f'resolved_{outcome}', 0) for outcome in ('created', 'fuzzy')}
+    click.echo(f"Resolved {len(updates)} of {len(rows)} distinct vendor name(s) in {time.monotonic() - started_at:.2f}s: {new['created']} new vendor(s), {new['fuzzy']} fuzzy match(es).")
+    invoices_done = 0
+    for start in range(0, len(updates), batch_size):
+        # Invoices with that exact vendor_name; MySQL's case/accent-insensitive '=' only adds spellings with the same key
+        invoices_done += db_service.execute_many("UPDATE invoices SET vendor_id = %s WHERE vendor_id IS NULL AND vendor_name = %s", updates[start:start + batch_size])
+        click.echo(f"Linked {invoices_done} invoice(s) to their vendor.")
+    if invoices_done: click.echo(f"Rebuilt invoice_rollups: {db_service.rebuild_invoice_rollups()} row(s).")
+
+@invoices_cli.command('reparse')
+@click.option('--workers', default=max(1, (os.cpu_count() or 2) - 1), show_default=True, help="Parser processes (0 = parse in this process).")
+@click.option('--batch-size', default=200, show_default=True, help="Invoices per read, parse task and write transaction.")
+@click.option('--fields', default=",".join(REPARSE_COLUMNS), show_default=True, help="Comma separated invoices columns to rewrite.")
+@click.option('--dry-run', is_flag=True, help="Print what would change; write nothing.")
+@click.option('--show-diffs', default=20, show_default=True, help="Changed invoices to print in full with --dry-run.")
+@click.option('--force', is_flag=True, help="Rewrite every invoice, not only those whose fields changed.")
+@click.option('--checkpoint', default='reparse_checkpoint.json', show_default=True, type=click.Path(dir_okay=False), help="Progress file, written after each committed batch.")
+@click.option('--resume', is_flag=True, help="Continue after the last committed invoice in --checkpoint.")
+def reparse_command(workers, batch_size, fields, dry_run, show_diffs, force, checkpoint, resume):
+    """
+    Re-runs the current Textract parser over the responses stored in invoice_documents and writes changed fields back.
+    No AWS calls are made. Fields edited by hand since ingestion are overwritten too; check with --dry-run first.
+    """
+    columns = [c.strip() for c in fields.split(',') if c.strip()]
+    unknown = [c for c in columns if c not in REPARSE_COLUMNS]
+    if unknown or not columns: raise click.ClickException(f"--fields must be a subset of: {', '.join(REPARSE_COLUMNS)}.")
+    try: _reparse_invoices(_get_db_service(), columns, max(0, workers), max(1, batch_size), dry_run, show_diffs, force, checkpoint, resume)
+    except Error as e: raise click.ClickException(f"Database error during re-parse (rerun with --resume): {e}")
+
+def _completed_future(result):
+    future = Future(); future.set_result(result)
+    return future
+
+def _reparse_invoices(db_service, columns, workers, batch_size, dry_run, show_diffs, force, checkpoint_path, resume):
+    state = {"last_id": 0, "processed": 0, "updated": 0, "unchanged": 0, "failed": 0}
+    if resume:
+        saved = reparse.load_checkpoint(checkpoint_path)
+        if saved: state.update({k: saved[k] for k in state if k in saved}); click.echo(f"Resuming after invoice {state['last_id']} ({state['processed']} already processed).")
+        else: click.echo(f"No checkpoint at {checkpoint_path}, starting from the beginning.")
+    field_changes = Counter(); failures = []; diffs_shown = 0
+    read_seconds = parse_seconds = write_seconds = 0.0; processed_this_run = 0
+    worker_args = (current_app.config.get('TEXTRACT_FIELD_ALIASES'), current_app.config.get('TEXTRACT_LOCALE_HINTS'), db_service.document_compression_level)
+    executor = None
+    if workers > 0: executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=reparse.init_worker, initargs=worker_args)
+    else: reparse.init_worker(*worker_args)
+    click.echo(f"Re-parsing stored Textract responses with {workers or 'no'} worker process(es), batches of {batch_size}{' (dry run)' if dry_run else ''}.")
+
+    pending = deque(); after_id = state['last_id']; exhausted = False; started_at = time.monotonic()
+    try:
+        while True:
+            while not exhausted and len(pending) < max(1, workers) * 2: # Keep every worker busy while the oldest batch is written
+                read_started_at = time.monotonic()
+                rows = db_service.get_stored_textract_page(after_id, batch_size, columns)
+                read_seconds += time.monotonic() - read_started_at
+                if rows is None: raise click.ClickException(f"Failed to read invoices after id {after_id}; rerun with --resume.")
+                if not rows: exhausted = True; break
+                after_id = rows[-1]['id']
+                tasks = [(row['id'], row['encoding'], row['payload']) for row in rows]
+                current = {row['id']: {c: row.get(c) for c in columns} for row in rows} # Payloads are not kept in the parent
+                future = executor.submit(reparse.reparse_rows, tasks, columns) if executor else _completed_future(reparse.reparse_rows(tasks, columns))
+                pending.append((current, future))
+            if not pending: break
+
+            current, future = pending.popleft() # Batches are written in id order, so the checkpoint is always a safe resume point
+            results, batch_parse_seconds = future.result(); parse_seconds += batch_parse_seconds
+            updates = []
+            for invoice_id, values, document_row, error in results:
+                if error: state['failed'] += 1; failures.append((invoice_id, error)); continue
+                changes = reparse.changed_columns(current[invoice_id], values, columns)
+                field_changes.update(changes.keys())
+                if not changes and not force: state['unchanged'] += 1; continue
+                updates.append((invoice_id, values, document_row))
+                if dry_run and changes and diffs_shown < show_diffs:
+                    diffs_shown += 1
+                    click.echo(f"Invoice {invoice_id}: " + "; ".join(f"{c} {old!r} -> {new!r}" for c, (old, new) in changes.items()))
+            if updates and not dry_run:
+                write_started_at = time.monotonic()
+                if db_service.apply_reparsed_fields(updates, columns) is None:
+                    raise click.ClickException(f"Failed to write invoices {updates[0][0]}..{updates[-1][0]}; rerun with --resume.")
+                write_seconds += time.monotonic() - write_started_at
+            state['updated'] += len(updates); state['processed'] += len(results); processed_this_run += len(results)
+            state['last_id'] = max(current)
+            if not dry_run: reparse.save_checkpoint(checkpoint_path, state)
+            elapsed = time.monotonic() - started_at
+            click.echo(f"Processed {state['processed']} invoice(s) (last id {state['last_id']}), {processed_this_run / elapsed:.1f}/s.")
+    finally:
+        if executor: executor.shutdown(wait=True, cancel_futures=True)
+
+    elapsed = time.monotonic() - started_at
+    verb = "would be updated" if dry_run else "updated"
+    click.echo(f"Done: {processed_this_run} invoice(s) in {elapsed:.1f}s ({processed_this_run / elapsed if elapsed else 0:.1f}/s); "
+               f"in total {state['updated']} {verb}, {state['unchanged']} unchanged, {state['failed']} failed.")
+    if field_changes: click.echo("Changed fields: " + ", ".join(f"{c} {n}" for c, n in field_changes.most_common()))
+    click.echo(f"Time: DB read {read_seconds:.1f}s, parse {parse_seconds:.1f}s over {max(1, workers)} process(es), DB write {write_seconds:.1f}s.")
+    for invoice_id, error in failures[:20]: click.echo(f"Invoice {invoice_id} could not be re-parsed: {error}", err=True)
+    if dry_run: click.echo("Dry run: nothing was written.")
+    elif os.path.exists(checkpoint_path): os.remove(checkpoint_path) # Finished; the next run starts from the beginning
+
+def register_commands(app):
+    app.cli.add_command(invoices_cli)
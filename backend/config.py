@@ -12,6 +12,8 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'default-fallback-secret-key-please-change')
     DEBUG = os.environ.get('FLASK_ENV') == 'development'
     FLASK_ENV = os.environ.get('FLASK_ENV', 'production')
+    STARTUP_PROFILE = os.environ.get('STARTUP_PROFILE', 'false').lower() == 'true' # Log import and service init times per module at startup
+    PRELOAD_CLIENTS = os.environ.get('PRELOAD_CLIENTS', 'false').lower() == 'true' # Build boto3/OpenAI clients at startup instead of on first use
 
     AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
     AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
@@ -25,12 +27,103 @@ class Config:
     DB_DATABASE = os.environ.get('DB_DATABASE')
     DB_USERNAME = os.environ.get('DB_USERNAME')
     DB_PASSWORD = os.environ.get('DB_PASSWORD')
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5)) # Idle connections kept open
+    DB_POOL_MAX_OVERFLOW = int(os.environ.get('DB_POOL_MAX_OVERFLOW', 10)) # Extra connections allowed under load
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30)) # Seconds to wait for a free connection
+    DB_POOL_RECYCLE_SECONDS = int(os.environ.get('DB_POOL_RECYCLE_SECONDS', 1800)) # Replace connections older than this (0 = never)
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true' # Health-check connections on checkout
 
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 
+    # Generated AI insights reused while their prompt fingerprint is unchanged (services/insight_service.py)
+    AI_INSIGHTS_STALE_WHILE_REVALIDATE = os.environ.get('AI_INSIGHTS_STALE_WHILE_REVALIDATE', 'false').lower() == 'true' # Serve the last insight, regenerate in background
+    AI_INSIGHTS_KEEP_PER_TYPE = int(os.environ.get('AI_INSIGHTS_KEEP_PER_TYPE', 20)) # Older insights are pruned
+
+    # Local rule-based NLU for /api/chat/ (services/nlu_service.py); OpenAI NLU only below the confidence threshold
+    NLU_LOCAL_MIN_CONFIDENCE = float(os.environ.get('NLU_LOCAL_MIN_CONFIDENCE', 0.75)) # 1.0 = only fully understood queries skip OpenAI
+    NLU_CACHE_MAX_ENTRIES = int(os.environ.get('NLU_CACHE_MAX_ENTRIES', 256)) # Normalised query -> NLU result (0 disables)
+    NLU_VENDOR_REFRESH_SECONDS = float(os.environ.get('NLU_VENDOR_REFRESH_SECONDS', 300)) # How often known vendor names are reloaded
+
+    # Canonical vendors (services/vendor_index.py): Textract vendor names resolved to vendors.id at ingest
+    VENDOR_MATCH_THRESHOLD = float(os.environ.get('VENDOR_MATCH_THRESHOLD', 0.7)) # Trigram similarity (0-1) for a new spelling to join a known vendor
+    VENDOR_INDEX_REFRESH_SECONDS = float(os.environ.get('VENDOR_INDEX_REFRESH_SECONDS', 300)) # How often the in-memory index reloads vendors added by other workers
+
+    # AI report generation (services/report_service.py)
+    REPORT_STREAM_HEARTBEAT_SECONDS = float(os.environ.get('REPORT_STREAM_HEARTBEAT_SECONDS', 10)) # SSE heartbeat while the model is silent, keeps proxies from timing out
+
+    # PDF export rendering (services/pdf_render_service.py)
+    PDF_RENDER_WORKERS = int(os.environ.get('PDF_RENDER_WORKERS', 2)) # WeasyPrint render processes (0 = one in-process render thread)
+    PDF_RENDER_MAX_PENDING = int(os.environ.get('PDF_RENDER_MAX_PENDING', 8)) # Queued + running renders before new ones get 503 / Retry-After
+    PDF_RENDER_JOB_TTL_SECONDS = float(os.environ.get('PDF_RENDER_JOB_TTL_SECONDS', 600)) # How long finished render jobs stay downloadable
+    PDF_RENDER_TIMEOUT_SECONDS = float(os.environ.get('PDF_RENDER_TIMEOUT_SECONDS', 120)) # Synchronous export waits this long for its render
+
+    # Request tracing (services/tracing.py): Server-Timing on every response, slow spans of sampled requests exported
+    TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'true').lower() == 'true'
+    TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0.1)) # Share of requests / background jobs whose slow spans are exported
+    TRACE_SLOW_SPAN_MS = float(os.environ.get('TRACE_SLOW_SPAN_MS', 500)) # DB query, AWS or OpenAI call at least this slow
+    TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'log') # 'log', 'none' or 'package.module:factory' (factory(app_config) -> object with export(trace_record))
+    TRACE_SERVER_TIMING = os.environ.get('TRACE_SERVER_TIMING', 'true').lower() == 'true' # Per-kind totals in the Server-Timing response header
+
+    # Prometheus metrics at GET /api/metrics (services/metrics.py)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_BEARER_TOKEN = os.environ.get('METRICS_BEARER_TOKEN') # If set, scrapes must send 'Authorization: Bearer <token>'
+    METRICS_LATENCY_BUCKETS = os.environ.get('METRICS_LATENCY_BUCKETS', '') # Histogram bounds in seconds, e.g. '0.01,0.1,1,10' (default 5 ms .. 30 s)
+    METRICS_DB_GAUGE_TTL_SECONDS = float(os.environ.get('METRICS_DB_GAUGE_TTL_SECONDS', 15)) # Invoice / ingestion job counts re-read at most this often
+    HEALTH_DB_PROBE_TTL_SECONDS = float(os.environ.get('HEALTH_DB_PROBE_TTL_SECONDS', 5)) # /api/health reuses a DB check this recent (0 = query every probe)
+
+    # Textract expense field mapping (services/expense_parser.py); extra aliases rank after the built-in ones
+    TEXTRACT_FIELD_ALIASES = os.environ.get('TEXTRACT_FIELD_ALIASES', '') # Extra Textract keys per field, e.g. 'total_amount=AMOUNT_PAYABLE|TOTAL_INC_VAT;quantity=PCS'
+    TEXTRACT_LOCALE_HINTS = os.environ.get('TEXTRACT_LOCALE_HINTS', 'false').lower() == 'true' # Read ambiguous '1.234' / '03/04/2024' by each document's own conventions
+
+    # Textract payloads stored compressed in invoice_documents (see services/textract_documents.py)
+    TEXTRACT_GEOMETRY_RETAIN = os.environ.get('TEXTRACT_GEOMETRY_RETAIN', '') # Geometry keys to keep, e.g. 'BoundingBox' (default: prune all)
+    INVOICE_DOCUMENT_COMPRESSION_LEVEL = int(os.environ.get('INVOICE_DOCUMENT_COMPRESSION_LEVEL', 6)) # zlib level 1-9
+
+    # Versioned result cache for analytics/report reads (services/cache_service.py); invoice writes invalidate it
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory') # 'memory' (per process, version shared via cache_version), 'redis' (shared across workers, needs the redis package) or 'none'
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 512)) # memory backend, LRU beyond this
+    CACHE_VERSION_TTL_SECONDS = float(os.environ.get('CACHE_VERSION_TTL_SECONDS', 1)) # memory backend: how long the shared data version is reused before re-reading it
+    CACHE_DEFAULT_TTL_SECONDS = float(os.environ.get('CACHE_DEFAULT_TTL_SECONDS', 300))
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL') # e.g. redis://localhost:6379/0
+
+    # Background ingestion pipeline (upload -> S3 -> Textract -> parse -> DB)
+    INGESTION_WORKERS_ENABLED = os.environ.get('INGESTION_WORKERS_ENABLED', 'false').lower() == 'true' # Run the pipeline workers in this process; never under `flask <command>`
+    INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 4))
+    INGEST_MAX_ATTEMPTS = int(os.environ.get('INGEST_MAX_ATTEMPTS', 5)) # Per stage
+    INGEST_RETRY_BASE_SECONDS = float(os.environ.get('INGEST_RETRY_BASE_SECONDS', 2))
+    INGEST_SPOOL_DIR = os.environ.get('INGEST_SPOOL_DIR') # Defaults to backend/ingest_spool; must be shared by the web and worker processes
+    INGEST_POLL_SECONDS = float(os.environ.get('INGEST_POLL_SECONDS', 5)) # How often workers look for jobs queued by other processes
+    INGEST_JOB_LEASE_SECONDS = int(os.environ.get('INGEST_JOB_LEASE_SECONDS', 600)) # A claimed job whose process died is claimable again after this
+    UPLOAD_DEDUPLICATION = os.environ.get('UPLOAD_DEDUPLICATION', 'true').lower() == 'true' # Re-uploads of identical content (SHA-256) return the existing invoice
+    TEXTRACT_MAX_CONCURRENT_SUBMISSIONS = int(os.environ.get('TEXTRACT_MAX_CONCURRENT_SUBMISSIONS', 2))
+    TEXTRACT_SUBMIT_TPS = float(os.environ.get('TEXTRACT_SUBMIT_TPS', 1)) # StartExpenseAnalysis default quota is low, keep under it
+
+    # Bulk upload endpoint (many files / ZIP archives per request)
+    BULK_UPLOAD_MAX_WORKERS = int(os.environ.get('BULK_UPLOAD_MAX_WORKERS', 8)) # Concurrent S3 transfers (also sizes the S3 HTTP pool)
+    BULK_UPLOAD_MAX_FILES = int(os.environ.get('BULK_UPLOAD_MAX_FILES', 5000))
+    BULK_UPLOAD_MAX_MEMBER_BYTES = int(os.environ.get('BULK_UPLOAD_MAX_MEMBER_BYTES', 20 * 1024 * 1024)) # Per file, after decompression
+    BULK_UPLOAD_SPOOL_MEMORY_BYTES = int(os.environ.get('BULK_UPLOAD_SPOOL_MEMORY_BYTES', 1024 * 1024)) # Larger files spool to disk
+
+    # Server-side Textract completion poller
+    TEXTRACT_POLL_INITIAL_DELAY_SECONDS = float(os.environ.get('TEXTRACT_POLL_INITIAL_DELAY_SECONDS', 5)) # Doubles per check
+    TEXTRACT_POLL_MAX_DELAY_SECONDS = float(os.environ.get('TEXTRACT_POLL_MAX_DELAY_SECONDS', 60))
+    TEXTRACT_POLL_TPS = float(os.environ.get('TEXTRACT_POLL_TPS', 2)) # Global GetExpenseAnalysis budget
+    TEXTRACT_POLL_BATCH_SIZE = int(os.environ.get('TEXTRACT_POLL_BATCH_SIZE', 10))
+    TEXTRACT_POLL_CONCURRENCY = int(os.environ.get('TEXTRACT_POLL_CONCURRENCY', 4))
+    TEXTRACT_POLL_MAX_CHECKS = int(os.environ.get('TEXTRACT_POLL_MAX_CHECKS', 120)) # Then the invoice is marked textract_failed (e.g. an expired JobId)
+    TEXTRACT_POLL_MAX_AGE_SECONDS = float(os.environ.get('TEXTRACT_POLL_MAX_AGE_SECONDS', 6 * 3600)) # Same, counted from submission; survives restarts
+    TEXTRACT_POLL_RESYNC_SECONDS = float(os.environ.get('TEXTRACT_POLL_RESYNC_SECONDS', 30)) # Re-read 'processing_textract' invoices from DB (picks up jobs submitted by other processes)
+    TEXTRACT_POLL_LEASE_SECONDS = float(os.environ.get('TEXTRACT_POLL_LEASE_SECONDS', 60)) # One poller per deployment holds this lease; a standby takes over after it expires
+
+    # Local stand-ins for S3/Textract (no AWS calls), see services/local_aws_stubs.py
+    USE_LOCAL_AWS_STUBS = os.environ.get('USE_LOCAL_AWS_STUBS', 'false').lower() == 'true'
+    LOCAL_STORAGE_DIR = os.environ.get('LOCAL_STORAGE_DIR') # Defaults to backend/local_storage
+    LOCAL_TEXTRACT_FIXTURE = os.environ.get('LOCAL_TEXTRACT_FIXTURE') # Recorded GetExpenseAnalysis JSON response
+    LOCAL_TEXTRACT_DELAY_SECONDS = float(os.environ.get('LOCAL_TEXTRACT_DELAY_SECONDS', 2))
+
     # Basic check for essential configs
     # These are just print statements, add more robust checks or raise errors if needed for critical configs
-    if not all([AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, S3_BUCKET_NAME]):
+    if not USE_LOCAL_AWS_STUBS and not all([AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, S3_BUCKET_NAME]):
         print("Warning: One or more AWS S3 configurations are missing.")
     if not OPENAI_API_KEY and FLASK_ENV != 'testing': # Optional for now
          print("Warning: OPENAI_API_KEY is missing.")
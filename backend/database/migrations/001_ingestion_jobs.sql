@@ -0,0 +1,22 @@
+-- Migration 001: background ingestion pipeline jobs
+-- Apply with: mysql -u developer -p invoxdb < backend/database/migrations/001_ingestion_jobs.sql
+
+CREATE TABLE IF NOT EXISTS ingestion_jobs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    invoice_id INT NOT NULL,
+    original_filename VARCHAR(255),
+    content_type VARCHAR(100),
+    spool_path VARCHAR(1024),
+    stage VARCHAR(50) NOT NULL DEFAULT 's3_upload',
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    attempts INT NOT NULL DEFAULT 0,
+    s3_key VARCHAR(1024),
+    textract_job_id VARCHAR(255),
+    last_error TEXT,
+    next_run_at DATETIME NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    INDEX idx_ingestion_jobs_status (status),
+    INDEX idx_ingestion_jobs_invoice_id (invoice_id),
+    CONSTRAINT fk_ingestion_jobs_invoice FOREIGN KEY (invoice_id) REFERENCES invoices(id) ON DELETE CASCADE
+);
@@ -0,0 +1,6 @@
+-- Migration 002: bulk upload batches
+-- Apply with: mysql -u developer -p invoxdb < backend/database/migrations/002_invoice_upload_batches.sql
+
+ALTER TABLE invoices
+    ADD COLUMN upload_batch_id VARCHAR(32) NULL AFTER upload_timestamp,
+    ADD INDEX idx_invoices_upload_batch_id (upload_batch_id);
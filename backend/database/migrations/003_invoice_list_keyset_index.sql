@@ -0,0 +1,5 @@
+-- Migration 003: keyset pagination index for the invoice list (ORDER BY upload_timestamp DESC, id DESC)
+-- Apply with: mysql -u developer -p invoxdb < backend/database/migrations/003_invoice_list_keyset_index.sql
+
+ALTER TABLE invoices
+    ADD INDEX idx_invoices_upload_ts_id (upload_timestamp, id);
@@ -0,0 +1,17 @@
+-- Migration 004: move Textract payloads (parsed_data, full_textract_response) out of the invoices row
+-- Apply with: mysql -u developer -p invoxdb < backend/database/migrations/004_invoice_documents.sql
+-- Then backfill existing rows (pruned + compressed, resumable):  flask invoices backfill-documents
+-- and, once verified, drop the old columns:                      flask invoices backfill-documents --drop-columns
+
+CREATE TABLE IF NOT EXISTS invoice_documents (
+    invoice_id INT NOT NULL,
+    doc_type VARCHAR(50) NOT NULL, -- 'parsed_data' or 'full_textract_response'
+    encoding VARCHAR(20) NOT NULL DEFAULT 'zlib+json',
+    payload LONGBLOB NOT NULL,
+    raw_bytes INT,
+    stored_bytes INT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (invoice_id, doc_type),
+    CONSTRAINT fk_invoice_documents_invoice FOREIGN KEY (invoice_id) REFERENCES invoices(id) ON DELETE CASCADE
+);
@@ -0,0 +1,23 @@
+-- Migration 005: analytics rollup maintained on every invoices write (see DbService._execute_with_rollup)
+-- Apply with: mysql -u developer -p invoxdb < backend/database/migrations/005_invoice_rollups.sql
+-- Check it any time with: flask invoices rollups-verify  (rebuild with: flask invoices rollups-rebuild)
+
+CREATE TABLE IF NOT EXISTS invoice_rollups (
+    month CHAR(7) NOT NULL DEFAULT '', -- 'YYYY-MM' of invoice_date, '' when unknown
+    vendor_name VARCHAR(255) NOT NULL DEFAULT '', -- '' stands in for NULL in all key columns
+    user_category VARCHAR(100) NOT NULL DEFAULT '',
+    status VARCHAR(50) NOT NULL DEFAULT '',
+    currency VARCHAR(10) NOT NULL DEFAULT '',
+    invoice_count INT NOT NULL DEFAULT 0,
+    total_amount DECIMAL(16, 2) NOT NULL DEFAULT 0,
+    amount_count INT NOT NULL DEFAULT 0, -- Invoices with a non-NULL total_amount
+    PRIMARY KEY (month, vendor_name, user_category, status, currency),
+    INDEX idx_invoice_rollups_status_month (status, month)
+);
+
+-- Initial fill from the existing invoices
+DELETE FROM invoice_rollups;
+INSERT INTO invoice_rollups (month, vendor_name, user_category, status, currency, invoice_count, total_amount, amount_count)
+SELECT COALESCE(DATE_FORMAT(invoice_date, '%Y-%m'), ''), COALESCE(vendor_name, ''), COALESCE(user_category, ''),
+       COALESCE(status, ''), COALESCE(currency, ''), COUNT(*), COALESCE(SUM(total_amount), 0), COUNT(total_amount)
+FROM invoices GROUP BY 1, 2, 3, 4, 5;
@@ -0,0 +1,16 @@
+-- Migration 006: generated AI insights, keyed by a fingerprint of the prompt context + model parameters (see services/insight_service.py)
+-- Apply with: mysql -u developer -p invoxdb < backend/database/migrations/006_ai_insights.sql
+
+CREATE TABLE IF NOT EXISTS ai_insights (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    insight_type VARCHAR(50) NOT NULL, -- e.g. 'dashboard_summary'
+    fingerprint CHAR(64) NOT NULL, -- SHA-256 of the prompt messages and model parameters
+    model VARCHAR(100),
+    content TEXT NOT NULL,
+    prompt_tokens INT,
+    completion_tokens INT,
+    generation_ms INT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_ai_insights_type_fingerprint (insight_type, fingerprint),
+    INDEX idx_ai_insights_type_created (insight_type, created_at)
+);
@@ -0,0 +1,6 @@
+-- Migration 007: covering index for filtered COUNT/SUM/MIN/MAX (DbService.get_invoice_aggregates_by_filter, chat totals/counts)
+-- status + invoice_date range is the common access path; the remaining columns let MySQL aggregate from the index alone.
+-- Apply with: mysql -u developer -p invoxdb < backend/database/migrations/007_invoice_aggregate_index.sql
+
+ALTER TABLE invoices
+    ADD INDEX idx_invoices_status_date_agg (status, invoice_date, currency, total_amount, vendor_name, user_category);
@@ -0,0 +1,15 @@
+-- Migration 008: persisted AI reports (services/report_service.py), fetched again / exported to PDF without regenerating
+-- Apply with: mysql -u developer -p invoxdb < backend/database/migrations/008_generated_reports.sql
+
+CREATE TABLE IF NOT EXISTS generated_reports (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    report_type VARCHAR(50) NOT NULL, -- 'monthly_expense', 'comprehensive_overview'
+    report_params JSON, -- year, month, filters the report was generated for
+    report_markdown MEDIUMTEXT NOT NULL,
+    model VARCHAR(100),
+    prompt_tokens INT,
+    completion_tokens INT,
+    generation_ms INT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_generated_reports_type_created (report_type, created_at)
+);
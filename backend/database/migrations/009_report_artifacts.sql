@@ -0,0 +1,11 @@
+-- Migration 009: generated_reports doubles as the report artifact store (Markdown + rendered PDF, services/report_service.py)
+-- artifact_key = sha256(report type, params, data version, prompt version, model); invoice writes clear it for the affected months.
+-- Apply with: mysql -u developer -p invoxdb < backend/database/migrations/009_report_artifacts.sql
+
+ALTER TABLE generated_reports
+    ADD COLUMN artifact_key CHAR(64) NULL AFTER report_params,
+    ADD COLUMN report_month CHAR(7) NULL AFTER artifact_key, -- 'YYYY-MM' for monthly reports, NULL for all-time reports
+    ADD COLUMN report_pdf LONGBLOB NULL AFTER report_markdown,
+    ADD COLUMN pdf_generated_at TIMESTAMP NULL AFTER report_pdf,
+    ADD INDEX idx_generated_reports_artifact (artifact_key),
+    ADD INDEX idx_generated_reports_month (report_month);
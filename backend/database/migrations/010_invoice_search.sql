@@ -0,0 +1,19 @@
+-- Migration 010: full-text invoice search (services/invoice_search.py, GET /api/invoices/search)
+-- ft_invoices_search serves the search endpoint; the single-column indexes serve the vendor / category filters of chat
+-- and reports, which used LIKE '%term%' (a full table scan: a leading wildcard can't use idx_invoices_vendor_name).
+-- line_item_text holds the parsed line-item descriptions; fill it for existing invoices with
+-- `flask invoices reparse --fields line_item_text` (re-parses the stored Textract responses, no AWS calls).
+-- InnoDB rebuilds the table for its first FULLTEXT index; run outside peak hours on large tables.
+-- Apply with: mysql -u developer -p invoxdb < backend/database/migrations/010_invoice_search.sql
+
+ALTER TABLE invoices
+    ADD COLUMN line_item_text TEXT NULL AFTER line_items;
+
+ALTER TABLE invoices
+    ADD FULLTEXT INDEX ft_invoices_search (vendor_name, invoice_id_number, user_category, line_item_text);
+
+ALTER TABLE invoices
+    ADD FULLTEXT INDEX ft_invoices_vendor_name (vendor_name);
+
+ALTER TABLE invoices
+    ADD FULLTEXT INDEX ft_invoices_user_category (user_category);
@@ -0,0 +1,52 @@
+-- Migration 011: canonical vendor dimension (services/vendor_index.py, DbService.resolve_vendor_id)
+-- Textract spellings of one vendor ('DELL INC.', 'Dell Technologies', 'Dell') share a normalised key, or are matched to a
+-- known key by trigram similarity, and resolve to one vendors row; invoices.vendor_id points at it, and invoice_rollups
+-- and the aggregate index key on vendor_id instead of the raw vendor_name.
+-- After applying, run `flask invoices vendors-backfill` to resolve the vendor_name of existing invoices (it rebuilds
+-- invoice_rollups when done); until then existing invoices count under "no vendor" in the vendor aggregates.
+-- Apply with: mysql -u developer -p invoxdb < backend/database/migrations/011_vendors.sql
+
+CREATE TABLE IF NOT EXISTS vendors (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    canonical_name VARCHAR(255) NOT NULL, -- Display name: the first spelling seen
+    normalized_key VARCHAR(255) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_vendors_normalized_key (normalized_key)
+);
+
+CREATE TABLE IF NOT EXISTS vendor_aliases (
+    alias_key VARCHAR(255) NOT NULL PRIMARY KEY, -- normalize_vendor_name() of a spelling; every vendor's own key is one too
+    vendor_id INT NOT NULL,
+    alias_name VARCHAR(255) NOT NULL, -- First spelling seen with this key
+    match_score DECIMAL(4, 3) NOT NULL DEFAULT 1.000, -- Trigram similarity of a fuzzy match, 1 for exact
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_vendor_aliases_vendor_id (vendor_id),
+    CONSTRAINT fk_vendor_aliases_vendor FOREIGN KEY (vendor_id) REFERENCES vendors(id) ON DELETE CASCADE
+);
+
+ALTER TABLE invoices
+    ADD COLUMN vendor_id INT NULL AFTER vendor_name,
+    ADD INDEX idx_invoices_vendor_id (vendor_id),
+    ADD CONSTRAINT fk_invoices_vendor FOREIGN KEY (vendor_id) REFERENCES vendors(id) ON DELETE SET NULL,
+    DROP INDEX idx_invoices_status_date_agg,
+    ADD INDEX idx_invoices_status_date_agg (status, invoice_date, currency, total_amount, vendor_id, user_category);
+
+DROP TABLE IF EXISTS invoice_rollups;
+CREATE TABLE invoice_rollups (
+    month CHAR(7) NOT NULL DEFAULT '', -- 'YYYY-MM' of invoice_date, '' when unknown
+    vendor_id INT NOT NULL DEFAULT 0, -- 0 stands in for NULL (no resolved vendor), '' for NULL in the other key columns
+    user_category VARCHAR(100) NOT NULL DEFAULT '',
+    status VARCHAR(50) NOT NULL DEFAULT '',
+    currency VARCHAR(10) NOT NULL DEFAULT '',
+    invoice_count INT NOT NULL DEFAULT 0,
+    total_amount DECIMAL(16, 2) NOT NULL DEFAULT 0,
+    amount_count INT NOT NULL DEFAULT 0, -- Invoices with a non-NULL total_amount
+    PRIMARY KEY (month, vendor_id, user_category, status, currency),
+    INDEX idx_invoice_rollups_status_month (status, month)
+);
+
+-- Initial fill (vendors-backfill rebuilds it once vendor_id is set)
+INSERT INTO invoice_rollups (month, vendor_id, user_category, status, currency, invoice_count, total_amount, amount_count)
+SELECT COALESCE(DATE_FORMAT(invoice_date, '%Y-%m'), ''), COALESCE(vendor_id, 0), COALESCE(user_category, ''),
+       COALESCE(status, ''), COALESCE(currency, ''), COUNT(*), COALESCE(SUM(total_amount), 0), COUNT(total_amount)
+FROM invoices GROUP BY 1, 2, 3, 4, 5;
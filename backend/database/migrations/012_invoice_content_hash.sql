@@ -0,0 +1,10 @@
+-- Migration 012: upload deduplication by content hash (UPLOAD_DEDUPLICATION)
+-- Uploads are hashed (SHA-256) while they are spooled; a file whose hash matches an invoice that did not fail is not
+-- sent to S3 / Textract again, the upload response points at the existing invoice instead.
+-- The index is not UNIQUE: a failed upload keeps its hash so the same file can be retried. Invoices uploaded before
+-- this migration have no hash and are never matched.
+-- Apply with: mysql -u developer -p invoxdb < backend/database/migrations/012_invoice_content_hash.sql
+
+ALTER TABLE invoices
+    ADD COLUMN content_sha256 CHAR(64) NULL AFTER s3_key,
+    ADD INDEX idx_invoices_content_sha256 (content_sha256);
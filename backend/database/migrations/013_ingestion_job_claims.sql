@@ -0,0 +1,9 @@
+-- Migration 013: claim ingestion jobs in the DB (INGESTION_WORKERS_ENABLED)
+-- Several processes may run ingestion workers (gunicorn workers, a separate worker process). Each one claims a job
+-- with an UPDATE ... WHERE status IN ('queued', 'waiting') before running a stage, so a stage runs once. A claim is a
+-- lease: a 'running' job whose worker died becomes claimable again after INGEST_JOB_LEASE_SECONDS.
+-- Apply with: mysql -u developer -p invoxdb < backend/database/migrations/013_ingestion_job_claims.sql
+
+ALTER TABLE ingestion_jobs
+    ADD COLUMN claimed_by VARCHAR(100) NULL AFTER next_run_at,
+    ADD COLUMN lease_expires_at DATETIME NULL AFTER claimed_by;
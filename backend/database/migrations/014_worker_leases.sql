@@ -0,0 +1,11 @@
+-- Migration 014: worker leases (services/textract_poller.py)
+-- Every process that runs the ingestion workers also starts a TextractPoller, but only the holder of the
+-- 'textract_poller' row polls Textract, so TEXTRACT_POLL_TPS is a budget per deployment rather than per process.
+-- The holder renews the lease every TEXTRACT_POLL_LEASE_SECONDS / 3; a standby poller takes over once it expires.
+-- Apply with: mysql -u developer -p invoxdb < backend/database/migrations/014_worker_leases.sql
+
+CREATE TABLE IF NOT EXISTS worker_leases (
+    name VARCHAR(64) NOT NULL PRIMARY KEY,
+    owner VARCHAR(100) NOT NULL,
+    expires_at DATETIME NOT NULL
+);
@@ -0,0 +1,11 @@
+-- Migration 015: shared data version for the in-process analytics cache (CACHE_BACKEND=memory)
+-- Each process keeps its own cached results, keyed by this version. Every invoice write, including `flask invoices ...`
+-- commands, increments it, so a write in one process invalidates the cached results of all of them.
+-- Apply with: mysql -u developer -p invoxdb < backend/database/migrations/015_cache_version.sql
+
+CREATE TABLE IF NOT EXISTS cache_version (
+    id TINYINT NOT NULL PRIMARY KEY, -- Always 1
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT IGNORE INTO cache_version (id, version) VALUES (1, 0);
@@ -0,0 +1,18 @@
+-- Migration 016: PDF render jobs shared by all web processes
+-- The job is accepted by one gunicorn worker but polled and downloaded through any of them, so status and PDF live here.
+-- Jobs that only re-serve a stored report PDF keep report_id and no copy of the bytes (download reads generated_reports).
+-- Apply with: mysql -u developer -p invoxdb < backend/database/migrations/016_pdf_render_jobs.sql
+
+CREATE TABLE IF NOT EXISTS pdf_render_jobs (
+    job_id CHAR(32) NOT NULL PRIMARY KEY,
+    report_id INT NULL, -- generated_reports.id the PDF belongs to, if any
+    title VARCHAR(255),
+    status VARCHAR(20) NOT NULL DEFAULT 'queued', -- 'queued', 'running', 'done', 'failed'
+    error TEXT,
+    pages INT,
+    render_ms INT,
+    pdf LONGBLOB NULL,
+    submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP NULL,
+    INDEX idx_pdf_render_jobs_submitted (submitted_at)
+);
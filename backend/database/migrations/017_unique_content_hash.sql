@@ -0,0 +1,18 @@
+-- Migration 017: one invoice per upload content hash (UPLOAD_DEDUPLICATION)
+-- With a plain index, two concurrent uploads of the same file could both miss the duplicate check and both be stored.
+-- The UNIQUE index lets only one of them claim the hash; the other is answered as a duplicate. A failed invoice gives its
+-- hash up when the same file is uploaded again (DbService.claim_invoice_content_hash / create_invoice_record).
+-- Apply with: mysql -u developer -p invoxdb < backend/database/migrations/017_unique_content_hash.sql
+
+-- Keep the hash on the oldest invoice that did not fail (else the oldest one); clear it on the other copies
+UPDATE invoices i
+JOIN (
+    SELECT content_sha256, COALESCE(MIN(CASE WHEN status NOT IN ('error', 'textract_failed', 'parsing_failed', 'db_update_failed_post_textract',
+                                                               's3_upload_failed', 'textract_submission_failed', 'textract_unknown_status') THEN id END), MIN(id)) AS keep_id
+    FROM invoices WHERE content_sha256 IS NOT NULL GROUP BY content_sha256 HAVING COUNT(*) > 1
+) d ON i.content_sha256 = d.content_sha256 AND i.id <> d.keep_id
+SET i.content_sha256 = NULL;
+
+ALTER TABLE invoices
+    DROP INDEX idx_invoices_content_sha256,
+    ADD UNIQUE INDEX idx_invoices_content_sha256 (content_sha256);
@@ -21,33 +21,179 @@ FLUSH PRIVILEGES;
 -- Switch to the invoxdb database
 USE invoxdb;
 
+-- Create the vendors table (canonical vendors, see services/vendor_index.py)
+CREATE TABLE IF NOT EXISTS vendors (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    canonical_name VARCHAR(255) NOT NULL, -- Display name: the first spelling seen
+    normalized_key VARCHAR(255) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_vendors_normalized_key (normalized_key)
+);
+
+-- Create the vendor_aliases table (normalised spellings -> vendor; every vendor's own key is one too)
+CREATE TABLE IF NOT EXISTS vendor_aliases (
+    alias_key VARCHAR(255) NOT NULL PRIMARY KEY,
+    vendor_id INT NOT NULL,
+    alias_name VARCHAR(255) NOT NULL, -- First spelling seen with this key
+    match_score DECIMAL(4, 3) NOT NULL DEFAULT 1.000, -- Trigram similarity of a fuzzy match, 1 for exact
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_vendor_aliases_vendor_id (vendor_id),
+    CONSTRAINT fk_vendor_aliases_vendor FOREIGN KEY (vendor_id) REFERENCES vendors(id) ON DELETE CASCADE
+);
+
 -- Create the invoices table
 CREATE TABLE IF NOT EXISTS invoices (
     id INT AUTO_INCREMENT PRIMARY KEY,
     user_category VARCHAR(100),
     s3_bucket_name VARCHAR(255),
     s3_key VARCHAR(1024),
+    content_sha256 CHAR(64) NULL,
     original_filename VARCHAR(255),
     upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    upload_batch_id VARCHAR(32),
     status VARCHAR(50) DEFAULT 'pending_upload',
     textract_job_id VARCHAR(255),
     vendor_name VARCHAR(255),
+    vendor_id INT NULL, -- Canonical vendor (DbService.resolve_vendor_id)
     invoice_id_number VARCHAR(100),
     invoice_date DATE,
     due_date DATE,
     total_amount DECIMAL(12, 2),
     currency VARCHAR(10),
     line_items JSON,
-    parsed_data JSON,
+    line_item_text TEXT, -- Line-item descriptions (from the parser), for full-text search
     user_category VARCHAR(100),
     last_modified_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     error_message TEXT,
     UNIQUE KEY unique_s3_key (s3_key(255)),
     INDEX idx_invoices_vendor_name (vendor_name),
+    INDEX idx_invoices_vendor_id (vendor_id),
     INDEX idx_invoices_invoice_date (invoice_date),
-    INDEX idx_invoices_status (status)
+    INDEX idx_invoices_status (status),
+    INDEX idx_invoices_upload_batch_id (upload_batch_id),
+    INDEX idx_invoices_upload_ts_id (upload_timestamp, id),
+    UNIQUE INDEX idx_invoices_content_sha256 (content_sha256), -- One live invoice per file content; failed ones give the hash up on re-upload
+    INDEX idx_invoices_status_date_agg (status, invoice_date, currency, total_amount, vendor_id, user_category),
+    FULLTEXT INDEX ft_invoices_search (vendor_name, invoice_id_number, user_category, line_item_text),
+    FULLTEXT INDEX ft_invoices_vendor_name (vendor_name),
+    FULLTEXT INDEX ft_invoices_user_category (user_category),
+    CONSTRAINT fk_invoices_vendor FOREIGN KEY (vendor_id) REFERENCES vendors(id) ON DELETE SET NULL
+);
+
+-- Create the invoice_documents table (compressed Textract payloads, kept out of the invoices row)
+CREATE TABLE IF NOT EXISTS invoice_documents (
+    invoice_id INT NOT NULL,
+    doc_type VARCHAR(50) NOT NULL, -- 'parsed_data' or 'full_textract_response'
+    encoding VARCHAR(20) NOT NULL DEFAULT 'zlib+json',
+    payload LONGBLOB NOT NULL,
+    raw_bytes INT,
+    stored_bytes INT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (invoice_id, doc_type),
+    CONSTRAINT fk_invoice_documents_invoice FOREIGN KEY (invoice_id) REFERENCES invoices(id) ON DELETE CASCADE
+);
+
+-- Create the invoice_rollups table (analytics aggregates, kept in step with invoices by DbService)
+CREATE TABLE IF NOT EXISTS invoice_rollups (
+    month CHAR(7) NOT NULL DEFAULT '', -- 'YYYY-MM' of invoice_date, '' when unknown
+    vendor_id INT NOT NULL DEFAULT 0, -- 0 stands in for NULL (no resolved vendor), '' for NULL in the other key columns
+    user_category VARCHAR(100) NOT NULL DEFAULT '',
+    status VARCHAR(50) NOT NULL DEFAULT '',
+    currency VARCHAR(10) NOT NULL DEFAULT '',
+    invoice_count INT NOT NULL DEFAULT 0,
+    total_amount DECIMAL(16, 2) NOT NULL DEFAULT 0,
+    amount_count INT NOT NULL DEFAULT 0, -- Invoices with a non-NULL total_amount
+    PRIMARY KEY (month, vendor_id, user_category, status, currency),
+    INDEX idx_invoice_rollups_status_month (status, month)
+);
+
+-- Create the ingestion_jobs table (background upload pipeline state, survives restarts)
+CREATE TABLE IF NOT EXISTS ingestion_jobs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    invoice_id INT NOT NULL,
+    original_filename VARCHAR(255),
+    content_type VARCHAR(100),
+    spool_path VARCHAR(1024),
+    stage VARCHAR(50) NOT NULL DEFAULT 's3_upload',
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    attempts INT NOT NULL DEFAULT 0,
+    s3_key VARCHAR(1024),
+    textract_job_id VARCHAR(255),
+    last_error TEXT,
+    next_run_at DATETIME NULL,
+    claimed_by VARCHAR(100) NULL, -- Worker (host:pid:id) running the current stage
+    lease_expires_at DATETIME NULL, -- After this a 'running' job is claimable again (its worker died)
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    INDEX idx_ingestion_jobs_status (status),
+    INDEX idx_ingestion_jobs_invoice_id (invoice_id),
+    CONSTRAINT fk_ingestion_jobs_invoice FOREIGN KEY (invoice_id) REFERENCES invoices(id) ON DELETE CASCADE
+);
+
+-- Create the cache_version table (data version of the analytics cache, shared by all processes; one row, id 1)
+CREATE TABLE IF NOT EXISTS cache_version (
+    id TINYINT NOT NULL PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
 );
+INSERT IGNORE INTO cache_version (id, version) VALUES (1, 0);
 
+-- Create the worker_leases table (one holder per deployment for singleton background workers, e.g. the Textract poller)
+CREATE TABLE IF NOT EXISTS worker_leases (
+    name VARCHAR(64) NOT NULL PRIMARY KEY,
+    owner VARCHAR(100) NOT NULL, -- host:pid:id of the holding process
+    expires_at DATETIME NOT NULL
+);
+
+-- Create the ai_insights table (generated AI summaries, reused while their prompt fingerprint is unchanged)
+CREATE TABLE IF NOT EXISTS ai_insights (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    insight_type VARCHAR(50) NOT NULL, -- e.g. 'dashboard_summary'
+    fingerprint CHAR(64) NOT NULL, -- SHA-256 of the prompt messages and model parameters
+    model VARCHAR(100),
+    content TEXT NOT NULL,
+    prompt_tokens INT,
+    completion_tokens INT,
+    generation_ms INT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_ai_insights_type_fingerprint (insight_type, fingerprint),
+    INDEX idx_ai_insights_type_created (insight_type, created_at)
+);
+
+-- Create the generated_reports table (AI reports kept for re-fetch and PDF export)
+CREATE TABLE IF NOT EXISTS generated_reports (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    report_type VARCHAR(50) NOT NULL, -- 'monthly_expense', 'comprehensive_overview'
+    report_params JSON, -- year, month, filters the report was generated for
+    artifact_key CHAR(64) NULL, -- Report store key (type, params, data version, prompt version); NULL once invalidated
+    report_month CHAR(7) NULL, -- 'YYYY-MM' for monthly reports, NULL for all-time reports
+    report_markdown MEDIUMTEXT NOT NULL,
+    report_pdf LONGBLOB NULL, -- Rendered PDF, kept so repeated exports skip WeasyPrint
+    pdf_generated_at TIMESTAMP NULL,
+    model VARCHAR(100),
+    prompt_tokens INT,
+    completion_tokens INT,
+    generation_ms INT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_generated_reports_type_created (report_type, created_at),
+    INDEX idx_generated_reports_artifact (artifact_key),
+    INDEX idx_generated_reports_month (report_month)
+);
+
+-- Create the pdf_render_jobs table (PDF render job status and output, visible to every web process)
+CREATE TABLE IF NOT EXISTS pdf_render_jobs (
+    job_id CHAR(32) NOT NULL PRIMARY KEY,
+    report_id INT NULL, -- generated_reports.id; jobs re-serving a stored report PDF keep no copy of the bytes
+    title VARCHAR(255),
+    status VARCHAR(20) NOT NULL DEFAULT 'queued', -- 'queued', 'running', 'done', 'failed'
+    error TEXT,
+    pages INT,
+    render_ms INT,
+    pdf LONGBLOB NULL,
+    submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP NULL,
+    INDEX idx_pdf_render_jobs_submitted (submitted_at)
+);
 
 -- Create the chat_logs table
 CREATE TABLE IF NOT EXISTS chat_logs (
@@ -2,6 +2,8 @@
 from flask import Blueprint, jsonify, current_app, request
 import logging
 from datetime import datetime, timedelta # For date calculations
+from ..services.insight_service import InsightError
+from ..services.openai_service import OpenAIService
 
 logger = logging.getLogger(__name__)
 analytics_bp = Blueprint('analytics_bp', __name__)
@@ -60,21 +62,54 @@ def get_monthly_spending():
         logger.error(f"Error in /analytics/monthly-spend endpoint: {e}", exc_info=True)
         return jsonify({"error": "Failed to retrieve monthly spending data"}), 500
 
+def _parse_date_bound(value, end_of_period=False):
+    """Parses a 'YYYY-MM-DD' or 'YYYY-MM' query value. 'YYYY-MM' means the first (or, for upper bounds, last) day of that month."""
+    if not value: return None
+    if len(value) == 7:
+        month_start = datetime.strptime(value, '%Y-%m').date()
+        return ((month_start.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)) if end_of_period else month_start
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+@analytics_bp.route('/dashboard', methods=['GET'])
+def get_dashboard_analytics():
+    """All dashboard blocks in one response (one DB round trip). Optional ?from=&to= (YYYY-MM or YYYY-MM-DD) and ?top=."""
+    db_service = current_app.extensions.get('db_service')
+    if not db_service:
+        logger.error("DbService not initialized in analytics/dashboard.")
+        return jsonify({"error": "Analytics service not available"}), 503
+    try:
+        date_from = _parse_date_bound(request.args.get('from'))
+        date_to = _parse_date_bound(request.args.get('to'), end_of_period=True)
+    except ValueError:
+        return jsonify({"error": "Invalid 'from'/'to' date. Use YYYY-MM or YYYY-MM-DD."}), 400
+    if date_from and date_to and date_from > date_to:
+        return jsonify({"error": "'from' must not be after 'to'."}), 400
+    try:
+        dashboard = db_service.get_dashboard_data(date_from=date_from, date_to=date_to, top_n=request.args.get('top', 5, type=int))
+        if dashboard is None: return jsonify({"error": "Failed to retrieve dashboard analytics"}), 500
+        return jsonify(dashboard), 200
+    except Exception as e:
+        logger.error(f"Error in /analytics/dashboard endpoint: {e}", exc_info=True)
+        return jsonify({"error": "Failed to retrieve dashboard analytics"}), 500
+
 @analytics_bp.route('/openai-summary', methods=['GET'])
 def get_openai_dashboard_summary():
+    """AI summary of the dashboard data. Served from ai_insights while the data is unchanged; ?refresh=1 forces a new one."""
     db_service = current_app.extensions.get('db_service')
-    openai_service = current_app.extensions.get('openai_service')
+    insight_service = current_app.extensions.get('insight_service')
 
-    if not db_service or not openai_service:
+    if not db_service or not insight_service:
         logger.error("Services not available for openai-summary.")
         return jsonify({"error": "AI summary service not available."}), 503
 
     try:
-        # 1. Gather more comprehensive data
-        overall_stats = db_service.get_comprehensive_report_summary_stats() # Gets total_invoices, total_spent, date_range, unique_vendors
-        top_vendors = db_service.get_expenses_by_vendor(limit=3)
-        top_categories = db_service.get_expenses_by_category(limit=3)
-        monthly_trend_all = db_service.get_monthly_spend()
+        # 1. Gather more comprehensive data (one query, same numbers as the dashboard)
+        dashboard = db_service.get_dashboard_data(top_n=3) or {}
+        overall_stats = {**dashboard["summary"], "oldest_invoice_date": dashboard.get("first_month"), "newest_invoice_date": dashboard.get("last_month"),
+                         "unique_vendors": dashboard.get("unique_vendors", 0)} if dashboard else None
+        top_vendors = dashboard.get("expenses_by_vendor", [])
+        top_categories = dashboard.get("expenses_by_category", [])
+        monthly_trend_all = dashboard.get("monthly_spend", [])
 
         # Prepare context for OpenAI
         prompt_context_parts = ["Key Overall Invoice Statistics:"]
@@ -121,24 +156,19 @@ Focus on:
 Be professional and provide a quick, informative overview. Do not list all the data again, but synthesize it.
 Current date for reference is {datetime.now().strftime('%B %Y')}.
 """
-        messages = openai_service.build_prompt_with_context(
-            user_query=user_style_query.strip(),
-            invoice_context_str=prompt_context
-        )
-        
-        logger.info("Requesting enhanced AI summary for dashboard from OpenAI...")
-        ai_summary = openai_service.get_chat_completion(messages, model="gpt-3.5-turbo", temperature=0.5, max_tokens=300)
+        messages = OpenAIService.build_prompt_with_context(user_query=user_style_query.strip(), invoice_context_str=prompt_context)
+        model_params = {"model": "gpt-3.5-turbo", "temperature": 0.5, "max_tokens": 300}
 
-        if ai_summary and not ai_summary.startswith("ERROR_") and "AI_ASSISTANT_EMPTY_REPLY" not in ai_summary:
-            logger.info(f"Enhanced AI Summary Generated: {ai_summary[:100]}...")
-            return jsonify({"ai_insight_summary": ai_summary}), 200
-        else:
-            # ... (error handling same as before) ...
-            logger.error(f"Failed to get enhanced AI summary or OpenAI returned an error string: {ai_summary}")
+        try: insight = insight_service.get_insight('dashboard_summary', messages, model_params, force_refresh=request.args.get('refresh', '').lower() in ('1', 'true'))
+        except InsightError as e:
+            logger.error(f"Failed to get enhanced AI summary: {e} ({e.details})")
             user_facing_error = "Failed to generate AI dashboard summary."
-            if ai_summary and "authentication" in ai_summary.lower(): user_facing_error = "AI service authentication issue."
-            elif ai_summary and "rate_limit" in ai_summary.lower(): user_facing_error = "AI service is busy, please try later."
-            return jsonify({"error": user_facing_error, "details": ai_summary}), 500
+            if not e.details: user_facing_error = str(e)
+            elif "authentication" in e.details.lower(): user_facing_error = "AI service authentication issue."
+            elif "rate_limit" in e.details.lower(): user_facing_error = "AI service is busy, please try later."
+            return jsonify({"error": user_facing_error, "details": e.details}), 500
+        logger.info(f"AI dashboard summary served (cached={insight['cached']}, stale={insight['stale']}): {insight['content'][:100]}...")
+        return jsonify({"ai_insight_summary": insight["content"], "cached": insight["cached"], "stale": insight["stale"], "generated_at": insight["generated_at"]}), 200
 
     except Exception as e:
         current_app.logger.error(f"Error in /analytics/openai-summary endpoint: {e}", exc_info=True)
@@ -4,6 +4,9 @@ import logging
 import json
 from datetime import datetime, timedelta
 import re 
+import time
+from ..services.openai_service import OpenAIStreamError
+from .streaming import sse_event, wants_event_stream, event_stream_response
 
 logger = logging.getLogger(__name__)
 chat_bp = Blueprint('chat_bp', __name__)
@@ -121,9 +124,11 @@ def build_context_from_structured_intent(db_service, structured_nlu):
                 elif op == "<": db_filters["total_amount_lt"] = float_val
             except ValueError: logger.warning(f"Invalid amount value for filter: {val}")
     
-    sort_map = {"date_desc": "invoice_date DESC", "amount_asc": "total_amount ASC", "id_desc": "id DESC"}
+    sort_map = {"date_desc": "invoice_date DESC", "amount_asc": "total_amount ASC", "amount_desc": "total_amount DESC", "id_desc": "id DESC"}
     db_filters["order_by"] = sort_map.get(entities.get("sort_by"), "invoice_date DESC, id DESC")
 
+    if intent in ["count_invoices", "get_total_spend"]: return build_aggregate_answer(db_service, intent, db_filters)
+
     relevant_invoices = []
     # Only query DB if intent suggests we need invoice list/details or data for calculation
     if intent in ["list_invoices", "count_invoices", "get_total_spend", "get_invoice_detail", "general_query"]: # Added general_query to fetch some context
@@ -140,13 +145,6 @@ def build_context_from_structured_intent(db_service, structured_nlu):
             logger.error(f"Context Builder: Error querying DB: {e}", exc_info=True)
             return "Error retrieving data from the database for context."
     
-    if intent == "count_invoices": return f"I found {len(relevant_invoices)} invoice(s) matching your criteria."
-    if intent == "get_total_spend":
-        if not relevant_invoices: return "I couldn't find any invoices matching your criteria to calculate total spend."
-        total_spend = sum(inv.get('total_amount', 0) or 0 for inv in relevant_invoices)
-        currency_found = next((inv.get('currency') for inv in relevant_invoices if inv.get('currency')), "$")
-        return f"Based on {len(relevant_invoices)} invoice(s), the total spend is {currency_found}{total_spend:.2f}."
-
     if not relevant_invoices: # This will be hit if intent wasn't count/total_spend AND no invoices found
         return "I couldn't find any specific invoices matching your request in the database for context."
 
@@ -161,9 +159,93 @@ def build_context_from_structured_intent(db_service, structured_nlu):
     logger.debug(f"Final context for OpenAI (len {len(final_context)}): {final_context[:500]}...")
     return final_context
 
+def build_aggregate_answer(db_service, intent, db_filters):
+    """Answers count/total intents from SQL aggregates over every matching invoice (exact, not limited to a row sample)."""
+    try:
+        logger.info(f"Context Builder: Aggregating invoices with filters: {db_filters}")
+        aggregates = db_service.get_invoice_aggregates_by_filter(db_filters)
+    except Exception as e:
+        logger.error(f"Context Builder: Error aggregating invoices: {e}", exc_info=True); aggregates = None
+    if aggregates is None: return "Error retrieving data from the database for context."
+    invoice_count = sum(row['invoice_count'] for row in aggregates)
+    if intent == "count_invoices": return f"I found {invoice_count} invoice(s) matching your criteria."
+    if not invoice_count: return "I couldn't find any invoices matching your criteria to calculate total spend."
+    priced = [row for row in aggregates if row['amount_count']]
+    if not priced: return f"I found {invoice_count} invoice(s) matching your criteria, but none of them has a total amount."
+    if len(priced) == 1: return f"Based on {invoice_count} invoice(s), the total spend is {priced[0]['currency'] or '$'}{priced[0]['total_amount']:.2f}."
+    per_currency = ", ".join(f"{row['currency'] or '$'}{row['total_amount']:.2f} ({row['invoice_count']} invoice(s))" for row in priced)
+    return f"Based on {invoice_count} invoice(s), the total spend is {per_currency} (amounts in different currencies are not added together)."
+
+def run_chat_nlu(openai_service, user_message):
+    """Step 1: intent/entities, from the local NLU (and its cache) when available, else the OpenAI NLU call."""
+    nlu_service = current_app.extensions.get('nlu_service')
+    if nlu_service: return nlu_service.parse(user_message, fallback=lambda query: get_structured_intent_from_query(openai_service, query)) # Local rules / LRU first
+    return get_structured_intent_from_query(openai_service, user_message)
+
+def run_chat_context(db_service, structured_nlu):
+    """Step 2: returns (invoice_context_str, direct_reply). direct_reply is set when the DB answer is the reply (counts / totals)."""
+    if structured_nlu and not structured_nlu.get("error"):
+        logger.info(f"NLU result ({structured_nlu.get('nlu_source', 'openai')}): Intent='{structured_nlu.get('intent')}', Entities='{structured_nlu.get('entities')}'")
+        invoice_context_str = build_context_from_structured_intent(db_service, structured_nlu)
+        if structured_nlu.get("intent") in ["count_invoices", "get_total_spend"] and not any(err_kw in invoice_context_str for err_kw in ["Error", "I couldn't find", "understanding the specifics", "Database service is not available"]):
+            logger.info(f"Intent '{structured_nlu.get('intent')}' handled directly. Reply: {invoice_context_str}")
+            return invoice_context_str, invoice_context_str
+        return invoice_context_str, None
+    logger.error(f"NLU failed or error: {structured_nlu}")
+    invoice_context_str = structured_nlu.get("error", "Issue understanding request.")
+    if structured_nlu and structured_nlu.get("original_nlu_response","").startswith("ERROR_OPENAI_"):
+         invoice_context_str += " AI NLU error: " + structured_nlu["original_nlu_response"]
+    return invoice_context_str, None
+
+def user_facing_ai_error(assistant_reply):
+    final_reply = "Sorry, AI issue. Try again."
+    if assistant_reply:
+        if "authentication" in assistant_reply.lower(): final_reply = "AI Auth Error."
+        elif "rate_limit" in assistant_reply.lower(): final_reply = "AI busy. Try later."
+    return final_reply
+
+def stream_chat_events(openai_service, db_service, user_message):
+    """
+    Generator behind the text/event-stream mode of /api/chat/. Events, in order: nlu, context, token (repeated), done;
+    or error at any point. If the client disconnects, the OpenAI stream is closed so generation stops.
+    """
+    started_at = time.monotonic(); reply_parts = []; usage = {}
+    try:
+        yield ": stream opened\n\n" # Flushes the response headers right away
+        structured_nlu = run_chat_nlu(openai_service, user_message)
+        yield sse_event("nlu", {"intent": structured_nlu.get("intent"), "entities": structured_nlu.get("entities"), "source": structured_nlu.get("nlu_source", "openai"), "error": structured_nlu.get("error")})
+        invoice_context_str, direct_reply = run_chat_context(db_service, structured_nlu)
+        yield sse_event("context", {"direct": direct_reply is not None, "context_chars": len(invoice_context_str)})
+        if direct_reply is not None:
+            yield sse_event("token", {"text": direct_reply})
+            yield sse_event("done", {"reply": direct_reply, "elapsed_ms": int((time.monotonic() - started_at) * 1000)}); return
+
+        messages_for_openai = openai_service.build_prompt_with_context(user_message, invoice_context_str)
+        tokens = openai_service.stream_chat_completion(messages_for_openai, usage=usage)
+        first_token_ms = None
+        try:
+            for delta in tokens:
+                if first_token_ms is None: first_token_ms = int((time.monotonic() - started_at) * 1000)
+                reply_parts.append(delta)
+                yield sse_event("token", {"text": delta})
+        except OpenAIStreamError as e:
+            logger.error(f"OpenAI streaming error: {e}")
+            yield sse_event("error", {"message": user_facing_ai_error(str(e)), "partial_reply": "".join(reply_parts)}); return
+        finally: tokens.close()
+        reply = "".join(reply_parts).strip()
+        if not reply: yield sse_event("error", {"message": user_facing_ai_error(None)}); return
+        logger.info(f"Streamed AI reply ({len(reply)} chars, first token after {first_token_ms} ms): '{reply[:100]}...'")
+        yield sse_event("done", {"reply": reply, "usage": usage or None, "first_token_ms": first_token_ms, "elapsed_ms": int((time.monotonic() - started_at) * 1000)})
+    except GeneratorExit:
+        logger.info(f"Chat stream cancelled by the client after {len(reply_parts)} token(s).")
+        raise
+    except Exception as e:
+        logger.error(f"Unhandled EXCEPTION in chat stream: {e}", exc_info=True)
+        yield sse_event("error", {"message": "Unexpected internal error in chat."})
 
 @chat_bp.route("/", methods=["POST"])
 def chat_with_assistant_route():
+    """Chat reply as JSON ({"reply": ...}), or as server-sent events with "stream": true / ?stream=1 / Accept: text/event-stream."""
     logger.info("Chat route /api/chat/ POST request received.") 
     openai_service = current_app.extensions.get('openai_service'); db_service = current_app.extensions.get('db_service')
     logger.debug(f"OpenAI Service in chat_route: {'Available' if openai_service else 'NOT AVAILABLE'}")
@@ -172,22 +254,14 @@ def chat_with_assistant_route():
     data = request.json; user_message = data.get("message")
     if not user_message: logger.warning("No message provided."); return jsonify({"error": "No message"}), 400
     logger.info(f"Chat request for: '{user_message}'")
+    if wants_event_stream(data):
+        return event_stream_response(stream_chat_events(openai_service, db_service, user_message))
     try:
         logger.info("Step 1 (Chat Route): Getting NLU from query...")
-        structured_nlu = get_structured_intent_from_query(openai_service, user_message)
-        invoice_context_str = "No specific invoice context built." 
-        if structured_nlu and not structured_nlu.get("error"):
-            logger.info(f"NLU result: Intent='{structured_nlu.get('intent')}', Entities='{structured_nlu.get('entities')}'")
-            logger.info("Step 2 (Chat Route): Building context from DB...")
-            invoice_context_str = build_context_from_structured_intent(db_service, structured_nlu)
-            if structured_nlu.get("intent") in ["count_invoices", "get_total_spend"] and not any(err_kw in invoice_context_str for err_kw in ["Error", "I couldn't find", "understanding the specifics", "Database service is not available"]):
-                logger.info(f"Intent '{structured_nlu.get('intent')}' handled directly. Reply: {invoice_context_str}")
-                return jsonify({"reply": invoice_context_str}), 200
-        else: 
-            logger.error(f"NLU failed or error: {structured_nlu}")
-            invoice_context_str = structured_nlu.get("error", "Issue understanding request.")
-            if structured_nlu and structured_nlu.get("original_nlu_response","").startswith("ERROR_OPENAI_"):
-                 invoice_context_str += " AI NLU error: " + structured_nlu["original_nlu_response"]
+        structured_nlu = run_chat_nlu(openai_service, user_message)
+        logger.info("Step 2 (Chat Route): Building context from DB...")
+        invoice_context_str, direct_reply = run_chat_context(db_service, structured_nlu)
+        if direct_reply is not None: return jsonify({"reply": direct_reply}), 200
         
         logger.info("Step 3 (Chat Route): Building messages for OpenAI main response...")
         messages_for_openai = openai_service.build_prompt_with_context(user_message, invoice_context_str)
@@ -196,13 +270,9 @@ def chat_with_assistant_route():
         logger.info(f"RAW assistant_reply from OpenAIService: '{assistant_reply}'")
         if assistant_reply is None or assistant_reply.startswith("ERROR_") or "AI_ASSISTANT_EMPTY_REPLY" in assistant_reply:
             logger.error(f"OpenAI service error/no valid reply: {assistant_reply}")
-            final_reply = "Sorry, AI issue. Try again."
-            if assistant_reply:
-                if "authentication" in assistant_reply.lower(): final_reply = "AI Auth Error."
-                elif "rate_limit" in assistant_reply.lower(): final_reply = "AI busy. Try later."
-            return jsonify({"reply": final_reply}), 500
+            return jsonify({"reply": user_facing_ai_error(assistant_reply)}), 500
         logger.info(f"Sending AI reply: '{assistant_reply[:100]}...'")
         return jsonify({"reply": assistant_reply}), 200
     except Exception as e:
         logger.error(f"Unhandled EXCEPTION in chat route: {e}", exc_info=True)
-        return jsonify({"reply": "Unexpected internal error in chat."}), 500
\ No newline at end of file
+        return jsonify({"reply": "Unexpected internal error in chat."}), 500
@@ -1,26 +1,30 @@
 # backend/routes/invoice_routes.py
 from flask import Blueprint, request, jsonify, current_app
 import os
-import uuid
 import json
+import base64
+import binascii
 from decimal import Decimal
 import datetime # Import datetime to check for date/datetime objects
-
-ALLOWED_FIELDS = [
-    'vendor_name',
-    'invoice_id_number',
-    'invoice_date',
-    'due_date',
-    'total_amount',
-    'currency',
-    'vendor_phone',
-    'vendor_address',
-    'parsed_data',
-    'full_textract_response'
-]
+from ..services.ingestion_service import StageError, persist_expense_documents
+from ..services.bulk_upload_service import BulkUploadError
 
 invoice_bp = Blueprint('invoice_bp', __name__)
 
+# Opaque keyset cursor for the invoice list: base64url of [upload_timestamp ISO string, id]
+def encode_invoice_cursor(next_key):
+    upload_timestamp, invoice_id = next_key
+    payload = json.dumps([upload_timestamp.isoformat() if isinstance(upload_timestamp, datetime.datetime) else upload_timestamp, invoice_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_invoice_cursor(cursor):
+    """Returns (upload_timestamp, id) from a cursor; raises ValueError if the cursor is malformed."""
+    try:
+        upload_timestamp, invoice_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+        return datetime.datetime.fromisoformat(upload_timestamp), int(invoice_id)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
 # Helper function to format invoice data for JSON response
 def format_invoice_for_json(invoice_dict):
     if not invoice_dict:
@@ -63,12 +67,9 @@ def format_invoice_for_json(invoice_dict):
 
 @invoice_bp.route("/upload", methods=["POST"])
 def upload_invoice_route():
-    db_service = current_app.extensions.get('db_service')
-    s3_service = current_app.extensions.get('s3_service')
-    textract_service = current_app.extensions.get('textract_service')
-
-    if not all([db_service, s3_service, textract_service]):
-        current_app.logger.error("One or more services not available in /upload route.")
+    ingestion_service = current_app.extensions.get('ingestion_service')
+    if not ingestion_service:
+        current_app.logger.error("IngestionService not available in /upload route.")
         return jsonify({"error": "Server configuration error, services not available."}), 503
 
     current_app.logger.info("Upload endpoint hit")
@@ -84,76 +85,81 @@ def upload_invoice_route():
     original_filename = file.filename
     current_app.logger.info(f"File received: {original_filename}")
 
-    invoice_record = None
+    # Only persist + enqueue here; S3 upload, Textract submission and result collection run in the background pipeline
     try:
-        invoice_record = db_service.create_invoice_record(
-            original_filename=original_filename,
-            status='pending_s3_upload'
-        )
-        if not invoice_record or 'id' not in invoice_record:
-            current_app.logger.error(f"Failed to create database record for {original_filename}")
-            return jsonify({"error": "Failed to initialize invoice processing in DB"}), 500
-        invoice_id = invoice_record['id']
-        current_app.logger.info(f"Initial DB record created for {original_filename} with ID: {invoice_id}")
-
-        s3_folder = f"invoices/{invoice_id}"
-        s3_object_key = s3_service.upload_file_obj(file_obj=file, object_name=original_filename, folder=s3_folder)
-        if not s3_object_key:
-            db_service.update_invoice_status(invoice_id, status='s3_upload_failed', error_message="S3 upload failed")
-            return jsonify({"error": "Failed to upload file to S3 storage."}), 500
-        current_app.logger.info(f"File {original_filename} uploaded to S3 at {s3_service.bucket_name}/{s3_object_key}")
-
-        update_s3_success = db_service.update_invoice_s3_details(
-            invoice_id=invoice_id,
-            s3_bucket=s3_service.bucket_name,
-            s3_key=s3_object_key,
-            status='pending_textract_submission'
-        )
-        if not update_s3_success:
-            current_app.logger.error(f"Failed to update DB with S3 details for invoice ID {invoice_id}.")
-            return jsonify({"error": "File uploaded to S3, but failed to update database record with S3 info."}), 500
-        current_app.logger.info(f"DB record updated for invoice ID {invoice_id} with S3 details.")
-
-        client_request_token = f"invox-{invoice_id}-{str(uuid.uuid4())}"
-        job_tag = f"InvoxAI-Invoice-{invoice_id}"
-
-        textract_job_id = textract_service.start_expense_analysis(
-            s3_object_key=s3_object_key,
-            client_request_token=client_request_token,
-            job_tag=job_tag
-        )
-        if not textract_job_id:
-            db_service.update_invoice_status(invoice_id, status='textract_submission_failed', error_message="Failed to start Textract expense analysis job.")
-            return jsonify({"error": "Failed to start Textract analysis."}), 500
-        current_app.logger.info(f"Textract Expense Analysis started for invoice ID {invoice_id}. JobId: {textract_job_id}")
-
-        update_textract_job_success = db_service.update_invoice_status(
-            invoice_id,
-            status='processing_textract',
-            textract_job_id=textract_job_id
-        )
-        if not update_textract_job_success:
-            current_app.logger.error(f"Failed to update DB with Textract Job ID for invoice {invoice_id}.")
-            return jsonify({"error": "Textract job started, but failed to update database record with Job ID."}), 500
-        current_app.logger.info(f"DB record updated for invoice ID {invoice_id} with Textract JobId: {textract_job_id}, status 'processing_textract'.")
+        queued = ingestion_service.submit_upload(file, original_filename, content_type=file.mimetype)
+    except StageError as e:
+        current_app.logger.error(f"Failed to queue upload {original_filename}: {e}")
+        return jsonify({"error": "Failed to initialize invoice processing in DB"}), 500
+    except Exception as e:
+        current_app.logger.error(f"Critical error during upload process for {original_filename}: {e}", exc_info=True)
+        return jsonify({"error": "An internal error occurred during file upload processing."}), 500
 
+    if queued['duplicate']: # Same content as an invoice already ingested: nothing was stored or sent to Textract
         return jsonify({
-            "message": f"File '{original_filename}' uploaded and Textract Expense Analysis initiated.",
-            "invoice_id": invoice_id,
-            "s3_bucket": s3_service.bucket_name,
-            "s3_key": s3_object_key,
-            "textract_job_id": textract_job_id,
-            "current_status": 'processing_textract'
-        }), 202
+            "message": f"File '{original_filename}' was already uploaded as invoice {queued['invoice_id']}.",
+            "invoice_id": queued['invoice_id'],
+            "duplicate": True,
+            "current_status": queued['status'],
+            "status_url": f"/api/invoices/{queued['invoice_id']}"
+        }), 200
+
+    return jsonify({
+        "message": f"File '{original_filename}' received and queued for processing.",
+        "invoice_id": queued['invoice_id'],
+        "ingestion_job_id": queued['job_id'],
+        "duplicate": False,
+        "current_status": queued['status'],
+        "status_url": f"/api/invoices/{queued['invoice_id']}/ingestion-status"
+    }), 202
+
+@invoice_bp.route("/upload/bulk", methods=["POST"])
+def bulk_upload_invoices_route():
+    bulk_upload_service = current_app.extensions.get('bulk_upload_service')
+    if not bulk_upload_service:
+        current_app.logger.error("BulkUploadService not available in /upload/bulk route.")
+        return jsonify({"error": "Server configuration error, services not available."}), 503
 
+    # Accepts any number of 'files' parts; each may be an invoice file or a ZIP archive of invoices
+    files = request.files.getlist('files') + request.files.getlist('file')
+    if not files or all(f.filename == '' for f in files):
+        return jsonify({"error": "No files provided. Send one or more 'files' parts (invoices or ZIP archives)."}), 400
+
+    current_app.logger.info(f"Bulk upload endpoint hit with {len(files)} part(s).")
+    try:
+        result = bulk_upload_service.process(files)
+    except BulkUploadError as e:
+        return jsonify({"error": str(e)}), 400
+    except StageError as e:
+        current_app.logger.error(f"Bulk upload failed: {e}")
+        return jsonify({"error": "Failed to initialize invoice processing in DB"}), 500
     except Exception as e:
-        current_app.logger.error(f"Critical error during upload process for {original_filename}: {e}", exc_info=True)
-        db_service = current_app.extensions.get('db_service')
-        if db_service and invoice_record and 'id' in invoice_record:
-             db_service.update_invoice_status(invoice_record['id'], status='error', error_message=f"Upload processing error: {str(e)[:250]}")
-        return jsonify({"error": "An internal error occurred during file upload processing."}), 500
+        current_app.logger.error(f"Critical error during bulk upload: {e}", exc_info=True)
+        return jsonify({"error": "An internal error occurred during bulk upload processing."}), 500
 
-    return jsonify({"error": "File upload failed due to an unknown server issue"}), 500
+    result["status_url"] = f"/api/invoices/upload/bulk/{result['batch_id']}"
+    return jsonify(result), 202
+
+@invoice_bp.route("/upload/bulk/<batch_id>", methods=["GET"])
+def get_bulk_upload_status_route(batch_id):
+    db_service = current_app.extensions.get('db_service')
+    if not db_service: return jsonify({"error": "Server configuration error."}), 503
+    invoices = db_service.get_invoices_by_upload_batch(batch_id)
+    if not invoices: return jsonify({"error": "Bulk upload batch not found."}), 404
+    status_counts = {}
+    for invoice in invoices: status_counts[invoice['status']] = status_counts.get(invoice['status'], 0) + 1
+    return jsonify({"batch_id": batch_id, "total": len(invoices), "status_counts": status_counts, "invoices": [format_invoice_for_json(inv) for inv in invoices]}), 200
+
+@invoice_bp.route("/<int:invoice_id>/ingestion-status", methods=["GET"])
+def get_ingestion_status_route(invoice_id):
+    db_service = current_app.extensions.get('db_service')
+    if not db_service: return jsonify({"error": "Server configuration error."}), 503
+    job = db_service.get_ingestion_job_for_invoice(invoice_id)
+    if not job: return jsonify({"error": "No ingestion job found for this invoice."}), 404
+    job_json = {k: job.get(k) for k in ['id', 'invoice_id', 'stage', 'status', 'attempts', 'textract_job_id', 'last_error']}
+    for ts_key in ['next_run_at', 'created_at', 'updated_at']:
+        job_json[ts_key] = job[ts_key].isoformat() if isinstance(job.get(ts_key), datetime.datetime) else job.get(ts_key)
+    return jsonify(job_json), 200
 
 @invoice_bp.route("/<int:invoice_id>/process-textract-result", methods=["POST"])
 def process_textract_result_route(invoice_id):
@@ -172,30 +178,28 @@ def process_textract_result_route(invoice_id):
     if current_db_status in ['processed', 'textract_failed', 'parsing_failed', 'db_update_failed_post_textract']:
         return jsonify({"message": f"Invoice already processed or failed: {current_db_status}", "data": format_invoice_for_json(invoice)}), 200
 
+    # The server-side poller collects results on its own schedule; don't spend Textract quota on client polling
+    textract_poller = current_app.extensions.get('textract_poller')
+    next_check_in = textract_poller.next_check_in(invoice_id) if textract_poller else None
+    if current_db_status == 'processing_textract' and next_check_in is not None:
+        retry_after = max(1, int(round(next_check_in)))
+        response = jsonify({"message": "Textract analysis is still in progress.", "invoice_id": invoice_id, "job_status": "IN_PROGRESS", "next_check_in_seconds": retry_after})
+        response.headers['Retry-After'] = str(retry_after)
+        return response, 202
+
     current_app.logger.info(f"Fetching Textract Expense results for Job ID: {textract_job_id} (Invoice ID: {invoice_id})")
     textract_response = textract_service.get_all_expense_results_paginated(textract_job_id)
     actual_job_status_from_textract = textract_response.get('JobStatus')
     current_app.logger.info(f"Textract Expense Job Status for {textract_job_id} from AWS: {actual_job_status_from_textract}")
 
-    if actual_job_status_from_textract == 'SUCCEEDED':
+    if actual_job_status_from_textract in ('SUCCEEDED', 'PARTIAL_SUCCESS'): # PARTIAL_SUCCESS is terminal: store what Textract returned
         expense_docs = textract_response.get('ExpenseDocuments', [])
         if not expense_docs:
             db_service.update_invoice_status(invoice_id, status='textract_failed', error_message="SUCCEEDED with no ExpenseDocuments")
             return jsonify({"error": "Textract analysis SUCCEEDED but no expense documents returned."}), 500
         try:
-            current_app.logger.info(f"Parsing {len(expense_docs)} ExpenseDocument(s) from Textract for invoice ID {invoice_id}")
-            parsed_data = textract_service.parse_expense_data(expense_docs)
-
-            # Filter parsed_data based on the whitelist
-            filtered_data = {k: v for k, v in parsed_data.items() if k in ALLOWED_FIELDS}
-
-            # Pass filtered_data dictionary directly to update_invoice_parsed_data
-            # The DbService method will handle which fields to use.
-            update_db_success = db_service.update_invoice_parsed_data(
-                invoice_id=invoice_id,
-                status='processed', # This is the primary status update
-                **filtered_data # Unpack all parsed fields as keyword arguments
-            )
+            update_db_success = persist_expense_documents(db_service, textract_service, invoice_id, expense_docs, expected_status=current_db_status)
+            if not update_db_success and (db_service.get_invoice_by_id(invoice_id) or {}).get('status') == 'processed': update_db_success = True # The poller stored it first
 
             if update_db_success:
                 current_app.logger.info(f"Successfully processed and stored Textract Expense data for invoice ID {invoice_id}.")
@@ -229,14 +233,23 @@ def get_invoices_route():
         current_app.logger.error("DbService not available in /invoices GET route.")
         return jsonify({"error": "Server configuration error, database service not available."}), 503
     try:
-        limit = request.args.get('limit', 100, type=int) # Default to 100, can be overridden by query param
-        offset = request.args.get('offset', 0, type=int)
-
-        current_app.logger.info(f"GET /api/invoices/ - Calling db_service.get_all_invoices(limit={limit}, offset={offset})")
-        invoices_raw = db_service.get_all_invoices(limit=limit, offset=offset)
-
-        if invoices_raw is None: # Should return [] on error or no data, None is unexpected
-            current_app.logger.error("db_service.get_all_invoices() returned None unexpectedly.")
+        limit = min(max(request.args.get('limit', 100, type=int), 1), 500) # Default to 100, can be overridden by query param
+        offset = request.args.get('offset', 0, type=int) # Legacy paging, ignored when a cursor is given
+        after = None
+        if request.args.get('cursor'):
+            try: after = decode_invoice_cursor(request.args['cursor'])
+            except ValueError as e: return jsonify({"error": str(e)}), 400
+        fields = None
+        if request.args.get('fields'):
+            fields = [f.strip() for f in request.args['fields'].split(',') if f.strip()]
+            unknown_fields = [f for f in fields if f not in db_service.INVOICE_SELECTABLE_COLUMNS]
+            if unknown_fields: return jsonify({"error": f"Unknown field(s): {', '.join(unknown_fields)}", "allowed_fields": db_service.INVOICE_SELECTABLE_COLUMNS}), 400
+
+        current_app.logger.info(f"GET /api/invoices/ - Calling db_service.get_invoices_page(limit={limit}, after={after}, offset={offset})")
+        invoices_raw, next_key = db_service.get_invoices_page(limit=limit, after=after, fields=fields, offset=offset)
+
+        if invoices_raw is None:
+            current_app.logger.error("db_service.get_invoices_page() failed.")
             return jsonify({"error": "Database query failed to retrieve any invoices."}), 500
 
         current_app.logger.info(f"GET /api/invoices/ - Fetched {len(invoices_raw)} raw invoice(s) from DB.")
@@ -256,18 +269,39 @@ def get_invoices_route():
         if invoices_raw and len(formatted_invoices) < len(invoices_raw):
             current_app.logger.warning("GET /api/invoices/ - Some raw invoices were not formatted correctly and were excluded.")
 
-        return jsonify(formatted_invoices), 200
+        response = jsonify(formatted_invoices)
+        if next_key: response.headers['X-Next-Cursor'] = encode_invoice_cursor(next_key) # Body stays a plain array for existing clients
+        return response, 200
     except Exception as e:
         current_app.logger.error(f"Error in get_invoices_route: {e}", exc_info=True)
         return jsonify({"error": "Failed to retrieve invoices due to an internal server error"}), 500
 
+@invoice_bp.route("/search", methods=["GET"])
+def search_invoices_route():
+    """Ranked full-text search: ?q=...&limit=20&offset=0&status=processed. The body carries next_offset while more results remain."""
+    db_service = current_app.extensions.get('db_service')
+    if not db_service:
+        current_app.logger.error("DbService not available in /invoices/search route.")
+        return jsonify({"error": "Server configuration error, database service not available."}), 503
+    query = (request.args.get('q') or '').strip()
+    if not query: return jsonify({"error": "Query parameter 'q' is required."}), 400
+    if len(query) > 200: return jsonify({"error": "Query is too long (200 characters max)."}), 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    offset = min(max(request.args.get('offset', 0, type=int), 0), 10000) # Deep OFFSETs re-rank every skipped row
+    results, has_more, mode = db_service.search_invoices(query, limit=limit, offset=offset, status=request.args.get('status') or None)
+    if results is None: return jsonify({"error": "Search failed due to a database error."}), 500
+    return jsonify({"query": query, "mode": mode, "results": [format_invoice_for_json(row) for row in results],
+                    "limit": limit, "offset": offset, "next_offset": offset + limit if has_more else None}), 200
+
 @invoice_bp.route("/<int:invoice_id>", methods=["GET"])
 def get_invoice_detail_route(invoice_id):
     # ... (This route was already correct, uses format_invoice_for_json) ...
     db_service = current_app.extensions.get('db_service')
     if not db_service: return jsonify({"error": "Server configuration error."}), 503
+    # Compressed Textract documents are only loaded here; ?include=parsed_data,full_textract_response (default: parsed_data)
+    include_documents = [d.strip() for d in request.args.get('include', 'parsed_data').split(',') if d.strip() in ('parsed_data', 'full_textract_response')]
     try:
-        invoice = db_service.get_invoice_by_id(invoice_id)
+        invoice = db_service.get_invoice_by_id(invoice_id, include_documents=include_documents)
         if invoice: return jsonify(format_invoice_for_json(invoice)), 200
         else: return jsonify({"error": "Invoice not found"}), 404
     except Exception as e: current_app.logger.error(f"Error fetching invoice {invoice_id}: {e}", exc_info=True); return jsonify({"error": "Failed to retrieve details"}), 500
@@ -288,7 +322,7 @@ def update_invoice_route(invoice_id):
         if not db_service.get_invoice_by_id(invoice_id): return jsonify({"error": "Invoice not found"}), 404
         success = db_service.update_invoice_fields(invoice_id, update_payload)
         if success:
-            updated_invoice_dict = db_service.get_invoice_by_id(invoice_id)
+            updated_invoice_dict = db_service.get_invoice_by_id(invoice_id, include_documents=('parsed_data',)) # Detail view re-renders from this
             return jsonify({"message": f"Invoice ID {invoice_id} updated.","invoice": format_invoice_for_json(updated_invoice_dict)}), 200
         else: current_app.logger.error(f"Update op false for invoice {invoice_id}."); return jsonify({"error": "Failed to update in DB."}), 500
     except Exception as e: current_app.logger.error(f"Exception during update for invoice {invoice_id}: {e}", exc_info=True); return jsonify({"error": "Internal server error during update."}), 500
@@ -3,9 +3,9 @@ from flask import Blueprint, request, jsonify, current_app, make_response
 from datetime import datetime, timedelta
 import json
 import logging
-import markdown 
-from weasyprint import HTML, CSS # Main WeasyPrint imports
-# from weasyprint.fonts import FontConfiguration # <--- TEMPORARILY COMMENTED OUT FOR DEBUGGING
+from ..services.report_service import ReportGenerationError
+from ..services.pdf_render_service import PdfRenderError, PdfRenderBusyError
+from .streaming import sse_event, wants_event_stream, event_stream_response
 
 logger = logging.getLogger(__name__)
 report_bp = Blueprint('report_bp', __name__)
@@ -57,43 +57,24 @@ def format_invoices_for_monthly_report_context(invoices, report_month_year_str,
     return full_context
 
 
-@report_bp.route('/generate/monthly-expense', methods=['POST', 'OPTIONS'])
-def generate_monthly_expense_report():
-    if request.method == 'OPTIONS': return jsonify(success=True), 200 # Handle CORS preflight
-
-    db_service = current_app.extensions.get('db_service')
-    openai_service = current_app.extensions.get('openai_service')
-    if not db_service or not openai_service: 
-        logger.error("generate_monthly_expense_report: DbService or OpenAIService not available.")
-        return jsonify({"error": "Reporting service unavailable due to server configuration."}), 503
+MONTHLY_REPORT_MODEL_PARAMS = {"model": "gpt-3.5-turbo-0125", "temperature": 0.2, "max_tokens": 3000}
+COMPREHENSIVE_REPORT_MODEL_PARAMS = {"model": "gpt-4-turbo-preview", "temperature": 0.3, "max_tokens": 3500}
+# Part of the report store key: bump when a prompt below changes so reports written from the old prompt aren't served again
+MONTHLY_REPORT_PROMPT_VERSION = 1
+COMPREHENSIVE_REPORT_PROMPT_VERSION = 1
 
-    data = request.get_json();
-    if not data: return jsonify({"error": "Missing request data (year, month)."}), 400
-    try:
-        year = int(data.get('year')); month = int(data.get('month'))
-        if not (2000 <= year <= datetime.now().year + 10 and 1 <= month <= 12):
-            return jsonify({"error": "Invalid year or month provided."}), 400
-    except (ValueError, TypeError): 
-        return jsonify({"error": "Year and month must be valid integers."}), 400
-    
-    vendor_filter = data.get('vendor_name'); category_filter = data.get('category')
-    report_month_year_str = datetime(year, month, 1).strftime('%B %Y')
-    report_filters_for_log = {"vendor": vendor_filter, "category": category_filter}
-    logger.info(f"Generating monthly expense report content for: {report_month_year_str}, Filters: {report_filters_for_log}")
+def parse_monthly_report_params(data):
+    """
+    Validated report params ({year, month, vendor_name, category}) from a request body.
+    :raises ValueError: With a message for the client.
+    """
+    try: year = int(data.get('year')); month = int(data.get('month'))
+    except (ValueError, TypeError): raise ValueError("Year and month must be valid integers.")
+    if not (2000 <= year <= datetime.now().year + 10 and 1 <= month <= 12): raise ValueError("Invalid year or month provided.")
+    return {"year": year, "month": month, "vendor_name": (data.get('vendor_name') or '').strip() or None, "category": (data.get('category') or '').strip() or None}
 
-    try:
-        invoices_for_report = db_service.get_invoices_for_report(year, month, vendor_filter, category_filter, limit_for_details=100) # Fetch more for context
-        
-        if not invoices_for_report:
-            logger.info(f"No invoices found for monthly report: {report_month_year_str}, Filters: {report_filters_for_log}")
-            no_data_md = f"# Monthly Expense Report - {report_month_year_str}\n\nNo processed invoices found for this period matching the specified criteria."
-            if vendor_filter: no_data_md += f"\n**Vendor Filter:** {vendor_filter}"
-            if category_filter: no_data_md += f"\n**Category Filter:** {category_filter}"
-            return jsonify({"report_markdown": no_data_md, "message": "No data found to generate this report."}), 200
-
-        report_data_context = format_invoices_for_monthly_report_context(invoices_for_report, report_month_year_str, report_filters_for_log)
-        
-        report_generation_prompt_instruction = f"""
+def build_monthly_report_messages(report_month_year_str, vendor_filter, category_filter, report_data_context):
+    report_generation_prompt_instruction = f"""
 Generate a professional "Monthly Expense Report" in Markdown format for InvoxAI.
 Report Period: {report_month_year_str}
 {f"Filters Applied: Vendor='{vendor_filter}'" if vendor_filter else ""} {f"Category='{category_filter}'" if category_filter else ""}
@@ -118,65 +99,63 @@ Important Instructions:
 
 Generate the full Markdown report now.
 """
-        messages = [{"role": "user", "content": report_generation_prompt_instruction.strip()}]
-        logger.info(f"Requesting Monthly Report Markdown from OpenAI for {report_month_year_str} (prompt length: {len(report_generation_prompt_instruction)} chars)...")
-        report_markdown = openai_service.get_chat_completion(messages, model="gpt-3.5-turbo-0125", temperature=0.2, max_tokens=3000) 
-        
-        if report_markdown and not report_markdown.startswith("ERROR_") and "AI_ASSISTANT_EMPTY_REPLY" not in report_markdown:
-            logger.info(f"Markdown report generated successfully for {report_month_year_str}. Length: {len(report_markdown)}")
-            cleaned_md = report_markdown.strip();
-            if cleaned_md.startswith("```markdown"): cleaned_md = cleaned_md[10:]
-            if cleaned_md.startswith("```"): cleaned_md = cleaned_md[3:]
-            if cleaned_md.endswith("```"): cleaned_md = cleaned_md[:-3]
-            return jsonify({"report_markdown": cleaned_md.strip(), "message": "Report content generated successfully."}), 200
-        else:
-            logger.error(f"Failed to generate report markdown from OpenAI for {report_month_year_str}: {report_markdown}")
-            return jsonify({"error": "Failed to generate report content via AI.", "details": report_markdown}), 500
-    except Exception as e:
-        logger.error(f"Error generating monthly expense report content: {e}", exc_info=True)
-        return jsonify({"error": "An internal server error occurred while generating the report content."}), 500
+    return [{"role": "user", "content": report_generation_prompt_instruction.strip()}]
 
+def build_no_data_monthly_markdown(report_month_year_str, vendor_filter, category_filter):
+    no_data_md = f"# Monthly Expense Report - {report_month_year_str}\n\nNo processed invoices found for this period matching the specified criteria."
+    if vendor_filter: no_data_md += f"\n**Vendor Filter:** {vendor_filter}"
+    if category_filter: no_data_md += f"\n**Category Filter:** {category_filter}"
+    return no_data_md
 
-@report_bp.route('/generate/comprehensive-overview', methods=['POST', 'OPTIONS'])
-def generate_comprehensive_overview_report():
-    if request.method == 'OPTIONS': return jsonify(success=True), 200
-    db_service = current_app.extensions.get('db_service'); openai_service = current_app.extensions.get('openai_service')
-    if not db_service or not openai_service: return jsonify({"error": "Reporting service unavailable."}), 503
-    logger.info("Generating Comprehensive Overview Report...")
-    try:
-        overall_summary = db_service.get_comprehensive_report_summary_stats() 
-        all_vendor_spend = db_service.get_expenses_by_vendor(limit=None) 
-        all_category_spend = db_service.get_expenses_by_category(limit=None)
-        monthly_spend_trend = db_service.get_monthly_spend() 
-        status_counts = db_service.get_invoice_status_counts() 
-        context_parts = ["<report_data_context>"]
-        context_parts.append("\n[Overall Financial Metrics]")
-        if overall_summary:
-            context_parts.append(f"Total Processed Invoices: {overall_summary.get('total_invoices', 'N/A')}"); context_parts.append(f"Total Amount Spent (Processed): ${float(overall_summary.get('total_spent', 0.0)):.2f}"); context_parts.append(f"Average Spend per Invoice: ${float(overall_summary.get('total_spent', 0.0) / (overall_summary.get('total_invoices', 1) or 1)):.2f}"); context_parts.append(f"Date Range: {overall_summary.get('oldest_invoice_date', 'N/A')} to {overall_summary.get('newest_invoice_date', 'N/A')}"); context_parts.append(f"Unique Vendors: {overall_summary.get('unique_vendors', 'N/A')}")
-        else: context_parts.append("Overall financial metrics could not be calculated.")
-        context_parts.append("\n[Spending by Category (All Time - Top 7 for context)]") # Clarified title
-        if all_category_spend:
-            for cat_data in all_category_spend[:7]: context_parts.append(f"- Category: {cat_data.get('user_category', 'N/A')}, Total Spent: ${float(cat_data.get('total_spent_for_category', 0.0)):.2f}, Number of Invoices: {cat_data.get('invoice_count', 0)}")
-            if len(all_category_spend) > 7: context_parts.append("  ...and more categories exist.")
-        else: context_parts.append("No categorized spending data available.")
-        context_parts.append("\n[Spending by Vendor (All Time - Top 7 for context)]") # Clarified title
-        if all_vendor_spend:
-            for ven_data in all_vendor_spend[:7]: context_parts.append(f"- Vendor: {ven_data.get('vendor_name', 'N/A')}, Total Spent: ${float(ven_data.get('total_spent_for_vendor', 0.0)):.2f}, Number of Invoices: {ven_data.get('invoice_count', 0)}")
-            if len(all_vendor_spend) > 7: context_parts.append("  ...and more vendors exist.")
-        else: context_parts.append("No vendor spending data available.")
-        context_parts.append("\n[Monthly Spending Trend (All Time - Last 12 months for context)]") # Clarified title
-        if monthly_spend_trend:
-            for month_data in monthly_spend_trend[-12:]: context_parts.append(f"- Month: {month_data.get('month_year', 'N/A')}, Total Spent: ${float(month_data.get('monthly_total', 0.0)):.2f}, Number of Invoices: {month_data.get('invoice_count',0)}")
-            if len(monthly_spend_trend) > 12 : context_parts.append("  ... (trend data also available for earlier periods)")
-        else: context_parts.append("No monthly spending trend data available.")
-        context_parts.append("\n[Invoice Processing Status (All Invoices in System)]") # Clarified title
-        if status_counts:
-            for status_key, count_val in status_counts.items(): context_parts.append(f"- {status_key.replace('_', ' ').title()}: {count_val}")
-        else: context_parts.append("Could not retrieve invoice status counts.")
-        context_parts.append("</report_data_context>"); report_data_context = "\n".join(context_parts)
-        MAX_CONTEXT_CHARS = 12000 
-        if len(report_data_context) > MAX_CONTEXT_CHARS: logger.warning(f"Comprehensive report context length ({len(report_data_context)}) truncated."); report_data_context = report_data_context[:MAX_CONTEXT_CHARS] + "\n... (Context truncated)"
-        report_master_prompt = f"""
+def prepare_monthly_report(db_service, report_params):
+    """
+    Loads the month's invoices and builds the OpenAI prompt (shared by generation and PDF export).
+    :return: (messages, None), or (None, no_data_markdown) when no invoices match.
+    """
+    year, month = report_params['year'], report_params['month']
+    vendor_filter, category_filter = report_params.get('vendor_name'), report_params.get('category')
+    report_month_year_str = datetime(year, month, 1).strftime('%B %Y')
+    invoices_for_report = db_service.get_invoices_for_report(year, month, vendor_filter, category_filter, limit_for_details=100) # Fetch more for context
+    if not invoices_for_report:
+        logger.info(f"No invoices found for monthly report: {report_month_year_str}, Filters: vendor={vendor_filter}, category={category_filter}")
+        return None, build_no_data_monthly_markdown(report_month_year_str, vendor_filter, category_filter)
+    report_data_context = format_invoices_for_monthly_report_context(invoices_for_report, report_month_year_str, {"vendor_name": vendor_filter, "category": category_filter})
+    return build_monthly_report_messages(report_month_year_str, vendor_filter, category_filter, report_data_context), None
+
+def build_comprehensive_report_messages(db_service):
+    overall_summary = db_service.get_comprehensive_report_summary_stats() 
+    all_vendor_spend = db_service.get_expenses_by_vendor(limit=None) 
+    all_category_spend = db_service.get_expenses_by_category(limit=None)
+    monthly_spend_trend = db_service.get_monthly_spend() 
+    status_counts = db_service.get_invoice_status_counts() 
+    context_parts = ["<report_data_context>"]
+    context_parts.append("\n[Overall Financial Metrics]")
+    if overall_summary:
+        context_parts.append(f"Total Processed Invoices: {overall_summary.get('total_invoices', 'N/A')}"); context_parts.append(f"Total Amount Spent (Processed): ${float(overall_summary.get('total_spent', 0.0)):.2f}"); context_parts.append(f"Average Spend per Invoice: ${float(overall_summary.get('total_spent', 0.0) / (overall_summary.get('total_invoices', 1) or 1)):.2f}"); context_parts.append(f"Date Range: {overall_summary.get('oldest_invoice_date', 'N/A')} to {overall_summary.get('newest_invoice_date', 'N/A')}"); context_parts.append(f"Unique Vendors: {overall_summary.get('unique_vendors', 'N/A')}")
+    else: context_parts.append("Overall financial metrics could not be calculated.")
+    context_parts.append("\n[Spending by Category (All Time - Top 7 for context)]") # Clarified title
+    if all_category_spend:
+        for cat_data in all_category_spend[:7]: context_parts.append(f"- Category: {cat_data.get('user_category', 'N/A')}, Total Spent: ${float(cat_data.get('total_spent_for_category', 0.0)):.2f}, Number of Invoices: {cat_data.get('invoice_count', 0)}")
+        if len(all_category_spend) > 7: context_parts.append("  ...and more categories exist.")
+    else: context_parts.append("No categorized spending data available.")
+    context_parts.append("\n[Spending by Vendor (All Time - Top 7 for context)]") # Clarified title
+    if all_vendor_spend:
+        for ven_data in all_vendor_spend[:7]: context_parts.append(f"- Vendor: {ven_data.get('vendor_name', 'N/A')}, Total Spent: ${float(ven_data.get('total_spent_for_vendor', 0.0)):.2f}, Number of Invoices: {ven_data.get('invoice_count', 0)}")
+        if len(all_vendor_spend) > 7: context_parts.append("  ...and more vendors exist.")
+    else: context_parts.append("No vendor spending data available.")
+    context_parts.append("\n[Monthly Spending Trend (All Time - Last 12 months for context)]") # Clarified title
+    if monthly_spend_trend:
+        for month_data in monthly_spend_trend[-12:]: context_parts.append(f"- Month: {month_data.get('month_year', 'N/A')}, Total Spent: ${float(month_data.get('monthly_total', 0.0)):.2f}, Number of Invoices: {month_data.get('invoice_count',0)}")
+        if len(monthly_spend_trend) > 12 : context_parts.append("  ... (trend data also available for earlier periods)")
+    else: context_parts.append("No monthly spending trend data available.")
+    context_parts.append("\n[Invoice Processing Status (All Invoices in System)]") # Clarified title
+    if status_counts:
+        for status_key, count_val in status_counts.items(): context_parts.append(f"- {(status_key or 'unknown').replace('_', ' ').title()}: {count_val}")
+    else: context_parts.append("Could not retrieve invoice status counts.")
+    context_parts.append("</report_data_context>"); report_data_context = "\n".join(context_parts)
+    MAX_CONTEXT_CHARS = 12000 
+    if len(report_data_context) > MAX_CONTEXT_CHARS: logger.warning(f"Comprehensive report context length ({len(report_data_context)}) truncated."); report_data_context = report_data_context[:MAX_CONTEXT_CHARS] + "\n... (Context truncated)"
+    report_master_prompt = f"""
 You are InvoxAI's advanced financial reporting engine. Generate a "Comprehensive Invoice Overview Report" in Markdown.
 This report covers all processed invoice data available in the system.
 Report Sections (use Markdown headings ##, ###, bold, lists, tables where appropriate):
@@ -192,139 +171,226 @@ Be strictly data-driven. If data for a section is missing or insufficient from t
 Here is the full data context to use:
 {report_data_context}
 Generate the complete Markdown report."""
-        messages = [{"role": "user", "content": report_master_prompt.strip()}]
+    return [{"role": "user", "content": report_master_prompt.strip()}]
+
+def stream_report_events(report_service, report_type, report_params, messages, model_params, artifact_key=None):
+    """SSE frames for a streamed report: started, section..., heartbeat while the model is silent, done / error."""
+    events = report_service.stream(report_type, report_params, messages, model_params, artifact_key=artifact_key)
+    try:
+        for event, data in events: yield sse_event(event, data)
+    finally: events.close() # Client gone: stops the producer thread's OpenAI stream
+
+def stream_static_report_events(report_id, report_markdown, stored=False):
+    """SSE frames for a report that needed no generation (same event sequence as a streamed one)."""
+    yield sse_event("started", {"report_type": None, "model": None})
+    yield sse_event("section", {"index": 0, "markdown": report_markdown})
+    yield sse_event("done", {"report_id": report_id, "report_markdown": report_markdown, "sections": 1, "generation_ms": 0, "usage": None, "stored": stored})
+
+def stored_report_response(report, wants_stream, message):
+    """Response for a report served from the report store, as JSON or as a one-section event stream."""
+    if wants_stream: return event_stream_response(stream_static_report_events(report['id'], report['report_markdown'], stored=True))
+    return jsonify({"report_id": report['id'], "report_markdown": report['report_markdown'], "stored": True, "generated_at": report.get('created_at'), "message": message}), 200
+
+@report_bp.route('/generate/monthly-expense', methods=['POST', 'OPTIONS'])
+def generate_monthly_expense_report():
+    """
+    Monthly report as JSON, or streamed section by section as server-sent events ("stream": true / Accept: text/event-stream).
+    Served from the report store when the same report was generated from the same data and prompt before.
+    """
+    if request.method == 'OPTIONS': return jsonify(success=True), 200 # Handle CORS preflight
+
+    db_service = current_app.extensions.get('db_service')
+    report_service = current_app.extensions.get('report_service')
+    if not db_service or not report_service or not report_service.openai_service: 
+        logger.error("generate_monthly_expense_report: DbService or OpenAIService not available.")
+        return jsonify({"error": "Reporting service unavailable due to server configuration."}), 503
+
+    data = request.get_json(silent=True)
+    if not data: return jsonify({"error": "Missing request data (year, month)."}), 400
+    try: report_params = parse_monthly_report_params(data)
+    except ValueError as e: return jsonify({"error": str(e)}), 400
+    report_month_year_str = datetime(report_params['year'], report_params['month'], 1).strftime('%B %Y')
+    logger.info(f"Generating monthly expense report content for: {report_month_year_str}, Filters: vendor={report_params['vendor_name']}, category={report_params['category']}")
+
+    try:
+        artifact_key = report_service.artifact_key('monthly_expense', report_params, MONTHLY_REPORT_PROMPT_VERSION, MONTHLY_REPORT_MODEL_PARAMS)
+        stored_report = report_service.find_stored(artifact_key)
+        if stored_report: return stored_report_response(stored_report, wants_event_stream(data), "Report loaded from the report store.")
+
+        messages, no_data_md = prepare_monthly_report(db_service, report_params)
+        if no_data_md:
+            report_id = report_service.save_static_report('monthly_expense', report_params, no_data_md, artifact_key=artifact_key)
+            if wants_event_stream(data): return event_stream_response(stream_static_report_events(report_id, no_data_md))
+            return jsonify({"report_markdown": no_data_md, "report_id": report_id, "message": "No data found to generate this report."}), 200
+
+        logger.info(f"Requesting Monthly Report Markdown from OpenAI for {report_month_year_str} (prompt length: {len(messages[0]['content'])} chars)...")
+        if wants_event_stream(data):
+            return event_stream_response(stream_report_events(report_service, 'monthly_expense', report_params, messages, MONTHLY_REPORT_MODEL_PARAMS, artifact_key))
+        try: report = report_service.generate('monthly_expense', report_params, messages, MONTHLY_REPORT_MODEL_PARAMS, artifact_key=artifact_key)
+        except ReportGenerationError as e:
+            logger.error(f"Failed to generate report markdown from OpenAI for {report_month_year_str}: {e.details}")
+            return jsonify({"error": "Failed to generate report content via AI.", "details": e.details}), 500
+        logger.info(f"Markdown report generated successfully for {report_month_year_str}. Length: {len(report['report_markdown'])}")
+        return jsonify({**report, "message": "Report content generated successfully."}), 200
+    except Exception as e:
+        logger.error(f"Error generating monthly expense report content: {e}", exc_info=True)
+        return jsonify({"error": "An internal server error occurred while generating the report content."}), 500
+
+
+@report_bp.route('/generate/comprehensive-overview', methods=['POST', 'OPTIONS'])
+def generate_comprehensive_overview_report():
+    """Comprehensive overview as JSON, or streamed as server-sent events ("stream": true / Accept: text/event-stream). Uses the report store like the monthly report."""
+    if request.method == 'OPTIONS': return jsonify(success=True), 200
+    db_service = current_app.extensions.get('db_service'); report_service = current_app.extensions.get('report_service')
+    if not db_service or not report_service or not report_service.openai_service: return jsonify({"error": "Reporting service unavailable."}), 503
+    logger.info("Generating Comprehensive Overview Report...")
+    wants_stream = wants_event_stream(request.get_json(silent=True))
+    try:
+        artifact_key = report_service.artifact_key('comprehensive_overview', {}, COMPREHENSIVE_REPORT_PROMPT_VERSION, COMPREHENSIVE_REPORT_MODEL_PARAMS)
+        stored_report = report_service.find_stored(artifact_key)
+        if stored_report: return stored_report_response(stored_report, wants_stream, "Comprehensive report loaded from the report store.")
+        messages = build_comprehensive_report_messages(db_service)
         logger.info("Requesting Comprehensive Overview Report Markdown from OpenAI...")
-        report_markdown = openai_service.get_chat_completion(messages, model="gpt-4-turbo-preview", temperature=0.3, max_tokens=3500) 
-        if report_markdown and not report_markdown.startswith("ERROR_") and "AI_ASSISTANT_EMPTY_REPLY" not in report_markdown:
-            logger.info(f"Comprehensive report generated. Length: {len(report_markdown)}")
-            cleaned_md = report_markdown.strip();
-            if cleaned_md.startswith("```markdown"): cleaned_md = cleaned_md[10:]
-            if cleaned_md.startswith("```"): cleaned_md = cleaned_md[3:]
-            if cleaned_md.endswith("```"): cleaned_md = cleaned_md[:-3]
-            return jsonify({"report_markdown": cleaned_md.strip(), "message": "Comprehensive report generated."}), 200
-        else:
-            logger.error(f"Failed to generate comprehensive report from OpenAI: {report_markdown}")
-            return jsonify({"error": "Failed to generate comprehensive report via AI.", "details": report_markdown}), 500
+        if wants_stream:
+            return event_stream_response(stream_report_events(report_service, 'comprehensive_overview', {}, messages, COMPREHENSIVE_REPORT_MODEL_PARAMS, artifact_key))
+        try: report = report_service.generate('comprehensive_overview', {}, messages, COMPREHENSIVE_REPORT_MODEL_PARAMS, artifact_key=artifact_key)
+        except ReportGenerationError as e:
+            logger.error(f"Failed to generate comprehensive report from OpenAI: {e.details}")
+            return jsonify({"error": "Failed to generate comprehensive report via AI.", "details": e.details}), 500
+        logger.info(f"Comprehensive report generated. Length: {len(report['report_markdown'])}")
+        return jsonify({**report, "message": "Comprehensive report generated."}), 200
     except Exception as e:
         logger.error(f"Error generating comprehensive overview report: {e}", exc_info=True)
         return jsonify({"error": "Internal server error generating comprehensive report."}), 500
 
+@report_bp.route('/<int:report_id>', methods=['GET'])
+def get_generated_report(report_id):
+    """A previously generated report (Markdown and the parameters it was generated for)."""
+    report_service = current_app.extensions.get('report_service')
+    if not report_service: return jsonify({"error": "Reporting service unavailable."}), 503
+    report = report_service.get_report(report_id)
+    if not report: return jsonify({"error": "Report not found."}), 404
+    return jsonify(report), 200
+
+def monthly_report_pdf_filename(report_params):
+    filename = f"InvoxAI_Monthly_Expense_Report_{datetime(int(report_params['year']), int(report_params['month']), 1).strftime('%Y_%m_%B')}"
+    if report_params.get('vendor_name'): filename += f"_Vendor_{report_params['vendor_name'].replace(' ', '_').lower()}"
+    if report_params.get('category'): filename += f"_Category_{report_params['category'].replace(' ', '_').lower()}"
+    return filename + ".pdf"
+
+def resolve_monthly_export_report(db_service, report_service, data):
+    """
+    The monthly report to export: the stored report for {"report_id": N}, otherwise the report store entry for
+    year/month/filters (the Markdown the generate endpoint returned), generated only on a store miss.
+    :return: (report, report_params, None) or (None, None, error_response).
+    """
+    if data.get('report_id') is not None:
+        try: report = report_service.get_report(int(data['report_id']))
+        except (ValueError, TypeError): return None, None, (jsonify({"error": "report_id must be an integer."}), 400)
+        if not report or report.get('report_type') != 'monthly_expense': return None, None, (jsonify({"error": "Monthly expense report not found."}), 404)
+        return report, report.get('report_params') or {}, None
+    try: report_params = parse_monthly_report_params(data)
+    except ValueError as e: return None, None, (jsonify({"error": str(e)}), 400)
+    try:
+        artifact_key = report_service.artifact_key('monthly_expense', report_params, MONTHLY_REPORT_PROMPT_VERSION, MONTHLY_REPORT_MODEL_PARAMS)
+        report = report_service.find_stored(artifact_key)
+        if not report:
+            logger.info(f"PDF Export: No stored report, generating Markdown for Monthly Report - {datetime(report_params['year'], report_params['month'], 1).strftime('%B %Y')}")
+            messages, no_data_md = prepare_monthly_report(db_service, report_params)
+            if no_data_md: report = {"id": report_service.save_static_report('monthly_expense', report_params, no_data_md, artifact_key=artifact_key), "report_markdown": no_data_md}
+            else:
+                generated = report_service.generate('monthly_expense', report_params, messages, MONTHLY_REPORT_MODEL_PARAMS, artifact_key=artifact_key)
+                report = {"id": generated['report_id'], "report_markdown": generated['report_markdown']}
+        return report, report_params, None
+    except ReportGenerationError as e:
+        logger.error(f"PDF Export: AI content generation failed with: {e.details}")
+        return None, None, (jsonify({"error": "Failed to generate report content via AI.", "details": e.details}), 500)
+    except Exception as e: 
+        logger.error(f"PDF Export: Error generating report markdown: {e}", exc_info=True)
+        return None, None, (jsonify({"error": "Internal error generating report content for PDF."}), 500)
+
+def pdf_busy_response(error):
+    response = jsonify({"error": str(error)})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
+def pdf_download_response(pdf_bytes, filename):
+    response = make_response(pdf_bytes)
+    response.headers['Content-Type'] = 'application/pdf'
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def get_pdf_export_services():
+    db_service = current_app.extensions.get('db_service')
+    report_service = current_app.extensions.get('report_service')
+    pdf_render_service = current_app.extensions.get('pdf_render_service')
+    return (db_service, report_service, pdf_render_service) if db_service and report_service and pdf_render_service else None
+
 @report_bp.route('/export/monthly-expense/pdf', methods=['POST', 'OPTIONS'])
 def export_monthly_expense_report_pdf():
+    """
+    PDF of a monthly report (see resolve_monthly_export_report), rendered by the PDF render pool while this request
+    waits. The rendered PDF is stored with the report, so repeated exports skip rendering.
+    Prefer /export/monthly-expense/pdf/jobs for large reports.
+    """
     if request.method == 'OPTIONS':
         return jsonify(success=True), 200
 
     logger.info("PDF Export for monthly report requested.")
-    
-    # --- WeasyPrint logic is now active ---
-    db_service = current_app.extensions.get('db_service')
-    openai_service = current_app.extensions.get('openai_service')
-    if not db_service or not openai_service:
-        return jsonify({"error": "Reporting service unavailable for PDF export."}), 503
+    services = get_pdf_export_services()
+    if not services: return jsonify({"error": "Reporting service unavailable for PDF export."}), 503
+    db_service, report_service, pdf_render_service = services
+    data = request.get_json(silent=True)
+    if not data: return jsonify({"error": "Missing request data for PDF export."}), 400
+    report, report_params, error_response = resolve_monthly_export_report(db_service, report_service, data)
+    if error_response: return error_response
+
+    filename = monthly_report_pdf_filename(report_params)
+    pdf_bytes = report_service.get_pdf(report)
+    if pdf_bytes is not None: logger.info(f"PDF Export: Using stored PDF of report {report['id']}.")
+    else:
+        try: pdf_bytes = pdf_render_service.render(report['report_markdown'], filename.replace('.pdf', ''), on_done=lambda pdf, report_id=report.get('id'): report_service.save_pdf(report_id, pdf))
+        except PdfRenderBusyError as e: return pdf_busy_response(e)
+        except PdfRenderError as e:
+            logger.error(f"Error generating PDF for {filename}: {e} ({e.details})")
+            return jsonify({"error": "Failed to generate PDF due to an internal error.", "details": e.details}), 500
+    return pdf_download_response(pdf_bytes, filename)
 
-    data = request.get_json()
+@report_bp.route('/export/monthly-expense/pdf/jobs', methods=['POST', 'OPTIONS'])
+def submit_monthly_expense_pdf_job():
+    """Queues a monthly report PDF render (same body as the export). Returns 202 with the job; poll status_url, then fetch download_url."""
+    if request.method == 'OPTIONS': return jsonify(success=True), 200
+    services = get_pdf_export_services()
+    if not services: return jsonify({"error": "Reporting service unavailable for PDF export."}), 503
+    db_service, report_service, pdf_render_service = services
+    data = request.get_json(silent=True)
     if not data: return jsonify({"error": "Missing request data for PDF export."}), 400
-    try:
-        year = int(data.get('year')); month = int(data.get('month'))
-        if not (2000 <= year <= datetime.now().year + 10 and 1 <= month <= 12):
-            return jsonify({"error": "Invalid year or month for PDF export."}), 400
-    except (ValueError, TypeError): 
-        return jsonify({"error": "Year and month must be valid integers for PDF export."}), 400
-    
-    vendor_filter = data.get('vendor_name'); category_filter = data.get('category')
-    report_month_year_str_fn = datetime(year, month, 1).strftime('%Y_%m_%B') 
-    filename = f"InvoxAI_Monthly_Expense_Report_{report_month_year_str_fn}"
-    if vendor_filter: filename += f"_Vendor_{vendor_filter.replace(' ', '_').lower()}"
-    if category_filter: filename += f"_Category_{category_filter.replace(' ', '_').lower()}"
-    filename += ".pdf"
-
-    report_markdown_content = None
-    try: 
-        logger.info(f"PDF Export: Generating Markdown for Monthly Report - {datetime(year,month,1).strftime('%B %Y')}")
-        invoices_for_report = db_service.get_invoices_for_report(year, month, vendor_filter, category_filter, limit_for_details=100)
-        
-        # Use a simpler context/prompt if no invoices found, directly for markdown
-        if not invoices_for_report: 
-            report_markdown_content = f"# Monthly Expense Report - {datetime(year,month,1).strftime('%B %Y')}\n\n"
-            if vendor_filter: report_markdown_content += f"**Vendor Filter:** {vendor_filter}\n"
-            if category_filter: report_markdown_content += f"**Category Filter:** {category_filter}\n"
-            report_markdown_content += "\nNo processed invoices found for this period matching the specified criteria."
-        else:
-            report_data_context = format_invoices_for_monthly_report_context(invoices_for_report, datetime(year,month,1).strftime('%B %Y'), {"vendor_name": vendor_filter, "category": category_filter})
-            report_generation_prompt_instruction = f"""
-Generate a professional "Monthly Expense Report" in Markdown format for InvoxAI. Report Period: {datetime(year,month,1).strftime('%B %Y')}
-{f"Filters Applied: Vendor='{vendor_filter}'" if vendor_filter else ""} {f"Category='{category_filter}'" if category_filter else ""}
-Sections (use Markdown headings ##, ###, bold, lists, tables): Executive Summary, Spending Overview, Top Vendors, Spend by Category, Invoice Detail Summary (Appendix).
-Be strictly data-driven from <report_data_context>. If data for a section isn't there, state "Insufficient data".
-<report_data_context>
-{report_data_context}
-</report_data_context>
-Generate the full Markdown report."""
-            messages = [{"role": "user", "content": report_generation_prompt_instruction.strip()}]
-            report_markdown_content = openai_service.get_chat_completion(messages, model="gpt-3.5-turbo-0125", temperature=0.2, max_tokens=3000)
-            
-            if report_markdown_content and not report_markdown_content.startswith("ERROR_") and "AI_ASSISTANT_EMPTY_REPLY" not in report_markdown_content:
-                cleaned_md = report_markdown_content.strip(); 
-                if cleaned_md.startswith("```markdown"): cleaned_md = cleaned_md[10:]
-                if cleaned_md.startswith("```"): cleaned_md = cleaned_md[3:]
-                if cleaned_md.endswith("```"): cleaned_md = cleaned_md[:-3]
-                report_markdown_content = cleaned_md.strip()
-            else: 
-                logger.error(f"PDF Export: AI content generation failed with: {report_markdown_content}")
-                raise Exception(f"AI content generation failed for PDF: {report_markdown_content or 'Unknown AI error'}")
-                
-    except Exception as e: 
-        logger.error(f"PDF Export: Error generating report markdown: {e}", exc_info=True)
-        return jsonify({"error": "Internal error generating report content for PDF."}), 500
+    report, report_params, error_response = resolve_monthly_export_report(db_service, report_service, data)
+    if error_response: return error_response
 
-    if not report_markdown_content: # Should be caught by the exception above ideally
-        logger.error("PDF Export: Report markdown content is unexpectedly None after generation attempt.")
-        return jsonify({"error": "Could not generate report content for PDF (content was empty)."}), 500
-    
-    try:
-        logger.info("PDF Export: Converting Markdown to HTML for WeasyPrint.")
-        html_content = markdown.markdown(report_markdown_content, extensions=['tables', 'fenced_code', 'sane_lists'])
-        
-        pdf_css_string = """
-        @page { size: A4; margin: 1.5cm; @bottom-center { content: "Page " counter(page) " of " counter(pages); font-size: 9pt; color: #666;}}
-        body { font-family: 'Times New Roman', Times, serif; font-size: 11pt; line-height: 1.5; color: #222; }
-        h1, h2, h3, h4, h5, h6 { font-family: 'Arial Black', 'Arial Bold', Gadget, sans-serif; color: #1a3b5c; margin-top: 1.2em; margin-bottom: 0.6em; border-bottom: 1px solid #cccccc; padding-bottom: 0.2em; page-break-after: avoid; }
-        h1 { font-size: 22pt; text-align: center; border-bottom: 2px solid #1a3b5c; margin-bottom: 1em;}
-        h2 { font-size: 16pt; } h3 { font-size: 13pt; } h4 { font-size: 11pt; font-style: italic; border-bottom: none;}
-        table { border-collapse: collapse; width: 100%; margin-bottom: 1.2em; page-break-inside: auto; }
-        tr { page-break-inside: avoid; page-break-after: auto; }
-        thead { display: table-header-group; } 
-        th, td { border: 1px solid #bfbfbf; padding: 7px; text-align: left; vertical-align: top; }
-        th { background-color: #e9eff5; font-weight: bold; color: #1a3b5c;}
-        p { margin-bottom: 0.8em; text-align: justify;}
-        ul, ol { margin-bottom: 0.8em; padding-left: 25px; page-break-inside: auto; }
-        li { margin-bottom: 0.3em; }
-        strong, b { font-weight: bold; } em, i { font-style: italic; }
-        a { color: #0066cc; text-decoration: none; } a:hover { text-decoration: underline; }
-        pre { background-color: #f8f8f8; padding: 10px; border: 1px solid #eee; border-radius: 3px; overflow-x: auto; white-space: pre-wrap; word-wrap: break-word; font-family: 'Courier New', monospace; font-size: 9pt;}
-        code { font-family: 'Courier New', monospace; background-color: #f0f0f0; padding: 1px 3px; border-radius: 2px;}
-        blockquote { border-left: 3px solid #adb5bd; padding-left: 12px; color: #495057; margin-left: 0; font-style: italic;}
-        """
-        
-        font_config = FontConfiguration() # Using default font configuration
-        html_doc = HTML(string=f"<html><head><meta charset='utf-8'><title>{filename.replace('.pdf','')}</title></head><body>{html_content}</body></html>", base_url=".")
-        css_doc = CSS(string=pdf_css_string, font_config=font_config)
-        
-        pdf_bytes = html_doc.write_pdf(stylesheets=[css_doc], font_config=font_config)
-        
-        logger.info(f"PDF generated successfully for {filename}. Size: {len(pdf_bytes)} bytes.")
-
-        response = make_response(pdf_bytes)
-        response.headers['Content-Type'] = 'application/pdf'
-        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
-        return response
-        
-    except NameError as ne: 
-        logger.error(f"WeasyPrint components (HTML, CSS) not available. Error: {ne}", exc_info=True)
-        return jsonify({"error": "PDF generation service component missing. Please check server logs.", "details": str(ne)}), 500
-    except Exception as e:
-        logger.error(f"Error generating PDF for {filename}: {e}", exc_info=True)
-        error_detail = str(e)
-        if "DLL load failed" in error_detail or "library not found" in error_detail.lower() or "No module named 'pangocffi'" in error_detail or "No module named '_weasyprint_bindings'" in error_detail:
-            error_detail = "A required system library for PDF generation is missing or WeasyPrint installation is incomplete. Please check WeasyPrint system dependencies (e.g., Pango, Cairo, CFFI related libs)."
-        return jsonify({"error": "Failed to generate PDF due to an internal error.", "details": error_detail}), 500
\ No newline at end of file
+    title = monthly_report_pdf_filename(report_params).replace('.pdf', '')
+    stored_pdf = report_service.get_pdf(report)
+    if stored_pdf is not None: job = pdf_render_service.add_finished_job(stored_pdf, title, report_id=report.get('id')) # Same download flow, nothing to render
+    else:
+        try: job = pdf_render_service.submit(report['report_markdown'], title, on_done=lambda pdf, report_id=report.get('id'): report_service.save_pdf(report_id, pdf), report_id=report.get('id'))
+        except PdfRenderBusyError as e: return pdf_busy_response(e)
+    job_url = f"{request.script_root}/api/reports/pdf-jobs/{job['job_id']}"
+    return jsonify({**job, "report_id": report.get('id'), "status_url": job_url, "download_url": f"{job_url}/download"}), 202
+
+@report_bp.route('/pdf-jobs/<job_id>', methods=['GET'])
+def get_pdf_job(job_id):
+    pdf_render_service = current_app.extensions.get('pdf_render_service')
+    job = pdf_render_service.get_job(job_id) if pdf_render_service else None
+    if not job: return jsonify({"error": "PDF job not found or expired."}), 404
+    return jsonify(job), 200
+
+@report_bp.route('/pdf-jobs/<job_id>/download', methods=['GET'])
+def download_pdf_job(job_id):
+    pdf_render_service = current_app.extensions.get('pdf_render_service')
+    job = pdf_render_service.get_job(job_id) if pdf_render_service else None
+    if not job: return jsonify({"error": "PDF job not found or expired."}), 404
+    if job['status'] == "failed": return jsonify({"error": "Failed to generate PDF due to an internal error.", "details": job['error']}), 500
+    if job['status'] != "done":
+        response = jsonify(job); response.headers['Retry-After'] = "1"
+        return response, 202
+    return pdf_download_response(pdf_render_service.get_job_pdf(job_id), f"{job['title']}.pdf")
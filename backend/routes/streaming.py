@@ -0,0 +1,16 @@
+# backend/routes/streaming.py
+# Server-sent event helpers shared by the streaming chat and report endpoints
+import json
+from flask import request, Response, stream_with_context
+
+def sse_event(event, data):
+    """One server-sent event frame with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def wants_event_stream(data):
+    """True when the client asked for text/event-stream ("stream": true in the body, ?stream=1 or the Accept header)."""
+    return bool((data or {}).get("stream")) or request.args.get('stream', '').lower() in ('1', 'true') or 'text/event-stream' in request.headers.get('Accept', '')
+
+def event_stream_response(events):
+    """Wraps a generator of SSE frames; proxy buffering is disabled so frames go out as they are produced."""
+    return Response(stream_with_context(events), mimetype='text/event-stream', headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,208 @@
+# backend/services/bulk_upload_service.py
+import os
+import time
+import uuid
+import hashlib
+import zipfile
+import mimetypes
+import threading
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from .ingestion_service import StageError
+
+logger = logging.getLogger(__name__)
+
+class BulkUploadError(Exception):
+    """Raised when a bulk upload request is rejected as a whole (too many files, unreadable archive, ...)."""
+    pass
+
+class BulkUploadService:
+    """
+    Bulk ingestion of many invoice files (multipart list and/or ZIP archives).
+    All invoice rows are inserted with one batched INSERT, files are uploaded to S3 through a bounded thread pool
+    (ZIP members are streamed one at a time, never extracting the whole archive), and successful uploads are queued
+    on the IngestionService at the Textract submission stage. Files whose content (SHA-256) was already ingested, or
+    appears twice in the batch, are not uploaded: they resolve to the existing invoice and their placeholder row is dropped.
+    """
+
+    ALLOWED_EXTENSIONS = {'.pdf', '.png', '.jpg', '.jpeg', '.tif', '.tiff'} # Formats AnalyzeExpense accepts
+
+    def __init__(self, app_config, db_service, s3_service, ingestion_service):
+        self.config = app_config
+        self.db_service = db_service
+        self.s3_service = s3_service
+        self.ingestion_service = ingestion_service
+        self.max_workers = max(1, int(self.config.get('BULK_UPLOAD_MAX_WORKERS', 8)))
+        self.max_files = max(1, int(self.config.get('BULK_UPLOAD_MAX_FILES', 5000)))
+        self.max_member_bytes = int(self.config.get('BULK_UPLOAD_MAX_MEMBER_BYTES', 20 * 1024 * 1024))
+        self.spool_memory_bytes = int(self.config.get('BULK_UPLOAD_SPOOL_MEMORY_BYTES', 1024 * 1024))
+        self.deduplicate = bool(self.config.get('UPLOAD_DEDUPLICATION', True))
+        self._hashes_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bulk-upload")
+        self._stats_lock = threading.Lock()
+        self._stats = {"batches": 0, "files_uploaded": 0, "files_failed": 0, "files_duplicate": 0}
+
+    def stats(self):
+        with self._stats_lock: return {"workers": self.max_workers, **self._stats}
+
+    # --- Collecting items ---
+    @staticmethod
+    def _is_zip(file_storage):
+        return file_storage.filename.lower().endswith('.zip') or file_storage.mimetype in ('application/zip', 'application/x-zip-compressed')
+
+    def _check_name(self, filename):
+        """Returns an error message if a file should not be ingested, else None."""
+        base_name = os.path.basename(filename)
+        if not base_name or base_name.startswith('.') or filename.startswith('__MACOSX/'): return "Skipped hidden or metadata entry."
+        if os.path.splitext(base_name)[1].lower() not in self.ALLOWED_EXTENSIONS: return f"Unsupported file type '{os.path.splitext(base_name)[1] or base_name}'."
+        return None
+
+    def collect_items(self, files):
+        """
+        Expands uploaded FileStorage objects into per-file items. ZIP archives are read through their central directory
+        only; member bytes are decompressed later, inside the upload workers.
+        :return: (items, archives) - items are dicts with filename, opener, size, status, error; archives must be closed by the caller.
+        """
+        items = []; archives = []
+        try: self._collect_into(files, items, archives)
+        except Exception:
+            for archive in archives: archive.close()
+            raise
+        return items, archives
+
+    def _collect_into(self, files, items, archives):
+        for file_storage in files:
+            if not file_storage or not file_storage.filename: continue
+            if self._is_zip(file_storage):
+                try: archive = zipfile.ZipFile(file_storage.stream)
+                except (zipfile.BadZipFile, OSError) as e: raise BulkUploadError(f"'{file_storage.filename}' is not a readable ZIP archive: {e}")
+                archives.append(archive)
+                for info in archive.infolist():
+                    if info.is_dir(): continue
+                    item = {"filename": info.filename, "size": info.file_size, "opener": (lambda a=archive, i=info: a.open(i)), "status": "queued", "error": None}
+                    item["error"] = self._check_name(info.filename)
+                    if item["error"]: item["status"] = "skipped"
+                    elif info.file_size > self.max_member_bytes: item["status"] = "rejected"; item["error"] = f"File exceeds {self.max_member_bytes} bytes."
+                    items.append(item)
+            else:
+                item = {"filename": file_storage.filename, "size": None, "opener": (lambda f=file_storage: f.stream), "status": "queued", "error": None,
+                        "content_type": file_storage.mimetype}
+                item["error"] = self._check_name(file_storage.filename)
+                if item["error"]: item["status"] = "skipped"
+                items.append(item)
+            if sum(1 for item in items if item["status"] == "queued") > self.max_files:
+                raise BulkUploadError(f"Too many files in one bulk upload (limit {self.max_files}).")
+
+    # --- Upload ---
+    def _upload_one(self, item, batch_hashes):
+        """
+        Streams one item into a spooled temp file (bounded size), hashing it on the way, and uploads it to its
+        pre-generated S3 key. Returns None without uploading when the content is a duplicate (item['duplicate_of'] is
+        then the existing invoice row, or the batch item that claimed the same content first).
+        """
+        with tempfile.SpooledTemporaryFile(max_size=self.spool_memory_bytes) as spool:
+            source = item["opener"](); content_hash = hashlib.sha256()
+            try:
+                if hasattr(source, 'seek') and not isinstance(source, zipfile.ZipExtFile): source.seek(0)
+                copied = 0
+                while True:
+                    chunk = source.read(64 * 1024)
+                    if not chunk: break
+                    copied += len(chunk)
+                    if copied > self.max_member_bytes: raise BulkUploadError(f"File exceeds {self.max_member_bytes} bytes.") # Declared sizes can lie
+                    content_hash.update(chunk); spool.write(chunk)
+            finally:
+                if isinstance(source, zipfile.ZipExtFile): source.close()
+            item["content_sha256"] = content_hash.hexdigest()
+            if self.deduplicate:
+                with self._hashes_lock: first = batch_hashes.setdefault(item["content_sha256"], item)
+                if first is not item: item["duplicate_of"] = first; return None
+                existing = self.db_service.claim_invoice_content_hash(item["invoice_id"], item["content_sha256"]) # Before the upload: concurrent batches can't both claim it
+                if existing: item["duplicate_of"] = existing; return None
+            spool.seek(0)
+            s3_object_key = self.s3_service.upload_file_obj(file_obj=spool, object_name=item["filename"], content_type=item.get("content_type"), object_key=item["s3_key"])
+        if not s3_object_key: raise StageError("Failed to upload file to S3.")
+        return s3_object_key
+
+    def process(self, files):
+        """
+        Ingests a bulk upload request.
+        :param files: List of werkzeug FileStorage objects (plain files and/or ZIP archives).
+        :return: Dict with batch_id, per-file results, counts and throughput.
+        """
+        started_at = time.monotonic()
+        items, archives = self.collect_items(files)
+        try:
+            batch_id = uuid.uuid4().hex
+            accepted = [item for item in items if item["status"] == "queued"]
+            if not accepted: raise BulkUploadError("No supported invoice files found in the upload.")
+            for item in accepted:
+                item["s3_key"] = f"invoices/bulk/{batch_id}/{uuid.uuid4()}{os.path.splitext(item['filename'])[1].lower()}"
+                item.setdefault("content_type", None)
+                item["content_type"] = item["content_type"] if item["content_type"] not in (None, 'application/octet-stream') else mimetypes.guess_type(item["filename"])[0]
+
+            rows = self.db_service.create_invoice_records_bulk(
+                [{"original_filename": os.path.basename(item["filename"]), "s3_bucket": self.s3_service.bucket_name, "s3_key": item["s3_key"]} for item in accepted],
+                upload_batch_id=batch_id, status='pending_s3_upload')
+            if rows is None: raise StageError("Failed to create invoice records for bulk upload.", retryable=False)
+            invoice_ids_by_key = {row['s3_key']: row['id'] for row in rows}
+            for item in accepted: item["invoice_id"] = invoice_ids_by_key.get(item["s3_key"])
+
+            batch_hashes = {}
+            futures = [(item, self._executor.submit(self._upload_one, item, batch_hashes)) for item in accepted]
+            for item, future in futures:
+                try: item["status"] = "uploaded" if future.result() else "duplicate"
+                except Exception as e:
+                    logger.error(f"BulkUploadService: Upload of '{item['filename']}' (batch {batch_id}) failed: {e}")
+                    item["status"] = "failed"; item["error"] = str(e)[:250]
+        finally:
+            for archive in archives: archive.close()
+
+        duplicates = [item for item in accepted if item["status"] == "duplicate"]
+        self._resolve_duplicates(duplicates)
+        uploaded = [item for item in accepted if item["status"] == "uploaded"]
+        failed = [item for item in accepted if item["status"] == "failed"]
+        self.db_service.update_invoice_statuses_bulk([item["invoice_id"] for item in uploaded], 'pending_textract_submission')
+        for error_message in {item["error"] for item in failed}:
+            self.db_service.update_invoice_statuses_bulk([item["invoice_id"] for item in failed if item["error"] == error_message], 's3_upload_failed', error_message=error_message)
+        if uploaded:
+            try:
+                self.ingestion_service.submit_uploaded([{"invoice_id": item["invoice_id"], "original_filename": os.path.basename(item["filename"]),
+                                                         "content_type": item["content_type"], "s3_key": item["s3_key"]} for item in uploaded])
+            except StageError as e:
+                logger.error(f"BulkUploadService: Batch {batch_id} uploaded but could not be queued for Textract: {e}")
+                for item in uploaded: item["status"] = "uploaded_not_queued"; item["error"] = str(e)
+
+        elapsed = time.monotonic() - started_at
+        with self._stats_lock:
+            self._stats["batches"] += 1; self._stats["files_uploaded"] += len(uploaded); self._stats["files_failed"] += len(failed)
+            self._stats["files_duplicate"] += sum(1 for item in accepted if item["status"] == "duplicate")
+        logger.info(f"BulkUploadService: Batch {batch_id}: {len(uploaded)}/{len(accepted)} file(s) uploaded in {elapsed:.2f}s ({len(uploaded) / elapsed if elapsed else 0:.1f} files/s).")
+        return {
+            "batch_id": batch_id,
+            "files": [{"filename": item["filename"], "invoice_id": item.get("invoice_id"), "status": item["status"], "s3_key": item.get("s3_key"), "error": item["error"],
+                       "duplicate": item["status"] == "duplicate"} for item in items],
+            "counts": {"received": len(items), "uploaded": len(uploaded), "failed": len(failed), "duplicates": sum(1 for item in accepted if item["status"] == "duplicate"),
+                       "skipped": len(items) - len(accepted)},
+            "elapsed_seconds": round(elapsed, 3),
+            "files_per_second": round(len(uploaded) / elapsed, 2) if elapsed else None
+        }
+
+    def _resolve_duplicates(self, duplicates):
+        """
+        Points duplicate items at the invoice they repeat and deletes their placeholder rows. An in-batch duplicate
+        shares the outcome of the item that was uploaded: if that upload failed, so does the duplicate.
+        """
+        placeholder_ids = []
+        for item in sorted(duplicates, key=lambda item: "opener" in item["duplicate_of"]): # Existing-invoice hits first: a batch original may itself be one
+            original = item.pop("duplicate_of")
+            if original.get("status") == "failed": item["status"] = "failed"; item["error"] = original["error"]; continue
+            placeholder_ids.append(item["invoice_id"])
+            item["invoice_id"] = original["invoice_id"] if "opener" in original else original["id"]
+            item["s3_key"] = original["s3_key"]
+        if placeholder_ids and self.db_service.delete_invoices_bulk(placeholder_ids) is None:
+            logger.error(f"BulkUploadService: Could not delete placeholder invoice rows {placeholder_ids} of duplicate uploads.")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
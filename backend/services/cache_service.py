@@ -0,0 +1,198 @@
+# backend/services/cache_service.py
+import copy
+import time
+import pickle
+import hashlib
+import logging
+import threading
+import functools
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class LruTtlCacheBackend:
+    """
+    In-process cache: least-recently-used eviction once `max_entries` is reached, plus a per-entry TTL.
+    Entries are per process, but with a `version_store` (DbService: the one-row cache_version table) the data version is
+    shared, so a write in any process (another gunicorn worker, a `flask invoices ...` command) invalidates every
+    process's entries. The shared version is re-read at most every `version_ttl` seconds (and right after this process
+    bumps it), so a cache hit costs no DB round trip; another process's write is seen within `version_ttl`.
+    Without a store the version is a process-local counter, only exact for a single process.
+    """
+
+    def __init__(self, max_entries=512, version_store=None, version_ttl=1.0):
+        self.max_entries = max(1, int(max_entries))
+        self.version_store = version_store
+        self.version_ttl = max(0.0, float(version_ttl))
+        self._version_read_at = float('-inf')
+        self._entries = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._version = 0
+        self.evictions = 0; self.expirations = 0
+
+    def get(self, key):
+        """Returns (found, value)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None: return False, None
+            if entry[0] is not None and entry[0] <= time.monotonic():
+                del self._entries[key]; self.expirations += 1
+                return False, None
+            self._entries.move_to_end(key)
+            return True, copy.deepcopy(entry[1]) # Callers may mutate what they get back
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl if ttl else None, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False); self.evictions += 1
+
+    def clear(self):
+        with self._lock: self._entries.clear()
+
+    def get_version(self):
+        if self.version_store is None:
+            with self._lock: return self._version
+        with self._lock:
+            if time.monotonic() - self._version_read_at < self.version_ttl: return self._version
+        version = self.version_store.get_cache_data_version()
+        if version is None: raise RuntimeError("shared cache data version is unavailable")
+        with self._lock:
+            if version != self._version: self._version = version; self._entries.clear() # Older versions can never be read again
+            self._version_read_at = time.monotonic()
+        return version
+
+    def bump_version(self):
+        if self.version_store is not None:
+            with self._lock: self._version_read_at = float('-inf') # Our own write must be visible on the next read
+            if not self.version_store.bump_cache_data_version(): raise RuntimeError("could not bump the shared cache data version")
+            with self._lock: self._version_read_at = float('-inf'); self._entries.clear()
+            return None
+        with self._lock:
+            self._version += 1
+            self._entries.clear() # Older versions can never be read again, free the memory now
+            return self._version
+
+    def stats(self):
+        with self._lock: return {"backend": "memory", "version_source": "process" if self.version_store is None else "db", "entries": len(self._entries),
+                                 "max_entries": self.max_entries, "evictions": self.evictions, "expirations": self.expirations}
+
+class RedisCacheBackend:
+    """
+    Shared cache for multi-process deployments (several gunicorn workers see the same entries and data version).
+    Requires the optional `redis` package. Eviction is left to Redis (maxmemory-policy allkeys-lru recommended).
+    """
+
+    def __init__(self, redis_url, key_prefix='invox:cache:'):
+        try: import redis
+        except ImportError as e: raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package (pip install redis).") from e
+        self.client = redis.Redis.from_url(redis_url)
+        self.key_prefix = key_prefix
+        self.version_key = f"{key_prefix}data_version"
+        self.evictions = 0; self.expirations = 0 # Tracked by Redis itself (INFO stats)
+
+    def get(self, key):
+        raw = self.client.get(self.key_prefix + key)
+        return (False, None) if raw is None else (True, pickle.loads(raw))
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.key_prefix + key, pickle.dumps(value), ex=int(ttl) if ttl else None)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=f"{self.key_prefix}*"):
+            if key.decode() != self.version_key: self.client.delete(key)
+
+    def get_version(self):
+        return int(self.client.get(self.version_key) or 0)
+
+    def bump_version(self):
+        return int(self.client.incr(self.version_key))
+
+    def stats(self):
+        return {"backend": "redis", "evictions": self.evictions, "expirations": self.expirations}
+
+class CacheService:
+    """
+    Versioned result cache for DbService read methods.
+    Keys are method + arguments + the current data version; invoice writes bump the version, so a cached result is never
+    served after the data it was computed from changed (TTL only bounds memory, it isn't what keeps results fresh).
+    """
+
+    def __init__(self, app_config, version_store=None):
+        """:param version_store: Shares the memory backend's data version between processes (see LruTtlCacheBackend)."""
+        self.config = app_config
+        self.default_ttl = float(self.config.get('CACHE_DEFAULT_TTL_SECONDS', 300))
+        backend_name = (self.config.get('CACHE_BACKEND') or 'memory').lower()
+        self.enabled = backend_name != 'none'
+        if backend_name == 'redis':
+            self.backend = RedisCacheBackend(self.config.get('CACHE_REDIS_URL') or 'redis://localhost:6379/0')
+        else:
+            self.backend = LruTtlCacheBackend(self.config.get('CACHE_MAX_ENTRIES', 512), version_store=version_store,
+                                              version_ttl=self.config.get('CACHE_VERSION_TTL_SECONDS', 1.0))
+            if version_store is None and backend_name == 'memory':
+                logger.warning("CacheService: memory backend without a shared data version; writes in other processes won't invalidate this cache. Use one process or CACHE_BACKEND=redis.")
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "errors": 0, "invalidations": 0}
+        logger.info(f"CacheService initialized (backend={backend_name}, ttl={self.default_ttl}s).")
+
+    def _count(self, name):
+        with self._stats_lock: self._stats[name] += 1
+
+    @staticmethod
+    def make_key(namespace, args, kwargs):
+        digest = hashlib.sha1(repr((args, sorted(kwargs.items()))).encode('utf-8')).hexdigest()
+        return f"{namespace}:{digest}"
+
+    def data_version(self):
+        try: return self.backend.get_version()
+        except Exception as e: self._count("errors"); logger.warning(f"CacheService: Could not read data version: {e}"); return None
+
+    def bump_data_version(self):
+        """Called after every invoice write; makes all cached results computed from older data unreachable."""
+        try: self.backend.bump_version(); self._count("invalidations")
+        except Exception as e: self._count("errors"); logger.error(f"CacheService: Could not bump data version, clearing cache instead: {e}"); self.clear()
+
+    def get(self, key):
+        try: found, value = self.backend.get(key)
+        except Exception as e: self._count("errors"); logger.warning(f"CacheService: Cache read failed for {key}: {e}"); return False, None
+        self._count("hits" if found else "misses")
+        return found, value
+
+    def set(self, key, value, ttl=None):
+        try: self.backend.set(key, value, ttl if ttl is not None else self.default_ttl)
+        except Exception as e: self._count("errors"); logger.warning(f"CacheService: Cache write failed for {key}: {e}")
+
+    def clear(self):
+        try: self.backend.clear()
+        except Exception as e: logger.warning(f"CacheService: Cache clear failed: {e}")
+
+    def stats(self):
+        with self._stats_lock: counters = dict(self._stats)
+        lookups = counters["hits"] + counters["misses"]
+        try: backend_stats = self.backend.stats()
+        except Exception as e: backend_stats = {"error": str(e)}
+        return {**backend_stats, **counters, "hit_ratio": round(counters["hits"] / lookups, 3) if lookups else None, "data_version": self.data_version()}
+
+def cached_read(namespace=None, ttl=None):
+    """
+    Decorator for DbService read methods. Results are cached in `self.cache` (a CacheService, if attached) under
+    namespace + arguments + data version. Results of calls that hit a DB error are not cached.
+    """
+    def decorator(method):
+        cache_namespace = namespace or method.__name__
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache = getattr(self, 'cache', None)
+            if cache is None or not cache.enabled: return method(self, *args, **kwargs)
+            version = cache.data_version() # Read before computing: a concurrent write makes this entry unreachable, never stale
+            if version is None: return method(self, *args, **kwargs)
+            key = f"v{version}:{cache.make_key(cache_namespace, args, kwargs)}"
+            found, value = cache.get(key)
+            if found: return value
+            self.reset_query_error_flag()
+            value = method(self, *args, **kwargs)
+            if not self.query_error_occurred(): cache.set(key, value, ttl)
+            return value
+        return wrapper
+    return decorator
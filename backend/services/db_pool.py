@@ -0,0 +1,158 @@
+# backend/services/db_pool.py
+import mysql.connector
+from mysql.connector import Error
+import threading
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+class PoolTimeoutError(Error):
+    """Raised when no connection could be checked out within the pool timeout."""
+    pass
+
+class ConnectionPool:
+    """
+    A small thread-safe MySQL connection pool.
+    Keeps up to `pool_size` idle connections around, allows `max_overflow` extra connections under load
+    (closed again when returned), pings connections on checkout and recycles them after `recycle_seconds`.
+    """
+
+    def __init__(self, connect_kwargs, pool_size=5, max_overflow=10, timeout=30, recycle_seconds=1800, pre_ping=True, connect=None):
+        """
+        :param connect_kwargs: Keyword arguments passed to mysql.connector.connect().
+        :param pool_size: Number of idle connections kept open.
+        :param max_overflow: Extra connections allowed beyond pool_size when the pool is exhausted.
+        :param timeout: Seconds to wait for a free connection before raising PoolTimeoutError.
+        :param recycle_seconds: Connections older than this are closed and replaced on checkout (0 disables).
+        :param pre_ping: If True, connections are health-checked before being handed out.
+        :param connect: Optional connection factory (defaults to mysql.connector.connect).
+        """
+        self.connect_kwargs = connect_kwargs
+        self.pool_size = max(1, int(pool_size))
+        self.max_overflow = max(0, int(max_overflow))
+        self.timeout = timeout
+        self.recycle_seconds = recycle_seconds
+        self.pre_ping = pre_ping
+        self._connect = connect or mysql.connector.connect
+        self._idle = deque() # (connection, created_at)
+        self._created_at = {} # id(connection) -> created_at, for checked out connections
+        self._cond = threading.Condition(threading.Lock())
+        self._total = 0 # open connections (idle + in use)
+        self._in_use = 0
+        self._stats = {"checkouts": 0, "waits": 0, "wait_time_total": 0.0, "timeouts": 0, "created": 0, "recycled": 0, "ping_failures": 0}
+
+    def _count(self, stat):
+        """Increments a stats counter from code running outside self._cond (connect / ping happen without the lock)."""
+        with self._cond: self._stats[stat] += 1
+
+    def _new_connection(self):
+        conn = self._connect(**self.connect_kwargs)
+        self._count("created")
+        logger.info(f"ConnectionPool: Opened new MySQL connection to {self.connect_kwargs.get('host')}/{self.connect_kwargs.get('database')}")
+        return conn
+
+    @staticmethod
+    def _close_quietly(conn):
+        try: conn.close()
+        except Exception as e: logger.debug(f"ConnectionPool: Ignoring error while closing connection: {e}")
+
+    def _is_usable(self, conn, created_at):
+        if self.recycle_seconds and time.monotonic() - created_at > self.recycle_seconds:
+            self._count("recycled")
+            logger.debug("ConnectionPool: Recycling connection past its max age.")
+            return False
+        if self.pre_ping:
+            try:
+                if not conn.is_connected(): raise Error("Connection is not alive.")
+            except Exception as e:
+                self._count("ping_failures")
+                logger.warning(f"ConnectionPool: Health check on checkout failed, replacing connection: {e}")
+                return False
+        return True
+
+    def acquire(self):
+        """Checks out a connection, waiting up to `timeout` seconds when the pool and its overflow are exhausted."""
+        wait_started = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, created_at = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._total < self.pool_size + self.max_overflow:
+                    conn, created_at = None, None
+                    self._total += 1; self._in_use += 1
+                    break
+                if wait_started is None:
+                    wait_started = time.monotonic(); self._stats["waits"] += 1
+                remaining = self.timeout - (time.monotonic() - wait_started)
+                if remaining <= 0:
+                    self._stats["wait_time_total"] += time.monotonic() - wait_started; self._stats["timeouts"] += 1
+                    raise PoolTimeoutError(f"Timed out after {self.timeout}s waiting for a database connection (pool_size={self.pool_size}, max_overflow={self.max_overflow}).")
+                self._cond.wait(remaining)
+            if wait_started is not None: self._stats["wait_time_total"] += time.monotonic() - wait_started
+            self._stats["checkouts"] += 1
+
+        # Connect / ping outside the lock so a slow server doesn't block other threads
+        try:
+            if conn is not None and not self._is_usable(conn, created_at):
+                self._close_quietly(conn); conn = None
+            if conn is None:
+                conn = self._new_connection(); created_at = time.monotonic()
+        except Exception:
+            with self._cond:
+                self._total -= 1; self._in_use -= 1; self._cond.notify()
+            raise
+        with self._cond: self._created_at[id(conn)] = created_at
+        return conn
+
+    def release(self, conn, discard=False):
+        """Returns a connection to the pool. Broken, overflow or discarded connections are closed instead."""
+        if conn is None: return
+        try:
+            if not discard and getattr(conn, 'in_transaction', False): conn.rollback() # Never hand out a dirty transaction
+        except Exception as e:
+            logger.warning(f"ConnectionPool: Rollback on release failed, discarding connection: {e}"); discard = True
+        with self._cond:
+            created_at = self._created_at.pop(id(conn), time.monotonic())
+            self._in_use -= 1
+            if not discard and len(self._idle) < self.pool_size:
+                self._idle.append((conn, created_at)); conn = None
+            else:
+                self._total -= 1
+            self._cond.notify()
+        if conn is not None: self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self):
+        """Context manager that checks out a connection and always returns it."""
+        conn = self.acquire(); discard = False
+        try: yield conn
+        except Error: discard = not self.is_alive(conn); raise
+        finally: self.release(conn, discard=discard)
+
+    @staticmethod
+    def is_alive(conn):
+        try: return conn.is_connected()
+        except Exception: return False
+
+    def stats(self):
+        """Returns a snapshot of pool usage counters (for /api/health)."""
+        with self._cond:
+            return {
+                "pool_size": self.pool_size, "max_overflow": self.max_overflow,
+                "in_use": self._in_use, "idle": len(self._idle), "open": self._total,
+                "waits": self._stats["waits"], "wait_time_total_ms": round(self._stats["wait_time_total"] * 1000, 2),
+                "timeouts": self._stats["timeouts"], "checkouts": self._stats["checkouts"],
+                "connections_created": self._stats["created"], "recycled": self._stats["recycled"], "ping_failures": self._stats["ping_failures"]
+            }
+
+    def dispose(self):
+        """Closes all idle connections. Checked out connections are closed when they are released."""
+        with self._cond:
+            idle = list(self._idle); self._idle.clear(); self._total -= len(idle)
+        for conn, _ in idle: self._close_quietly(conn)
+        logger.info(f"ConnectionPool: Disposed {len(idle)} idle connection(s).")
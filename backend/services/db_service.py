@@ -1,26 +1,37 @@
 # backend/services/db_service.py
-import mysql.connector
 from mysql.connector import Error # For catching specific MySQL errors
 from flask import current_app, g # Flask's application context and request context globals
 import json # For handling JSON data (line_items, parsed_data)
 import logging # For application logging
 from decimal import Decimal, InvalidOperation # For precise monetary values
 from datetime import datetime, timedelta, date # For date manipulations
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from .db_pool import ConnectionPool
+from .cache_service import cached_read
+from .tracing import span as trace_span
+from .invoice_search import text_filter, indexed_words, boolean_query, SEARCH_COLUMNS
+from .vendor_index import VendorIndex, normalize_vendor_name
+from .textract_documents import prune_geometry, encode_document, decode_document, parse_retain_list, ENCODING_ZLIB_JSON
 
 # Standard logger for this module
 logger = logging.getLogger(__name__)
 
 # --- Database Connection Management ---
-# These functions handle the database connection per request using Flask's 'g' object.
+# Connections come from the ConnectionPool owned by DbService. get_db()/close_db() keep the
+# per-request API (a connection checked out into Flask's 'g' object) for code that needs a raw connection.
 
-def get_db_config():
-    """Helper function to retrieve database configuration from the Flask app's config."""
+def get_db_config(app_config=None):
+    """Helper function to retrieve database configuration from the given config (defaults to the Flask app's config)."""
+    app_config = app_config if app_config is not None else current_app.config
     config = {
-        'host': current_app.config['DB_HOST'],
-        'port': current_app.config.get('DB_PORT', 3306), # Default MySQL port
-        'database': current_app.config['DB_DATABASE'],
-        'user': current_app.config['DB_USERNAME'],
-        'password': current_app.config['DB_PASSWORD']
+        'host': app_config.get('DB_HOST'),
+        'port': app_config.get('DB_PORT', 3306), # Default MySQL port
+        'database': app_config.get('DB_DATABASE'),
+        'user': app_config.get('DB_USERNAME'),
+        'password': app_config.get('DB_PASSWORD')
     }
     # Ensure port is an integer
     if not config['port']:
@@ -35,35 +46,34 @@ def get_db_config():
 
 def get_db():
     """
-    Opens a new database connection if one doesn't exist for the current app context (request),
-    or reuses an existing one for the current context.
-    Stores the connection in Flask's 'g' object.
+    Checks out a pooled connection for the current app context (request) if one isn't held yet,
+    or reuses the one already held. Stored in Flask's 'g' object and returned to the pool by close_db.
     """
-    # Check if 'db_conn' is in 'g' and if the connection is still active
-    if 'db_conn' not in g or not hasattr(g.db_conn, 'is_connected') or not g.db_conn.is_connected():
+    if 'db_conn' not in g or g.db_conn is None:
+        db_service = current_app.extensions.get('db_service')
+        if db_service is None:
+            raise Error("DbService not initialized; no connection pool available.")
         try:
-            config = get_db_config()
-            logger.debug(f"Attempting to connect to DB: {config['host']}:{config['port']}/{config['database']} as user '{config['user']}'")
-            g.db_conn = mysql.connector.connect(**config)
-            logger.info(f"Successfully connected to MySQL database: {config.get('database')}")
+            g.db_conn = db_service.pool.acquire()
         except Error as e:
-            logger.error(f"Error connecting to MySQL Database: {e}", exc_info=True)
+            logger.error(f"Error checking out MySQL connection from pool: {e}", exc_info=True)
             g.db_conn = None # Ensure it's None if connection failed
             raise # Re-raise the exception to signal failure to the caller
     return g.db_conn
 
 def close_db(e=None):
-    """Closes the database connection at the end of the request (if it was opened)."""
+    """Returns the request's connection to the pool at the end of the request (if one was checked out)."""
     db_conn = g.pop('db_conn', None) # Get and remove connection from 'g'
-    if db_conn is not None and hasattr(db_conn, 'is_connected') and db_conn.is_connected():
-        try:
-            db_conn.close()
-            logger.info("MySQL database connection closed.")
-        except Error as e:
-            logger.error(f"Error closing MySQL connection: {e}", exc_info=True)
+    if db_conn is not None:
+        db_service = current_app.extensions.get('db_service')
+        if db_service is not None and db_service._pool is not None:
+            db_service.pool.release(db_conn)
+        else:
+            try: db_conn.close()
+            except Error as close_e: logger.error(f"Error closing MySQL connection: {close_e}", exc_info=True)
 
 def init_app(app):
-    """Registers database close function with the Flask app to be called after each request."""
+    """Registers the connection release function with the Flask app to be called after each request."""
     app.teardown_appcontext(close_db)
 
 # --- DbService Class ---
@@ -77,10 +87,15 @@ class DbService:
     INVOICE_TABLE_PARSED_COLUMNS = [
         'vendor_name', 'invoice_id_number', 'invoice_date', 'due_date',
         'total_amount', 'subtotal', 'tax', 'currency',  # Added subtotal, tax here for completeness if schema has them
-        'line_items', 'parsed_data',  # 'parsed_data' stores the full raw JSON from Textract service
-        'user_category',
-        'full_textract_response'
+        'line_items', 'line_item_text',
+        'user_category'
     ]
+    # Parser output keys stored in the invoice_documents side table (compressed) instead of the invoices row -> document type
+    INVOICE_DOCUMENT_FIELDS = {
+        'parsed_data_detail': 'parsed_data',
+        'parsed_data': 'parsed_data',
+        'full_textract_response': 'full_textract_response'
+    }
     # Columns in 'invoices' table that are allowed to be updated via a generic PUT request (e.g., manual edits)
     INVOICE_TABLE_EDITABLE_COLUMNS = [
         'vendor_name', 'invoice_id_number', 'invoice_date', 'due_date',
@@ -88,6 +103,19 @@ class DbService:
         'user_category', 'status', 'error_message'
     ]
 
+    # Columns the invoice list API returns by default (no JSON/Textract blobs)
+    INVOICE_LIST_COLUMNS = [
+        'id', 'original_filename', 'vendor_name', 'invoice_date', 'total_amount', 'currency',
+        'user_category', 'status', 'textract_job_id', 'error_message', 'upload_timestamp'
+    ]
+    # Columns a caller may request through a projection (fields=...)
+    INVOICE_SELECTABLE_COLUMNS = INVOICE_LIST_COLUMNS + [
+        's3_bucket_name', 's3_key', 'invoice_id_number', 'due_date', 'last_modified_timestamp',
+        'upload_batch_id', 'line_items', 'vendor_id', 'content_sha256'
+    ]
+    # Statuses of invoices whose processing failed (error_message is kept; a re-upload of the same file is not a duplicate)
+    INVOICE_FAILED_STATUSES = ['error', 'textract_failed', 'parsing_failed', 'db_update_failed_post_textract', 's3_upload_failed', 'textract_submission_failed', 'textract_unknown_status']
+
     def __init__(self, app_config):
         """
         Initializes the DbService.
@@ -96,6 +124,79 @@ class DbService:
         self.config = app_config
         if not self.config.get('DB_DATABASE'):
             logger.warning("DbService initialized but DB_DATABASE config is missing.")
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self.cache = None # Optional CacheService for read methods, see attach_cache()
+        self._query_state = threading.local()
+        self._connection_probe = (float('-inf'), False, None) # (checked at, ok, error) of the last check_connection()
+        self.document_geometry_retain = parse_retain_list(self.config.get('TEXTRACT_GEOMETRY_RETAIN'))
+        self.document_compression_level = int(self.config.get('INVOICE_DOCUMENT_COMPRESSION_LEVEL', 6))
+        self.vendor_index = VendorIndex(self.config.get('VENDOR_MATCH_THRESHOLD', 0.7)) # Loaded from vendor_aliases on first use
+        self.vendor_index_refresh_seconds = float(self.config.get('VENDOR_INDEX_REFRESH_SECONDS', 300))
+        self._vendor_index_loaded_at = None
+        self._vendor_index_lock = threading.Lock()
+        self._vendor_stats = defaultdict(int) # exact / fuzzy / created / unresolved resolutions
+
+    @property
+    def pool(self):
+        """The shared connection pool, created on first use so the app can start while MySQL is unreachable."""
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ConnectionPool(
+                        get_db_config(self.config),
+                        pool_size=self.config.get('DB_POOL_SIZE', 5),
+                        max_overflow=self.config.get('DB_POOL_MAX_OVERFLOW', 10),
+                        timeout=self.config.get('DB_POOL_TIMEOUT', 30),
+                        recycle_seconds=self.config.get('DB_POOL_RECYCLE_SECONDS', 1800),
+                        pre_ping=self.config.get('DB_POOL_PRE_PING', True)
+                    )
+                    logger.info(f"DbService: Connection pool created (size={self._pool.pool_size}, max_overflow={self._pool.max_overflow}).")
+        return self._pool
+
+    def attach_cache(self, cache_service):
+        """Enables the versioned result cache for @cached_read methods; invoice writes bump its data version."""
+        self.cache = cache_service
+
+    def reset_query_error_flag(self):
+        self._query_state.failed = False
+
+    def query_error_occurred(self):
+        """True if a query failed on this thread since reset_query_error_flag() (so a fallback result isn't cached)."""
+        return getattr(self._query_state, 'failed', False)
+
+    def _invalidate_cache(self):
+        if self.cache is not None: self.cache.bump_data_version()
+
+    # Shared data version of the memory cache backend (cache_version table, migration 015)
+    def get_cache_data_version(self):
+        """The current cache data version, or None if it can't be read (reads then go uncached)."""
+        try: row = self.execute_query("SELECT version FROM cache_version WHERE id = 1", fetch_one=True)
+        except Error: return None
+        return int(row['version']) if row else 0
+
+    def bump_cache_data_version(self):
+        """Increments the cache data version (creating the row if needed). Returns True on success."""
+        try: return self.execute_query("INSERT INTO cache_version (id, version) VALUES (1, 1) ON DUPLICATE KEY UPDATE version = version + 1") is not None
+        except Error: return False
+
+    def check_connection(self, max_age_seconds=0):
+        """
+        Runs `SELECT 1` and returns (ok, error message or None). A result younger than max_age_seconds is returned
+        without querying, so frequent health probes and metric scrapes don't each take a connection.
+        """
+        checked_at, ok, error = self._connection_probe
+        if max_age_seconds and time.monotonic() - checked_at < max_age_seconds: return ok, error
+        try:
+            ok = self.execute_query("SELECT 1 AS ok", fetch_one=True) is not None
+            error = None if ok else "DB connection not active or failed to get."
+        except Exception as e: ok, error = False, str(e); logger.error(f"DB connection check failed: {e}")
+        self._connection_probe = (time.monotonic(), ok, error)
+        return ok, error
+
+    def get_pool_stats(self):
+        """Returns connection pool counters, or None if the pool hasn't been used yet."""
+        return self._pool.stats() if self._pool is not None else None
 
     def execute_query(self, query, params=None, fetch_one=False, fetch_all=False, is_insert=False):
         """
@@ -108,12 +209,10 @@ class DbService:
         :param is_insert: True if it's an INSERT query to get lastrowid.
         :return: Query result (single row, all rows, last insert ID, or row count) or None on error.
         """
-        conn = None; cursor = None; result = None
+        conn = None; cursor = None; result = None; discard_conn = False
+        query_span = trace_span('db', 'query', sql=query).__enter__() # Pool wait counts towards the query
         try:
-            conn = get_db() # Gets a connection from the request context pool
-            if conn is None:
-                logger.error("execute_query: Database connection not available.")
-                raise Error("Database connection not available for query execution.")
+            conn = self.pool.acquire() # Borrowed for this query only, returned in 'finally'
 
             # Use dictionary cursor for SELECT queries for easier access to columns by name
             use_dictionary_cursor = (fetch_one or fetch_all) and not is_insert
@@ -134,9 +233,12 @@ class DbService:
                 conn.commit()
                 result = cursor.rowcount # Number of rows affected
                 logger.info(f"Query executed successfully. Rows affected: {result}")
+            query_span.set(rows=len(result) if fetch_all and result is not None else (int(result is not None) if fetch_one else cursor.rowcount))
         except Error as e: # Catch MySQL specific errors
+            self._query_state.failed = True; query_span.set(error=f"MySQL {e.errno}")
             logger.error(f"Database query error: {e}. Query: '{query}', Params: '{params}'", exc_info=True)
-            if conn and conn.in_transaction: # Check if a transaction is active
+            if conn is not None and not ConnectionPool.is_alive(conn): discard_conn = True
+            elif conn and conn.in_transaction: # Check if a transaction is active
                 try:
                     conn.rollback()
                     logger.info("Database transaction rolled back due to error.")
@@ -145,23 +247,409 @@ class DbService:
             raise # Re-raise the exception so the calling route can handle it (e.g., return 500)
         finally:
             if cursor:
-                cursor.close()
-            # Connection itself is closed by the teardown_appcontext hook (close_db)
+                try: cursor.close()
+                except Error: discard_conn = True
+            if conn is not None: self.pool.release(conn, discard=discard_conn)
+            query_span.finish()
         return result
 
+    def execute_many(self, query, seq_of_params):
+        """
+        Executes one statement for many parameter sets and commits. For simple INSERT ... VALUES statements the
+        connector batches all rows into a single multi-row INSERT (one round trip).
+        :return: Number of rows affected.
+        """
+        conn = None; cursor = None; discard_conn = False
+        query_span = trace_span('db', 'executemany', sql=query, batch=len(seq_of_params)).__enter__()
+        try:
+            conn = self.pool.acquire()
+            cursor = conn.cursor()
+            logger.debug(f"Executing batched SQL query: {query} with {len(seq_of_params)} parameter set(s)")
+            cursor.executemany(query, seq_of_params)
+            conn.commit()
+            logger.info(f"Batched query executed successfully. Rows affected: {cursor.rowcount}")
+            query_span.set(rows=cursor.rowcount)
+            return cursor.rowcount
+        except Error as e:
+            self._query_state.failed = True; query_span.set(error=f"MySQL {e.errno}")
+            logger.error(f"Database batched query error: {e}. Query: '{query}', Rows: {len(seq_of_params)}", exc_info=True)
+            if conn is not None and not ConnectionPool.is_alive(conn): discard_conn = True
+            elif conn and conn.in_transaction:
+                try: conn.rollback(); logger.info("Database transaction rolled back due to error.")
+                except Error as rb_e: logger.error(f"Error during database transaction rollback: {rb_e}")
+            raise
+        finally:
+            if cursor:
+                try: cursor.close()
+                except Error: discard_conn = True
+            if conn is not None: self.pool.release(conn, discard=discard_conn)
+            query_span.finish()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs several statements on one pooled connection as a single transaction.
+        Yields a dictionary cursor; commits when the block exits normally and rolls back on any exception.
+        The whole block is one tracing span (its statements are not timed one by one).
+        """
+        transaction_span = trace_span('db', 'transaction').__enter__()
+        conn = self.pool.acquire(); cursor = None; discard_conn = False
+        try:
+            cursor = conn.cursor(dictionary=True)
+            yield cursor
+            conn.commit()
+        except Exception as e:
+            transaction_span.set(error=f"MySQL {e.errno}" if isinstance(e, Error) else type(e).__name__)
+            if isinstance(e, Error): self._query_state.failed = True; logger.error(f"Database transaction error: {e}", exc_info=True)
+            if not ConnectionPool.is_alive(conn): discard_conn = True
+            else:
+                try: conn.rollback(); logger.info("Database transaction rolled back.")
+                except Error as rb_e: logger.error(f"Error during database transaction rollback: {rb_e}"); discard_conn = True
+            raise
+        finally:
+            if cursor:
+                try: cursor.close()
+                except Error: discard_conn = True
+            self.pool.release(conn, discard=discard_conn)
+            transaction_span.finish()
+
+    def run_in_transaction(self, work, retries=2):
+        """Calls work(cursor) inside transaction(), retrying on deadlocks / lock wait timeouts. Returns work's result."""
+        for attempt in range(retries + 1):
+            try:
+                with self.transaction() as cursor: result = work(cursor)
+                self._invalidate_cache() # Every transactional write touches invoices (and so analytics)
+                return result
+            except Error as e:
+                if e.errno not in (1213, 1205) or attempt == retries: raise # ER_LOCK_DEADLOCK, ER_LOCK_WAIT_TIMEOUT
+                logger.warning(f"Transaction hit a lock conflict ({e.errno}), retrying (attempt {attempt + 1}/{retries}).")
+                time.sleep(0.05 * (attempt + 1))
+
+    # --- Analytics rollup maintenance ---
+    # invoice_rollups holds COUNT/SUM per (month, vendor_id, category, status, currency). Every invoices write goes through
+    # _execute_with_rollup, which reads the affected rows' keys before and after the change and applies the difference
+    # in the same transaction, so the rollup never drifts from the table. vendor_id 0 stands for "no resolved vendor".
+    ROLLUP_KEY_COLUMNS = ['month', 'vendor_id', 'user_category', 'status', 'currency']
+
+    @staticmethod
+    def _rollup_key(row):
+        invoice_date = row.get('invoice_date')
+        month = invoice_date.strftime('%Y-%m') if isinstance(invoice_date, date) else (str(invoice_date)[:7] if invoice_date else '')
+        return (month, row.get('vendor_id') or 0, row.get('user_category') or '', row.get('status') or '', row.get('currency') or '') # '' / 0 stand in for NULL
+
+    def _read_rollup_rows(self, cursor, invoice_ids, for_update=False):
+        """Returns {invoice_id: (rollup_key, total_amount)} for the given invoices."""
+        if not invoice_ids: return {}
+        placeholders = ", ".join(["%s"] * len(invoice_ids))
+        cursor.execute(f"SELECT id, invoice_date, vendor_id, user_category, status, currency, total_amount FROM invoices WHERE id IN ({placeholders})"
+                       + (" FOR UPDATE" if for_update else ""), tuple(invoice_ids))
+        return {row['id']: (self._rollup_key(row), row['total_amount']) for row in cursor.fetchall()}
+
+    def _apply_rollup_deltas(self, cursor, before, after):
+        """Applies the rollup difference between two _read_rollup_rows snapshots."""
+        self._invalidate_report_artifacts(cursor, {key[0] for snapshot in (before, after) for key, _ in snapshot.values()})
+        deltas = defaultdict(lambda: [0, Decimal('0'), 0]) # key -> [invoice_count, total_amount, amount_count]
+        for snapshot, sign in ((before, -1), (after, 1)):
+            for key, amount in snapshot.values():
+                delta = deltas[key]; delta[0] += sign
+                if amount is not None: delta[1] += sign * Decimal(str(amount)); delta[2] += sign
+        changed = sorted((key, delta) for key, delta in deltas.items() if delta[0] or delta[1] or delta[2]) # Fixed order avoids deadlocks
+        if not changed: return
+        cursor.executemany(
+            "INSERT INTO invoice_rollups (month, vendor_id, user_category, status, currency, invoice_count, total_amount, amount_count) VALUES (%s, %s, %s, %s, %s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE invoice_count = invoice_count + VALUES(invoice_count), total_amount = total_amount + VALUES(total_amount), amount_count = amount_count + VALUES(amount_count)",
+            [(*key, delta[0], delta[1], delta[2]) for key, delta in changed])
+        emptied = [key for key, delta in changed if delta[0] < 0]
+        if emptied:
+            cursor.executemany("DELETE FROM invoice_rollups WHERE month = %s AND vendor_id = %s AND user_category = %s AND status = %s AND currency = %s AND invoice_count <= 0", emptied)
+
+    def _execute_with_rollup(self, invoice_ids, statements):
+        """Runs [(sql, params)] against the given invoices in one transaction and keeps invoice_rollups in step. Returns rows affected."""
+        def work(cursor):
+            before = self._read_rollup_rows(cursor, invoice_ids, for_update=True)
+            rows_affected = 0
+            for sql, params in statements:
+                logger.debug(f"Executing SQL query (with rollup): {sql} with params: {params}")
+                cursor.execute(sql, params); rows_affected += cursor.rowcount
+            self._apply_rollup_deltas(cursor, before, self._read_rollup_rows(cursor, invoice_ids))
+            return rows_affected
+        return self.run_in_transaction(work)
+
+    def _invalidate_report_artifacts(self, cursor, months):
+        """
+        Detaches stored reports built from the changed invoices (their months, plus every all-time report) from the report
+        store, in the same transaction as the write. The rows stay fetchable by id; they just stop being served for new requests.
+        """
+        if not months: return
+        placeholders = ", ".join(["%s"] * len(months))
+        try: cursor.execute(f"UPDATE generated_reports SET artifact_key = NULL WHERE artifact_key IS NOT NULL AND (report_month IS NULL OR report_month IN ({placeholders}))", tuple(sorted(months)))
+        except Error as e: logger.warning(f"Could not invalidate stored reports (is migration 009 applied?): {e}") # Must never block the invoice write
+
+    _ROLLUP_SCAN_SQL = ("SELECT COALESCE(DATE_FORMAT(invoice_date, '%Y-%m'), '') AS month, COALESCE(vendor_id, 0) AS vendor_id, COALESCE(user_category, '') AS user_category, "
+                        "COALESCE(status, '') AS status, COALESCE(currency, '') AS currency, COUNT(*) AS invoice_count, COALESCE(SUM(total_amount), 0) AS total_amount, "
+                        "COUNT(total_amount) AS amount_count FROM invoices GROUP BY 1, 2, 3, 4, 5")
+
+    def rebuild_invoice_rollups(self):
+        """Recomputes invoice_rollups from a full scan of invoices (one transaction). Returns the number of rollup rows."""
+        def work(cursor):
+            cursor.execute("DELETE FROM invoice_rollups")
+            cursor.execute(f"INSERT INTO invoice_rollups (month, vendor_id, user_category, status, currency, invoice_count, total_amount, amount_count) {self._ROLLUP_SCAN_SQL}")
+            return cursor.rowcount
+        return self.run_in_transaction(work)
+
+    def verify_invoice_rollups(self):
+        """
+        Compares invoice_rollups with a full GROUP BY scan of invoices.
+        :return: List of {'key', 'expected', 'actual'} mismatches (empty when the rollup is exact).
+        """
+        def index(rows):
+            indexed = {}
+            for row in rows:
+                key = tuple(str(row[c]).casefold().rstrip() for c in self.ROLLUP_KEY_COLUMNS) # Match MySQL's case-insensitive, PAD SPACE grouping
+                indexed[key] = (int(row['invoice_count']), Decimal(str(row['total_amount'])).quantize(Decimal('0.01')), int(row['amount_count']))
+            return indexed
+        expected = index(self.execute_query(self._ROLLUP_SCAN_SQL, fetch_all=True) or [])
+        actual = index(self.execute_query(f"SELECT {', '.join(self.ROLLUP_KEY_COLUMNS)}, invoice_count, total_amount, amount_count FROM invoice_rollups WHERE invoice_count <> 0", fetch_all=True) or [])
+        return [{"key": dict(zip(self.ROLLUP_KEY_COLUMNS, key)), "expected": expected.get(key), "actual": actual.get(key)}
+                for key in sorted(set(expected) | set(actual)) if expected.get(key) != actual.get(key)]
+
+    # --- Vendor dimension (vendors / vendor_aliases, see services/vendor_index.py) ---
+    # Every write that sets invoices.vendor_name also sets vendor_id from resolve_vendor_id, so vendor aggregates group
+    # on an integer instead of the raw Textract string.
+    def _ensure_vendor_index(self):
+        """Loads the vendor index on first use and reloads it every VENDOR_INDEX_REFRESH_SECONDS (other workers add vendors too)."""
+        loaded_at = self._vendor_index_loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.vendor_index_refresh_seconds: return True
+        with self._vendor_index_lock:
+            if self._vendor_index_loaded_at is not loaded_at: return True # Another thread just loaded it
+            try: rows = self.execute_query("SELECT alias_key, vendor_id FROM vendor_aliases", fetch_all=True) or []
+            except Error: return loaded_at is not None # Keep serving the previous index; none yet means vendors can't be resolved
+            self.vendor_index.load((row['alias_key'], row['vendor_id']) for row in rows)
+            self._vendor_index_loaded_at = time.monotonic()
+        logger.info(f"DbService: Loaded vendor index ({len(self.vendor_index)} alias key(s)).")
+        return True
+
+    def _save_vendor(self, key, vendor_name, vendor_id=None, score=1.0):
+        """
+        Records `key` as an alias of vendor_id, creating the vendor first when vendor_id is None. Concurrent creations of
+        the same key (other workers) converge on one row through the unique keys. Returns the vendor id the alias maps to.
+        """
+        display_name = " ".join(str(vendor_name).split())[:255]
+        with self.transaction() as cursor: # Not run_in_transaction: no invoice changes, so cached analytics stay valid
+            if vendor_id is None:
+                cursor.execute("INSERT INTO vendors (canonical_name, normalized_key) VALUES (%s, %s) ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)", (display_name, key))
+                vendor_id = cursor.lastrowid
+            cursor.execute("INSERT IGNORE INTO vendor_aliases (alias_key, vendor_id, alias_name, match_score) VALUES (%s, %s, %s, %s)", (key, vendor_id, display_name, round(score, 3)))
+            cursor.execute("SELECT vendor_id FROM vendor_aliases WHERE alias_key = %s", (key,))
+            vendor_id = cursor.fetchone()['vendor_id']
+        self.vendor_index.add(key, vendor_id)
+        return vendor_id
+
+    def resolve_vendor_id(self, vendor_name, create=True):
+        """
+        Canonical vendor id for a vendor name: an exact normalised-key hit, else the closest known vendor by trigram
+        similarity (>= VENDOR_MATCH_THRESHOLD), else a new vendor. With `create` (ingest and edits) a fuzzy match is stored
+        as a new alias and an unknown name becomes a vendor; without it nothing is written.
+        :return: The vendor id, or None for empty / placeholder names, unknown names with create=False, and DB errors.
+        """
+        key = normalize_vendor_name(vendor_name)
+        if key is None or not self._ensure_vendor_index(): return None
+        vendor_id, matched_key, score = self.vendor_index.match(key)
+        if vendor_id is not None and (matched_key == key or not create): self._vendor_stats['exact' if matched_key == key else 'fuzzy'] += 1; return vendor_id
+        if vendor_id is None and not create: self._vendor_stats['unresolved'] += 1; return None
+        try: resolved_id = self._save_vendor(key, vendor_name, vendor_id, score if vendor_id is not None else 1.0)
+        except Error: return vendor_id # Error logged by transaction(); a fuzzy match is still usable without its alias row
+        self._vendor_stats['fuzzy' if vendor_id is not None else 'created'] += 1
+        logger.info(f"DbService: Vendor '{vendor_name}' {'matched' if vendor_id is not None else 'created as'} vendor {resolved_id}" + (f" (key '{matched_key}', similarity {score:.2f})." if vendor_id is not None else "."))
+        return resolved_id
+
+    def get_vendor_index_stats(self):
+        return {"alias_keys": len(self.vendor_index), "match_threshold": self.vendor_index.match_threshold,
+                "loaded": self._vendor_index_loaded_at is not None, **{f"resolved_{outcome}": count for outcome, count in self._vendor_stats.items()}}
+
     # --- Invoice CRUD & Update Methods ---
-    def create_invoice_record(self, original_filename, s3_bucket=None, s3_key=None, status='pending_upload'):
-        """Creates an initial record for an invoice when it's first uploaded."""
-        sql = "INSERT INTO invoices (original_filename, s3_bucket_name, s3_key, status) VALUES (%s, %s, %s, %s)"
+    def create_invoice_record(self, original_filename, s3_bucket=None, s3_key=None, status='pending_upload', fetch_record=True, content_sha256=None):
+        """
+        Creates an initial record for an invoice when it's first uploaded.
+        Returns the full row, or just {'id': ...} when fetch_record is False (saves a round trip). Returns None when
+        content_sha256 already belongs to an invoice that hasn't failed (UNIQUE index; see claim_invoice_content_hash).
+        """
+        sql = "INSERT INTO invoices (original_filename, s3_bucket_name, s3_key, status, content_sha256) VALUES (%s, %s, %s, %s, %s)"
+        def work(cursor):
+            if content_sha256: self._release_failed_content_hash(cursor, content_sha256)
+            try: cursor.execute(sql, (original_filename, s3_bucket, s3_key, status, content_sha256))
+            except Error as e:
+                if e.errno != 1062: raise # ER_DUP_ENTRY: another upload of this content won the race
+                logger.info(f"Invoice content {content_sha256[:12]}... is already stored by another invoice."); return None
+            self._apply_rollup_deltas(cursor, {}, self._read_rollup_rows(cursor, [cursor.lastrowid]))
+            return cursor.lastrowid
         try:
-            invoice_id = self.execute_query(sql, (original_filename, s3_bucket, s3_key, status), is_insert=True)
-            return self.get_invoice_by_id(invoice_id) if invoice_id else None
+            invoice_id = self.run_in_transaction(work)
+            if not invoice_id: return None
+            logger.info(f"INSERT query successful. Last inserted ID: {invoice_id}")
+            return self.get_invoice_by_id(invoice_id) if fetch_record else {'id': invoice_id}
         except Error: return None # execute_query already logged the error
 
-    def get_invoice_by_id(self, invoice_id):
-        """Retrieves a single invoice by its primary ID."""
-        sql = "SELECT * FROM invoices WHERE id = %s"
-        try: return self.execute_query(sql, (invoice_id,), fetch_one=True)
+    def create_invoice_records_bulk(self, records, upload_batch_id, status='pending_s3_upload'):
+        """
+        Inserts many invoice rows in one batched INSERT. Each record is a dict with original_filename, s3_bucket and s3_key
+        (pre-generated so rows can be matched back). Returns [{'id', 'original_filename', 's3_key'}] or None on error.
+        """
+        if not records: return []
+        sql = "INSERT INTO invoices (original_filename, s3_bucket_name, s3_key, status, upload_batch_id) VALUES (%s, %s, %s, %s, %s)"
+        params = [(r['original_filename'], r.get('s3_bucket'), r['s3_key'], status, upload_batch_id) for r in records]
+        def work(cursor):
+            cursor.executemany(sql, params)
+            cursor.execute("SELECT id, original_filename, s3_key FROM invoices WHERE upload_batch_id = %s ORDER BY id ASC", (upload_batch_id,))
+            rows = cursor.fetchall()
+            self._apply_rollup_deltas(cursor, {}, self._read_rollup_rows(cursor, [row['id'] for row in rows]))
+            return rows
+        try: return self.run_in_transaction(work)
+        except Error: return None
+
+    def find_invoice_by_content_hash(self, content_sha256):
+        """
+        The first invoice uploaded with this file content (SHA-256 hex) that hasn't failed, as {id, status, s3_key,
+        original_filename}; None if there is none or on DB errors (the upload then proceeds as new).
+        """
+        placeholders = ", ".join(["%s"] * len(self.INVOICE_FAILED_STATUSES))
+        sql = f"SELECT id, status, s3_key, original_filename FROM invoices WHERE content_sha256 = %s AND status NOT IN ({placeholders}) ORDER BY id ASC LIMIT 1"
+        try: return self.execute_query(sql, (content_sha256, *self.INVOICE_FAILED_STATUSES), fetch_one=True)
+        except Error: return None
+
+    def _release_failed_content_hash(self, cursor, content_sha256):
+        """Clears the hash of a failed invoice with this content, so the same file can be uploaded again."""
+        placeholders = ", ".join(["%s"] * len(self.INVOICE_FAILED_STATUSES))
+        cursor.execute(f"UPDATE invoices SET content_sha256 = NULL WHERE content_sha256 = %s AND status IN ({placeholders})", (content_sha256, *self.INVOICE_FAILED_STATUSES))
+
+    def claim_invoice_content_hash(self, invoice_id, content_sha256):
+        """
+        Stores the content hash on an invoice unless an invoice that hasn't failed already has it. idx_invoices_content_sha256
+        is UNIQUE, so of two concurrent uploads of one file only one can claim it (not a rollup column, no cache bump).
+        :return: The invoice that already has this content (as find_invoice_by_content_hash), or None when claimed or on
+                 DB errors (the upload then proceeds as new).
+        """
+        placeholders = ", ".join(["%s"] * len(self.INVOICE_FAILED_STATUSES))
+        try:
+            with self.transaction() as cursor:
+                self._release_failed_content_hash(cursor, content_sha256)
+                try: cursor.execute("UPDATE invoices SET content_sha256 = %s WHERE id = %s", (content_sha256, invoice_id)); return None
+                except Error as e:
+                    if e.errno != 1062: raise # ER_DUP_ENTRY
+                cursor.execute(f"SELECT id, status, s3_key, original_filename FROM invoices WHERE content_sha256 = %s AND status NOT IN ({placeholders})",
+                               (content_sha256, *self.INVOICE_FAILED_STATUSES))
+                return cursor.fetchone()
+        except Error: return None
+
+    def delete_invoices_bulk(self, invoice_ids):
+        """Deletes many invoices in one statement (keeping invoice_rollups in step). Returns rows deleted, or None on error."""
+        if not invoice_ids: return 0
+        placeholders = ", ".join(["%s"] * len(invoice_ids))
+        try: return self._execute_with_rollup(invoice_ids, [(f"DELETE FROM invoices WHERE id IN ({placeholders})", tuple(invoice_ids))])
+        except Error: return None
+
+    def get_invoices_by_upload_batch(self, upload_batch_id):
+        """Returns the list columns of every invoice created by a bulk upload batch."""
+        sql = "SELECT id, original_filename, s3_key, status, error_message, upload_timestamp FROM invoices WHERE upload_batch_id = %s ORDER BY id ASC"
+        try: return self.execute_query(sql, (upload_batch_id,), fetch_all=True) or []
+        except Error: return []
+
+    def update_invoice_statuses_bulk(self, invoice_ids, status, error_message=None):
+        """Sets the same status (and error message) on many invoices in one statement."""
+        if not invoice_ids: return 0
+        placeholders = ", ".join(["%s"] * len(invoice_ids))
+        sql = f"UPDATE invoices SET status = %s, error_message = %s WHERE id IN ({placeholders})"
+        try: return self._execute_with_rollup(invoice_ids, [(sql, (status, error_message, *invoice_ids))])
+        except Error: return 0
+
+    def get_invoice_by_id(self, invoice_id, include_documents=()):
+        """
+        Retrieves a single invoice by its primary ID.
+        :param include_documents: Document types from invoice_documents to attach (e.g. 'parsed_data', 'full_textract_response').
+        """
+        sql = f"SELECT {', '.join(f'`{c}`' for c in self.INVOICE_SELECTABLE_COLUMNS)} FROM invoices WHERE id = %s" # No blobs in the hot row
+        try: invoice = self.execute_query(sql, (invoice_id,), fetch_one=True)
+        except Error: return None
+        if invoice and include_documents:
+            documents = self.get_invoice_documents(invoice_id, include_documents)
+            for doc_type in include_documents: invoice[doc_type] = documents.get(doc_type)
+        return invoice
+
+    # --- Invoice documents (compressed Textract payloads, loaded on demand) ---
+    def build_invoice_document_row(self, invoice_id, doc_type, payload):
+        """Prunes (Textract geometry) and compresses a payload into an invoice_documents parameter tuple."""
+        if doc_type == 'full_textract_response': payload = prune_geometry(payload, self.document_geometry_retain)
+        blob, raw_size = encode_document(payload, self.document_compression_level)
+        return (invoice_id, doc_type, ENCODING_ZLIB_JSON, blob, raw_size, len(blob))
+
+    def save_invoice_documents(self, invoice_id, documents):
+        """
+        Upserts payloads for an invoice into invoice_documents.
+        :param documents: Dict of document type -> JSON-serializable payload (None values are skipped).
+        :return: True on success.
+        """
+        rows = [self.build_invoice_document_row(invoice_id, doc_type, payload) for doc_type, payload in documents.items() if payload is not None]
+        if not rows: return True
+        return self.save_invoice_document_rows(rows)
+
+    _INVOICE_DOCUMENT_UPSERT_SQL = ("INSERT INTO invoice_documents (invoice_id, doc_type, encoding, payload, raw_bytes, stored_bytes) VALUES (%s, %s, %s, %s, %s, %s) "
+                                    "ON DUPLICATE KEY UPDATE encoding = VALUES(encoding), payload = VALUES(payload), raw_bytes = VALUES(raw_bytes), stored_bytes = VALUES(stored_bytes)")
+
+    def save_invoice_document_rows(self, rows):
+        """Batched upsert of pre-built (invoice_id, doc_type, encoding, payload, raw_bytes, stored_bytes) rows."""
+        try: self.execute_many(self._INVOICE_DOCUMENT_UPSERT_SQL, rows); return True
+        except Error: return False
+
+    def get_invoice_documents(self, invoice_id, doc_types):
+        """Loads and decompresses the requested document types for one invoice. Returns {doc_type: payload}."""
+        if not doc_types: return {}
+        placeholders = ", ".join(["%s"] * len(doc_types))
+        sql = f"SELECT doc_type, encoding, payload FROM invoice_documents WHERE invoice_id = %s AND doc_type IN ({placeholders})"
+        try: rows = self.execute_query(sql, (invoice_id, *doc_types), fetch_all=True) or []
+        except Error: return {}
+        documents = {}
+        for row in rows:
+            try: documents[row['doc_type']] = decode_document(row['payload'], row['encoding'])
+            except Exception as e: logger.error(f"Could not decode {row['doc_type']} document for invoice {invoice_id}: {e}")
+        return documents
+
+    # --- Offline re-parse of stored Textract responses (flask invoices reparse) ---
+    def get_stored_textract_page(self, after_id=0, limit=200, columns=()):
+        """
+        Keyset page (by invoice id) of invoices that have a stored full_textract_response.
+        :param columns: Current invoices columns to return alongside (for diffing); must be INVOICE_TABLE_PARSED_COLUMNS.
+        :return: Rows with id, encoding, payload (still compressed) and the columns, ordered by id; None on error.
+        """
+        columns = [c for c in columns if c in self.INVOICE_TABLE_PARSED_COLUMNS]
+        select_columns = "".join(f", i.`{c}`" for c in columns)
+        sql = (f"SELECT d.invoice_id AS id, d.encoding, d.payload{select_columns} FROM invoice_documents d JOIN invoices i ON i.id = d.invoice_id "
+               "WHERE d.doc_type = 'full_textract_response' AND d.invoice_id > %s ORDER BY d.invoice_id ASC LIMIT %s")
+        try: return self.execute_query(sql, (after_id, limit), fetch_all=True) or []
+        except Error: return None
+
+    def apply_reparsed_fields(self, updates, columns):
+        """
+        Writes re-parsed values for a batch of invoices in one transaction, with their new parsed_data documents, keeping
+        invoice_rollups in step. Status and error_message are left alone.
+        :param updates: [(invoice_id, {column: value}, parsed_data document row or None)].
+        :param columns: Columns to write (subset of INVOICE_TABLE_PARSED_COLUMNS); missing values are written as NULL.
+        :return: Number of invoices written, or None on error.
+        """
+        columns = [c for c in columns if c in self.INVOICE_TABLE_PARSED_COLUMNS]
+        if not updates or not columns: return 0
+        invoice_ids = [invoice_id for invoice_id, _, _ in updates]
+        if 'vendor_name' in columns: # Resolved before the transaction (a new vendor is its own short write)
+            updates = [(invoice_id, {**values, 'vendor_id': self.resolve_vendor_id(values.get('vendor_name'))}, document_row) for invoice_id, values, document_row in updates]
+            columns = columns + ['vendor_id']
+        def work(cursor):
+            before = self._read_rollup_rows(cursor, invoice_ids, for_update=True)
+            cursor.executemany(f"UPDATE invoices SET {', '.join(f'`{c}` = %s' for c in columns)} WHERE id = %s",
+                               [tuple(values.get(c) for c in columns) + (invoice_id,) for invoice_id, values, _ in updates])
+            document_rows = [document_row for _, _, document_row in updates if document_row]
+            if document_rows: cursor.executemany(self._INVOICE_DOCUMENT_UPSERT_SQL, document_rows)
+            self._apply_rollup_deltas(cursor, before, self._read_rollup_rows(cursor, invoice_ids))
+            return len(updates)
+        try: return self.run_in_transaction(work)
         except Error: return None
 
     def get_all_invoices(self, limit=100, offset=0):
@@ -170,51 +658,86 @@ class DbService:
         try: return self.execute_query(sql, (limit, offset), fetch_all=True)
         except Error: return []
 
-    def update_invoice_status(self, invoice_id, status, textract_job_id=None, error_message=None):
-        """Updates the status, and optionally Textract job ID and error message, of an invoice."""
+    def get_invoices_page(self, limit=100, after=None, fields=None, offset=None):
+        """
+        Keyset-paginated invoice list, newest first, ordered by (upload_timestamp, id).
+        :param limit: Page size.
+        :param after: Optional (upload_timestamp, id) of the last row of the previous page.
+        :param fields: Columns to select (subset of INVOICE_SELECTABLE_COLUMNS, 'id' is always included); defaults to INVOICE_LIST_COLUMNS.
+        :param offset: Legacy OFFSET paging, only used when no `after` key is given.
+        :return: (rows, next_key) where next_key is the (upload_timestamp, id) to pass as `after` for the next page, or None.
+        """
+        columns = list(dict.fromkeys(['id'] + [c for c in (fields or self.INVOICE_LIST_COLUMNS) if c in self.INVOICE_SELECTABLE_COLUMNS]))
+        select_columns = list(dict.fromkeys(columns + ['upload_timestamp'])) # Sort key is always needed for the cursor
+        sql = f"SELECT {', '.join(f'`{c}`' for c in select_columns)} FROM invoices"; params = []
+        if after:
+            # Expanded form of (upload_timestamp, id) < (%s, %s) so MySQL can range-scan idx_invoices_upload_ts_id
+            sql += " WHERE (`upload_timestamp` < %s OR (`upload_timestamp` = %s AND `id` < %s))"; params.extend([after[0], after[0], after[1]])
+        sql += " ORDER BY `upload_timestamp` DESC, `id` DESC LIMIT %s"; params.append(limit + 1) # One extra row tells us if there is a next page
+        if offset and not after: sql += " OFFSET %s"; params.append(offset)
+        try: rows = self.execute_query(sql, tuple(params), fetch_all=True) or []
+        except Error: return None, None
+        next_key = None
+        if len(rows) > limit:
+            rows = rows[:limit]; next_key = (rows[-1]['upload_timestamp'], rows[-1]['id'])
+        for row in rows:
+            for extra_column in set(select_columns) - set(columns): row.pop(extra_column, None)
+        return rows, next_key
+
+    def update_invoice_status(self, invoice_id, status, textract_job_id=None, error_message=None, expected_status=None):
+        """
+        Updates the status, and optionally Textract job ID and error message, of an invoice.
+        :param expected_status: Only update if the invoice still has this status (returns False otherwise).
+        """
         sql_parts = ["UPDATE invoices SET status = %s"]; params = [status]
         if textract_job_id is not None: sql_parts.append("textract_job_id = %s"); params.append(textract_job_id)
         if error_message is not None: sql_parts.append("error_message = %s"); params.append(error_message)
-        elif status not in ['error', 'textract_failed', 'parsing_failed', 'db_update_failed_post_textract', 's3_upload_failed', 'textract_submission_failed', 'textract_unknown_status']:
+        elif status not in self.INVOICE_FAILED_STATUSES:
             # Clear error message if status is positive and no new error is provided
             sql_parts.append("error_message = NULL")
         sql = ", ".join(sql_parts) + " WHERE id = %s"; params.append(invoice_id)
-        try: return self.execute_query(sql, tuple(params)) > 0 # Returns True if rows_affected > 0
+        if expected_status is not None: sql += " AND status = %s"; params.append(expected_status)
+        try: return self._execute_with_rollup([invoice_id], [(sql, tuple(params))]) > 0 # Returns True if rows_affected > 0
         except Error: return False
 
     def update_invoice_s3_details(self, invoice_id, s3_bucket, s3_key, status):
         """Updates an invoice record with S3 bucket, key after successful upload, and sets a new status."""
         sql = "UPDATE invoices SET s3_bucket_name = %s, s3_key = %s, status = %s, error_message = NULL WHERE id = %s"
-        try: return self.execute_query(sql, (s3_bucket, s3_key, status, invoice_id)) > 0
+        try: return self._execute_with_rollup([invoice_id], [(sql, (s3_bucket, s3_key, status, invoice_id))]) > 0
         except Error: return False
 
-    def update_invoice_parsed_data(self, invoice_id, status='processed', **parsed_fields):
+    def update_invoice_parsed_data(self, invoice_id, status='processed', expected_status=None, **parsed_fields):
         """
         Updates an invoice with data extracted by Textract (from parse_expense_data).
         Only attempts to update columns defined in self.INVOICE_TABLE_PARSED_COLUMNS (plus status and error_message).
-        The full raw output from TextractService's parser should be passed in parsed_fields['parsed_data_detail']
-        and will be stored in the 'parsed_data' JSON column.
+        With `expected_status` the row is only updated while the invoice still has that status (False otherwise), so two
+        collectors of the same Textract job can't both finish it.
+        The parser detail (parsed_fields['parsed_data_detail']) and the raw ExpenseDocument (parsed_fields['full_textract_response'])
+        are stored compressed in invoice_documents, not in the invoices row.
         """
         fields_to_update_sql = []
         params_sql = []
 
+        documents = {self.INVOICE_DOCUMENT_FIELDS[key]: parsed_fields.pop(key) for key in list(parsed_fields) if key in self.INVOICE_DOCUMENT_FIELDS}
+        if documents and not self.save_invoice_documents(invoice_id, documents):
+            self.update_invoice_status(invoice_id, status='db_update_failed_post_textract', error_message="DB update error: could not store Textract documents")
+            return False
+
         for key, value in parsed_fields.items():
             if key in self.INVOICE_TABLE_PARSED_COLUMNS: # Check against schema-aware list
                 fields_to_update_sql.append(f"`{key}` = %s")
                 # Convert Python Decimal to string for SQL if DB driver or column type requires it.
                 # MySQL connector handles Python Decimals well for DECIMAL columns.
-                # For JSON columns (line_items, parsed_data), ensure Decimals are serializable.
+                # For JSON columns (line_items), ensure Decimals are serializable.
                 if key in ['total_amount', 'subtotal', 'tax'] and isinstance(value, Decimal):
                     params_sql.append(value) # Store as Decimal
-                elif key in ['line_items', 'full_textract_response'] and value is not None: # For line_items to be stored as JSON
+                elif key == 'line_items' and value is not None: # For line_items to be stored as JSON
                     params_sql.append(json.dumps(value, default=str)) # default=str handles Decimals in list
                 else:
                     params_sql.append(value)
-            elif key == 'parsed_data_detail': # This is the raw JSON from TextractService
-                fields_to_update_sql.append("`parsed_data` = %s")
-                params_sql.append(json.dumps(value, default=str)) # default=str for any Decimals within
+        if 'vendor_name' in parsed_fields: fields_to_update_sql.append("`vendor_id` = %s"); params_sql.append(self.resolve_vendor_id(parsed_fields['vendor_name']))
 
-        if not fields_to_update_sql and 'parsed_data_detail' not in parsed_fields:
+        if not fields_to_update_sql and not documents:
              logger.info(f"No specific schema fields from parser to update for invoice ID {invoice_id}, only status.")
 
         fields_to_update_sql.append("`status` = %s"); params_sql.append(status)
@@ -222,10 +745,11 @@ class DbService:
 
         sql = f"UPDATE invoices SET {', '.join(fields_to_update_sql)} WHERE id = %s"
         params_sql.append(invoice_id)
+        if expected_status is not None: sql += " AND status = %s"; params_sql.append(expected_status)
 
         try:
             logger.debug(f"Updating parsed data for invoice {invoice_id}. PARAMS (types before DB): {[(type(p), p) for p in params_sql]}")
-            return self.execute_query(sql, tuple(params_sql)) > 0
+            return self._execute_with_rollup([invoice_id], [(sql, tuple(params_sql))]) > 0
         except Error as e:
             try: self.update_invoice_status(invoice_id, status='db_update_failed_post_textract', error_message=f"DB update error: {str(e)[:200]}")
             except: pass # Avoid error in error handling
@@ -244,67 +768,152 @@ class DbService:
                 else: params.append(value) # Other fields (dates, strings) as is
             else: logger.warning(f"Attempted to update disallowed field '{key}' via update_invoice_fields.")
         if not set_clauses: return False
+        if 'vendor_name' in fields_to_update: set_clauses.append("`vendor_id` = %s"); params.append(self.resolve_vendor_id(fields_to_update['vendor_name']))
         sql = f"UPDATE invoices SET {', '.join(set_clauses)} WHERE id = %s"; params.append(invoice_id)
         try:
             logger.debug(f"Updating invoice fields for ID {invoice_id} with SQL: {sql} and PARAMS: {params}")
-            return self.execute_query(sql, tuple(params)) > 0
+            return self._execute_with_rollup([invoice_id], [(sql, tuple(params))]) > 0
         except Error: return False # Error logged by execute_query
 
     # --- Analytics Methods ---
-    def get_analytics_summary(self): # ... (no changes from last full version)
-        sql_total_spent = "SELECT SUM(total_amount) as total_spent FROM invoices WHERE status = 'processed'"
-        sql_invoice_count = "SELECT COUNT(*) as total_invoices FROM invoices WHERE status = 'processed'"
-        total_spent_result = 0.0; invoice_count_result = 0
+    # Dashboard aggregates read invoice_rollups (a few rows per month/vendor/category) instead of scanning invoices
+    @cached_read()
+    def get_analytics_summary(self):
+        sql = "SELECT SUM(total_amount) as total_spent, SUM(invoice_count) as total_invoices FROM invoice_rollups WHERE status = 'processed'"
         try:
-            spent_data = self.execute_query(sql_total_spent, fetch_one=True)
-            if spent_data and spent_data.get('total_spent') is not None: total_spent_result = float(spent_data['total_spent'])
-            count_data = self.execute_query(sql_invoice_count, fetch_one=True)
-            if count_data and count_data.get('total_invoices') is not None: invoice_count_result = int(count_data['total_invoices'])
-            return {"total_spent": total_spent_result, "total_invoices": invoice_count_result}
+            data = self.execute_query(sql, fetch_one=True) or {}
+            return {"total_spent": float(data.get('total_spent') or 0), "total_invoices": int(data.get('total_invoices') or 0)}
         except Error: return {"total_spent": 0.0, "total_invoices": 0}
-    def get_expenses_by_vendor(self, limit=None): # ... (no changes from last full version)
-        sql = "SELECT vendor_name, SUM(total_amount) as tsfv, COUNT(*) as invoice_count FROM invoices WHERE status = 'processed' AND vendor_name IS NOT NULL AND vendor_name != 'N/A' AND vendor_name != '' GROUP BY vendor_name ORDER BY tsfv DESC"
+    @cached_read()
+    def get_expenses_by_vendor(self, limit=None):
+        sql = ("SELECT r.vendor_id, MIN(v.canonical_name) AS vendor_name, SUM(r.total_amount) as tsfv, SUM(r.invoice_count) as invoice_count FROM invoice_rollups r "
+               "JOIN vendors v ON v.id = r.vendor_id WHERE r.status = 'processed' GROUP BY r.vendor_id ORDER BY tsfv DESC")
         params = []
         if limit is not None: sql += " LIMIT %s"; params.append(limit)
-        try: results = self.execute_query(sql, tuple(params) if params else None, fetch_all=True); return [{**row, 'total_spent_for_vendor': float(row.pop('tsfv'))} for row in results] if results else []
+        try: results = self.execute_query(sql, tuple(params) if params else None, fetch_all=True); return [{**row, 'invoice_count': int(row['invoice_count']), 'total_spent_for_vendor': float(row.pop('tsfv'))} for row in results] if results else []
         except Error: return []
-    def get_expenses_by_category(self, limit=None): # ... (no changes from last full version)
-        sql = "SELECT user_category, SUM(total_amount) as tsfc, COUNT(*) as invoice_count FROM invoices WHERE status = 'processed' AND user_category IS NOT NULL AND user_category != '' GROUP BY user_category ORDER BY tsfc DESC"
+    @cached_read()
+    def get_expenses_by_category(self, limit=None):
+        sql = "SELECT user_category, SUM(total_amount) as tsfc, SUM(invoice_count) as invoice_count FROM invoice_rollups WHERE status = 'processed' AND user_category != '' GROUP BY user_category ORDER BY tsfc DESC"
         params = [];
         if limit is not None: sql += " LIMIT %s"; params.append(limit)
-        try: results = self.execute_query(sql, tuple(params) if params else None, fetch_all=True); return [{**row, 'total_spent_for_category': float(row.pop('tsfc'))} for row in results] if results else []
+        try: results = self.execute_query(sql, tuple(params) if params else None, fetch_all=True); return [{**row, 'invoice_count': int(row['invoice_count']), 'total_spent_for_category': float(row.pop('tsfc'))} for row in results] if results else []
         except Error: return []
-    def get_monthly_spend(self): # ... (no changes from last full version)
-        sql = "SELECT DATE_FORMAT(invoice_date, '%Y-%m') as month_year, SUM(total_amount) as monthly_total, COUNT(*) as invoice_count FROM invoices WHERE status = 'processed' AND invoice_date IS NOT NULL GROUP BY month_year ORDER BY month_year ASC"
-        try: results = self.execute_query(sql, fetch_all=True); return [{**row, 'monthly_total': float(row['monthly_total'])} for row in results] if results else []
+    def get_known_vendor_names(self):
+        """Canonical vendor names plus the spellings seen for them ('Dell', 'DELL INC.'). Returns None on DB errors."""
+        sql = "SELECT canonical_name AS vendor_name FROM vendors UNION SELECT alias_name FROM vendor_aliases"
+        try: return [row['vendor_name'] for row in (self.execute_query(sql, fetch_all=True) or [])]
+        except Error: return None
+
+    @cached_read()
+    def get_monthly_spend(self):
+        sql = "SELECT month as month_year, SUM(total_amount) as monthly_total, SUM(invoice_count) as invoice_count FROM invoice_rollups WHERE status = 'processed' AND month != '' GROUP BY month ORDER BY month ASC"
+        try: results = self.execute_query(sql, fetch_all=True); return [{**row, 'invoice_count': int(row['invoice_count']), 'monthly_total': float(row['monthly_total'])} for row in results] if results else []
         except Error: return []
-    def get_invoices_by_filter(self, filters, limit=5, offset=0): # ... (no changes from last full version)
-        if not isinstance(filters, dict): logger.error("get_invoices_by_filter: filters must be a dict."); return []
+    @cached_read()
+    def get_dashboard_data(self, date_from=None, date_to=None, top_n=5):
+        """
+        Every dashboard block (summary, top vendors, top categories, monthly trend, status counts) from one query plus one pass.
+        Whole-month (or open) bounds are served from invoice_rollups; day-level bounds fall back to one grouped scan of invoices.
+        :param date_from: Optional inclusive lower bound on invoice_date (date).
+        :param date_to: Optional inclusive upper bound on invoice_date (date).
+        :param top_n: Number of vendors/categories to return (None for all).
+        """
+        month_aligned = (date_from is None or date_from.day == 1) and (date_to is None or (date_to + timedelta(days=1)).day == 1)
+        where_clauses = []; params = []
+        if month_aligned:
+            if date_from: where_clauses.append("month >= %s"); params.append(date_from.strftime('%Y-%m'))
+            if date_to: where_clauses.append("month <= %s"); params.append(date_to.strftime('%Y-%m'))
+            if where_clauses: where_clauses.append("month != ''")
+            sql = "SELECT r.month, r.vendor_id, v.canonical_name AS vendor_name, r.user_category, r.status, r.currency, r.invoice_count, r.total_amount FROM invoice_rollups r LEFT JOIN vendors v ON v.id = r.vendor_id"
+            if where_clauses: sql += " WHERE " + " AND ".join(f"r.{clause}" for clause in where_clauses)
+        else:
+            if date_from: where_clauses.append("invoice_date >= %s"); params.append(date_from.isoformat())
+            if date_to: where_clauses.append("invoice_date <= %s"); params.append(date_to.isoformat())
+            sql = ("SELECT COALESCE(DATE_FORMAT(i.invoice_date, '%Y-%m'), '') AS month, COALESCE(i.vendor_id, 0) AS vendor_id, v.canonical_name AS vendor_name, "
+                   "COALESCE(i.user_category, '') AS user_category, COALESCE(i.status, '') AS status, COALESCE(i.currency, '') AS currency, COUNT(*) AS invoice_count, "
+                   f"COALESCE(SUM(i.total_amount), 0) AS total_amount FROM invoices i LEFT JOIN vendors v ON v.id = i.vendor_id WHERE {' AND '.join(f'i.{clause}' for clause in where_clauses)} GROUP BY 1, 2, 3, 4, 5, 6")
+        try: rows = self.execute_query(sql, tuple(params) if params else None, fetch_all=True) or []
+        except Error: return None
+
+        total_spent = Decimal('0'); total_invoices = 0; status_counts = defaultdict(int); currencies = defaultdict(Decimal)
+        vendor_names = {}; vendors = defaultdict(lambda: [Decimal('0'), 0]); categories = defaultdict(lambda: [Decimal('0'), 0]); months = defaultdict(lambda: [Decimal('0'), 0])
+        for row in rows:
+            count = int(row['invoice_count']); amount = Decimal(str(row['total_amount'] or 0))
+            if not count: continue
+            status_counts[row['status'] or None] += count
+            if row['status'] != 'processed': continue
+            total_spent += amount; total_invoices += count
+            if row['currency']: currencies[row['currency']] += amount
+            if row['vendor_id'] and row['vendor_name'] is not None: vendor_names[row['vendor_id']] = row['vendor_name']
+            for bucket, key in ((vendors, row['vendor_id'] if row['vendor_id'] in vendor_names else None), (categories, row['user_category'] or None), (months, row['month'] or None)):
+                if key is None: continue
+                bucket[key][0] += amount; bucket[key][1] += count
+
+        def top(bucket, name_key, total_key, id_key=None, names=None):
+            ranked = sorted(bucket.items(), key=lambda item: item[1][0], reverse=True)
+            return [{**({id_key: key} if id_key else {}), name_key: names[key] if names is not None else key, "invoice_count": count, total_key: float(amount)}
+                    for key, (amount, count) in (ranked[:top_n] if top_n is not None else ranked)]
+        monthly = [{"month_year": month, "monthly_total": float(amount), "invoice_count": count} for month, (amount, count) in sorted(months.items())]
+        return {
+            "summary": {"total_spent": float(total_spent), "total_invoices": total_invoices},
+            "expenses_by_vendor": top(vendors, 'vendor_name', 'total_spent_for_vendor', id_key='vendor_id', names=vendor_names),
+            "expenses_by_category": top(categories, 'user_category', 'total_spent_for_category'),
+            "monthly_spend": monthly,
+            "status_counts": dict(status_counts),
+            "spend_by_currency": {currency: float(amount) for currency, amount in currencies.items()},
+            "unique_vendors": len(vendors),
+            "first_month": monthly[0]["month_year"] if monthly else None,
+            "last_month": monthly[-1]["month_year"] if monthly else None,
+            "range": {"from": date_from.isoformat() if date_from else None, "to": date_to.isoformat() if date_to else None},
+            "source": "rollup" if month_aligned else "scan"
+        }
+
+    @staticmethod
+    def _with_substring_fallback(run, terms, found=bool):
+        """
+        Returns run(True) (text filters through the FULLTEXT index), or run(False) (plain LIKE '%term%' scan) when that found
+        nothing for an indexable term: the index only knows word prefixes, so 'soft' needs the scan to find 'Microsoft'.
+        """
+        result = run(True)
+        if result is None or found(result) or not any(indexed_words(term) for term in terms if term): return result
+        return run(False)
+
+    def _invoice_filter_where(self, filters, fulltext=True):
+        """
+        Builds the WHERE clause shared by the filtered invoice reads (chat context rows and aggregates).
+        Without a status filter only processed invoices are included. Returns (where_sql, params).
+        """
         where_clauses = []; params = []
-        has_specific_status_filter = False
-        if filters.get('status_exact_match'): where_clauses.append("`status` = %s"); params.append(filters['status_exact_match']); has_specific_status_filter = True
-        elif filters.get('status_like_match'): where_clauses.append("`status` LIKE %s"); params.append(filters['status_like_match']); has_specific_status_filter = True
-        if not has_specific_status_filter: where_clauses.append("`status` = 'processed'")
+        if filters.get('status_exact_match'): where_clauses.append("`status` = %s"); params.append(filters['status_exact_match'])
+        elif filters.get('status_like_match'): where_clauses.append("`status` LIKE %s"); params.append(filters['status_like_match'])
+        else: where_clauses.append("`status` = 'processed'")
         if filters.get('id_exact_match') and isinstance(filters.get('id_exact_match'), int): where_clauses.append("`id` = %s"); params.append(filters['id_exact_match'])
-        if filters.get('vendor_name_like'): where_clauses.append("`vendor_name` LIKE %s"); params.append(f"%{filters['vendor_name_like']}%")
-        if filters.get('user_category_like'): where_clauses.append("`user_category` LIKE %s"); params.append(f"%{filters['user_category_like']}%")
+        for column in ('vendor_name', 'user_category'): # FULLTEXT-assisted 'contains' (see invoice_search.text_filter)
+            if filters.get(f'{column}_like'):
+                clauses, clause_params = text_filter(column, filters[f'{column}_like'], fulltext=fulltext); where_clauses.extend(clauses); params.extend(clause_params)
         if filters.get('invoice_date_exact'): where_clauses.append("`invoice_date` = %s"); params.append(filters['invoice_date_exact'])
         else:
             if filters.get('invoice_date_start'): where_clauses.append("`invoice_date` >= %s"); params.append(filters['invoice_date_start'])
             if filters.get('invoice_date_end'): where_clauses.append("`invoice_date` <= %s"); params.append(filters['invoice_date_end'])
         if filters.get('total_amount_gt') is not None: where_clauses.append("`total_amount` > %s"); params.append(Decimal(str(filters['total_amount_gt'])))
         if filters.get('total_amount_lt') is not None: where_clauses.append("`total_amount` < %s"); params.append(Decimal(str(filters['total_amount_lt'])))
-        base_sql = "SELECT id, original_filename, vendor_name, invoice_date, total_amount, currency, user_category, status FROM invoices" # Select specific fields
-        if where_clauses: base_sql += " WHERE " + " AND ".join(where_clauses)
+        return " AND ".join(where_clauses), params
+
+    def get_invoices_by_filter(self, filters, limit=5, offset=0):
+        if not isinstance(filters, dict): logger.error("get_invoices_by_filter: filters must be a dict."); return []
         order_by_clause = filters.get('order_by', 'invoice_date DESC, id DESC')
         allowed_sort_cols = ['upload_timestamp', 'invoice_date', 'total_amount', 'vendor_name', 'status', 'id']
         sort_col_candidate = order_by_clause.split(' ')[0].lower(); sort_dir_candidate = order_by_clause.split(' ')[-1].upper() if len(order_by_clause.split(' ')) > 1 else 'DESC'
         if sort_col_candidate not in allowed_sort_cols or sort_dir_candidate not in ['ASC', 'DESC']: order_by_clause = 'invoice_date DESC, id DESC'
-        base_sql += f" ORDER BY {order_by_clause}"
-        base_sql += " LIMIT %s OFFSET %s"; params.extend([limit, offset])
-        try:
+        def run(fulltext):
+            where_sql, params = self._invoice_filter_where(filters, fulltext=fulltext)
+            base_sql = f"SELECT id, original_filename, vendor_name, invoice_date, total_amount, currency, user_category, status FROM invoices WHERE {where_sql}" # Select specific fields
+            base_sql += f" ORDER BY {order_by_clause} LIMIT %s OFFSET %s"; params.extend([limit, offset])
             logger.debug(f"Executing get_invoices_by_filter query: {base_sql} with params: {params}")
-            results = self.execute_query(sql, tuple(params), fetch_all=True)
+            return self.execute_query(base_sql, tuple(params), fetch_all=True)
+        try:
+            results = self._with_substring_fallback(run, (filters.get('vendor_name_like'), filters.get('user_category_like')))
             if results:
                 for row in results: # Convert Decimal to float for easier JSON handling if needed
                     if row.get('total_amount') is not None and isinstance(row['total_amount'], Decimal): row['total_amount'] = float(row['total_amount'])
@@ -312,7 +921,57 @@ class DbService:
             return results if results else []
         except Error: return []
 
+    SEARCH_RESULT_COLUMNS = ['id', 'original_filename', 'vendor_name', 'invoice_id_number', 'invoice_date', 'total_amount', 'currency', 'user_category', 'status', 'line_item_text']
+
+    @cached_read()
+    def search_invoices(self, query, limit=20, offset=0, status=None):
+        """
+        Full-text search over vendor name, invoice number, category and line-item descriptions (ft_invoices_search).
+        Every word must match (as a prefix); results are ranked by relevance, vendor name matches counting double.
+        A query with no indexable word (e.g. 'HP': shorter than the index's minimum token size) is answered by a LIKE scan.
+        :return: (rows with a 'score', has_more, mode 'fulltext' or 'scan'), or (None, False, None) on DB errors.
+        """
+        columns = ", ".join(f"`{c}`" for c in self.SEARCH_RESULT_COLUMNS)
+        words = indexed_words(query)
+        if words:
+            match_all = f"MATCH({', '.join(f'`{c}`' for c in SEARCH_COLUMNS)}) AGAINST (%s IN BOOLEAN MODE)"; expression = boolean_query(words)
+            sql = f"SELECT {columns}, {match_all} + 2 * MATCH(`vendor_name`) AGAINST (%s IN BOOLEAN MODE) AS score FROM invoices WHERE {match_all}"
+            params = [expression, expression, expression]; order_by = "score DESC, id DESC"; mode = "fulltext"
+        else:
+            sql = f"SELECT {columns}, 0 AS score FROM invoices WHERE ({' OR '.join(f'`{c}` LIKE %s' for c in SEARCH_COLUMNS)})"
+            params = [f"%{query.strip()}%"] * len(SEARCH_COLUMNS); order_by = "id DESC"; mode = "scan"
+        if status: sql += " AND `status` = %s"; params.append(status)
+        sql += f" ORDER BY {order_by} LIMIT %s OFFSET %s"; params.extend([limit + 1, offset]) # One extra row tells us if there is a next page
+        try: rows = self.execute_query(sql, tuple(params), fetch_all=True) or []
+        except Error as e: logger.error(f"Error searching invoices for '{query}': {e}", exc_info=True); return None, False, None
+        for row in rows: row['score'] = round(float(row['score'] or 0), 4)
+        return rows[:limit], len(rows) > limit, mode
+
+    @cached_read()
+    def get_invoice_aggregates_by_filter(self, filters):
+        """
+        Exact COUNT/SUM/MIN/MAX over every invoice matching `filters` (same keys as get_invoices_by_filter), per currency.
+        Runs entirely in SQL; idx_invoices_status_date_agg covers the filter and aggregate columns.
+        :return: List of dicts (currency, invoice_count, amount_count, total_amount, min_amount, max_amount, first_date, last_date),
+                 largest total first, or None on DB errors.
+        """
+        if not isinstance(filters, dict): logger.error("get_invoice_aggregates_by_filter: filters must be a dict."); return None
+        def run(fulltext):
+            where_sql, params = self._invoice_filter_where(filters, fulltext=fulltext)
+            sql = ("SELECT `currency`, COUNT(*) AS invoice_count, COUNT(`total_amount`) AS amount_count, SUM(`total_amount`) AS total_amount, "
+                   "MIN(`total_amount`) AS min_amount, MAX(`total_amount`) AS max_amount, MIN(`invoice_date`) AS first_date, MAX(`invoice_date`) AS last_date "
+                   f"FROM invoices WHERE {where_sql} GROUP BY `currency` ORDER BY total_amount DESC")
+            return self.execute_query(sql, tuple(params), fetch_all=True) or []
+        try: results = self._with_substring_fallback(run, (filters.get('vendor_name_like'), filters.get('user_category_like')))
+        except Error as e: logger.error(f"Error fetching invoice aggregates: {e}", exc_info=True); return None
+        to_float = lambda value: float(value) if value is not None else None
+        to_iso = lambda value: value.isoformat() if isinstance(value, date) else value
+        return [{"currency": row['currency'], "invoice_count": int(row['invoice_count']), "amount_count": int(row['amount_count']),
+                 "total_amount": to_float(row['total_amount']) or 0.0, "min_amount": to_float(row['min_amount']), "max_amount": to_float(row['max_amount']),
+                 "first_date": to_iso(row['first_date']), "last_date": to_iso(row['last_date'])} for row in results]
+
     # --- Methods for Comprehensive Report Data ---
+    @cached_read()
     def get_comprehensive_report_summary_stats(self, year=None, month=None, vendor_name=None, category=None): # ... (no changes from last full version)
         where_clauses = ["`status` = 'processed'"]; params = []
         if year and month:
@@ -320,22 +979,26 @@ class DbService:
             except ValueError: logger.error(f"Invalid year/month for report summary: {year}-{month}"); return None
             where_clauses.append("`invoice_date` BETWEEN %s AND %s"); params.extend([start_date_obj.strftime('%Y-%m-%d'), end_date_obj.strftime('%Y-%m-%d')])
         elif year: where_clauses.append("`invoice_date` BETWEEN %s AND %s"); params.extend([f"{year}-01-01", f"{year}-12-31"])
-        if vendor_name: where_clauses.append("`vendor_name` LIKE %s"); params.append(f"%{vendor_name}%")
-        if category: where_clauses.append("`user_category` LIKE %s"); params.append(f"%{category}%")
-        where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
-        sql_summary = f"SELECT COUNT(*) as `total_invoices`, SUM(`total_amount`) as `total_spent`, MIN(`invoice_date`) as `oldest_invoice_date`, MAX(`invoice_date`) as `newest_invoice_date`, COUNT(DISTINCT `vendor_name`) as `unique_vendors` FROM invoices WHERE {where_sql}"
+        def run(fulltext):
+            run_clauses = list(where_clauses); run_params = list(params)
+            if vendor_name: clauses, clause_params = text_filter('vendor_name', vendor_name, fulltext=fulltext); run_clauses.extend(clauses); run_params.extend(clause_params)
+            if category: clauses, clause_params = text_filter('user_category', category, fulltext=fulltext); run_clauses.extend(clauses); run_params.extend(clause_params)
+            sql_summary = f"SELECT COUNT(*) as `total_invoices`, SUM(`total_amount`) as `total_spent`, MIN(`invoice_date`) as `oldest_invoice_date`, MAX(`invoice_date`) as `newest_invoice_date`, COUNT(DISTINCT `vendor_id`) as `unique_vendors` FROM invoices WHERE {' AND '.join(run_clauses)}"
+            logger.debug(f"Executing get_comprehensive_report_summary_stats: {sql_summary} with {run_params}")
+            return self.execute_query(sql_summary, tuple(run_params) if run_params else None, fetch_one=True)
         try:
-            logger.debug(f"Executing get_comprehensive_report_summary_stats: {sql_summary} with {params}")
-            summary_data = self.execute_query(sql_summary, tuple(params) if params else None, fetch_one=True)
+            summary_data = self._with_substring_fallback(run, (vendor_name, category), found=lambda row: bool(row and row.get('total_invoices')))
             if summary_data:
                 total_spent = summary_data.get('total_spent'); oldest_date_val = summary_data.get('oldest_invoice_date'); newest_date_val = summary_data.get('newest_invoice_date')
                 return {"total_invoices": int(summary_data.get('total_invoices',0) or 0),"total_spent": float(total_spent) if total_spent else 0.0,"oldest_invoice_date": oldest_date_val.isoformat() if isinstance(oldest_date_val, date) else None,"newest_invoice_date": newest_date_val.isoformat() if isinstance(newest_date_val, date) else None,"unique_vendors": int(summary_data.get('unique_vendors',0) or 0)}
             return {"total_invoices":0, "total_spent":0.0, "oldest_invoice_date":None, "newest_invoice_date":None, "unique_vendors":0}
         except Error as e: logger.error(f"Error fetching comprehensive summary stats: {e}", exc_info=True); return None
-    def get_invoice_status_counts(self): # ... (no changes from last full version)
-        sql = "SELECT `status`, COUNT(*) as count FROM invoices GROUP BY `status`"
-        try: results = self.execute_query(sql, fetch_all=True); return {row['status']: int(row['count']) for row in results} if results else {}
+    @cached_read()
+    def get_invoice_status_counts(self):
+        sql = "SELECT `status`, SUM(invoice_count) as count FROM invoice_rollups GROUP BY `status`"
+        try: results = self.execute_query(sql, fetch_all=True); return {(row['status'] or None): int(row['count']) for row in results if int(row['count'])} if results else {}
         except Error as e: logger.error(f"Error fetching status counts: {e}", exc_info=True); return {}
+    @cached_read()
     def get_invoices_for_report(self, year, month, vendor_name=None, category=None, limit_for_details=15): # ... (no changes from last full version)
         try: start_date = datetime(year, month, 1); end_date = (start_date.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
         except ValueError: logger.error(f"Invalid year/month for get_invoices_for_report: {year}-{month}."); return []
@@ -343,13 +1006,15 @@ class DbService:
         if vendor_name: filters["vendor_name_like"] = vendor_name
         if category: filters["user_category_like"] = category
         select_fields = "id, original_filename, vendor_name, invoice_date, due_date, total_amount, currency, user_category, line_items, status, s3_key"
-        where_clauses = ["`status` = %s", "`invoice_date` >= %s", "`invoice_date` <= %s"]; params = [filters["status_exact_match"], filters["invoice_date_start"], filters["invoice_date_end"]]
-        if filters.get('vendor_name_like'): where_clauses.append("`vendor_name` LIKE %s"); params.append(f"%{filters['vendor_name_like']}%")
-        if filters.get('user_category_like'): where_clauses.append("`user_category` LIKE %s"); params.append(f"%{filters['user_category_like']}%")
-        sql = f"SELECT {select_fields} FROM invoices WHERE {' AND '.join(where_clauses)} ORDER BY invoice_date ASC, id ASC LIMIT %s"; params.append(limit_for_details)
-        try:
+        def run(fulltext):
+            where_clauses = ["`status` = %s", "`invoice_date` >= %s", "`invoice_date` <= %s"]; params = [filters["status_exact_match"], filters["invoice_date_start"], filters["invoice_date_end"]]
+            if vendor_name: clauses, clause_params = text_filter('vendor_name', vendor_name, fulltext=fulltext); where_clauses.extend(clauses); params.extend(clause_params)
+            if category: clauses, clause_params = text_filter('user_category', category, fulltext=fulltext); where_clauses.extend(clauses); params.extend(clause_params)
+            sql = f"SELECT {select_fields} FROM invoices WHERE {' AND '.join(where_clauses)} ORDER BY invoice_date ASC, id ASC LIMIT %s"; params.append(limit_for_details)
             logger.debug(f"Executing get_invoices_for_report query: {sql} with params: {params}")
-            invoices = self.execute_query(sql, tuple(params), fetch_all=True)
+            return self.execute_query(sql, tuple(params), fetch_all=True)
+        try:
+            invoices = self._with_substring_fallback(run, (vendor_name, category))
             if invoices:
                 for inv in invoices:
                     if inv.get('total_amount') is not None and isinstance(inv['total_amount'], Decimal): inv['total_amount'] = float(inv['total_amount'])
@@ -371,7 +1036,236 @@ class DbService:
     def delete_invoice_by_id(self, invoice_id):
         sql = "DELETE FROM invoices WHERE id = %s"
         try:
-            rows_affected = self.execute_query(sql, (invoice_id,))
+            rows_affected = self._execute_with_rollup([invoice_id], [(sql, (invoice_id,))])
             if rows_affected > 0: logger.info(f"Successfully deleted invoice ID {invoice_id} from database."); return True
             else: logger.warning(f"No invoice found with ID {invoice_id} to delete."); return False
         except Error: return False
+
+    # --- AI insights (generated summaries keyed by prompt fingerprint) ---
+    def get_ai_insight(self, insight_type, fingerprint):
+        """Returns the stored insight for an exact prompt fingerprint, or None."""
+        sql = "SELECT id, insight_type, fingerprint, model, content, created_at FROM ai_insights WHERE insight_type = %s AND fingerprint = %s"
+        try: return self.execute_query(sql, (insight_type, fingerprint), fetch_one=True)
+        except Error: return None
+
+    def get_latest_ai_insight(self, insight_type):
+        """Returns the most recently generated insight of a type (whatever its fingerprint), or None."""
+        sql = "SELECT id, insight_type, fingerprint, model, content, created_at FROM ai_insights WHERE insight_type = %s ORDER BY created_at DESC, id DESC LIMIT 1"
+        try: return self.execute_query(sql, (insight_type,), fetch_one=True)
+        except Error: return None
+
+    def save_ai_insight(self, insight_type, fingerprint, content, model=None, prompt_tokens=None, completion_tokens=None, generation_ms=None, keep_per_type=20):
+        """
+        Upserts a generated insight and prunes all but the `keep_per_type` newest insights of that type.
+        :return: True on success.
+        """
+        sql = ("INSERT INTO ai_insights (insight_type, fingerprint, model, content, prompt_tokens, completion_tokens, generation_ms) VALUES (%s, %s, %s, %s, %s, %s, %s) "
+               "ON DUPLICATE KEY UPDATE model = VALUES(model), content = VALUES(content), prompt_tokens = VALUES(prompt_tokens), "
+               "completion_tokens = VALUES(completion_tokens), generation_ms = VALUES(generation_ms), created_at = CURRENT_TIMESTAMP")
+        try: self.execute_query(sql, (insight_type, fingerprint, model, content, prompt_tokens, completion_tokens, generation_ms))
+        except Error: return False
+        prune_sql = ("DELETE FROM ai_insights WHERE insight_type = %s AND id NOT IN "
+                     "(SELECT id FROM (SELECT id FROM ai_insights WHERE insight_type = %s ORDER BY created_at DESC, id DESC LIMIT %s) AS newest)")
+        try: self.execute_query(prune_sql, (insight_type, insight_type, keep_per_type))
+        except Error: logger.warning(f"Could not prune old '{insight_type}' AI insights.") # Not fatal, the new row is saved
+        return True
+
+    # --- Generated reports (also the report artifact store, see ReportService.artifact_key) ---
+    GENERATED_REPORT_COLUMNS = "id, report_type, report_params, report_month, report_markdown, model, generation_ms, created_at, (report_pdf IS NOT NULL) AS has_pdf" # No PDF blob
+
+    @staticmethod
+    def _decode_generated_report(report):
+        if report and isinstance(report.get('report_params'), (str, bytes, bytearray)):
+            try: report['report_params'] = json.loads(report['report_params'])
+            except ValueError: pass
+        if report and 'has_pdf' in report: report['has_pdf'] = bool(report['has_pdf'])
+        return report
+
+    def save_generated_report(self, report_type, report_params_json, report_markdown, model=None, prompt_tokens=None, completion_tokens=None, generation_ms=None,
+                              artifact_key=None, report_month=None):
+        """Persists a generated report (stored under `artifact_key` when given). Returns the new report ID or None on error."""
+        sql = ("INSERT INTO generated_reports (report_type, report_params, artifact_key, report_month, report_markdown, model, prompt_tokens, completion_tokens, generation_ms) "
+               "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)")
+        try: return self.execute_query(sql, (report_type, report_params_json, artifact_key, report_month, report_markdown, model, prompt_tokens, completion_tokens, generation_ms), is_insert=True)
+        except Error: return None
+
+    def get_generated_report(self, report_id):
+        """Returns a stored report (report_params decoded, has_pdf flag instead of the PDF itself), or None."""
+        sql = f"SELECT {self.GENERATED_REPORT_COLUMNS} FROM generated_reports WHERE id = %s"
+        try: return self._decode_generated_report(self.execute_query(sql, (report_id,), fetch_one=True))
+        except Error: return None
+
+    def find_report_artifact(self, artifact_key):
+        """Returns the newest stored report with this artifact key (same shape as get_generated_report), or None."""
+        sql = f"SELECT {self.GENERATED_REPORT_COLUMNS} FROM generated_reports WHERE artifact_key = %s ORDER BY id DESC LIMIT 1"
+        try: return self._decode_generated_report(self.execute_query(sql, (artifact_key,), fetch_one=True))
+        except Error: return None
+
+    def get_report_data_version(self, month=None):
+        """
+        Cheap fingerprint of the invoice data a report is built from: row count plus an order-independent checksum of
+        invoice_rollups for one 'YYYY-MM' month (or all months). Changes whenever an invoice in scope is added, moved or
+        re-totalled. Returns a string, or None on error.
+        """
+        sql = ("SELECT COUNT(*) AS group_count, COALESCE(BIT_XOR(CRC32(CONCAT_WS('|', month, vendor_id, user_category, status, currency, "
+               "invoice_count, total_amount, amount_count))), 0) AS checksum FROM invoice_rollups" + (" WHERE month = %s" if month else ""))
+        try: row = self.execute_query(sql, (month,) if month else None, fetch_one=True)
+        except Error: return None
+        return f"{row['group_count']}:{row['checksum']}" if row else None
+
+    def get_generated_report_pdf(self, report_id):
+        """Returns the stored PDF bytes of a report, or None if it was never rendered (or on error)."""
+        try: row = self.execute_query("SELECT report_pdf FROM generated_reports WHERE id = %s", (report_id,), fetch_one=True)
+        except Error: return None
+        return bytes(row['report_pdf']) if row and row.get('report_pdf') is not None else None
+
+    def save_generated_report_pdf(self, report_id, pdf_bytes):
+        """Stores the rendered PDF next to the report's Markdown. Returns True on success."""
+        try: return self.execute_query("UPDATE generated_reports SET report_pdf = %s, pdf_generated_at = CURRENT_TIMESTAMP WHERE id = %s", (pdf_bytes, report_id)) > 0
+        except Error: return False
+
+    # --- PDF Render Job Methods (shared by all web processes, see PdfRenderService) ---
+    PDF_JOB_PUBLIC_COLUMNS = "job_id, title, status, error, pages, render_ms, UNIX_TIMESTAMP(submitted_at) AS submitted_at, UNIX_TIMESTAMP(finished_at) AS finished_at"
+
+    def create_pdf_job(self, job_id, title, report_id=None, status='queued'):
+        """Records a new render job. Returns True on success."""
+        sql = "INSERT INTO pdf_render_jobs (job_id, report_id, title, status, finished_at) VALUES (%s, %s, %s, %s, IF(%s = 'done', CURRENT_TIMESTAMP, NULL))"
+        try: self.execute_query(sql, (job_id, report_id, (title or '')[:255], status, status)); return True
+        except Error: return False
+
+    def set_pdf_job_status(self, job_id, status):
+        try: return self.execute_query("UPDATE pdf_render_jobs SET status = %s WHERE job_id = %s", (status, job_id)) > 0
+        except Error: return False
+
+    def finish_pdf_job(self, job_id, status, pdf=None, pages=None, render_ms=None, error=None):
+        """Stores the outcome of a render job ('done' with its PDF, or 'failed' with the error)."""
+        sql = "UPDATE pdf_render_jobs SET status = %s, pdf = %s, pages = %s, render_ms = %s, error = %s, finished_at = CURRENT_TIMESTAMP WHERE job_id = %s"
+        try: return self.execute_query(sql, (status, pdf, pages, render_ms, error, job_id)) > 0
+        except Error: return False
+
+    def get_pdf_job(self, job_id):
+        """Returns the job status (without PDF bytes), or None if unknown or on error."""
+        try: row = self.execute_query(f"SELECT {self.PDF_JOB_PUBLIC_COLUMNS} FROM pdf_render_jobs WHERE job_id = %s", (job_id,), fetch_one=True)
+        except Error: return None
+        if not row: return None
+        return {**row, "submitted_at": float(row['submitted_at']) if row['submitted_at'] is not None else None, "finished_at": float(row['finished_at']) if row['finished_at'] is not None else None}
+
+    def get_pdf_job_pdf(self, job_id):
+        """Returns the PDF of a done job: its own bytes, or the stored PDF of the report it references."""
+        sql = ("SELECT COALESCE(j.pdf, r.report_pdf) AS pdf FROM pdf_render_jobs j LEFT JOIN generated_reports r ON r.id = j.report_id "
+               "WHERE j.job_id = %s AND j.status = 'done'")
+        try: row = self.execute_query(sql, (job_id,), fetch_one=True)
+        except Error: return None
+        return bytes(row['pdf']) if row and row.get('pdf') is not None else None
+
+    def delete_expired_pdf_jobs(self, ttl_seconds, stale_seconds):
+        """Drops jobs finished more than ttl_seconds ago, and unfinished ones older than stale_seconds (their process died)."""
+        sql = ("DELETE FROM pdf_render_jobs WHERE (finished_at IS NOT NULL AND finished_at < NOW() - INTERVAL %s SECOND) "
+               "OR (finished_at IS NULL AND submitted_at < NOW() - INTERVAL %s SECOND)")
+        try: return self.execute_query(sql, (int(ttl_seconds), int(stale_seconds)))
+        except Error: return 0
+
+    # --- Ingestion Job Methods (background upload pipeline) ---
+    INGESTION_JOB_UPDATABLE_COLUMNS = ['stage', 'status', 'attempts', 'spool_path', 's3_key', 'textract_job_id', 'last_error', 'next_run_at']
+
+    def create_ingestion_job(self, invoice_id, original_filename, spool_path, content_type=None, stage='s3_upload'):
+        """Persists a new ingestion job so it survives restarts. Returns the job ID or None on error."""
+        sql = "INSERT INTO ingestion_jobs (invoice_id, original_filename, spool_path, content_type, stage, status) VALUES (%s, %s, %s, %s, %s, 'queued')"
+        try: return self.execute_query(sql, (invoice_id, original_filename, spool_path, content_type, stage), is_insert=True)
+        except Error: return None
+
+    def create_ingestion_jobs_bulk(self, jobs, stage='textract_submit'):
+        """
+        Inserts ingestion jobs for already uploaded invoices in one batched INSERT.
+        Each job is a dict with invoice_id, original_filename, content_type and s3_key. Returns the inserted rows.
+        """
+        if not jobs: return []
+        sql = "INSERT INTO ingestion_jobs (invoice_id, original_filename, content_type, s3_key, stage, status) VALUES (%s, %s, %s, %s, %s, 'queued')"
+        try:
+            self.execute_many(sql, [(j['invoice_id'], j.get('original_filename'), j.get('content_type'), j.get('s3_key'), stage) for j in jobs])
+            placeholders = ", ".join(["%s"] * len(jobs))
+            return self.execute_query(f"SELECT * FROM ingestion_jobs WHERE invoice_id IN ({placeholders}) AND stage = %s AND status = 'queued' ORDER BY id ASC",
+                                      (*[j['invoice_id'] for j in jobs], stage), fetch_all=True) or []
+        except Error: return None
+
+    def update_ingestion_job(self, job_id, **fields):
+        """Updates the given columns (see INGESTION_JOB_UPDATABLE_COLUMNS) of an ingestion job."""
+        set_clauses = []; params = []
+        for key, value in fields.items():
+            if key in self.INGESTION_JOB_UPDATABLE_COLUMNS: set_clauses.append(f"`{key}` = %s"); params.append(value)
+            else: logger.warning(f"Attempted to update disallowed ingestion job field '{key}'.")
+        if not set_clauses: return False
+        sql = f"UPDATE ingestion_jobs SET {', '.join(set_clauses)} WHERE id = %s"; params.append(job_id)
+        try: return self.execute_query(sql, tuple(params)) > 0
+        except Error: return False
+
+    def get_ingestion_job_for_invoice(self, invoice_id):
+        """Returns the most recent ingestion job for an invoice, or None."""
+        sql = "SELECT * FROM ingestion_jobs WHERE invoice_id = %s ORDER BY id DESC LIMIT 1"
+        try: return self.execute_query(sql, (invoice_id,), fetch_one=True)
+        except Error: return None
+
+    # Claimable: due queued/waiting jobs, and 'running' jobs whose claiming process died (lease expired, or claimed before migration 013)
+    _CLAIMABLE_JOB_CONDITION = ("((status IN ('queued', 'waiting') AND (next_run_at IS NULL OR next_run_at <= NOW()))"
+                                " OR (status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < NOW())))")
+
+    def get_claimable_ingestion_jobs(self, limit=500):
+        """Returns up to `limit` jobs a worker could claim now (see claim_ingestion_job), oldest first. Jobs waiting on Textract are the poller's."""
+        sql = f"SELECT * FROM ingestion_jobs WHERE stage <> 'textract_collect' AND {self._CLAIMABLE_JOB_CONDITION} ORDER BY id ASC LIMIT %s"
+        try: return self.execute_query(sql, (limit,), fetch_all=True) or []
+        except Error: return []
+
+    def claim_ingestion_job(self, job_id, stage, owner, lease_seconds):
+        """
+        Atomically marks a job 'running' for `owner` if it is still at `stage` and nobody else holds it, so a stage runs
+        in one process only even when several processes run workers. Returns True if this caller got the job.
+        """
+        sql = ("UPDATE ingestion_jobs SET status = 'running', claimed_by = %s, lease_expires_at = NOW() + INTERVAL %s SECOND"
+               " WHERE id = %s AND stage = %s AND (status IN ('queued', 'waiting') OR (status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < NOW())))")
+        try: return self.execute_query(sql, (owner, int(lease_seconds), job_id, stage)) == 1
+        except Error: return False
+
+    def get_ingestion_job_state_counts(self):
+        """[{status, stage, count}] of unfinished ingestion jobs (for /api/metrics); finished ones are not counted, the table keeps them all."""
+        sql = "SELECT status, stage, COUNT(*) AS count FROM ingestion_jobs WHERE status IN ('queued', 'running', 'waiting') GROUP BY status, stage"
+        try: return self.execute_query(sql, fetch_all=True) or []
+        except Error: return []
+
+    def finish_ingestion_jobs_for_invoice(self, invoice_id, status, last_error=None):
+        """Marks an invoice's ingestion jobs waiting on Textract as completed/failed (called by the Textract poller)."""
+        sql = "UPDATE ingestion_jobs SET status = %s, last_error = %s, next_run_at = NULL WHERE invoice_id = %s AND stage = 'textract_collect' AND status IN ('queued', 'running', 'waiting')"
+        try: return self.execute_query(sql, (status, last_error[:1000] if last_error else None, invoice_id)) >= 0
+        except Error: return False
+
+    # --- Worker leases (one holder per deployment, e.g. the Textract poller) ---
+    def acquire_worker_lease(self, name, owner, lease_seconds):
+        """
+        Takes or renews the lease `name` for `owner` if it is free, expired or already owner's. Returns True if owner holds it.
+        Assignments in ON DUPLICATE KEY UPDATE run left to right, so expires_at sees the owner just written.
+        """
+        sql = ("INSERT INTO worker_leases (name, owner, expires_at) VALUES (%s, %s, NOW() + INTERVAL %s SECOND) "
+               "ON DUPLICATE KEY UPDATE owner = IF(owner = VALUES(owner) OR expires_at < NOW(), VALUES(owner), owner), "
+               "expires_at = IF(owner = VALUES(owner), VALUES(expires_at), expires_at)")
+        try:
+            self.execute_query(sql, (name, owner, int(lease_seconds)))
+            row = self.execute_query("SELECT owner FROM worker_leases WHERE name = %s", (name,), fetch_one=True)
+            return bool(row) and row['owner'] == owner
+        except Error: return False
+
+    def get_worker_lease_owner(self, name):
+        """The owner of an unexpired lease, or None."""
+        try: row = self.execute_query("SELECT owner FROM worker_leases WHERE name = %s AND expires_at >= NOW()", (name,), fetch_one=True)
+        except Error: return None
+        return row['owner'] if row else None
+
+    def release_worker_lease(self, name, owner):
+        """Gives up a lease early (on shutdown) so another process can take it without waiting for it to expire."""
+        try: return self.execute_query("DELETE FROM worker_leases WHERE name = %s AND owner = %s", (name, owner)) > 0
+        except Error: return False
+
+    def get_invoices_processing_textract(self):
+        """Returns id, textract_job_id and age_seconds (since the row last changed, i.e. roughly since submission) of every invoice waiting on a Textract job."""
+        sql = ("SELECT id, textract_job_id, TIMESTAMPDIFF(SECOND, last_modified_timestamp, NOW()) AS age_seconds"
+               " FROM invoices WHERE status = 'processing_textract' AND textract_job_id IS NOT NULL")
+        try: return self.execute_query(sql, fetch_all=True) or []
+        except Error: return []
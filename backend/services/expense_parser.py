@@ -0,0 +1,188 @@
+# backend/services/expense_parser.py
+# Table-driven mapping of Textract AnalyzeExpense ExpenseDocuments to invoice fields (used by TextractService.parse_expense_data).
+import re
+import json
+import logging
+from functools import lru_cache
+from .textract_values import LocaleHint, parse_amount, parse_date
+from .invoice_search import line_item_text
+
+logger = logging.getLogger(__name__)
+
+_KEY_SEPARATORS = re.compile(r'[\s\.:\(\)#]')
+
+# Summary field -> normalized SummaryField type keys, highest priority first (see normalize_summary_key)
+SUMMARY_FIELD_ALIASES = {
+    "vendor_name": ('VENDOR_NAME', 'VENDOR', 'SUPPLIER_NAME', 'MERCHANT_NAME', 'ISSUED_BY_SIGNATURE'),
+    "invoice_id_number": ('INVOICE_NO', 'REFERENCE', 'INVOICE_RECEIPT_ID', 'RECEIPT_NUMBER', 'INVOICE_ID', 'DOCUMENT_NUMBER', 'INV_NO'),
+    "invoice_date": ('INVOICE_RECEIPT_DATE', 'ISSUE_DATE', 'EXPENSE_DATE', 'DATE', 'TRANSACTION_DATE', 'INVOICE_DATE'),
+    "due_date": ('DUE_DATE', 'PAYMENT_DUE_DATE'),
+    "total_amount": ('TOTAL_GBP', 'TOTAL_DUE_GBP', 'AMOUNT_£', 'TOTAL', 'AMOUNT_DUE', 'BALANCE_DUE', 'GRAND_TOTAL', 'NET_AMOUNT'),
+    "subtotal": ('SUBTOTAL', 'SUB_TOTAL'),
+    "tax": ('TAX', 'TOTAL_TAX_AMOUNT', 'VAT', 'GST'),
+    "currency": ('CURRENCY', 'CURRENCY_CODE'),
+}
+# Line item field -> LineItemExpenseField type keys (upper case, spaces as '_')
+LINE_ITEM_FIELD_ALIASES = {
+    "description": ('ITEM', 'DESCRIPTION', 'SERVICE', 'PRODUCT_NAME'),
+    "product_code": ('PRODUCT_CODE', 'SKU', 'ITEM_CODE'),
+    "amount": ('PRICE',),
+    "quantity": ('QUANTITY', 'QTY', 'UNITS'),
+    "unit_price": ('UNIT_PRICE',),
+}
+DATE_FIELDS = ("invoice_date", "due_date")
+SUMMARY_AMOUNT_FIELDS = {"total_amount": "TOTAL", "subtotal": "SUBTOTAL", "tax": "TAX"} # field -> name used in parse warnings
+LINE_ITEM_AMOUNT_FIELDS = {"amount": "Line Item PRICE", "quantity": "Line Item QTY", "unit_price": "Line Item UNIT_PRICE"}
+CURRENCY_MARKERS = (("GBP", ("gbp", "£")), ("USD", ("usd", "$")), ("EUR", ("eur", "€"))) # Checked in order on the total's key + value
+
+@lru_cache(maxsize=4096)
+def normalize_summary_key(field_type_text):
+    """'Invoice No.' -> 'INVOICE_NO': upper case, separators replaced by '_' (one '__' collapsed), outer '_' stripped."""
+    return _KEY_SEPARATORS.sub('_', field_type_text.upper()).replace('__', '_').strip('_')
+
+@lru_cache(maxsize=4096)
+def normalize_line_item_key(field_type_text):
+    return field_type_text.upper().replace(' ', '_')
+
+def parse_alias_overrides(value):
+    """
+    Parses TEXTRACT_FIELD_ALIASES: 'total_amount=AMOUNT_PAYABLE|TOTAL_INC_VAT;quantity=PCS' into {field: (keys...)}.
+    Keys are normalized like Textract's; unknown fields are logged and ignored.
+    """
+    if not value: return {}
+    if isinstance(value, dict): entries = value.items()
+    else: entries = (part.split('=', 1) for part in str(value).split(';') if '=' in part)
+    overrides = {}
+    for field, keys in entries:
+        field = field.strip()
+        if field not in SUMMARY_FIELD_ALIASES and field not in LINE_ITEM_FIELD_ALIASES:
+            logger.error(f"TEXTRACT_FIELD_ALIASES: Unknown field '{field}', ignored. Known: {', '.join(list(SUMMARY_FIELD_ALIASES) + list(LINE_ITEM_FIELD_ALIASES))}.")
+            continue
+        if isinstance(keys, str): keys = keys.split('|')
+        normalize = normalize_summary_key if field in SUMMARY_FIELD_ALIASES else normalize_line_item_key
+        overrides[field] = tuple(normalize(key.strip()) for key in keys if key.strip())
+    return overrides
+
+class ExpenseFieldMapper:
+    """
+    Maps an ExpenseDocument to invoice fields in one pass over its SummaryFields and line item fields, using lookup
+    tables built once from the alias lists (defaults above, plus configured extra aliases, which rank after the defaults).
+    For each field the highest priority alias present wins; of repeated types, the last value wins.
+    With locale_hints, each document's number/date conventions are inferred from its summary values (see LocaleHint).
+    """
+
+    def __init__(self, extra_aliases=None, locale_hints=False):
+        self.locale_hints = bool(locale_hints)
+        extra_aliases = parse_alias_overrides(extra_aliases)
+        self.summary_aliases = {field: keys + tuple(k for k in extra_aliases.get(field, ()) if k not in keys) for field, keys in SUMMARY_FIELD_ALIASES.items()}
+        self.line_item_aliases = {field: keys + tuple(k for k in extra_aliases.get(field, ()) if k not in keys) for field, keys in LINE_ITEM_FIELD_ALIASES.items()}
+        self._summary_lookup = {} # normalized key -> ((field, priority), ...)
+        for field, keys in self.summary_aliases.items():
+            for priority, key in enumerate(keys): self._summary_lookup.setdefault(key, []).append((field, priority))
+        self._summary_lookup = {key: tuple(targets) for key, targets in self._summary_lookup.items()}
+        self._line_item_lookup = {}
+        for field, keys in self.line_item_aliases.items():
+            for key in keys: self._line_item_lookup.setdefault(key, field)
+
+    @classmethod
+    def from_config(cls, app_config):
+        return cls(app_config.get('TEXTRACT_FIELD_ALIASES'), locale_hints=app_config.get('TEXTRACT_LOCALE_HINTS'))
+
+    def parse(self, expense_documents):
+        logger.info(f"Attempting to parse {len(expense_documents)} ExpenseDocument(s) using AnalyzeExpense structure.")
+        if not expense_documents or len(expense_documents) == 0:
+            logger.warning("No ExpenseDocuments received to parse.")
+            return {}
+        debug = logger.isEnabledFor(logging.DEBUG)
+        doc = expense_documents[0]
+        extracted_data = {
+            "vendor_name": None, "invoice_id_number": None, "invoice_date": None,
+            "due_date": None, "total_amount": None, "subtotal": None, "tax": None,
+            "currency": None, "line_items": [],
+            "parsed_data_detail": {"summary_fields_detected": {}, "errors": []},
+            "full_textract_response": doc
+        }
+        errors = extracted_data["parsed_data_detail"]["errors"]
+        locale = LocaleHint() if self.locale_hints else None
+
+        # --- Single pass over SummaryFields: best (priority, value, raw type) per field ---
+        summary_fields_raw = {}
+        raw_key_by_value = {} # Value -> first raw type holding it, for currency inference on the total's key
+        raw_keys_overwritten = False
+        best = {}
+        summary_lookup = self._summary_lookup
+        for field in doc.get('SummaryFields', []):
+            field_type_text = field.get('Type', {}).get('Text')
+            field_value_text = field.get('ValueDetection', {}).get('Text')
+            if not (field_type_text and field_value_text): continue
+            if field_type_text in summary_fields_raw and summary_fields_raw[field_type_text] != field_value_text: raw_keys_overwritten = True
+            summary_fields_raw[field_type_text] = field_value_text
+            raw_key_by_value.setdefault(field_value_text, field_type_text)
+            if locale is not None: locale.observe(field_value_text)
+            normalized_key = normalize_summary_key(field_type_text)
+            if debug: logger.debug(f"Raw SummaryField: Type='{field_type_text}' -> NormalizedKey='{normalized_key}', Value='{field_value_text}'")
+            for target, priority in summary_lookup.get(normalized_key, ()):
+                current = best.get(target)
+                if current is None or priority <= current[0]: best[target] = (priority, field_value_text)
+        extracted_data["parsed_data_detail"]["summary_fields_detected"] = summary_fields_raw
+        values = {target: value for target, (_, value) in best.items()}
+        if locale is not None: extracted_data["parsed_data_detail"]["locale_hint"] = locale.as_dict()
+
+        extracted_data["vendor_name"] = values.get("vendor_name")
+        extracted_data["invoice_id_number"] = values.get("invoice_id_number")
+        for date_field in DATE_FIELDS:
+            raw_date_str = values.get(date_field)
+            if not raw_date_str:
+                if debug: logger.debug(f"No candidate found for {date_field} in summary fields.")
+                continue
+            try:
+                extracted_data[date_field] = parse_date(raw_date_str, locale)
+                if debug: logger.debug(f"[DATE_PARSER_SUCCESS] Parsed {date_field}: {extracted_data[date_field]} from raw '{raw_date_str}'")
+            except Exception as e:
+                logger.warning(f"[DATE_PARSER_ERROR] For {date_field} from '{raw_date_str}': {e}")
+                errors.append(f"Date parsing error for {date_field.replace('_', ' ')}: {raw_date_str}")
+        for amount_field, log_name in SUMMARY_AMOUNT_FIELDS.items():
+            if values.get(amount_field): extracted_data[amount_field] = parse_amount(values[amount_field], log_name, locale)
+
+        raw_total_str = values.get("total_amount")
+        if raw_total_str:
+            if raw_keys_overwritten: matched_key = next((k_raw for k_raw, v_raw in summary_fields_raw.items() if v_raw == raw_total_str), None)
+            else: matched_key = raw_key_by_value.get(raw_total_str)
+            text_to_check_currency = ((matched_key or '') + raw_total_str).lower()
+            extracted_data["currency"] = next((code for code, markers in CURRENCY_MARKERS if any(m in text_to_check_currency for m in markers)), None)
+        if not extracted_data["currency"] and values.get("currency"): extracted_data["currency"] = values["currency"].strip().upper()
+
+        # --- Line items ---
+        line_item_lookup = self._line_item_lookup
+        parsed_line_items = []
+        line_item_groups = doc.get('LineItemGroups', [])
+        for group_idx, group in enumerate(line_item_groups):
+            for item_idx, line_item_obj in enumerate(group.get('LineItems', [])):
+                current_item_parsed = {"description": None, "quantity": None, "unit_price": None, "amount": None, "product_code": None, "raw_fields": []}
+                raw_fields = current_item_parsed["raw_fields"]
+                for field in line_item_obj.get('LineItemExpenseFields', []):
+                    item_field_value_obj = field.get('ValueDetection', {})
+                    item_field_type_text = field.get('Type', {}).get('Text')
+                    item_field_value_text = item_field_value_obj.get('Text')
+                    if not (item_field_type_text and item_field_value_text): continue
+                    raw_fields.append({"type": item_field_type_text, "value": item_field_value_text, "confidence": item_field_value_obj.get('Confidence')})
+                    target = line_item_lookup.get(normalize_line_item_key(item_field_type_text))
+                    if target is None: continue
+                    if target == "description":
+                        description = current_item_parsed["description"]
+                        current_item_parsed["description"] = (description + " " + item_field_value_text).strip() if description else item_field_value_text
+                    elif target in LINE_ITEM_AMOUNT_FIELDS: current_item_parsed[target] = parse_amount(item_field_value_text, LINE_ITEM_AMOUNT_FIELDS[target], locale)
+                    else: current_item_parsed[target] = item_field_value_text
+                if current_item_parsed["description"] or current_item_parsed["amount"] is not None or current_item_parsed["quantity"] is not None:
+                    parsed_line_items.append(current_item_parsed)
+                elif raw_fields and debug: logger.debug(f"Line item {item_idx} in group {group_idx} had only raw fields: {raw_fields}")
+        extracted_data["line_items"] = parsed_line_items
+        extracted_data["line_item_text"] = line_item_text(parsed_line_items) # Descriptions for full-text search
+        extracted_data["parsed_data_detail"]["line_item_groups_raw_count"] = len(line_item_groups)
+        logger.info(
+            f"Refined Parsed from AnalyzeExpense: Vendor='{extracted_data['vendor_name']}', "
+            f"Date='{extracted_data['invoice_date']}', Total='{extracted_data['total_amount']}', "
+            f"Inv#='{extracted_data['invoice_id_number']}', Currency='{extracted_data['currency']}', Items='{len(extracted_data['line_items'])}'"
+        )
+        if debug: logger.debug(f"Full Refined parsed expense data object: {json.dumps(extracted_data, default=str, indent=2)}")
+        return extracted_data
@@ -0,0 +1,309 @@
+# backend/services/ingestion_service.py
+import os
+import uuid
+import time
+import heapq
+import hashlib
+import queue
+import itertools
+import threading
+import socket
+import logging
+from datetime import datetime, timedelta
+from .throttle import TokenBucket
+from .tracing import background_trace
+
+logger = logging.getLogger(__name__)
+
+# Keys from TextractService.parse_expense_data that are handed to DbService.update_invoice_parsed_data
+PARSED_FIELDS_TO_PERSIST = [
+    'vendor_name',
+    'invoice_id_number',
+    'invoice_date',
+    'due_date',
+    'total_amount',
+    'currency',
+    'vendor_phone',
+    'vendor_address',
+    'line_item_text', # Line-item descriptions, searched by GET /api/invoices/search
+    'parsed_data_detail', # Stored compressed in invoice_documents as 'parsed_data'
+    'full_textract_response'
+]
+
+def persist_expense_documents(db_service, textract_service, invoice_id, expense_docs, expected_status=None):
+    """
+    Parses Textract ExpenseDocuments and stores the result on the invoice (status 'processed'). Returns True on success.
+    With `expected_status` nothing is stored unless the invoice still has that status (returns False).
+    """
+    logger.info(f"Parsing {len(expense_docs)} ExpenseDocument(s) from Textract for invoice ID {invoice_id}")
+    parsed_data = textract_service.parse_expense_data(expense_docs)
+    filtered_data = {k: v for k, v in parsed_data.items() if k in PARSED_FIELDS_TO_PERSIST}
+    return db_service.update_invoice_parsed_data(invoice_id=invoice_id, status='processed', expected_status=expected_status, **filtered_data)
+
+class StageError(Exception):
+    """Raised by a pipeline stage. Retryable errors are retried with backoff, others fail the job immediately."""
+    def __init__(self, message, retryable=True, invoice_status=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.invoice_status = invoice_status
+
+class IngestionService:
+    """
+    In-process background pipeline for uploaded invoices: spool file -> S3 upload -> Textract submission, after which the
+    job is handed to the TextractPoller for result collection (parse + DB update). Jobs are persisted in the `ingestion_jobs`
+    table, each stage is retried with exponential backoff, and Textract submissions are capped by a concurrency limit plus
+    a TPS token bucket.
+    Only processes that were start()ed run jobs; the others just record them. Started processes poll the table for due jobs
+    (new uploads from any process, retries, jobs of a process that died) and claim each one in the DB before running a
+    stage, so a stage never runs in two processes at once.
+    """
+
+    STAGE_FAILURE_STATUS = {
+        's3_upload': 's3_upload_failed',
+        'textract_submit': 'textract_submission_failed'
+    }
+
+    def __init__(self, app_config, db_service, s3_service, textract_service, textract_poller):
+        self.config = app_config
+        self.db_service = db_service
+        self.s3_service = s3_service
+        self.textract_service = textract_service
+        self.textract_poller = textract_poller
+        self.num_workers = max(1, int(self.config.get('INGEST_WORKERS', 4)))
+        self.max_attempts = max(1, int(self.config.get('INGEST_MAX_ATTEMPTS', 5)))
+        self.retry_base_seconds = float(self.config.get('INGEST_RETRY_BASE_SECONDS', 2))
+        self.spool_dir = self.config.get('INGEST_SPOOL_DIR') or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'ingest_spool')
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.deduplicate = bool(self.config.get('UPLOAD_DEDUPLICATION', True))
+        self.poll_seconds = max(0.5, float(self.config.get('INGEST_POLL_SECONDS', 5)))
+        self.lease_seconds = max(30, int(self.config.get('INGEST_JOB_LEASE_SECONDS', 600)))
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}" # ingestion_jobs.claimed_by
+
+        self._textract_slots = threading.BoundedSemaphore(max(1, int(self.config.get('TEXTRACT_MAX_CONCURRENT_SUBMISSIONS', 2))))
+        self._textract_bucket = TokenBucket(float(self.config.get('TEXTRACT_SUBMIT_TPS', 1)))
+        self._ready = queue.Queue()
+        self._delayed = [] # heap of (run_at, seq, job)
+        self._delayed_cond = threading.Condition()
+        self._seq = itertools.count()
+        self._local_job_ids = set() # Jobs in this process's queues, so polling doesn't enqueue them twice
+        self._last_poll = 0.0
+        self._threads = []
+        self._running = False
+        self._stats_lock = threading.Lock()
+        self._stats = {"in_flight": 0, "handed_off": 0, "failed": 0, "retries": 0, "duplicates": 0}
+
+    # --- Lifecycle ---
+    def start(self):
+        """Starts the worker pool and scheduler thread, then picks up the jobs that are due in the DB."""
+        if self._running: return
+        self._running = True
+        self._threads.append(threading.Thread(target=self._scheduler_loop, name="ingest-scheduler", daemon=True))
+        for i in range(self.num_workers):
+            self._threads.append(threading.Thread(target=self._worker_loop, name=f"ingest-worker-{i}", daemon=True))
+        for t in self._threads: t.start()
+        logger.info(f"IngestionService started with {self.num_workers} worker(s) as {self.worker_id}.") # The scheduler's first poll picks up due jobs
+
+    def stop(self, timeout=5):
+        """Stops workers after their current job. Unfinished jobs stay in the DB for the next started process."""
+        self._running = False
+        with self._delayed_cond: self._delayed_cond.notify_all()
+        for _ in range(self.num_workers): self._ready.put(None)
+        for t in self._threads: t.join(timeout)
+        self._threads = []
+
+    def resume_pending_jobs(self):
+        """
+        Enqueues the due jobs no live process holds: uploads recorded by processes that don't run workers, retries, and
+        jobs of a process that stopped (their claim lease expired). Called on start and every INGEST_POLL_SECONDS.
+        Jobs already waiting on Textract are picked up by the poller's own resync from the invoices table.
+        """
+        self._last_poll = time.monotonic()
+        with self._delayed_cond: local_job_ids = set(self._local_job_ids)
+        jobs = [job for job in self.db_service.get_claimable_ingestion_jobs() if job['id'] not in local_job_ids]
+        for job in jobs: self.enqueue(job)
+        if jobs: logger.info(f"IngestionService: Picked up {len(jobs)} ingestion job(s) from the DB.")
+
+    # --- Submission ---
+    def spool_file(self, file_obj, original_filename):
+        """Writes the uploaded file to the local spool directory. Returns (path, SHA-256 hex of the content)."""
+        _, file_extension = os.path.splitext(original_filename or '')
+        spool_path = os.path.join(self.spool_dir, f"{uuid.uuid4()}{file_extension.lower()}")
+        return spool_path, self._copy_to(getattr(file_obj, 'stream', file_obj), spool_path)
+
+    @staticmethod
+    def _copy_to(file_obj, path):
+        """Copies file_obj to path in 1 MB chunks, hashing each chunk on the way. Returns the SHA-256 hex digest."""
+        content_hash = hashlib.sha256()
+        with open(path, 'wb') as target:
+            for chunk in iter(lambda: file_obj.read(1024 * 1024), b''): content_hash.update(chunk); target.write(chunk)
+        return content_hash.hexdigest()
+
+    def submit_upload(self, file_obj, original_filename, content_type=None):
+        """
+        Persists an uploaded file and enqueues it for background processing. A file whose content was already ingested
+        (same SHA-256, invoice not failed) is not stored or processed again: the existing invoice is returned instead.
+        Returns {'invoice_id', 'job_id', 'duplicate', 'status'} or raises StageError if the upload could not be recorded.
+        """
+        spool_path, content_sha256 = self.spool_file(file_obj, original_filename)
+        existing = self.db_service.find_invoice_by_content_hash(content_sha256) if self.deduplicate else None
+        if existing:
+            self._remove_spool_file(spool_path)
+            with self._stats_lock: self._stats["duplicates"] += 1
+            logger.info(f"IngestionService: {original_filename} has the same content as invoice ID {existing['id']}; skipped S3 upload and Textract.")
+            return {"invoice_id": existing['id'], "job_id": None, "duplicate": True, "status": existing['status']}
+        invoice_record = self.db_service.create_invoice_record(original_filename=original_filename, status='pending_s3_upload', fetch_record=False,
+                                                               content_sha256=content_sha256 if self.deduplicate else None)
+        if not invoice_record:
+            self._remove_spool_file(spool_path)
+            existing = self.db_service.find_invoice_by_content_hash(content_sha256) if self.deduplicate else None # Lost the race to a concurrent upload
+            if existing:
+                with self._stats_lock: self._stats["duplicates"] += 1
+                return {"invoice_id": existing['id'], "job_id": None, "duplicate": True, "status": existing['status']}
+            raise StageError("Failed to create invoice record.", retryable=False)
+        invoice_id = invoice_record['id']
+        job_id = self.db_service.create_ingestion_job(invoice_id, original_filename, spool_path, content_type)
+        if not job_id:
+            self.db_service.update_invoice_status(invoice_id, status='error', error_message="Failed to create ingestion job.")
+            self._remove_spool_file(spool_path)
+            raise StageError("Failed to create ingestion job.", retryable=False)
+        self.enqueue({"id": job_id, "invoice_id": invoice_id, "stage": 's3_upload', "attempts": 0, "spool_path": spool_path,
+                      "original_filename": original_filename, "content_type": content_type, "s3_key": None, "textract_job_id": None})
+        logger.info(f"IngestionService: Queued invoice ID {invoice_id} ({original_filename}) as job {job_id}.")
+        return {"invoice_id": invoice_id, "job_id": job_id, "duplicate": False, "status": 'pending_s3_upload'}
+
+    def submit_uploaded(self, uploaded):
+        """
+        Enqueues invoices whose files are already in S3 (e.g. from a bulk upload) straight at the Textract stage.
+        :param uploaded: List of dicts with invoice_id, original_filename, content_type and s3_key.
+        :return: Number of jobs queued.
+        """
+        jobs = self.db_service.create_ingestion_jobs_bulk(uploaded, stage='textract_submit')
+        if jobs is None: raise StageError("Failed to create ingestion jobs for uploaded batch.", retryable=False)
+        for job in jobs: self.enqueue(job)
+        logger.info(f"IngestionService: Queued {len(jobs)} already uploaded invoice(s) for Textract submission.")
+        return len(jobs)
+
+    def enqueue(self, job, delay=0.0):
+        """Queues a job in this process. Without started workers it only stays in the DB, for a process that has them."""
+        if not self._running: return
+        with self._delayed_cond: self._local_job_ids.add(job['id'])
+        if delay and delay > 0:
+            with self._delayed_cond:
+                heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._seq), job))
+                self._delayed_cond.notify()
+        else:
+            self._ready.put(job)
+
+    def stats(self):
+        with self._stats_lock: counters = dict(self._stats)
+        with self._delayed_cond: delayed = len(self._delayed)
+        return {"workers": self.num_workers, "ready": self._ready.qsize(), "delayed": delayed, **counters}
+
+    # --- Worker machinery ---
+    def _scheduler_loop(self):
+        while self._running:
+            if time.monotonic() - self._last_poll >= self.poll_seconds:
+                try: self.resume_pending_jobs()
+                except Exception as e: logger.error(f"IngestionService: Polling for ingestion jobs failed: {e}", exc_info=True)
+            with self._delayed_cond:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, _, job = heapq.heappop(self._delayed); self._ready.put(job)
+                next_poll_in = self._last_poll + self.poll_seconds - now
+                timeout = min(self._delayed[0][0] - now, next_poll_in) if self._delayed else next_poll_in
+                self._delayed_cond.wait(max(0.0, timeout))
+
+    def _worker_loop(self):
+        while self._running:
+            job = self._ready.get()
+            if job is None: break
+            with self._delayed_cond: self._local_job_ids.discard(job['id']) # Re-added if the stage re-enqueues it
+            with self._stats_lock: self._stats["in_flight"] += 1
+            try:
+                with background_trace(f"ingest-{job.get('id')}", f"ingest {job.get('stage')}"): self._run_stage(job)
+            except Exception as e: logger.error(f"IngestionService: Unexpected error in job {job.get('id')}: {e}", exc_info=True)
+            finally:
+                with self._stats_lock: self._stats["in_flight"] -= 1
+
+    def _run_stage(self, job):
+        stage = job['stage']
+        handler = getattr(self, f"_stage_{stage}", None)
+        if handler is None:
+            self._fail(job, f"Unknown ingestion stage '{stage}'."); return
+        if not self.db_service.claim_ingestion_job(job['id'], stage, self.worker_id, self.lease_seconds):
+            logger.debug(f"IngestionService: Job {job['id']} stage '{stage}' is held by another worker or already done, skipped."); return
+        try:
+            handler(job)
+        except StageError as e:
+            if e.retryable: self._retry(job, str(e))
+            else: self._fail(job, str(e), invoice_status=e.invoice_status)
+        except Exception as e:
+            logger.error(f"IngestionService: Stage '{stage}' raised for job {job['id']}: {e}", exc_info=True)
+            self._retry(job, f"{type(e).__name__}: {e}")
+
+    def _advance(self, job, next_stage, delay=0.0):
+        job['stage'] = next_stage; job['attempts'] = 0
+        next_run_at = datetime.now() + timedelta(seconds=delay) if delay else None
+        self.db_service.update_ingestion_job(job['id'], stage=next_stage, status='waiting' if delay else 'queued', attempts=0,
+                                             spool_path=job.get('spool_path'), s3_key=job.get('s3_key'), textract_job_id=job.get('textract_job_id'),
+                                             last_error=None, next_run_at=next_run_at)
+        self.enqueue(job, delay=delay)
+
+    def _retry(self, job, error_message):
+        job['attempts'] = int(job.get('attempts') or 0) + 1
+        if job['attempts'] >= self.max_attempts:
+            self._fail(job, f"Giving up after {job['attempts']} attempt(s): {error_message}"); return
+        delay = self.retry_base_seconds * (2 ** (job['attempts'] - 1))
+        with self._stats_lock: self._stats["retries"] += 1
+        logger.warning(f"IngestionService: Job {job['id']} stage '{job['stage']}' attempt {job['attempts']} failed ({error_message}). Retrying in {delay:.1f}s.")
+        self.db_service.update_ingestion_job(job['id'], status='waiting', attempts=job['attempts'], last_error=error_message[:1000],
+                                             next_run_at=datetime.now() + timedelta(seconds=delay))
+        self.enqueue(job, delay=delay)
+
+    def _fail(self, job, error_message, invoice_status=None):
+        invoice_status = invoice_status or self.STAGE_FAILURE_STATUS.get(job['stage'], 'error')
+        logger.error(f"IngestionService: Job {job['id']} for invoice {job['invoice_id']} failed at stage '{job['stage']}': {error_message}")
+        self.db_service.update_ingestion_job(job['id'], status='failed', last_error=error_message[:1000], next_run_at=None)
+        self.db_service.update_invoice_status(job['invoice_id'], status=invoice_status, error_message=error_message[:250])
+        with self._stats_lock: self._stats["failed"] += 1
+
+    @staticmethod
+    def _remove_spool_file(spool_path):
+        try:
+            if spool_path and os.path.exists(spool_path): os.remove(spool_path)
+        except OSError as e: logger.warning(f"IngestionService: Could not remove spool file {spool_path}: {e}")
+
+    # --- Stages ---
+    def _stage_s3_upload(self, job):
+        spool_path = job.get('spool_path')
+        if not spool_path or not os.path.exists(spool_path):
+            raise StageError(f"Spooled upload file is missing: {spool_path}", retryable=False)
+        if not job.get('s3_key'):
+            # One key per job, recorded before the upload: a retry (or another worker after a crash) overwrites the same object instead of orphaning it
+            job['s3_key'] = f"invoices/{job['invoice_id']}/{job['id']}{os.path.splitext(job.get('original_filename') or '')[1].lower()}"
+            if not self.db_service.update_ingestion_job(job['id'], s3_key=job['s3_key']): job['s3_key'] = None; raise StageError("Failed to record the S3 key on the ingestion job")
+        with open(spool_path, 'rb') as spooled_file:
+            s3_object_key = self.s3_service.upload_file_obj(file_obj=spooled_file, object_name=job['original_filename'],
+                                                            content_type=job.get('content_type'), object_key=job['s3_key'])
+        if not s3_object_key: raise StageError("S3 upload failed")
+        if not self.db_service.update_invoice_s3_details(invoice_id=job['invoice_id'], s3_bucket=self.s3_service.bucket_name,
+                                                         s3_key=s3_object_key, status='pending_textract_submission'):
+            raise StageError("Failed to update DB with S3 details")
+        self._remove_spool_file(spool_path)
+        job['spool_path'] = None
+        self._advance(job, 'textract_submit')
+
+    def _stage_textract_submit(self, job):
+        with self._textract_slots:
+            self._textract_bucket.acquire()
+            # A stable token makes retried submissions idempotent on the Textract side
+            textract_job_id = self.textract_service.start_expense_analysis(
+                s3_object_key=job['s3_key'], client_request_token=f"invox-{job['invoice_id']}-{job['id']}", job_tag=f"InvoxAI-Invoice-{job['invoice_id']}")
+        if not textract_job_id: raise StageError("Failed to start Textract expense analysis job.")
+        if not self.db_service.update_invoice_status(job['invoice_id'], status='processing_textract', textract_job_id=textract_job_id):
+            raise StageError("Failed to update DB with Textract Job ID")
+        job['textract_job_id'] = textract_job_id
+        self.db_service.update_ingestion_job(job['id'], stage='textract_collect', status='waiting', attempts=0, textract_job_id=textract_job_id, last_error=None, next_run_at=None)
+        self.textract_poller.track(job['invoice_id'], textract_job_id)
+        with self._stats_lock: self._stats["handed_off"] += 1
+        logger.info(f"IngestionService: Job {job['id']} submitted to Textract (JobId {textract_job_id}), handed to TextractPoller.")
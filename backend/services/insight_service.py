@@ -0,0 +1,118 @@
+# backend/services/insight_service.py
+import json
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+class InsightError(Exception):
+    """Raised when an insight is neither stored nor could be generated. `details` carries the OpenAIService error string."""
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.details = details
+
+class InsightService:
+    """
+    Generated AI insights (e.g. the dashboard summary), persisted in ai_insights and keyed by a fingerprint of the exact
+    prompt messages + model parameters. While the underlying data is unchanged the prompt, and so the fingerprint, is
+    identical and the stored text is served without calling OpenAI.
+    With AI_INSIGHTS_STALE_WHILE_REVALIDATE on, a fingerprint miss returns the last good insight of that type (marked
+    stale) and regenerates it on a background thread instead of making the request wait for OpenAI.
+    """
+
+    def __init__(self, app_config, db_service, openai_service=None):
+        self.config = app_config
+        self.db_service = db_service
+        self.openai_service = openai_service
+        self.stale_while_revalidate = bool(self.config.get('AI_INSIGHTS_STALE_WHILE_REVALIDATE', False))
+        self.keep_per_type = max(1, int(self.config.get('AI_INSIGHTS_KEEP_PER_TYPE', 20)))
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="insight-refresh")
+        self._lock = threading.Lock()
+        self._in_flight = {} # fingerprint -> threading.Event, so concurrent misses share one OpenAI call
+        self._stats = {"hits": 0, "misses": 0, "stale_served": 0, "generated": 0, "generation_errors": 0}
+
+    def _count(self, name):
+        with self._lock: self._stats[name] += 1
+
+    def stats(self):
+        with self._lock: return {"stale_while_revalidate": self.stale_while_revalidate, "refreshing": len(self._in_flight), **self._stats}
+
+    @staticmethod
+    def fingerprint(messages, model_params):
+        """SHA-256 over the prompt messages and the model parameters that influence the output."""
+        canonical = json.dumps({"messages": messages, "params": model_params}, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _result(row, cached, stale=False):
+        created_at = row.get('created_at')
+        return {"content": row['content'], "fingerprint": row['fingerprint'], "model": row.get('model'), "cached": cached, "stale": stale,
+                "generated_at": created_at.isoformat() if hasattr(created_at, 'isoformat') else created_at}
+
+    def get_insight(self, insight_type, messages, model_params, force_refresh=False):
+        """
+        Returns the insight for this prompt, generating it only when no insight with the same fingerprint is stored.
+        :param model_params: Dict of OpenAIService.get_chat_completion keyword arguments (model, temperature, max_tokens).
+        :param force_refresh: Regenerate even if a stored insight matches.
+        :return: Dict with content, fingerprint, model, cached, stale and generated_at.
+        :raises InsightError: If nothing is stored and generation fails.
+        """
+        fingerprint = self.fingerprint(messages, model_params)
+        if not force_refresh:
+            row = self.db_service.get_ai_insight(insight_type, fingerprint)
+            if row: self._count("hits"); return self._result(row, cached=True)
+            self._count("misses")
+            if self.stale_while_revalidate:
+                latest = self.db_service.get_latest_ai_insight(insight_type)
+                if latest:
+                    self._refresh_in_background(insight_type, fingerprint, messages, model_params)
+                    self._count("stale_served")
+                    return self._result(latest, cached=True, stale=True)
+        return self._result(self._generate_once(insight_type, fingerprint, messages, model_params), cached=False)
+
+    def _generate_once(self, insight_type, fingerprint, messages, model_params):
+        """Generates and stores an insight; a caller arriving while the same fingerprint is in flight waits for that result."""
+        with self._lock:
+            event = self._in_flight.get(fingerprint)
+            owner = event is None
+            if owner: event = self._in_flight[fingerprint] = threading.Event()
+        if not owner:
+            event.wait(timeout=120)
+            row = self.db_service.get_ai_insight(insight_type, fingerprint)
+            if row: return row
+            raise InsightError("AI insight generation failed.")
+        try: return self._generate(insight_type, fingerprint, messages, model_params)
+        finally:
+            with self._lock: self._in_flight.pop(fingerprint, None)
+            event.set()
+
+    def _generate(self, insight_type, fingerprint, messages, model_params):
+        if not self.openai_service: raise InsightError("AI service not available.")
+        usage = {}; started_at = time.monotonic()
+        content = self.openai_service.get_chat_completion(messages, usage=usage, **model_params)
+        generation_ms = int((time.monotonic() - started_at) * 1000)
+        if not content or content.startswith("ERROR_") or "AI_ASSISTANT_EMPTY_REPLY" in content:
+            self._count("generation_errors")
+            logger.error(f"InsightService: '{insight_type}' generation failed: {content}")
+            raise InsightError("AI insight generation failed.", details=content)
+        self._count("generated")
+        logger.info(f"InsightService: Generated '{insight_type}' insight {fingerprint[:12]} in {generation_ms} ms ({usage.get('total_tokens', 'N/A')} tokens).")
+        if not self.db_service.save_ai_insight(insight_type, fingerprint, content, model=model_params.get('model'), prompt_tokens=usage.get('prompt_tokens'),
+                                               completion_tokens=usage.get('completion_tokens'), generation_ms=generation_ms, keep_per_type=self.keep_per_type):
+            logger.warning(f"InsightService: Could not store '{insight_type}' insight {fingerprint[:12]}, it will be regenerated next time.")
+        return {"content": content, "fingerprint": fingerprint, "model": model_params.get('model'), "created_at": datetime.now()}
+
+    def _refresh_in_background(self, insight_type, fingerprint, messages, model_params):
+        with self._lock:
+            if fingerprint in self._in_flight: return # Already being regenerated
+        def refresh():
+            try: self._generate_once(insight_type, fingerprint, messages, model_params)
+            except Exception as e: logger.error(f"InsightService: Background refresh of '{insight_type}' failed: {e}")
+        self._executor.submit(refresh)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
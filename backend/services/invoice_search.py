@@ -0,0 +1,40 @@
+# backend/services/invoice_search.py
+# Builds InnoDB FULLTEXT conditions for invoice text filters and GET /api/invoices/search (migration 010 adds the
+# indexes). A term is matched word by word as a prefix (BOOLEAN MODE '+word*'), so 'dell' finds 'Dell Technologies'
+# through the index instead of a LIKE '%dell%' scan. Words InnoDB does not index (shorter than innodb_ft_min_token_size,
+# or stopwords) can't be looked up that way; a term made only of such words falls back to LIKE. The index also can't
+# find a fragment inside a word ('soft' in 'Microsoft'), so callers rerun a filter that found nothing with fulltext=False.
+import re
+
+FT_MIN_TOKEN_SIZE = 3 # innodb_ft_min_token_size default; words shorter than this are not in the index
+# innodb_ft_default_stopword: never indexed, so '+the*' would match nothing
+INNODB_STOPWORDS = frozenset("a about an are as at be by com de en for from how i in is it la of on or that the this to was what when where who will with und www".split())
+SEARCH_COLUMNS = ('vendor_name', 'invoice_id_number', 'user_category', 'line_item_text') # ft_invoices_search, in index order
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+def indexed_words(text, min_token_size=FT_MIN_TOKEN_SIZE):
+    """Lower-cased words of `text` that the FULLTEXT index can find (boolean operators and punctuation dropped)."""
+    return [word for word in dict.fromkeys(_WORD.findall((text or '').lower())) if len(word) >= min_token_size and word not in INNODB_STOPWORDS]
+
+def boolean_query(words):
+    """'+dell* +tech*': every word required, each as a prefix."""
+    return " ".join(f"+{word}*" for word in words)
+
+def text_filter(column, term, min_token_size=FT_MIN_TOKEN_SIZE, fulltext=True):
+    """
+    WHERE clauses and params for "`column` contains `term`" (what LIKE '%term%' used to do). The MATCH narrows the rows
+    through the column's FULLTEXT index; the LIKE then keeps the old phrase semantics on those rows only.
+    The MATCH misses a fragment inside a word ('soft' in 'Microsoft'); `fulltext=False` gives the plain LIKE for that retry.
+    :return: ([clause, ...], [param, ...])
+    """
+    words = indexed_words(term, min_token_size)
+    like = ([f"`{column}` LIKE %s"], [f"%{term}%"])
+    if not words or not fulltext: return like
+    return [f"MATCH(`{column}`) AGAINST (%s IN BOOLEAN MODE)"] + like[0], [boolean_query(words)] + like[1]
+
+def line_item_text(line_items, max_length=8000):
+    """Distinct line-item descriptions joined into one searchable string (stored in invoices.line_item_text), or None."""
+    descriptions = dict.fromkeys(str(item.get('description')).strip() for item in (line_items or []) if isinstance(item, dict) and item.get('description'))
+    text = " | ".join(description for description in descriptions if description)
+    return text[:max_length] or None
@@ -0,0 +1,30 @@
+# backend/services/lazy_client.py
+import threading
+
+# One lock for every lazily built client: boto3's default session is not thread-safe to build clients from concurrently,
+# and an RLock lets one client factory use another.
+_construction_lock = threading.RLock()
+
+def lazy_client(factory):
+    """
+    Property decorator for SDK clients. `factory(self)` runs on first access (importing the SDK there, not at module
+    import) and its result is cached on the instance; a factory returning None is retried on the next access.
+    Assigning to the property replaces the client (used by tests and local stand-ins).
+    """
+    attribute = f"_{factory.__name__}"
+    def get_client(self):
+        client = self.__dict__.get(attribute)
+        if client is None:
+            with _construction_lock:
+                client = self.__dict__.get(attribute)
+                if client is None:
+                    client = factory(self)
+                    self.__dict__[attribute] = client
+        return client
+    def set_client(self, client):
+        self.__dict__[attribute] = client
+    return property(get_client, set_client, doc=factory.__doc__)
+
+def client_is_loaded(service, name):
+    """True if the lazy client `name` of `service` has been built (for health output and preloading)."""
+    return service.__dict__.get(f"_{name}") is not None
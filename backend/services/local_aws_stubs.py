@@ -0,0 +1,110 @@
+# backend/services/local_aws_stubs.py
+# Local stand-ins for S3Service and TextractService, enabled with USE_LOCAL_AWS_STUBS=true.
+# They let the upload/ingestion pipeline run end to end (dev machines, tests, demos) without AWS credentials.
+import os
+import uuid
+import json
+import time
+import shutil
+import logging
+import threading
+from .textract_service import TextractService
+from .expense_parser import ExpenseFieldMapper
+
+logger = logging.getLogger(__name__)
+
+class LocalS3Service:
+    """Stores objects under LOCAL_STORAGE_DIR/<bucket>/<key> with the same interface as S3Service."""
+
+    def __init__(self, app_config):
+        self.config = app_config
+        self.bucket_name = self.config.get('S3_BUCKET_NAME') or 'local-invox-bucket'
+        self.storage_dir = self.config.get('LOCAL_STORAGE_DIR') or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'local_storage')
+        os.makedirs(os.path.join(self.storage_dir, self.bucket_name), exist_ok=True)
+        logger.info(f"LocalS3Service initialized. Objects stored under {self.storage_dir}")
+
+    def _object_path(self, object_key, bucket_name=None):
+        return os.path.join(self.storage_dir, bucket_name or self.bucket_name, *object_key.split('/'))
+
+    def upload_file_obj(self, file_obj, object_name=None, folder='invoices', content_type=None, object_key=None):
+        if object_name is None: object_name = getattr(file_obj, 'filename', None) or 'upload'
+        _, file_extension = os.path.splitext(object_name)
+        s3_object_key = object_key or f"{folder.strip('/')}/{uuid.uuid4()}{file_extension}"
+        try:
+            target_path = self._object_path(s3_object_key)
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            file_obj.seek(0)
+            with open(target_path, 'wb') as target: shutil.copyfileobj(file_obj, target)
+            logger.info(f"[LOCAL_S3] File {object_name} stored at {self.bucket_name}/{s3_object_key}")
+            return s3_object_key
+        except Exception as e:
+            logger.error(f"[LOCAL_S3] Error storing {object_name}: {e}", exc_info=True)
+            return None
+
+    def get_presigned_url(self, object_key, expiration=3600, bucket_name=None):
+        return f"file://{self._object_path(object_key, bucket_name)}"
+
+    def delete_file_obj(self, object_key, bucket_name=None):
+        try:
+            os.remove(self._object_path(object_key, bucket_name))
+        except FileNotFoundError:
+            logger.warning(f"[LOCAL_S3] Object {object_key} not found, considered success.")
+        except Exception as e:
+            logger.error(f"[LOCAL_S3] Error deleting {object_key}: {e}", exc_info=True)
+            return False
+        return True
+
+class LocalTextractService(TextractService):
+    """
+    Fakes the asynchronous AnalyzeExpense API. Jobs report IN_PROGRESS for LOCAL_TEXTRACT_DELAY_SECONDS and then
+    SUCCEEDED with the ExpenseDocuments from LOCAL_TEXTRACT_FIXTURE (a recorded GetExpenseAnalysis JSON response),
+    or a minimal document if no fixture is configured. Parsing is inherited from TextractService unchanged.
+    """
+
+    def __init__(self, app_config):
+        self.config = app_config
+        self.s3_bucket_name = self.config.get('S3_BUCKET_NAME') or 'local-invox-bucket'
+        self.delay_seconds = float(self.config.get('LOCAL_TEXTRACT_DELAY_SECONDS', 2) or 0)
+        self.fixture_path = self.config.get('LOCAL_TEXTRACT_FIXTURE')
+        self.field_mapper = ExpenseFieldMapper.from_config(self.config)
+        self._jobs = {} # job_id -> (started_at, s3_object_key)
+        self._lock = threading.Lock()
+        logger.info(f"LocalTextractService initialized (delay={self.delay_seconds}s, fixture={self.fixture_path or 'built-in'}).")
+
+    def start_expense_analysis(self, s3_object_key, client_request_token=None, job_tag=None):
+        job_id = f"local-{uuid.uuid4()}"
+        with self._lock: self._jobs[job_id] = (time.monotonic(), s3_object_key)
+        logger.info(f"[LOCAL_TEXTRACT] Started fake expense analysis for {s3_object_key}. JobId: {job_id}")
+        return job_id
+
+    def _expense_documents(self, s3_object_key):
+        if self.fixture_path:
+            with open(self.fixture_path, 'r', encoding='utf-8') as fixture_file:
+                return json.load(fixture_file).get('ExpenseDocuments', [])
+        return [{
+            "ExpenseIndex": 1,
+            "SummaryFields": [
+                {"Type": {"Text": "VENDOR_NAME"}, "ValueDetection": {"Text": "Local Test Vendor"}},
+                {"Type": {"Text": "INVOICE_RECEIPT_ID"}, "ValueDetection": {"Text": os.path.basename(s3_object_key).split('.')[0][:12]}},
+                {"Type": {"Text": "INVOICE_RECEIPT_DATE"}, "ValueDetection": {"Text": time.strftime('%Y-%m-%d')}},
+                {"Type": {"Text": "TOTAL"}, "ValueDetection": {"Text": "$100.00"}}
+            ],
+            "LineItemGroups": [{"LineItemGroupIndex": 1, "LineItems": [{"LineItemExpenseFields": [
+                {"Type": {"Text": "ITEM"}, "ValueDetection": {"Text": "Local test item", "Confidence": 99.0}},
+                {"Type": {"Text": "PRICE"}, "ValueDetection": {"Text": "100.00", "Confidence": 99.0}}
+            ]}]}]
+        }]
+
+    def get_expense_analysis_results_page(self, job_id, max_results=100, next_token=None):
+        with self._lock: job = self._jobs.get(job_id)
+        if not job:
+            logger.warning(f"[LOCAL_TEXTRACT] Invalid JobId {job_id}.")
+            return None
+        started_at, s3_object_key = job
+        if time.monotonic() - started_at < self.delay_seconds:
+            return {'JobStatus': 'IN_PROGRESS'}
+        try:
+            return {'JobStatus': 'SUCCEEDED', 'ExpenseDocuments': self._expense_documents(s3_object_key), 'DocumentMetadata': {'Pages': 1}}
+        except Exception as e:
+            logger.error(f"[LOCAL_TEXTRACT] Could not load fixture for JobId {job_id}: {e}", exc_info=True)
+            return {'JobStatus': 'FAILED', 'StatusMessage': f"Local fixture error: {e}"}
@@ -0,0 +1,240 @@
+# backend/services/metrics.py
+# Prometheus metrics for GET /api/metrics: request latency per route, DB query counts and latency, S3/Textract call
+# latency, OpenAI latency and tokens per model (all fed by the tracing spans, see services/tracing.py), plus the
+# services' stats() counters, queue depths and cache hit ratios, and invoice / ingestion job states read at scrape time.
+# Hot-path updates never take a lock: every thread writes its own shard, and a scrape sums the shards.
+import re
+import time
+import bisect
+import logging
+import threading
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0) # Seconds
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# app.extensions name -> metric prefix for the numbers in its stats(). Keys listed in STATS_GAUGE_KEYS are current
+# values (gauges); every other number is a running count and is exported as a counter.
+SERVICE_STATS_PREFIXES = {
+    'ingestion_service': 'invox_ingestion', 'textract_poller': 'invox_textract_poller', 'bulk_upload_service': 'invox_bulk_upload',
+    'cache_service': 'invox_cache', 'insight_service': 'invox_ai_insights', 'nlu_service': 'invox_chat_nlu',
+    'report_service': 'invox_reports', 'pdf_render_service': 'invox_pdf_render', 'tracer': 'invox_tracing',
+}
+STATS_GAUGE_KEYS = {
+    'workers', 'ready', 'delayed', 'in_flight', 'tracked', 'due', 'lag_seconds', 'poll_budget_tokens', 'pending', 'max_pending',
+    'jobs_retained', 'avg_render_ms', 'entries', 'max_entries', 'hit_ratio', 'data_version', 'refreshing', 'cache_entries',
+    'known_vendors', 'heartbeat_seconds', 'sample_rate', 'slow_span_ms', 'pool_size', 'max_overflow', 'in_use', 'idle', 'open',
+}
+
+_METRIC_NAME = re.compile(r'[^a-zA-Z0-9_]')
+
+def parse_buckets(spec):
+    """'0.05,0.1,1' -> (0.05, 0.1, 1.0); empty means DEFAULT_LATENCY_BUCKETS."""
+    if not spec or not str(spec).strip(): return DEFAULT_LATENCY_BUCKETS
+    return tuple(sorted(float(bound) for bound in str(spec).split(',') if bound.strip()))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == float('inf'): return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsRegistry:
+    """
+    Counters and histograms keyed by (name, labels), where labels is a tuple of (name, value) pairs.
+    inc()/observe() only touch the calling thread's shard; a scrape sums all shards. Shards of threads that have
+    exited are folded into one retired shard at scrape time, so short-lived worker threads don't accumulate.
+    A scrape racing an update may see a histogram bucket one ahead of its count; the next scrape is consistent.
+    """
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._local = threading.local()
+        self._shards_lock = threading.Lock() # Taken once per thread (first update) and per scrape, never per update
+        self._shards = [] # (thread, shard)
+        self._retired = {}
+        self._metadata = {} # name -> (type, help)
+
+    def describe(self, name, metric_type, help_text):
+        self._metadata[name] = (metric_type, help_text)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock: self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def inc(self, name, labels=(), amount=1):
+        shard = self._shard(); key = (name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        shard = self._shard(); key = (name, labels)
+        series = shard.get(key)
+        if series is None: series = shard[key] = [0] * (len(self.buckets) + 3) # Per-bucket counts (+Inf last), sum, count
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value; series[-1] += 1
+
+    @staticmethod
+    def _merge(target, shard):
+        for key, value in shard.items():
+            if isinstance(value, list):
+                merged = target.get(key)
+                if merged is None: target[key] = list(value)
+                else:
+                    for index, count in enumerate(value): merged[index] += count
+            else: target[key] = target.get(key, 0) + value
+
+    def snapshot(self):
+        """{(name, labels): number or histogram list}, summed over all threads."""
+        with self._shards_lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive(): live.append((thread, shard))
+                else: self._merge(self._retired, shard)
+            self._shards = live
+            totals = {}
+            self._merge(totals, self._retired)
+        for _, shard in live: self._merge(totals, shard.copy())
+        return totals
+
+    def render(self, extra_families=()):
+        """
+        Prometheus text exposition of the registry plus `extra_families`: (name, type, help, [(labels, value)]) tuples
+        collected at scrape time (gauges, service counters).
+        """
+        families = {}
+        for (name, labels), value in self.snapshot().items(): families.setdefault(name, []).append((labels, value))
+        lines = []
+        for name in sorted(families):
+            metric_type, help_text = self._metadata.get(name, ('untyped', ''))
+            lines.append(f"# HELP {name} {help_text}"); lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in sorted(families[name], key=lambda item: item[0]):
+                if not isinstance(value, list): lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}"); continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), value):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', _format_value(float(bound))))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(float(value[-2]))}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+        for name, metric_type, help_text, samples in extra_families:
+            if not samples: continue
+            lines.append(f"# HELP {name} {help_text}"); lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples: lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+class MetricsService:
+    def __init__(self, app_config):
+        self.config = app_config
+        self.enabled = bool(self.config.get('METRICS_ENABLED', True))
+        self.bearer_token = self.config.get('METRICS_BEARER_TOKEN') or None
+        self.db_gauge_ttl = float(self.config.get('METRICS_DB_GAUGE_TTL_SECONDS', 15))
+        self.registry = MetricsRegistry(parse_buckets(self.config.get('METRICS_LATENCY_BUCKETS')))
+        self._db_gauges = (float('-inf'), []) # (collected at, families): scrapes within the TTL reuse the last DB read
+        self._db_gauges_lock = threading.Lock()
+        describe = self.registry.describe
+        describe('invox_http_request_duration_seconds', 'histogram', "HTTP request latency by route (time to the response headers for streamed responses).")
+        describe('invox_db_query_duration_seconds', 'histogram', "DbService query latency by operation (query, executemany, transaction), pool wait included.")
+        describe('invox_db_queries_total', 'counter', "DbService queries by operation.")
+        describe('invox_db_query_errors_total', 'counter', "DbService queries that raised a MySQL error, by operation.")
+        describe('invox_db_rows_total', 'counter', "Rows returned or affected by DbService queries, by operation.")
+        describe('invox_aws_call_duration_seconds', 'histogram', "S3 / Textract API call latency by operation (retries included).")
+        describe('invox_aws_call_errors_total', 'counter', "S3 / Textract API calls that failed, by operation.")
+        describe('invox_openai_request_duration_seconds', 'histogram', "OpenAI chat completion latency by model (whole stream for streamed completions).")
+        describe('invox_openai_requests_total', 'counter', "OpenAI chat completions by model and outcome.")
+        describe('invox_openai_tokens_total', 'counter', "OpenAI tokens by model and type (prompt, completion).")
+
+    def init_app(self, app):
+        if not self.enabled: return
+        from flask import request, g
+        tracing.add_span_listener(self.observe_span)
+
+        @app.before_request
+        def _start_request_timer():
+            g.metrics_started_at = time.perf_counter()
+
+        @app.after_request
+        def _observe_request(response):
+            started_at = g.pop('metrics_started_at', None)
+            if started_at is not None:
+                route = request.url_rule.rule if request.url_rule else 'unmatched' # Templates, not raw paths: label values stay bounded
+                self.registry.observe('invox_http_request_duration_seconds', time.perf_counter() - started_at,
+                                      (('method', request.method), ('route', route), ('status', str(response.status_code))))
+            return response
+
+    def observe_span(self, span):
+        """Span listener: turns finished tracing spans into DB / AWS / OpenAI metrics."""
+        seconds = span.duration_ms / 1000; attrs = span.attrs; inc = self.registry.inc
+        if span.kind == 'db':
+            labels = (('operation', span.name),)
+            self.registry.observe('invox_db_query_duration_seconds', seconds, labels); inc('invox_db_queries_total', labels)
+            if 'error' in attrs: inc('invox_db_query_errors_total', labels)
+            rows = attrs.get('rows')
+            if isinstance(rows, int) and rows > 0: inc('invox_db_rows_total', labels, rows)
+        elif span.kind == 'openai':
+            model = attrs.get('model') or 'unknown'
+            self.registry.observe('invox_openai_request_duration_seconds', seconds, (('model', model),))
+            inc('invox_openai_requests_total', (('model', model), ('outcome', 'error' if 'error' in attrs else ('cancelled' if attrs.get('cancelled') else 'ok'))))
+            for token_type in ('prompt', 'completion'):
+                tokens = attrs.get(f'{token_type}_tokens')
+                if isinstance(tokens, int) and tokens: inc('invox_openai_tokens_total', (('model', model), ('type', token_type)), tokens)
+        elif span.kind in ('s3', 'textract'):
+            labels = (('service', span.kind), ('operation', span.name))
+            self.registry.observe('invox_aws_call_duration_seconds', seconds, labels)
+            if 'error' in attrs: inc('invox_aws_call_errors_total', labels)
+
+    @staticmethod
+    def _stats_families(prefix, stats, labels=()):
+        families = []
+        for key, value in (stats or {}).items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)): continue
+            name = _METRIC_NAME.sub('_', f"{prefix}_{key}")
+            if key in STATS_GAUGE_KEYS: families.append((name, 'gauge', f"{key} from stats().", [(labels, value)]))
+            else: families.append((f"{name}_total", 'counter', f"{key} from stats().", [(labels, value)]))
+        return families
+
+    def _collect_db_gauges(self, db_service):
+        """Invoice statuses (from the rollup table) and ingestion job states; re-read at most every METRICS_DB_GAUGE_TTL_SECONDS."""
+        collected_at, families = self._db_gauges
+        if time.monotonic() - collected_at < self.db_gauge_ttl: return families
+        with self._db_gauges_lock:
+            collected_at, families = self._db_gauges
+            if time.monotonic() - collected_at < self.db_gauge_ttl: return families
+            families = []
+            status_counts = db_service.get_invoice_status_counts()
+            if status_counts: families.append(('invox_invoices', 'gauge', "Invoices by status (processing_textract = Textract jobs in flight).",
+                                               [((('status', status or 'none'),), count) for status, count in status_counts.items()]))
+            job_counts = db_service.get_ingestion_job_state_counts()
+            if job_counts: families.append(('invox_ingestion_jobs', 'gauge', "Ingestion jobs by status and stage.",
+                                            [((('status', row['status']), ('stage', row['stage'])), row['count']) for row in job_counts]))
+            self._db_gauges = (time.monotonic(), families)
+            return families
+
+    def render(self, extensions):
+        """The /api/metrics body. `extensions` is app.extensions (services are read, never required)."""
+        families = []
+        db_service = extensions.get('db_service')
+        if db_service is not None:
+            db_ok, _ = db_service.check_connection(max_age_seconds=self.db_gauge_ttl)
+            families.append(('invox_db_up', 'gauge', "1 if the last DB probe succeeded.", [((), int(db_ok))]))
+            families += self._stats_families('invox_db_pool', db_service.get_pool_stats())
+            if db_ok:
+                try: families += self._collect_db_gauges(db_service)
+                except Exception as e: logger.error(f"MetricsService: Could not read DB gauges: {e}", exc_info=True)
+        for extension_name, prefix in SERVICE_STATS_PREFIXES.items():
+            service = extensions.get(extension_name)
+            if service is None: continue
+            try: families += self._stats_families(prefix, service.stats())
+            except Exception as e: logger.error(f"MetricsService: stats() of {extension_name} failed: {e}")
+        return self.registry.render(families)
+
+    def stats(self):
+        return {"enabled": self.enabled, "series": len(self.registry.snapshot()), "threads": len(self.registry._shards)}
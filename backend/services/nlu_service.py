@@ -0,0 +1,203 @@
+# backend/services/nlu_service.py
+import re
+import time
+import logging
+import threading
+from calendar import monthrange
+from collections import OrderedDict
+from datetime import date, timedelta
+
+logger = logging.getLogger(__name__)
+
+MONTHS = {name: index for index, name in enumerate(['january', 'february', 'march', 'april', 'may', 'june', 'july', 'august', 'september', 'october', 'november', 'december'], start=1)}
+MONTHS.update({name[:3]: index for name, index in list(MONTHS.items())}); MONTHS['sept'] = 9
+_MONTH_ALT = "|".join(sorted(MONTHS, key=len, reverse=True))
+
+# Intent cue patterns, checked in this order (the first match wins)
+INTENT_PATTERNS = [
+    ('get_invoice_detail', re.compile(r"\b(?:details?|info(?:rmation)?|show|about|what(?:'s| is))\b.*\binvoice\s*(?:id\s*)?(?:#|no\.?|number)?\s*\d+\b|^invoice\s*(?:id\s*)?#?\s*\d+$")),
+    ('count_invoices', re.compile(r"\bhow many\b|\bcount\b|\bnumber of\b")),
+    ('get_total_spend', re.compile(r"\bhow much\b|\btotal\b|\bsum\b|\bspen[dt]\b|\bspending\b|\bexpenses?\b|\bpaid\b|\bcost\b")),
+    ('list_invoices', re.compile(r"\b(?:show|list|display|find|get|give me|which|what are|see)\b|\binvoices\b")),
+]
+INVOICE_ID_PATTERN = re.compile(r"\binvoice\s*(?:id\s*)?(?:#|no\.?|number)?\s*(\d+)\b")
+AMOUNT_PATTERN = re.compile(r"(?P<op>over|above|more than|greater than|exceeding|bigger than|larger than|>|under|below|less than|smaller than|<)\s*(?:\$|usd\s*|eur\s*|€|£)?\s*(?P<value>\d[\d,]*(?:\.\d+)?)\s*(?P<thousands>k\b)?(?:\s*(?:dollars|usd|euros?|eur))?")
+LIMIT_PATTERN = re.compile(r"\b(?:top|first|last|latest|(?:most )?recent)\s+(\d{1,3})\b(?! ?(?:days?|weeks?|months?|years?)\b)|\b(\d{1,3})\s+(?:most recent|latest|newest|biggest|largest)\b")
+STATUS_PATTERNS = [
+    ('processed', re.compile(r"\bprocessed\b")),
+    ('pending_textract', re.compile(r"\bpending\b|\bin progress\b|\bprocessing\b")),
+    ('error', re.compile(r"\bfailed\b|\berrors?\b|\berrored\b")),
+]
+SORT_PATTERNS = [ # amount_asc first: a bare 'sort by amount' means highest first
+    ('amount_asc', re.compile(r"\b(?:cheapest|smallest|lowest|least expensive)\b|\b(?:sort(?:ed)?|order(?:ed)?) by (?:the )?amount asc(?:ending)?\b")),
+    ('amount_desc', re.compile(r"\b(?:most expensive|biggest|largest|highest)\b|\b(?:sort(?:ed)?|order(?:ed)?) by (?:the )?amount(?: desc(?:ending)?| high(?:est)? to low(?:est)?)?\b")),
+    ('date_desc', re.compile(r"\b(?:latest|newest|most recent|recent)\b|\b(?:sort(?:ed)?|order(?:ed)?) by (?:the )?date\b")),
+]
+# Words that carry no meaning of their own; anything else left over after extraction lowers the confidence
+FILLER_WORDS = frozenset("""
+a an the i me my we our us you your is are was were be been do did does have has had can could would will please tell show list display find get
+give see what which whats how much many of for from with to on in at by and or all any invoice invoices bill bills total sum spend spent spending
+expense expenses paid pay cost costs count number there that this these those it its so far up vendor vendors supplier suppliers amount amounts
+dollars money overall altogether details detail info information about id no since during period between than
+""".split())
+
+class NluService:
+    """
+    Local rule-based NLU for the chat endpoint's common intents (get_total_spend, count_invoices, list_invoices,
+    get_invoice_detail). Produces the same intent/entities shape as the OpenAI NLU prompt in chat_routes, plus a
+    confidence; below NLU_LOCAL_MIN_CONFIDENCE the caller's fallback (the OpenAI NLU call) is used instead.
+    Results are kept in an LRU keyed by the normalised query (and today's date, since relative dates depend on it).
+    """
+
+    def __init__(self, app_config, db_service=None):
+        self.config = app_config
+        self.db_service = db_service
+        self.min_confidence = float(self.config.get('NLU_LOCAL_MIN_CONFIDENCE', 0.75))
+        self.cache_max_entries = max(0, int(self.config.get('NLU_CACHE_MAX_ENTRIES', 256)))
+        self.vendor_refresh_seconds = float(self.config.get('NLU_VENDOR_REFRESH_SECONDS', 300))
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._vendors = (); self._vendor_pattern = None; self._vendors_loaded_at = None
+        self._stats = {"cache_hits": 0, "local": 0, "fallback": 0}
+
+    def stats(self):
+        with self._lock: return {"cache_entries": len(self._cache), "known_vendors": len(self._vendors), **self._stats}
+
+    def _count(self, name):
+        with self._lock: self._stats[name] += 1
+
+    @staticmethod
+    def normalise_query(query):
+        return re.sub(r"\s+", " ", (query or "").lower().replace("’", "'")).strip(" ?!.")
+
+    # --- Known vendors ---
+    def _refresh_vendors(self):
+        """Reloads distinct vendor names (from the small rollup table) at most every NLU_VENDOR_REFRESH_SECONDS."""
+        if not self.db_service: return
+        if self._vendors_loaded_at is not None and time.monotonic() - self._vendors_loaded_at < self.vendor_refresh_seconds: return
+        vendors = self.db_service.get_known_vendor_names()
+        self._vendors_loaded_at = time.monotonic()
+        if vendors is None: return # Keep the previous list on DB errors
+        vendors = tuple(sorted({v.strip() for v in vendors if v and v.strip()}, key=len, reverse=True)) # Longest first: 'Dell Financial' before 'Dell'
+        if vendors == self._vendors: return
+        pattern = re.compile(r"(?<!\w)(" + "|".join(re.escape(v.lower()) for v in vendors) + r")(?!\w)") if vendors else None
+        with self._lock:
+            self._vendors, self._vendor_pattern = vendors, pattern
+            self._cache.clear() # Cached local parses may have missed a vendor that now exists
+        logger.info(f"NluService: Loaded {len(vendors)} known vendor name(s).")
+
+    # --- Entry point ---
+    def parse(self, query, fallback=None):
+        """
+        Returns an NLU result dict ({"intent", "entities", "confidence", "nlu_source"}).
+        :param fallback: Callable(query) -> NLU result, used when the local parse is not confident enough.
+        """
+        self._refresh_vendors()
+        normalised = self.normalise_query(query)
+        cache_key = (normalised, date.today().isoformat())
+        with self._lock:
+            cached = self._cache.get(cache_key)
+            if cached is not None: self._cache.move_to_end(cache_key); self._stats["cache_hits"] += 1
+        if cached is not None: return {**cached, "entities": dict(cached["entities"]), "nlu_source": "cache"}
+
+        result = self.parse_local(normalised)
+        if result["confidence"] >= self.min_confidence or fallback is None: self._count("local")
+        else:
+            logger.info(f"NluService: Local confidence {result['confidence']:.2f} below {self.min_confidence}, using fallback NLU.")
+            self._count("fallback")
+            result = {**fallback(query), "confidence": None, "nlu_source": "openai"}
+            if result.get("error"): return result # Never cache failed calls
+        with self._lock:
+            if self.cache_max_entries:
+                self._cache[cache_key] = result; self._cache.move_to_end(cache_key)
+                while len(self._cache) > self.cache_max_entries: self._cache.popitem(last=False)
+        return {**result, "entities": dict(result["entities"])}
+
+    # --- Local parser ---
+    def parse_local(self, text, today=None):
+        """Parses an already normalised query. Confidence is 0 without an intent cue and drops for every unexplained word."""
+        today = today or date.today()
+        entities = {}; consumed = []
+
+        def take(match, group=0):
+            consumed.append(match.span(group))
+
+        intent = None
+        for name, pattern in INTENT_PATTERNS:
+            if pattern.search(text): intent = name; break
+        if intent is None: return {"intent": "general_query", "entities": {}, "confidence": 0.0, "nlu_source": "local"}
+
+        if intent == 'get_invoice_detail':
+            match = INVOICE_ID_PATTERN.search(text)
+            entities["invoice_id"] = int(match.group(1)); take(match)
+        if self._vendor_pattern:
+            match = self._vendor_pattern.search(text)
+            if match:
+                entities["vendor_name"] = next((v for v in self._vendors if v.lower() == match.group(1)), match.group(1)); take(match)
+        for match in AMOUNT_PATTERN.finditer(text):
+            value = float(match.group('value').replace(',', '')) * (1000 if match.group('thousands') else 1)
+            op = '<' if match.group('op') in ('under', 'below', 'less than', 'smaller than', '<') else '>'
+            entities["amount_filter"] = {"operator": op, "value": value}; take(match)
+            break
+        for status, pattern in STATUS_PATTERNS:
+            match = pattern.search(text)
+            if match: entities["status"] = status; take(match); break
+        match = LIMIT_PATTERN.search(text)
+        if match: entities["limit_results"] = int(match.group(1) or match.group(2)); take(match)
+        for sort_by, pattern in SORT_PATTERNS:
+            match = pattern.search(text)
+            if match: entities["sort_by"] = sort_by; take(match); break
+        masked = list(text) # Dates are parsed with the spans above blanked out, so 'over 2000' is never read as a year
+        for start, end in consumed: masked[start:end] = " " * (end - start)
+        self._parse_dates("".join(masked), today, entities, take)
+        if intent == 'list_invoices' and "limit_results" not in entities: entities["limit_results"] = 5
+
+        leftover = text
+        for start, end in sorted(consumed, reverse=True): leftover = leftover[:start] + " " + leftover[end:]
+        unexplained = [word for word in re.findall(r"[a-z']+|\d+", leftover) if word not in FILLER_WORDS and word not in ("'s", "s")]
+        confidence = max(0.0, 1.0 - 0.3 * len(unexplained))
+        logger.debug(f"NluService: Local parse intent={intent} entities={entities} unexplained={unexplained} confidence={confidence:.2f}")
+        return {"intent": intent, "entities": entities, "confidence": round(confidence, 2), "nlu_source": "local"}
+
+    @staticmethod
+    def _month_end(year, month):
+        return date(year, month, monthrange(year, month)[1])
+
+    def _parse_dates(self, text, today, entities, take):
+        """Relative periods and month/year mentions, emitted as date_exact / date_range / month_year / year like the OpenAI NLU."""
+        def date_range(start, end): entities["date_range"] = {"start_date": start.isoformat(), "end_date": end.isoformat()}
+        quarter_start_month = 3 * ((today.month - 1) // 3) + 1
+
+        match = re.search(r"\b(today|yesterday)\b", text)
+        if match:
+            entities["date_exact"] = (today if match.group(1) == 'today' else today - timedelta(days=1)).isoformat(); take(match); return
+        match = re.search(r"\b(?:in the |over the )?(?:last|past|previous) (\d{1,3}) (day|week|month)s?\b", text)
+        if match:
+            count, unit = int(match.group(1)), match.group(2)
+            days = count * {'day': 1, 'week': 7, 'month': 30}[unit]
+            date_range(today - timedelta(days=days), today); take(match); return
+        match = re.search(r"\b(this|current|last|previous|past) (week|month|quarter|year)\b|\b(year to date|ytd|month to date|mtd)\b", text)
+        if match:
+            which, unit = match.group(1), match.group(2)
+            if match.group(3): which, unit = 'this', ('year' if match.group(3) in ('year to date', 'ytd') else 'month')
+            previous = which in ('last', 'previous', 'past')
+            if unit == 'week':
+                start = today - timedelta(days=today.weekday()) - timedelta(days=7 if previous else 0)
+                date_range(start, start + timedelta(days=6) if previous else today)
+            elif unit == 'month':
+                start = (today.replace(day=1) - timedelta(days=1)).replace(day=1) if previous else today.replace(day=1)
+                entities["month_year"] = start.strftime('%Y-%m')
+            elif unit == 'quarter':
+                start = date(today.year, quarter_start_month, 1)
+                if previous: start = date(start.year - 1, 10, 1) if start.month == 1 else date(start.year, start.month - 3, 1)
+                date_range(start, self._month_end(start.year, start.month + 2) if previous else today)
+            else:
+                entities["year"] = str(today.year - 1 if previous else today.year)
+            take(match); return
+        match = re.search(rf"\b(?:last |in |for |during )?({_MONTH_ALT})\.?(?:,? (\d{{4}}))?\b", text)
+        if match and not (match.group(1) == 'may' and not match.group(2) and not re.search(r"\b(?:in|for|during|last) may\b", text)): # 'may' is usually a verb
+            month = MONTHS[match.group(1)]
+            year = int(match.group(2)) if match.group(2) else (today.year if month <= today.month else today.year - 1) # Most recent such month
+            entities["month_year"] = f"{year:04d}-{month:02d}"; take(match); return
+        match = re.search(r"\b(?:in |for |during )?((?:19|20)\d{2})\b", text)
+        if match: entities["year"] = match.group(1); take(match)
@@ -1,11 +1,15 @@
 # backend/services/openai_service.py
-from openai import OpenAI 
-import httpx # Ensure httpx is imported
 import logging
 import json 
+from .lazy_client import lazy_client
+from .tracing import span as trace_span
 
 logger = logging.getLogger(__name__)
 
+class OpenAIStreamError(Exception):
+    """Raised by stream_chat_completion; the message is one of the ERROR_OPENAI_* strings get_chat_completion returns."""
+    pass
+
 class OpenAIService:
     def __init__(self, app_config):
         self.config = app_config
@@ -14,36 +18,46 @@ class OpenAIService:
         if not self.api_key or self.api_key == 'sk-YOUR_ACTUAL_OPENAI_API_KEY_HERE':
             logger.error("OpenAIService __init__: OPENAI_API_KEY not found or is placeholder in configuration.")
             raise ValueError("OpenAIService: OPENAI_API_KEY is required and valid but not configured.") 
-        
+
+    @lazy_client
+    def client(self):
+        """
+        The OpenAI client, built on first use: importing openai (and httpx, pydantic) is the largest part of app startup.
+        Returns None if it can't be built; callers already answer ERROR_OPENAI_CLIENT_NOT_INITIALIZED then.
+        """
         try:
-            logger.info("OpenAIService __init__: Attempting to create httpx.Client with proxy=None.")
+            from openai import OpenAI
+            import httpx
+            logger.info("OpenAIService: Attempting to create httpx.Client with proxy=None.")
             # *** THIS IS THE KEY CHANGE: proxy (singular) instead of proxies (plural) ***
             custom_http_client = httpx.Client(proxy=None) 
-            logger.info("OpenAIService __init__: httpx.Client(proxy=None) created successfully.")
+            logger.info("OpenAIService: httpx.Client(proxy=None) created successfully.")
             
-            self.client = OpenAI(
+            client = OpenAI(
                 api_key=self.api_key,
                 http_client=custom_http_client 
             )
-            logger.info("OpenAIService __init__: OpenAI client CREATED successfully using custom httpx client with proxy=None.")
+            logger.info("OpenAIService: OpenAI client CREATED successfully using custom httpx client with proxy=None.")
+            return client
         except TypeError as te: 
-            logger.error(f"OpenAIService __init__: TypeError during OpenAI client init: {te}", exc_info=True)
+            logger.error(f"OpenAIService: TypeError during OpenAI client init: {te}", exc_info=True)
             logger.error("This might indicate an issue with httpx version or OpenAI library's http_client compatibility.")
             # Fallback: Try initializing OpenAI client without explicit http_client
             # This relies on OpenAI library's internal httpx handling and unsetting proxy ENV VARS
-            logger.warning("OpenAIService __init__: Falling back to default OpenAI client initialization (ensure proxy ENV VARS are unset).")
+            logger.warning("OpenAIService: Falling back to default OpenAI client initialization (ensure proxy ENV VARS are unset).")
             try:
-                self.client = OpenAI(api_key=self.api_key)
-                logger.info("OpenAIService __init__: Fallback default OpenAI client CREATED successfully.")
+                client = OpenAI(api_key=self.api_key)
+                logger.info("OpenAIService: Fallback default OpenAI client CREATED successfully.")
+                return client
             except Exception as e_fallback:
-                logger.error(f"OpenAIService __init__: Fallback default OpenAI client init also FAILED: {e_fallback}", exc_info=True)
-                raise ValueError(f"OpenAIService: Failed to initialize OpenAI client (default and custom attempts failed) - {str(e_fallback)}")
+                logger.error(f"OpenAIService: Fallback default OpenAI client init also FAILED: {e_fallback}", exc_info=True)
+                return None
         except Exception as e:
-            logger.error(f"OpenAIService __init__: General failure to initialize OpenAI client: {e}", exc_info=True)
-            raise ValueError(f"OpenAIService: Failed to initialize OpenAI client - {str(e)}")
+            logger.error(f"OpenAIService: General failure to initialize OpenAI client: {e}", exc_info=True)
+            return None
 
-    def get_chat_completion(self, messages, model="gpt-3.5-turbo", temperature=0.7, max_tokens=1000):
-        # ... (rest of the get_chat_completion method remains THE SAME) ...
+    def get_chat_completion(self, messages, model="gpt-3.5-turbo", temperature=0.7, max_tokens=1000, usage=None):
+        # usage: optional dict, filled with prompt_tokens / completion_tokens / total_tokens when the API reports them
         logger.info("OpenAIService: Attempting get_chat_completion.")
         if not self.client:
             logger.error("OpenAIService: OpenAI client is not initialized in get_chat_completion.")
@@ -56,12 +70,15 @@ class OpenAIService:
             except Exception as log_e:
                 logger.warning(f"OpenAIService: Could not serialize messages for detailed logging: {log_e}")
                 logger.debug(f"OpenAIService: First user message content snippet: {next((m['content'] for m in messages if m['role'] == 'user'), 'N/A')[:100]}")
-            completion = self.client.chat.completions.create(model=model, messages=messages, temperature=temperature, max_tokens=max_tokens)
+            with trace_span('openai', 'chat.completions', model=model) as completion_span:
+                completion = self.client.chat.completions.create(model=model, messages=messages, temperature=temperature, max_tokens=max_tokens)
+                if completion.usage: completion_span.set(prompt_tokens=completion.usage.prompt_tokens, completion_tokens=completion.usage.completion_tokens)
             logger.debug(f"OpenAIService: Full OpenAI API response object: {completion.model_dump_json(indent=2)}")
             if completion.choices and len(completion.choices) > 0 and completion.choices[0].message:
                 assistant_reply = completion.choices[0].message.content; token_usage = completion.usage 
                 prompt_tokens = token_usage.prompt_tokens if token_usage else 'N/A'; completion_tokens = token_usage.completion_tokens if token_usage else 'N/A'; total_tokens = token_usage.total_tokens if token_usage else 'N/A'
                 logger.info(f"OpenAIService: Received reply from OpenAI. Tokens: Prompt={prompt_tokens}, Completion={completion_tokens}, Total={total_tokens}")
+                if usage is not None and token_usage: usage.update(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=total_tokens)
                 if assistant_reply and assistant_reply.strip():
                     logger.debug(f"OpenAIService: Assistant reply snippet: {assistant_reply.strip()[:200]}...")
                     return assistant_reply.strip()
@@ -73,15 +90,53 @@ class OpenAIService:
                 return "ERROR_OPENAI_NO_CHOICES: I'm sorry, I couldn't interpret the AI's response structure."
         except Exception as e: 
             logger.error(f"OpenAIService: Exception calling OpenAI chat completions API: {e}", exc_info=True)
-            error_message_lower = str(e).lower()
-            if "authentication" in error_message_lower: return "ERROR_OPENAI_AUTHENTICATION: OpenAI Authentication Error..."
-            elif "rate_limit_exceeded" in error_message_lower or "rate limit" in error_message_lower: return "ERROR_OPENAI_RATE_LIMIT: The AI assistant is too busy..."
-            elif "context_length_exceeded" in error_message_lower: return "ERROR_OPENAI_CONTEXT_TOO_LONG: Your request or the conversation is too long..."
-            elif "invalid_request_error" in error_message_lower: return f"ERROR_OPENAI_INVALID_REQUEST: Issue with the request to AI: {str(e)[:150]}"
-            return f"ERROR_OPENAI_API_CALL_FAILED: An error occurred with the AI assistant: {str(e)[:150]}"
+            return self._describe_api_error(e)
+
+    @staticmethod
+    def _describe_api_error(e):
+        """Maps an OpenAI client exception to the ERROR_OPENAI_* strings callers check for."""
+        error_message_lower = str(e).lower()
+        if "authentication" in error_message_lower: return "ERROR_OPENAI_AUTHENTICATION: OpenAI Authentication Error..."
+        elif "rate_limit_exceeded" in error_message_lower or "rate limit" in error_message_lower: return "ERROR_OPENAI_RATE_LIMIT: The AI assistant is too busy..."
+        elif "context_length_exceeded" in error_message_lower: return "ERROR_OPENAI_CONTEXT_TOO_LONG: Your request or the conversation is too long..."
+        elif "invalid_request_error" in error_message_lower: return f"ERROR_OPENAI_INVALID_REQUEST: Issue with the request to AI: {str(e)[:150]}"
+        return f"ERROR_OPENAI_API_CALL_FAILED: An error occurred with the AI assistant: {str(e)[:150]}"
+
+    def stream_chat_completion(self, messages, model="gpt-3.5-turbo", temperature=0.7, max_tokens=1000, usage=None):
+        """
+        Streaming variant of get_chat_completion: a generator yielding content deltas as OpenAI produces them.
+        Closing the generator (e.g. the client disconnected) closes the underlying HTTP stream, which stops generation.
+        :param usage: Optional dict, filled with token counts from the final chunk.
+        :raises OpenAIStreamError: With an ERROR_OPENAI_* message if the call fails.
+        """
+        if not self.client: raise OpenAIStreamError("ERROR_OPENAI_CLIENT_NOT_INITIALIZED")
+        logger.info(f"OpenAIService: Starting streamed completion. Model: {model}. Messages count: {len(messages)}.")
+        completion_span = trace_span('openai', 'chat.completions.stream', model=model).__enter__() # Ends when the stream does
+        try: stream = self.client.chat.completions.create(model=model, messages=messages, temperature=temperature, max_tokens=max_tokens,
+                                                          stream=True, stream_options={"include_usage": True})
+        except Exception as e:
+            logger.error(f"OpenAIService: Exception starting streamed completion: {e}", exc_info=True)
+            completion_span.set(error=type(e).__name__).finish()
+            raise OpenAIStreamError(self._describe_api_error(e)) from e
+        try:
+            for chunk in stream:
+                if chunk.usage:
+                    completion_span.set(prompt_tokens=chunk.usage.prompt_tokens, completion_tokens=chunk.usage.completion_tokens)
+                    if usage is not None: usage.update(prompt_tokens=chunk.usage.prompt_tokens, completion_tokens=chunk.usage.completion_tokens, total_tokens=chunk.usage.total_tokens)
+                if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content: yield chunk.choices[0].delta.content
+        except GeneratorExit:
+            logger.info("OpenAIService: Streamed completion cancelled by the consumer.")
+            completion_span.set(cancelled=True)
+            raise
+        except Exception as e:
+            logger.error(f"OpenAIService: Exception during streamed completion: {e}", exc_info=True)
+            completion_span.set(error=type(e).__name__)
+            raise OpenAIStreamError(self._describe_api_error(e)) from e
+        finally: stream.close(); completion_span.finish()
 
-    def build_prompt_with_context(self, user_query, invoice_context_str=""):
-        # ... (this method remains THE SAME) ...
+    @staticmethod
+    def build_prompt_with_context(user_query, invoice_context_str=""):
+        # Static so prompts can be built (and fingerprinted) without a configured client
         system_message = "You are InvoxAI..." # Keep your detailed system message
         messages = [{"role": "system", "content": system_message.strip()}]
         if invoice_context_str and invoice_context_str.strip() and "No specific invoice data found" not in invoice_context_str and "Database service is not available" not in invoice_context_str:
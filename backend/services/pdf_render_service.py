@@ -0,0 +1,253 @@
+# backend/services/pdf_render_service.py
+import html
+import time
+import uuid
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+REPORT_PDF_CSS = """
+@page { size: A4; margin: 1.5cm; @bottom-center { content: "Page " counter(page) " of " counter(pages); font-size: 9pt; color: #666;}}
+body { font-family: 'Times New Roman', Times, serif; font-size: 11pt; line-height: 1.5; color: #222; }
+h1, h2, h3, h4, h5, h6 { font-family: 'Arial Black', 'Arial Bold', Gadget, sans-serif; color: #1a3b5c; margin-top: 1.2em; margin-bottom: 0.6em; border-bottom: 1px solid #cccccc; padding-bottom: 0.2em; page-break-after: avoid; }
+h1 { font-size: 22pt; text-align: center; border-bottom: 2px solid #1a3b5c; margin-bottom: 1em;}
+h2 { font-size: 16pt; } h3 { font-size: 13pt; } h4 { font-size: 11pt; font-style: italic; border-bottom: none;}
+table { border-collapse: collapse; width: 100%; margin-bottom: 1.2em; page-break-inside: auto; }
+tr { page-break-inside: avoid; page-break-after: auto; }
+thead { display: table-header-group; }
+th, td { border: 1px solid #bfbfbf; padding: 7px; text-align: left; vertical-align: top; }
+th { background-color: #e9eff5; font-weight: bold; color: #1a3b5c;}
+p { margin-bottom: 0.8em; text-align: justify;}
+ul, ol { margin-bottom: 0.8em; padding-left: 25px; page-break-inside: auto; }
+li { margin-bottom: 0.3em; }
+strong, b { font-weight: bold; } em, i { font-style: italic; }
+a { color: #0066cc; text-decoration: none; } a:hover { text-decoration: underline; }
+pre { background-color: #f8f8f8; padding: 10px; border: 1px solid #eee; border-radius: 3px; overflow-x: auto; white-space: pre-wrap; word-wrap: break-word; font-family: 'Courier New', monospace; font-size: 9pt;}
+code { font-family: 'Courier New', monospace; background-color: #f0f0f0; padding: 1px 3px; border-radius: 2px;}
+blockquote { border-left: 3px solid #adb5bd; padding-left: 12px; color: #495057; margin-left: 0; font-style: italic;}
+"""
+
+MARKDOWN_EXTENSIONS = ['tables', 'fenced_code', 'sane_lists']
+
+class PdfRenderError(Exception):
+    """Raised when a PDF could not be rendered. `details` is safe to return to the client."""
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.details = details
+
+class PdfRenderBusyError(PdfRenderError):
+    """Raised when PDF_RENDER_MAX_PENDING renders are already queued; retry after `retry_after` seconds."""
+    def __init__(self, message, retry_after=5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+# --- Worker side: runs inside the pool processes (or the single render thread when PDF_RENDER_WORKERS=0) ---
+class WarmPdfRenderer:
+    """Keeps WeasyPrint's FontConfiguration, the compiled report stylesheet and the Markdown converter loaded between renders."""
+
+    def __init__(self, css_string=REPORT_PDF_CSS):
+        from weasyprint import HTML, CSS # Imported here so the web process never loads WeasyPrint's native libraries
+        try: from weasyprint.text.fonts import FontConfiguration # WeasyPrint >= 53
+        except ImportError: from weasyprint.fonts import FontConfiguration
+        self._html_class = HTML
+        self.font_config = FontConfiguration()
+        self.stylesheet = CSS(string=css_string, font_config=self.font_config)
+        import markdown
+        self.markdown = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+
+    def render(self, report_markdown, title):
+        """:return: Dict with pdf (bytes), pages and render_ms."""
+        started_at = time.perf_counter()
+        html_content = self.markdown.reset().convert(report_markdown)
+        html_doc = self._html_class(string=f"<html><head><meta charset='utf-8'><title>{html.escape(title or '')}</title></head><body>{html_content}</body></html>", base_url=".")
+        document = html_doc.render(stylesheets=[self.stylesheet], font_config=self.font_config)
+        pdf_bytes = document.write_pdf()
+        return {"pdf": pdf_bytes, "pages": len(document.pages), "render_ms": int((time.perf_counter() - started_at) * 1000)}
+
+_worker_renderer = None
+
+def _init_worker(css_string):
+    """Pool initializer: warms the renderer once per process. Failures surface on the first job instead of breaking the pool."""
+    global _worker_renderer
+    try: _worker_renderer = WarmPdfRenderer(css_string)
+    except Exception as e: logger.error(f"PDF render worker could not load WeasyPrint: {e}")
+
+def _render_in_worker(report_markdown, title):
+    global _worker_renderer
+    if _worker_renderer is None: _worker_renderer = WarmPdfRenderer()
+    return _worker_renderer.render(report_markdown, title)
+
+# --- Web process side ---
+class PdfRenderService:
+    """
+    Renders report PDFs off the request threads: a pool of PDF_RENDER_WORKERS warm renderer processes (0 = one
+    in-process render thread) behind a job API. At most PDF_RENDER_MAX_PENDING renders are queued or running at once;
+    further submissions are rejected with PdfRenderBusyError instead of piling up. Finished jobs (and their PDF bytes)
+    are kept for PDF_RENDER_JOB_TTL_SECONDS.
+    With a `job_store` (DbService: pdf_render_jobs table, migration 016) job state and PDFs are also written to the DB,
+    so any web process can answer the status and download requests, not only the one that accepted the job.
+    """
+
+    def __init__(self, app_config, job_store=None):
+        self.config = app_config
+        self.job_store = job_store
+        self.workers = max(0, int(self.config.get('PDF_RENDER_WORKERS', 2)))
+        self.max_pending = max(1, int(self.config.get('PDF_RENDER_MAX_PENDING', 8)))
+        self.job_ttl = float(self.config.get('PDF_RENDER_JOB_TTL_SECONDS', 600))
+        self.render_timeout = float(self.config.get('PDF_RENDER_TIMEOUT_SECONDS', 120))
+        self._executor = None # Created on first render, so app startup and CLI commands don't spawn processes
+        self._dispatcher = None # One thread per render slot: marks the job running, then waits on its render
+        self._executor_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._jobs = {} # job_id -> job dict (including the PDF bytes once done)
+        self._finished_events = {} # job_id -> threading.Event, for callers waiting on a render (see render())
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "pages_rendered": 0, "render_ms_total": 0}
+
+    def _get_executor(self):
+        """The render process pool, or None when PDF_RENDER_WORKERS=0 (the dispatcher thread renders itself)."""
+        with self._executor_lock:
+            if self._executor is None and self.workers:
+                # 'spawn' keeps the workers free of the web process's threads, sockets and connection pools
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                                     initializer=_init_worker, initargs=(REPORT_PDF_CSS,))
+                logger.info(f"PdfRenderService: Started {self.workers} render process(es).")
+            return self._executor
+
+    def _get_dispatcher(self):
+        with self._executor_lock:
+            if self._dispatcher is None: self._dispatcher = ThreadPoolExecutor(max_workers=max(1, self.workers), thread_name_prefix="pdf-render")
+            return self._dispatcher
+
+    def _reset_executor(self):
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None: executor.shutdown(wait=False)
+
+    @staticmethod
+    def describe_error(error):
+        """Client-facing details for a render failure."""
+        error_detail = str(error)
+        if isinstance(error, (ImportError, OSError)) or "DLL load failed" in error_detail or "library not found" in error_detail.lower() or "pangocffi" in error_detail or "_weasyprint_bindings" in error_detail:
+            return "A required system library for PDF generation is missing or WeasyPrint installation is incomplete. Please check WeasyPrint system dependencies (e.g., Pango, Cairo, CFFI related libs)."
+        return error_detail[:300]
+
+    def _prune(self):
+        """Drops finished jobs older than the TTL. Caller holds self._lock."""
+        cutoff = time.time() - self.job_ttl
+        for job_id in [job_id for job_id, job in self._jobs.items() if job['finished_at'] and job['finished_at'] < cutoff]:
+            del self._jobs[job_id]; self._finished_events.pop(job_id, None)
+
+    @staticmethod
+    def _public(job):
+        return {k: v for k, v in job.items() if k != 'pdf'}
+
+    def _store(self, method_name, *args, **kwargs):
+        """Calls a job_store method; a failing store only costs cross-process visibility, never the render."""
+        if self.job_store is None: return None
+        try: return getattr(self.job_store, method_name)(*args, **kwargs)
+        except Exception as e: logger.warning(f"PdfRenderService: Job store {method_name} failed: {e}"); return None
+
+    def submit(self, report_markdown, title, on_done=None, report_id=None):
+        """
+        Queues a render. on_done(pdf_bytes) is called from a render thread when it succeeds (e.g. to store the PDF).
+        :return: The job (without PDF bytes).
+        :raises PdfRenderBusyError: If max_pending renders are already queued or running.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock: self._stats["rejected"] += 1
+            raise PdfRenderBusyError(f"PDF renderer is busy ({self.max_pending} renders pending), try again shortly.")
+        job = {"job_id": uuid.uuid4().hex, "status": "queued", "title": title, "submitted_at": time.time(), "finished_at": None, "pages": None, "render_ms": None, "error": None, "pdf": None}
+        with self._lock:
+            self._prune(); self._jobs[job['job_id']] = job; self._finished_events[job['job_id']] = threading.Event(); self._stats["submitted"] += 1
+        self._store('delete_expired_pdf_jobs', self.job_ttl, self.job_ttl + self.render_timeout)
+        self._store('create_pdf_job', job['job_id'], title, report_id=report_id)
+        try: self._get_dispatcher().submit(self._run_job, job, report_markdown, title, on_done)
+        except Exception as e: self._finish_job(job, error=e) # Shut down
+        return self._public(job)
+
+    def _run_job(self, job, report_markdown, title, on_done):
+        with self._lock: job['status'] = "running"
+        self._store('set_pdf_job_status', job['job_id'], "running")
+        try:
+            executor = self._get_executor()
+            result = executor.submit(_render_in_worker, report_markdown, title).result() if executor else _render_in_worker(report_markdown, title)
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool): self._reset_executor() # Start a fresh pool next time
+            self._finish_job(job, error=e); return
+        self._finish_job(job, result=result)
+        if on_done:
+            try: on_done(result['pdf'])
+            except Exception as e: logger.error(f"PdfRenderService: on_done callback failed for job {job['job_id']}: {e}", exc_info=True)
+
+    def _finish_job(self, job, result=None, error=None):
+        with self._lock:
+            job['finished_at'] = time.time()
+            if error is not None:
+                job['status'] = "failed"; job['error'] = self.describe_error(error); self._stats["failed"] += 1
+                logger.error(f"PdfRenderService: Render job {job['job_id']} ('{job['title']}') failed: {error}")
+            else:
+                job.update(status="done", pdf=result['pdf'], pages=result['pages'], render_ms=result['render_ms'])
+                self._stats["completed"] += 1; self._stats["pages_rendered"] += result['pages']; self._stats["render_ms_total"] += result['render_ms']
+                logger.info(f"PdfRenderService: Rendered '{job['title']}' ({result['pages']} pages, {len(result['pdf'])} bytes) in {result['render_ms']} ms.")
+            finished_event = self._finished_events.pop(job['job_id'], None)
+        self._store('finish_pdf_job', job['job_id'], job['status'], pdf=job['pdf'], pages=job['pages'], render_ms=job['render_ms'], error=job['error'])
+        self._slots.release()
+        if finished_event: finished_event.set()
+
+    def add_finished_job(self, pdf_bytes, title, report_id=None):
+        """
+        Registers an already available PDF (e.g. from the report store) as a done job, so clients use one download flow.
+        With a report_id the stored job only references generated_reports.report_pdf instead of copying the bytes.
+        """
+        job = {"job_id": uuid.uuid4().hex, "status": "done", "title": title, "submitted_at": time.time(), "finished_at": time.time(), "pages": None, "render_ms": 0, "error": None, "pdf": pdf_bytes}
+        with self._lock: self._prune(); self._jobs[job['job_id']] = job
+        if self._store('create_pdf_job', job['job_id'], title, report_id=report_id, status="done") and report_id is None:
+            self._store('finish_pdf_job', job['job_id'], "done", pdf=pdf_bytes, render_ms=0)
+        return self._public(job)
+
+    def get_job(self, job_id):
+        """Returns the job status (without PDF bytes), or None if unknown or expired. Jobs of other processes come from the job store."""
+        with self._lock:
+            self._prune(); job = self._jobs.get(job_id)
+            if job: return self._public(job)
+        return self._store('get_pdf_job', job_id)
+
+    def get_job_pdf(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job: return job['pdf'] if job['status'] == "done" else None
+        return self._store('get_pdf_job_pdf', job_id)
+
+    def render(self, report_markdown, title, on_done=None):
+        """
+        Renders synchronously through the pool (the calling thread waits, the CPU work happens in a worker).
+        :return: PDF bytes.
+        :raises PdfRenderBusyError: If the renderer is saturated.
+        :raises PdfRenderError: If the render failed or took longer than PDF_RENDER_TIMEOUT_SECONDS.
+        """
+        job = self.submit(report_markdown, title, on_done=on_done)
+        with self._lock: finished_event = self._finished_events.get(job['job_id'])
+        if finished_event is not None and not finished_event.wait(self.render_timeout):
+            raise PdfRenderError("PDF rendering timed out.", details=f"Render job {job['job_id']} is still running; poll /api/reports/pdf-jobs/{job['job_id']}.")
+        finished = self.get_job(job['job_id'])
+        if not finished or finished['status'] != "done": raise PdfRenderError("Failed to render PDF.", details=(finished or {}).get('error'))
+        return self.get_job_pdf(job['job_id'])
+
+    def shutdown(self):
+        self._reset_executor()
+        with self._executor_lock: dispatcher, self._dispatcher = self._dispatcher, None
+        if dispatcher is not None: dispatcher.shutdown(wait=False)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._stats)
+            pending = sum(1 for job in self._jobs.values() if job['status'] == "queued"); running = sum(1 for job in self._jobs.values() if job['status'] == "running")
+            retained = len(self._jobs)
+        render_ms_total = counters.pop("render_ms_total")
+        return {"workers": self.workers, "max_pending": self.max_pending, "pending": pending, "running": running, "jobs_retained": retained, **counters,
+                "avg_render_ms": round(render_ms_total / counters["completed"]) if counters["completed"] else None}
@@ -0,0 +1,62 @@
+# backend/services/reparse.py
+# Re-applies the current expense parser to Textract responses already stored in invoice_documents (`flask invoices reparse`).
+# Everything here runs from the database copy: no S3 or Textract calls. reparse_rows runs in spawned worker processes.
+import os
+import json
+import time
+import logging
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from .expense_parser import ExpenseFieldMapper
+from .textract_documents import decode_document, encode_document, ENCODING_ZLIB_JSON
+
+_mapper = None # Per worker process, built by init_worker
+_compression_level = 6
+
+def init_worker(extra_aliases=None, locale_hints=False, compression_level=6):
+    """Pool initializer: builds the parser once per process with the app's TEXTRACT_* settings."""
+    global _mapper, _compression_level
+    for logger_name in ('backend.services.expense_parser', 'backend.services.textract_values'): # Per-document INFO/WARNING lines would flood the CLI
+        logging.getLogger(logger_name).setLevel(logging.ERROR)
+    _mapper = ExpenseFieldMapper(extra_aliases, locale_hints=locale_hints)
+    _compression_level = compression_level
+
+def reparse_rows(rows, columns):
+    """
+    Parses a batch of stored responses.
+    :param rows: [(invoice_id, encoding, compressed payload)] from DbService.get_stored_textract_page.
+    :param columns: Parser output keys to return per invoice.
+    :return: ([(invoice_id, {column: value} or None, parsed_data document row or None, error or None)], seconds spent).
+    """
+    started_at = time.perf_counter(); results = []
+    for invoice_id, encoding, payload in rows:
+        try:
+            parsed = _mapper.parse([decode_document(payload, encoding)])
+            blob, raw_size = encode_document(parsed.get('parsed_data_detail'), _compression_level)
+            results.append((invoice_id, {c: parsed.get(c) for c in columns}, (invoice_id, 'parsed_data', ENCODING_ZLIB_JSON, blob, raw_size, len(blob)), None))
+        except Exception as e: results.append((invoice_id, None, None, f"{type(e).__name__}: {str(e)[:200]}"))
+    return results, time.perf_counter() - started_at
+
+def _comparable(value):
+    """Puts DB values (date, DECIMAL(12,2)) and parser values ('YYYY-MM-DD', Decimal) on the same footing."""
+    if value is None or value == '': return None
+    if isinstance(value, date): return value.isoformat()
+    if isinstance(value, (Decimal, int, float)):
+        try: return Decimal(str(value)).quantize(Decimal('0.01'))
+        except InvalidOperation: return str(value)
+    return str(value)
+
+def changed_columns(current, values, columns):
+    """{column: (current value, re-parsed value)} for the columns whose value would change."""
+    return {c: (current.get(c), values.get(c)) for c in columns if _comparable(current.get(c)) != _comparable(values.get(c))}
+
+def load_checkpoint(path):
+    """The saved progress ({'last_id': ..., counters}) or None if there is no checkpoint file."""
+    if not path or not os.path.exists(path): return None
+    with open(path, 'r', encoding='utf-8') as checkpoint_file: return json.load(checkpoint_file)
+
+def save_checkpoint(path, state):
+    """Writes the checkpoint atomically, so an interrupted run never leaves a half-written file."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as checkpoint_file: json.dump(state, checkpoint_file, default=str)
+    os.replace(temp_path, path)
@@ -0,0 +1,204 @@
+# backend/services/report_service.py
+import re
+import json
+import hashlib
+import time
+import queue
+import logging
+import threading
+from .openai_service import OpenAIStreamError
+
+logger = logging.getLogger(__name__)
+
+_FENCE_LINE = re.compile(r"^```(?:markdown|md)?\s*$")
+_SECTION_HEADING = re.compile(r"^#{1,2} ") # New '#'/'##' heading starts a new streamed section
+
+class ReportGenerationError(Exception):
+    """Raised when OpenAI did not produce a report. `details` carries the ERROR_OPENAI_* string."""
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.details = details
+
+def clean_report_markdown(report_markdown):
+    """Strips the ```markdown fence models sometimes wrap the whole report in."""
+    lines = report_markdown.strip().splitlines()
+    if lines and _FENCE_LINE.match(lines[0].strip()): lines = lines[1:]
+    if lines and lines[-1].strip() == "```": lines = lines[:-1]
+    return "\n".join(lines).strip()
+
+class MarkdownSectionSplitter:
+    """Accumulates streamed Markdown and hands back complete sections (a heading plus its body) as soon as the next heading starts."""
+
+    def __init__(self):
+        self._partial_line = ""; self._section_lines = []; self._seen_content = False
+
+    def feed(self, delta):
+        """Returns the sections completed by this delta (usually none)."""
+        completed = []
+        lines = (self._partial_line + delta).split("\n")
+        self._partial_line = lines.pop()
+        for line in lines:
+            if not self._seen_content:
+                if not line.strip() or _FENCE_LINE.match(line.strip()): continue # Leading blank lines / opening fence
+                self._seen_content = True
+            if _SECTION_HEADING.match(line) and any(l.strip() for l in self._section_lines):
+                completed.append("\n".join(self._section_lines).strip("\n")); self._section_lines = []
+            self._section_lines.append(line)
+        return completed
+
+    def finish(self):
+        """Returns the last section (closing fence removed), or None."""
+        if self._partial_line: self._section_lines.append(self._partial_line); self._partial_line = ""
+        while self._section_lines and (not self._section_lines[-1].strip() or self._section_lines[-1].strip() == "```"): self._section_lines.pop()
+        section = "\n".join(self._section_lines).strip("\n"); self._section_lines = []
+        return section or None
+
+class ReportService:
+    """
+    Generates AI reports (blocking or streamed) and persists the final Markdown in generated_reports, so a report can
+    be fetched again or exported to PDF without another OpenAI call.
+    generated_reports is also the report store: a report saved with an artifact key (type, params, data version, prompt
+    version, model) is served again for the same request until an invoice write in its scope clears the key, and its
+    rendered PDF is kept next to the Markdown.
+    Streaming runs the OpenAI stream on a producer thread feeding a queue; the consumer (the HTTP response generator)
+    emits completed Markdown sections as they arrive and a heartbeat whenever the model is silent for
+    REPORT_STREAM_HEARTBEAT_SECONDS, so proxies don't time out the connection.
+    """
+
+    def __init__(self, app_config, db_service, openai_service=None):
+        self.config = app_config
+        self.db_service = db_service
+        self.openai_service = openai_service
+        self.heartbeat_seconds = max(1.0, float(self.config.get('REPORT_STREAM_HEARTBEAT_SECONDS', 10)))
+        self._stats_lock = threading.Lock()
+        self._stats = {"generated": 0, "streamed": 0, "cancelled": 0, "failed": 0, "store_hits": 0, "store_misses": 0, "pdf_hits": 0, "pdf_saved": 0}
+
+    def _count(self, name):
+        with self._stats_lock: self._stats[name] += 1
+
+    def stats(self):
+        with self._stats_lock: return {"heartbeat_seconds": self.heartbeat_seconds, **self._stats}
+
+    @staticmethod
+    def report_month(report_params):
+        """'YYYY-MM' for reports scoped to a month, None for all-time reports."""
+        year, month = (report_params or {}).get('year'), (report_params or {}).get('month')
+        return f"{int(year):04d}-{int(month):02d}" if year and month else None
+
+    def _save(self, report_type, report_params, report_markdown, model_params, usage, generation_ms, artifact_key=None):
+        report_id = self.db_service.save_generated_report(report_type, json.dumps(report_params, sort_keys=True, default=str), report_markdown,
+                                                          model=model_params.get('model'), prompt_tokens=usage.get('prompt_tokens'),
+                                                          completion_tokens=usage.get('completion_tokens'), generation_ms=generation_ms,
+                                                          artifact_key=artifact_key, report_month=self.report_month(report_params))
+        if report_id is None: logger.warning(f"ReportService: Could not persist {report_type} report, it will not be reusable.")
+        return report_id
+
+    def save_static_report(self, report_type, report_params, report_markdown, artifact_key=None):
+        """Persists a report that needed no AI generation (e.g. the 'no data' report). Returns the report id or None."""
+        return self._save(report_type, report_params, report_markdown, {}, {}, 0, artifact_key=artifact_key)
+
+    def get_report(self, report_id):
+        return self.db_service.get_generated_report(report_id)
+
+    # --- Report store ---
+    def artifact_key(self, report_type, report_params, prompt_version, model_params):
+        """
+        Store key for a report request: sha256 of type, params, the data version of the report's scope (its month, or all
+        invoices), the prompt version and the model settings. None if the data version can't be read (nothing is reused then).
+        """
+        data_version = self.db_service.get_report_data_version(self.report_month(report_params))
+        if data_version is None: return None
+        key_material = json.dumps({"type": report_type, "params": report_params, "data_version": data_version, "prompt_version": prompt_version,
+                                   "model_params": model_params}, sort_keys=True, default=str)
+        return hashlib.sha256(key_material.encode('utf-8')).hexdigest()
+
+    def find_stored(self, artifact_key):
+        """Returns the stored report for a key (see DbService.get_generated_report), or None."""
+        if not artifact_key: return None
+        report = self.db_service.find_report_artifact(artifact_key)
+        self._count("store_hits" if report else "store_misses")
+        if report: logger.info(f"ReportService: Serving stored {report['report_type']} report {report['id']}, no regeneration needed.")
+        return report
+
+    def get_pdf(self, report):
+        """Returns the stored PDF of a report (dict with id and has_pdf), or None if it has to be rendered."""
+        if not report.get('has_pdf'): return None
+        pdf_bytes = self.db_service.get_generated_report_pdf(report['id'])
+        if pdf_bytes is not None: self._count("pdf_hits")
+        return pdf_bytes
+
+    def save_pdf(self, report_id, pdf_bytes):
+        if report_id is not None and self.db_service.save_generated_report_pdf(report_id, pdf_bytes): self._count("pdf_saved")
+
+    # --- Blocking generation ---
+    def generate(self, report_type, report_params, messages, model_params, artifact_key=None):
+        """
+        Generates a report in one call and persists it (in the report store under `artifact_key`, if given).
+        :return: Dict with report_id and report_markdown.
+        :raises ReportGenerationError: If OpenAI returned an error or nothing.
+        """
+        if not self.openai_service: raise ReportGenerationError("AI service not available.")
+        usage = {}; started_at = time.monotonic()
+        report_markdown = self.openai_service.get_chat_completion(messages, usage=usage, **model_params)
+        if not report_markdown or report_markdown.startswith("ERROR_") or "AI_ASSISTANT_EMPTY_REPLY" in report_markdown:
+            self._count("failed"); raise ReportGenerationError("Failed to generate report content via AI.", details=report_markdown)
+        report_markdown = clean_report_markdown(report_markdown)
+        generation_ms = int((time.monotonic() - started_at) * 1000)
+        self._count("generated")
+        return {"report_id": self._save(report_type, report_params, report_markdown, model_params, usage, generation_ms, artifact_key=artifact_key), "report_markdown": report_markdown}
+
+    # --- Streaming generation ---
+    def _produce(self, messages, model_params, out_queue, stop_event, usage):
+        """Producer thread: forwards OpenAI deltas into the queue until done, failed or cancelled."""
+        try:
+            tokens = self.openai_service.stream_chat_completion(messages, usage=usage, **model_params)
+            try:
+                for delta in tokens:
+                    if stop_event.is_set(): logger.info("ReportService: Report stream cancelled, closing the OpenAI stream."); return
+                    out_queue.put(("delta", delta))
+            finally: tokens.close()
+            out_queue.put(("end", None))
+        except OpenAIStreamError as e: out_queue.put(("error", str(e)))
+        except Exception as e:
+            logger.error(f"ReportService: Unexpected error in report stream producer: {e}", exc_info=True)
+            out_queue.put(("error", f"ERROR_OPENAI_API_CALL_FAILED: {str(e)[:150]}"))
+
+    def stream(self, report_type, report_params, messages, model_params, artifact_key=None):
+        """
+        Generator of (event, data) tuples: started, section (repeated), heartbeat (while waiting), then done (with the
+        persisted report_id) or error. Closing the generator cancels the OpenAI stream.
+        """
+        if not self.openai_service: yield ("error", {"message": "AI service not available."}); return
+        out_queue = queue.Queue(); stop_event = threading.Event(); usage = {}
+        started_at = time.monotonic(); raw_parts = []; splitter = MarkdownSectionSplitter(); section_count = 0
+        producer = threading.Thread(target=self._produce, args=(messages, model_params, out_queue, stop_event, usage), name="report-stream", daemon=True)
+        producer.start()
+        finished = False
+        try:
+            yield ("started", {"report_type": report_type, "model": model_params.get('model')})
+            while True:
+                try: kind, payload = out_queue.get(timeout=self.heartbeat_seconds)
+                except queue.Empty:
+                    yield ("heartbeat", {"elapsed_ms": int((time.monotonic() - started_at) * 1000), "chars": sum(len(p) for p in raw_parts)}); continue
+                if kind == "delta":
+                    raw_parts.append(payload)
+                    for section in splitter.feed(payload):
+                        yield ("section", {"index": section_count, "markdown": section}); section_count += 1
+                elif kind == "error":
+                    self._count("failed"); finished = True
+                    yield ("error", {"message": "Failed to generate report content via AI.", "details": payload}); return
+                else: break
+            last_section = splitter.finish()
+            if last_section: yield ("section", {"index": section_count, "markdown": last_section}); section_count += 1
+            report_markdown = clean_report_markdown("".join(raw_parts))
+            finished = True
+            if not report_markdown:
+                self._count("failed"); yield ("error", {"message": "Failed to generate report content via AI.", "details": "AI_ASSISTANT_EMPTY_REPLY"}); return
+            generation_ms = int((time.monotonic() - started_at) * 1000)
+            report_id = self._save(report_type, report_params, report_markdown, model_params, usage, generation_ms, artifact_key=artifact_key)
+            self._count("streamed")
+            logger.info(f"ReportService: Streamed {report_type} report ({len(report_markdown)} chars, {section_count} sections) in {generation_ms} ms, id {report_id}.")
+            yield ("done", {"report_id": report_id, "report_markdown": report_markdown, "sections": section_count, "generation_ms": generation_ms, "usage": usage or None})
+        finally:
+            stop_event.set()
+            if not finished: self._count("cancelled"); logger.info(f"ReportService: {report_type} report stream closed by the client before completion.")
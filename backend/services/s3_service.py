@@ -1,9 +1,10 @@
 # backend/services/s3_service.py
-import boto3
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError, ClientError
 import os
 import uuid
 import logging
+from .lazy_client import lazy_client
+from .tracing import instrument_boto_client, span as trace_span
 
 logger = logging.getLogger(__name__)
 
@@ -19,19 +20,35 @@ class S3Service:
             logger.error("S3Service: AWS_REGION or S3_BUCKET_NAME not configured.")
             raise ValueError("S3Service: AWS_REGION or S3_BUCKET_NAME not configured.")
 
+        logger.info("S3Service initialized (boto3 client is created on first use).")
+
+    @lazy_client
+    def s3_client(self):
+        """The boto3 S3 client. Built on first use: importing boto3 and loading the S3 service model is slow, and many workers never upload."""
+        import boto3
+        from botocore.config import Config as BotoConfig
+        # One HTTP connection per concurrent transfer, otherwise bulk uploads queue on urllib3's default pool of 10
+        boto_config = BotoConfig(max_pool_connections=max(10, int(self.config.get('BULK_UPLOAD_MAX_WORKERS', 8) or 8)))
+
         if self.aws_access_key_id and self.aws_secret_access_key:
-            self.s3_client = boto3.client(
+            s3_client = boto3.client(
                 's3',
                 aws_access_key_id=self.aws_access_key_id,
                 aws_secret_access_key=self.aws_secret_access_key,
-                region_name=self.region_name
+                region_name=self.region_name,
+                config=boto_config
             )
-            logger.info("S3Service initialized with explicit credentials.")
+            logger.info("S3Service client created with explicit credentials.")
         else:
-            self.s3_client = boto3.client('s3', region_name=self.region_name)
-            logger.info("S3Service initialized (credentials will be sourced by boto3).")
+            s3_client = boto3.client('s3', region_name=self.region_name, config=boto_config)
+            logger.info("S3Service client created (credentials will be sourced by boto3).")
+        return instrument_boto_client(s3_client, 's3')
 
-    def upload_file_obj(self, file_obj, object_name=None, folder='invoices'):
+    def upload_file_obj(self, file_obj, object_name=None, folder='invoices', content_type=None, object_key=None):
+        """
+        Uploads a file-like object. The key is `<folder>/<uuid><ext>` unless a pre-generated `object_key` is given.
+        :return: The S3 object key, or None on error.
+        """
         if not self.bucket_name:
             logger.error("S3 bucket name not configured for upload.")
             return None
@@ -40,12 +57,12 @@ class S3Service:
             object_name = file_obj.filename
         
         _, file_extension = os.path.splitext(object_name)
-        s3_object_key = f"{folder.strip('/')}/{uuid.uuid4()}{file_extension}"
+        s3_object_key = object_key or f"{folder.strip('/')}/{uuid.uuid4()}{file_extension}"
 
         try:
             file_obj.seek(0)
             
-            content_type = file_obj.content_type
+            content_type = content_type or getattr(file_obj, 'content_type', None)
             if not content_type:
                 ext_lower = file_extension.lower()
                 if ext_lower in ['.png', '.jpg', '.jpeg', '.gif']:
@@ -56,12 +73,13 @@ class S3Service:
                     content_type = 'application/octet-stream'
             logger.debug(f"Uploading to S3 with ContentType: {content_type}")
 
-            self.s3_client.upload_fileobj(
-                file_obj,
-                self.bucket_name,
-                s3_object_key,
-                ExtraArgs={'ContentType': content_type}
-            )
+            with trace_span('s3', 'upload_fileobj', key=s3_object_key): # Its PutObject/multipart calls run on s3transfer threads, outside the trace
+                self.s3_client.upload_fileobj(
+                    file_obj,
+                    self.bucket_name,
+                    s3_object_key,
+                    ExtraArgs={'ContentType': content_type}
+                )
             logger.info(f"File {object_name} uploaded to {self.bucket_name}/{s3_object_key}")
             return s3_object_key
         except (NoCredentialsError, PartialCredentialsError) as e:
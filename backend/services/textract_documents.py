@@ -0,0 +1,44 @@
+# backend/services/textract_documents.py
+# Encoding helpers for the Textract payloads kept in the invoice_documents side table (out of the hot invoices row).
+import json
+import zlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+ENCODING_ZLIB_JSON = 'zlib+json'
+# Geometry keys AnalyzeExpense attaches to every field/block. Only what is in the retain-list survives pruning.
+GEOMETRY_KEYS = ('Geometry', 'BoundingBox', 'Polygon')
+
+def parse_retain_list(value):
+    """Parses a comma separated retain-list (e.g. 'BoundingBox') from config into a set of geometry key names."""
+    if not value: return frozenset()
+    if isinstance(value, (list, tuple, set, frozenset)): return frozenset(value)
+    return frozenset(part.strip() for part in str(value).split(',') if part.strip())
+
+def prune_geometry(obj, retain=frozenset()):
+    """
+    Returns a copy of a Textract response with geometry removed.
+    :param retain: Geometry keys to keep. Retaining 'BoundingBox' or 'Polygon' keeps a 'Geometry' object holding just those keys.
+    """
+    if isinstance(obj, list): return [prune_geometry(item, retain) for item in obj]
+    if not isinstance(obj, dict): return obj
+    pruned = {}
+    for key, value in obj.items():
+        if key == 'Geometry' and 'Geometry' not in retain:
+            kept = {k: v for k, v in value.items() if k in retain} if isinstance(value, dict) else None
+            if kept: pruned[key] = kept
+        elif key in ('BoundingBox', 'Polygon') and key not in retain and 'Geometry' not in retain: continue
+        else: pruned[key] = prune_geometry(value, retain)
+    return pruned
+
+def encode_document(payload, compression_level=6):
+    """Serializes a payload to compressed JSON. Returns (blob, raw_size)."""
+    raw = json.dumps(payload, default=str, separators=(',', ':')).encode('utf-8')
+    return zlib.compress(raw, compression_level), len(raw)
+
+def decode_document(blob, encoding=ENCODING_ZLIB_JSON):
+    """Inverse of encode_document. Plain JSON strings (legacy rows) are accepted as well."""
+    if blob is None: return None
+    if encoding == ENCODING_ZLIB_JSON: return json.loads(zlib.decompress(bytes(blob)).decode('utf-8'))
+    return json.loads(blob) if isinstance(blob, (str, bytes, bytearray)) else blob
@@ -0,0 +1,234 @@
+# backend/services/textract_poller.py
+import os
+import time
+import uuid
+import socket
+import heapq
+import random
+import itertools
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from .throttle import TokenBucket
+from .ingestion_service import persist_expense_documents
+from .tracing import background_trace
+
+logger = logging.getLogger(__name__)
+
+class TextractPoller:
+    """
+    Server-side collector for asynchronous Textract expense jobs.
+    Tracks every invoice in 'processing_textract', checks each job on its own exponential backoff schedule,
+    keeps all GetExpenseAnalysis calls under a global TPS budget and stores the parsed result when a job finishes.
+    Of all started pollers only the holder of the 'textract_poller' lease (worker_leases table) polls, so the budget
+    is per deployment; the others stand by and take over when the lease expires. Results are only stored while the
+    invoice is still in 'processing_textract', so a job is never finished twice.
+    """
+
+    LEASE_NAME = 'textract_poller'
+    PROCESSING_STATUS = 'processing_textract'
+
+    def __init__(self, app_config, db_service, textract_service):
+        self.config = app_config
+        self.db_service = db_service
+        self.textract_service = textract_service
+        self.initial_delay = float(self.config.get('TEXTRACT_POLL_INITIAL_DELAY_SECONDS', 5))
+        self.max_delay = float(self.config.get('TEXTRACT_POLL_MAX_DELAY_SECONDS', 60))
+        self.resync_seconds = float(self.config.get('TEXTRACT_POLL_RESYNC_SECONDS', 30))
+        self.lease_seconds = max(10.0, float(self.config.get('TEXTRACT_POLL_LEASE_SECONDS', 60)))
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}" # worker_leases.owner
+        self.batch_size = max(1, int(self.config.get('TEXTRACT_POLL_BATCH_SIZE', 10)))
+        self.max_checks = max(1, int(self.config.get('TEXTRACT_POLL_MAX_CHECKS', 120)))
+        self.max_age_seconds = float(self.config.get('TEXTRACT_POLL_MAX_AGE_SECONDS', 6 * 3600))
+        self._budget = TokenBucket(float(self.config.get('TEXTRACT_POLL_TPS', 2)))
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(self.config.get('TEXTRACT_POLL_CONCURRENCY', 4))), thread_name_prefix="textract-poll")
+        self._jobs = {} # invoice_id -> {"job_id", "checks", "due_at", "started_at"}; started_at is monotonic, backdated by the DB age on resync
+        self._heap = [] # (due_at, seq, invoice_id); stale entries are skipped
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._last_resync = 0.0
+        self._leader = False
+        self._lease_checked_at = float('-inf')
+        self._lease_owner = None; self._lease_owner_checked_at = float('-inf') # Cached for next_check_in() in processes that don't poll
+        self._stats = {"checks": 0, "completed": 0, "failed": 0, "errors": 0, "gave_up": 0}
+
+    # --- Lifecycle ---
+    def start(self):
+        if self._running: return
+        self._running = True
+        self._renew_lease()
+        self._thread = threading.Thread(target=self._loop, name="textract-poller", daemon=True); self._thread.start()
+        logger.info(f"TextractPoller started as {self.owner} ({'polling' if self._leader else 'standby, another process holds the lease'}), tracking {len(self._jobs)} job(s).")
+
+    def stop(self, timeout=5):
+        self._running = False
+        with self._cond: self._cond.notify_all()
+        if self._thread: self._thread.join(timeout)
+        self._executor.shutdown(wait=False)
+        if self._leader: self.db_service.release_worker_lease(self.LEASE_NAME, self.owner); self._leader = False
+
+    def _renew_lease(self):
+        """Takes or renews the poller lease; a new holder resyncs from the DB, one that lost it drops its schedule."""
+        self._lease_checked_at = time.monotonic()
+        leader = self.db_service.acquire_worker_lease(self.LEASE_NAME, self.owner, self.lease_seconds)
+        if leader and not self._leader:
+            self._leader = True; logger.info(f"TextractPoller: {self.owner} holds the poller lease, polling.")
+            self.resync_from_db()
+        elif not leader and self._leader:
+            self._leader = False; logger.warning(f"TextractPoller: {self.owner} lost the poller lease, standing by.")
+            with self._cond: self._jobs.clear(); self._heap.clear()
+
+    def resync_from_db(self):
+        """Starts tracking every invoice the DB says is in 'processing_textract' (covers restarts and manual submissions)."""
+        self._last_resync = time.monotonic()
+        for row in self.db_service.get_invoices_processing_textract():
+            self.track(row['id'], row['textract_job_id'], delay=0, age_seconds=row.get('age_seconds'))
+
+    # --- Tracking ---
+    def track(self, invoice_id, textract_job_id, delay=None, age_seconds=None):
+        """
+        Schedules status checks for a Textract job. Re-tracking an invoice keeps its current schedule.
+        :param age_seconds: How long ago the job was submitted (counts towards TEXTRACT_POLL_MAX_AGE_SECONDS).
+        Ignored unless this poller holds the lease: the holder finds the job on its next resync.
+        """
+        if not self._leader: return
+        with self._cond:
+            if invoice_id in self._jobs and self._jobs[invoice_id]["job_id"] == textract_job_id: return
+            due_at = time.monotonic() + (self.initial_delay if delay is None else delay)
+            self._jobs[invoice_id] = {"job_id": textract_job_id, "checks": 0, "due_at": due_at, "started_at": time.monotonic() - max(0.0, float(age_seconds or 0))}
+            heapq.heappush(self._heap, (due_at, next(self._seq), invoice_id))
+            self._cond.notify()
+
+    def untrack(self, invoice_id):
+        with self._cond: self._jobs.pop(invoice_id, None)
+
+    def next_check_in(self, invoice_id):
+        """
+        Seconds until the next scheduled check for an invoice (0 while a check is in flight). In a process that doesn't
+        poll, initial_delay if another process holds the poller lease (it will collect the job). None otherwise.
+        """
+        with self._cond: entry = self._jobs.get(invoice_id)
+        if entry: return 0.0 if entry["due_at"] == float('inf') else max(0.0, entry["due_at"] - time.monotonic())
+        if self._leader: return None
+        now = time.monotonic()
+        if now - self._lease_owner_checked_at >= self.lease_seconds / 3:
+            self._lease_owner = self.db_service.get_worker_lease_owner(self.LEASE_NAME); self._lease_owner_checked_at = now
+        return self.initial_delay if self._lease_owner not in (None, self.owner) else None
+
+    def stats(self):
+        """Queue depth and lag (how far behind schedule the most overdue check is) plus counters."""
+        now = time.monotonic()
+        with self._cond:
+            due = [entry["due_at"] for entry in self._jobs.values() if entry["due_at"] <= now]
+            counters = dict(self._stats)
+        return {"leader": self._leader, "tracked": len(self._jobs), "due": len(due), "lag_seconds": round(now - min(due), 3) if due else 0.0,
+                "poll_budget_tokens": round(self._budget.available(), 2), **counters}
+
+    # --- Scheduling loop ---
+    def _next_batch(self):
+        """Pops up to batch_size due jobs that fit in the current rate budget."""
+        batch = []; now = time.monotonic()
+        while self._heap and len(batch) < self.batch_size and self._heap[0][0] <= now:
+            due_at, _, invoice_id = self._heap[0]
+            entry = self._jobs.get(invoice_id)
+            if entry is None or entry["due_at"] != due_at: heapq.heappop(self._heap); continue # stale
+            if not self._budget.try_acquire(): break
+            heapq.heappop(self._heap)
+            entry["due_at"] = float('inf') # in flight
+            batch.append((invoice_id, entry["job_id"]))
+        return batch
+
+    def _loop(self):
+        while self._running:
+            if time.monotonic() - self._lease_checked_at >= self.lease_seconds / 3:
+                try: self._renew_lease()
+                except Exception as e: logger.error(f"TextractPoller: Lease renewal failed: {e}", exc_info=True)
+            if not self._leader:
+                with self._cond: self._cond.wait(self.lease_seconds / 3)
+                continue
+            if self.resync_seconds and time.monotonic() - self._last_resync > self.resync_seconds:
+                try: self.resync_from_db()
+                except Exception as e: logger.error(f"TextractPoller: Resync from DB failed: {e}", exc_info=True)
+            with self._cond:
+                batch = self._next_batch()
+                if not batch:
+                    if self._heap and self._heap[0][0] <= time.monotonic(): timeout = 1.0 / max(self._budget.rate, 0.1) # waiting on budget
+                    else: timeout = (self._heap[0][0] - time.monotonic()) if self._heap else None
+                    if self.resync_seconds: timeout = min(timeout, self.resync_seconds) if timeout is not None else self.resync_seconds
+                    timeout = min(timeout, self.lease_seconds / 3) if timeout is not None else self.lease_seconds / 3 # Renew before the lease runs out
+                    self._cond.wait(timeout); continue
+            for _ in self._executor.map(self._traced_check, batch): pass
+
+    def _reschedule(self, invoice_id, job_id):
+        with self._cond:
+            entry = self._jobs.get(invoice_id)
+            if entry is None or entry["job_id"] != job_id: return
+            entry["checks"] += 1
+            delay = min(self.max_delay, self.initial_delay * (2 ** min(entry["checks"], 10)))
+            entry["due_at"] = time.monotonic() + delay * random.uniform(0.9, 1.1) # jitter spreads checks out
+            heapq.heappush(self._heap, (entry["due_at"], next(self._seq), invoice_id))
+
+    def _retry_later(self, invoice_id, job_id, reason):
+        """Schedules the next check, or fails the invoice once the job has used up TEXTRACT_POLL_MAX_CHECKS or TEXTRACT_POLL_MAX_AGE_SECONDS."""
+        with self._cond:
+            entry = self._jobs.get(invoice_id)
+            if entry is None or entry["job_id"] != job_id: return
+            checks = entry["checks"] + 1; age = time.monotonic() - entry["started_at"]
+        if checks < self.max_checks and age < self.max_age_seconds:
+            self._reschedule(invoice_id, job_id); return
+        error_message = f"Gave up on Textract job after {checks} check(s) over {int(age)}s: {reason}"
+        logger.error(f"TextractPoller: Invoice {invoice_id}, job {job_id}: {error_message}")
+        self.db_service.update_invoice_status(invoice_id, status='textract_failed', error_message=error_message[:250], expected_status=self.PROCESSING_STATUS)
+        with self._cond: self._stats["gave_up"] += 1
+        self._finish(invoice_id, "failed", error_message)
+
+    def _finish(self, invoice_id, outcome, error_message=None):
+        self.untrack(invoice_id)
+        with self._cond: self._stats[outcome] += 1
+        self.db_service.finish_ingestion_jobs_for_invoice(invoice_id, 'completed' if outcome == 'completed' else 'failed', last_error=error_message)
+
+    def _traced_check(self, item):
+        invoice_id, job_id = item
+        with background_trace(f"textract-{invoice_id}", "textract check"): self._check(invoice_id, job_id)
+
+    def _check(self, invoice_id, job_id):
+        with self._cond: self._stats["checks"] += 1
+        try:
+            first_page = self.textract_service.get_expense_analysis_results_page(job_id)
+            if first_page is None:
+                raise RuntimeError("GetExpenseAnalysis returned no response")
+            job_status = first_page.get('JobStatus')
+            if job_status == 'IN_PROGRESS':
+                self._retry_later(invoice_id, job_id, "still IN_PROGRESS"); return
+            if job_status in ('SUCCEEDED', 'PARTIAL_SUCCESS'): # PARTIAL_SUCCESS is terminal too: store the pages Textract did analyse
+                textract_response = self.textract_service.get_all_expense_results_paginated(job_id, first_page=first_page, throttle=self._budget)
+                expense_docs = textract_response.get('ExpenseDocuments', [])
+                if not expense_docs:
+                    self.db_service.update_invoice_status(invoice_id, status='textract_failed', error_message=f"{job_status} with no ExpenseDocuments", expected_status=self.PROCESSING_STATUS)
+                    self._finish(invoice_id, "failed", f"{job_status} with no ExpenseDocuments"); return
+                try: stored = persist_expense_documents(self.db_service, self.textract_service, invoice_id, expense_docs, expected_status=self.PROCESSING_STATUS)
+                except Exception as e:
+                    logger.error(f"TextractPoller: Parsing failed for invoice {invoice_id}: {e}", exc_info=True)
+                    self.db_service.update_invoice_status(invoice_id, status='parsing_failed', error_message=f"Parsing/DB error: {str(e)[:200]}", expected_status=self.PROCESSING_STATUS)
+                    self._finish(invoice_id, "failed", str(e)); return
+                if stored and job_status == 'PARTIAL_SUCCESS': # Kept as 'processed', with what was missed in error_message
+                    partial_message = f"Textract PARTIAL_SUCCESS: {first_page.get('StatusMessage') or 'some pages were not analysed'}"
+                    logger.warning(f"TextractPoller: Invoice {invoice_id}: {partial_message}")
+                    self.db_service.update_invoice_status(invoice_id, status='processed', error_message=partial_message[:250], expected_status='processed')
+                if stored: logger.info(f"TextractPoller: Stored Textract Expense data for invoice ID {invoice_id}.")
+                elif (self.db_service.get_invoice_by_id(invoice_id) or {}).get('status') == 'processed':
+                    logger.info(f"TextractPoller: Invoice {invoice_id} was already stored by another collector, not storing it again.")
+                    self.untrack(invoice_id); return
+                self._finish(invoice_id, "completed" if stored else "failed", None if stored else "DB update failed after Textract"); return
+            if job_status == 'FAILED':
+                status_message = first_page.get('StatusMessage', "Textract job failed.")
+                self.db_service.update_invoice_status(invoice_id, status='textract_failed', error_message=status_message[:250], expected_status=self.PROCESSING_STATUS)
+                self._finish(invoice_id, "failed", status_message); return
+            logger.warning(f"TextractPoller: Unexpected status '{job_status}' for job {job_id} (invoice {invoice_id}), will retry.")
+            self._retry_later(invoice_id, job_id, f"unexpected status '{job_status}'")
+        except Exception as e:
+            with self._cond: self._stats["errors"] += 1
+            logger.error(f"TextractPoller: Error checking job {job_id} for invoice {invoice_id}: {e}", exc_info=True)
+            self._retry_later(invoice_id, job_id, f"{type(e).__name__}: {e}")
@@ -0,0 +1,140 @@
+# backend/services/textract_values.py
+# Amount and date normalisation for Textract field values. Common shapes ('1,234.56', '23,40', ISO and 'DD/MM/YYYY'
+# dates) take a fast path; everything else goes through the general rules (and dateutil for dates). Both paths give the
+# same results, and results are memoised per distinct string, since line items repeat the same quantities and prices.
+import re
+import logging
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from dateutil import parser as date_parser
+
+logger = logging.getLogger(__name__)
+
+CACHE_SIZE = 8192 # Distinct value strings remembered per parser (amounts and dates each)
+
+_NON_NUMERIC = re.compile(r'[^\d\.\-]')
+_PLAIN_AMOUNT = re.compile(r'-?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?') # 1234 / 1,234.56 / -12.5
+_DECIMAL_COMMA_AMOUNT = re.compile(r'-?\d{1,3}(?:\.\d{3})*,\d{1,2}|-?\d+,\d{1,2}') # 23,40 / 1.234,56
+_DOT_GROUPED_AMOUNT = re.compile(r'-?\d{1,3}(?:\.\d{3})+') # 1.234 (thousands, in a decimal-comma document)
+_COMMA_THOUSANDS_AMOUNT = re.compile(r'-?\d+,\d{3}') # 1,234 (a decimal, in a decimal-comma document)
+_ISO_DATE = re.compile(r'(\d{4})-(\d{2})-(\d{2})')
+_NUMERIC_DATE = re.compile(r'(\d{1,2})([/.-])(\d{1,2})\2(\d{4})')
+_DECIMAL_COMMA_EVIDENCE = re.compile(r'\d\.\d{3},\d{1,2}(?!\d)|(?<![\d.,])\d+,\d{2}(?![\d.,])')
+_DECIMAL_POINT_EVIDENCE = re.compile(r'\d,\d{3}\.\d{1,2}(?!\d)|(?<![\d.,])\d+\.\d{2}(?![\d.,])')
+
+class LocaleHint:
+    """
+    Number and date conventions of one document, inferred from its unambiguous values (e.g. '1.234,56' means decimal
+    comma, '25/12/2024' means day first). Only used when TEXTRACT_LOCALE_HINTS is on; it then decides ambiguous values
+    ('1.234', '03/04/2024') that the default rules read one fixed way. None means no (or conflicting) evidence.
+    """
+
+    def __init__(self, decimal_comma=None, dayfirst=None):
+        self.decimal_comma = decimal_comma
+        self.dayfirst = dayfirst
+        self._evidence = {"decimal_comma": set(), "dayfirst": set()}
+
+    def observe(self, value_text):
+        """Records what a raw field value says about the document's conventions."""
+        if not value_text: return
+        if _DECIMAL_COMMA_EVIDENCE.search(value_text): self._evidence["decimal_comma"].add(True)
+        if _DECIMAL_POINT_EVIDENCE.search(value_text): self._evidence["decimal_comma"].add(False)
+        numeric_date = _NUMERIC_DATE.fullmatch(value_text.strip())
+        if numeric_date:
+            first, second = int(numeric_date.group(1)), int(numeric_date.group(3))
+            if first > 12 >= second: self._evidence["dayfirst"].add(True)
+            elif second > 12 >= first: self._evidence["dayfirst"].add(False)
+        for name, seen in self._evidence.items():
+            if len(seen) == 1: setattr(self, name, next(iter(seen)))
+            elif len(seen) > 1: setattr(self, name, None)
+
+    def as_dict(self):
+        return {"decimal_comma": self.decimal_comma, "dayfirst": self.dayfirst}
+
+def clean_amount_text(cleaned_val):
+    """
+    The general amount rules (no fast path, no memo), applied to a value without currency symbols: the right-most of
+    ',' / '.' is the decimal separator, a lone ',' followed by 3 digits groups thousands, '(x)' is negative.
+    Returns the text to hand to Decimal; '', '-' or '.' mean no amount.
+    """
+    if ',' in cleaned_val and '.' in cleaned_val:
+        if cleaned_val.rfind(',') > cleaned_val.rfind('.'): cleaned_val = cleaned_val.replace('.', '').replace(',', '.')
+        else: cleaned_val = cleaned_val.replace(',', '')
+    elif ',' in cleaned_val:
+        if cleaned_val.count(',') == 1 and len(cleaned_val.split(',')[-1]) != 3: cleaned_val = cleaned_val.replace(',', '.')
+        else: cleaned_val = cleaned_val.replace(',', '')
+    if cleaned_val.startswith('(') and cleaned_val.endswith(')'): cleaned_val = '-' + cleaned_val[1:-1]
+    cleaned_val = _NON_NUMERIC.sub('', cleaned_val)
+    if cleaned_val.count('.') > 1:
+        first_dot_index = cleaned_val.find('.')
+        cleaned_val = cleaned_val[:first_dot_index+1] + cleaned_val[first_dot_index+1:].replace('.', '')
+    return cleaned_val
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _normalize_amount(value_text, decimal_comma):
+    """(Decimal or None, error kind or None, cleaned text, error message) for one amount string."""
+    cleaned_val = value_text
+    try:
+        cleaned_val = value_text.replace('$', '').replace('£', '').replace('€', '').strip()
+        if decimal_comma:
+            if _DOT_GROUPED_AMOUNT.fullmatch(cleaned_val): return Decimal(cleaned_val.replace('.', '')), None, cleaned_val, None
+            if _COMMA_THOUSANDS_AMOUNT.fullmatch(cleaned_val): return Decimal(cleaned_val.replace(',', '.')), None, cleaned_val, None
+        if _PLAIN_AMOUNT.fullmatch(cleaned_val): return Decimal(cleaned_val.replace(',', '')), None, cleaned_val, None
+        if _DECIMAL_COMMA_AMOUNT.fullmatch(cleaned_val): return Decimal(cleaned_val.replace('.', '').replace(',', '.')), None, cleaned_val, None
+        cleaned_val = clean_amount_text(cleaned_val)
+        return (Decimal(cleaned_val) if cleaned_val not in ('', '-', '.') else None), None, cleaned_val, None
+    except InvalidOperation: return None, "invalid", cleaned_val, None
+    except Exception as e: return None, "unexpected", cleaned_val, str(e)
+
+def parse_amount(value_text, field_name_for_log="amount", locale=None):
+    """
+    Parses a Textract money/quantity string ('$1,234.56', '1.234,56', '(12.00)') into a Decimal.
+    :param locale: Optional LocaleHint of the document; with decimal_comma set, '1.234' reads as 1234 and '1,234' as 1.234.
+    :return: Decimal, or None if the value is empty or unparseable (a warning is logged).
+    """
+    if not value_text: return None
+    try: value, error, cleaned_val, message = _normalize_amount(value_text, bool(locale and locale.decimal_comma))
+    except TypeError: value, error, cleaned_val, message = _normalize_amount.__wrapped__(value_text, bool(locale and locale.decimal_comma)) # Unhashable input
+    if error == "invalid": logger.warning(f"[PARSER_DECIMAL_ERROR] Could not parse {field_name_for_log} from '{value_text}' (cleaned: '{cleaned_val}') to Decimal due to InvalidOperation.")
+    elif error: logger.warning(f"[PARSER_DECIMAL_ERROR] Unexpected error parsing {field_name_for_log} from '{value_text}' (cleaned: '{cleaned_val}'): {message}")
+    return value
+
+def _valid_date(year, month, day):
+    try: return date(year, month, day).strftime('%Y-%m-%d')
+    except ValueError: return None
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _normalize_date(raw_date_str, dayfirst):
+    """('YYYY-MM-DD' or None, error message or None) for one date string."""
+    iso_date = _ISO_DATE.fullmatch(raw_date_str)
+    if iso_date:
+        parsed = _valid_date(int(iso_date.group(1)), int(iso_date.group(2)), int(iso_date.group(3)))
+        if parsed: return parsed, None
+    numeric_date = _NUMERIC_DATE.fullmatch(raw_date_str)
+    if numeric_date:
+        first, second, year = int(numeric_date.group(1)), int(numeric_date.group(3)), int(numeric_date.group(4))
+        # dateutil reads the other way round when the preferred order is impossible (e.g. day first but second part > 12)
+        day, month = (first, second) if (dayfirst and second <= 12) or (not dayfirst and first > 12) else (second, first)
+        parsed = _valid_date(year, month, day) if month <= 12 else None
+        if parsed: return parsed, None
+    try: return date_parser.parse(raw_date_str, dayfirst=dayfirst).strftime('%Y-%m-%d'), None
+    except Exception as e: return None, str(e) or type(e).__name__
+
+def parse_date(raw_date_str, locale=None):
+    """
+    'YYYY-MM-DD' for a Textract date string. '/'-separated dates are read day first unless the document's LocaleHint
+    says otherwise (which also decides '.'/'-'-separated ones). ISO dates are always year-month-day.
+    :raises ValueError: If the string is not a date.
+    """
+    dayfirst = locale.dayfirst if locale is not None and locale.dayfirst is not None else '/' in raw_date_str
+    parsed, error = _normalize_date(raw_date_str, dayfirst)
+    if error: raise ValueError(error)
+    return parsed
+
+def cache_stats():
+    """Memo cache counters, for benchmarks and debugging."""
+    return {name: cached.cache_info()._asdict() for name, cached in (("amounts", _normalize_amount), ("dates", _normalize_date))}
+
+def clear_caches():
+    _normalize_amount.cache_clear(); _normalize_date.cache_clear()
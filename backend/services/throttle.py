@@ -0,0 +1,52 @@
+# backend/services/throttle.py
+import threading
+import time
+
+class TokenBucket:
+    """
+    Thread-safe token bucket used to keep calls to rate-limited AWS APIs (e.g. Textract TPS quotas) under a budget.
+    `rate` tokens are added per second, up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def try_acquire(self, tokens=1):
+        """Takes `tokens` if available right now. Returns True on success, False otherwise."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1, timeout=None):
+        """Blocks until `tokens` are available (or `timeout` seconds pass). Returns True if the tokens were taken."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait_for = (tokens - self._tokens) / self.rate if self.rate > 0 else 0.1
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: return False
+                wait_for = min(wait_for, remaining)
+            time.sleep(wait_for)
+
+    def available(self):
+        """Current number of tokens (for metrics)."""
+        with self._lock:
+            self._refill()
+            return self._tokens
@@ -0,0 +1,244 @@
+# backend/services/tracing.py
+# Request tracing: times DB queries, S3/Textract calls and OpenAI completions per request. Every traced request gets
+# per-kind totals in a Server-Timing header (cheap: a clock read and two additions per span); a sampled share of
+# requests also hands spans slower than TRACE_SLOW_SPAN_MS to the exporter. Background ingestion stages and Textract
+# checks are traced the same way, without the header.
+import re
+import time
+import uuid
+import random
+import logging
+import importlib
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache, partial
+
+logger = logging.getLogger(__name__)
+
+SPAN_KINDS = ('db', 's3', 'textract', 'openai') # Server-Timing order
+MAX_SLOW_SPANS_PER_TRACE = 100 # A pathological request (e.g. N+1 over thousands of rows) exports this many at most
+_REQUEST_ID = re.compile(r'[A-Za-z0-9._:-]{1,64}')
+_current_trace = ContextVar('invox_trace', default=None)
+_active_tracer = None # Set by Tracer.init_app; background_trace uses it
+_span_listeners = [] # Called with every finished span, traced or not (see services/metrics.py)
+
+_SQL_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+_SQL_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SQL_PLACEHOLDER = re.compile(r'%\(\w+\)s|%s')
+_SQL_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SQL_WHITESPACE = re.compile(r'\s+')
+
+@lru_cache(maxsize=1024)
+def sql_fingerprint(query):
+    """The statement with literals and placeholders as '?' and IN lists collapsed, so one query shape is one fingerprint."""
+    fingerprint = _SQL_STRING.sub('?', query or '')
+    fingerprint = _SQL_PLACEHOLDER.sub('?', _SQL_NUMBER.sub('?', fingerprint))
+    fingerprint = _SQL_IN_LIST.sub('(?+)', _SQL_WHITESPACE.sub(' ', fingerprint).strip())
+    return fingerprint[:300]
+
+class _Span:
+    __slots__ = ('trace', 'kind', 'name', 'attrs', 'started_at', 'duration_ms')
+
+    def __init__(self, trace, kind, name, attrs):
+        self.trace = trace; self.kind = kind; self.name = name; self.attrs = attrs
+        self.started_at = 0.0; self.duration_ms = 0.0
+
+    def set(self, **attrs):
+        self.attrs.update(attrs); return self
+
+    def __enter__(self):
+        self.started_at = time.perf_counter(); return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None: self.attrs['error'] = exc_type.__name__
+        self.finish(); return False
+
+    def finish(self):
+        self.duration_ms = (time.perf_counter() - self.started_at) * 1000
+        if self.trace is not None: self.trace.record(self)
+        for listener in _span_listeners:
+            try: listener(self)
+            except Exception as e: logger.error(f"Tracing: Span listener {listener!r} failed: {e}")
+
+class _NullSpan:
+    """Returned when nothing is being traced; every call is a no-op."""
+    __slots__ = ()
+    def set(self, **attrs): return self
+    def __enter__(self): return self
+    def __exit__(self, exc_type, exc, tb): return False
+    def finish(self): pass
+
+_NULL_SPAN = _NullSpan()
+
+class Trace:
+    """Spans of one request (or background job). Per-kind totals always; slow spans only when sampled."""
+
+    def __init__(self, request_id, name, sampled, slow_span_ms):
+        self.request_id = request_id; self.name = name; self.sampled = sampled; self.slow_span_ms = slow_span_ms
+        self.started_at = time.perf_counter(); self.finished = False
+        self.totals = {} # kind -> [count, ms]
+        self.slow_spans = []
+
+    def record(self, span):
+        if self.finished: return # e.g. a streamed response still running after the trace was exported
+        total = self.totals.get(span.kind)
+        if total is None: self.totals[span.kind] = [1, span.duration_ms]
+        else: total[0] += 1; total[1] += span.duration_ms
+        if self.sampled and span.duration_ms >= self.slow_span_ms and len(self.slow_spans) < MAX_SLOW_SPANS_PER_TRACE: self.slow_spans.append(span)
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started_at) * 1000
+
+    def server_timing(self):
+        """Server-Timing header value, e.g. 'db;dur=12.4;desc="7 queries", openai;dur=850.0;desc="1 calls", total;dur=871.2'."""
+        parts = [f'{kind};dur={self.totals[kind][1]:.1f};desc="{self.totals[kind][0]} {"queries" if kind == "db" else "calls"}"' for kind in SPAN_KINDS if kind in self.totals]
+        parts.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ", ".join(parts)
+
+    def to_dict(self, duration_ms):
+        spans = []
+        for span in self.slow_spans:
+            attrs = dict(span.attrs)
+            if 'sql' in attrs: attrs['sql'] = sql_fingerprint(attrs['sql']) # Fingerprinted here, only for exported spans
+            spans.append({"kind": span.kind, "name": span.name, "duration_ms": round(span.duration_ms, 1), "attrs": attrs})
+        return {"request_id": self.request_id, "name": self.name, "duration_ms": round(duration_ms, 1),
+                "totals": {kind: {"count": count, "ms": round(ms, 1)} for kind, (count, ms) in self.totals.items()}, "slow_spans": spans}
+
+def span(kind, name=None, **attrs):
+    """
+    Context manager timing one call in the current trace; `with span('db', sql=query) as s: ...; s.set(rows=n)`.
+    Outside a traced request (and with no span listener) it returns a shared no-op span, so instrumented code needs no checks.
+    """
+    trace = _current_trace.get()
+    if trace is None and not _span_listeners: return _NULL_SPAN
+    return _Span(trace, kind, name or kind, attrs)
+
+def add_span_listener(listener):
+    """Registers listener(span) for every finished span (kind, name, attrs, duration_ms), e.g. to feed metrics."""
+    if listener not in _span_listeners: _span_listeners.append(listener)
+
+def remove_span_listener(listener):
+    if listener in _span_listeners: _span_listeners.remove(listener)
+
+def current_request_id():
+    trace = _current_trace.get()
+    return trace.request_id if trace is not None else None
+
+def _before_boto_call(kind, model=None, context=None, **kwargs):
+    if context is None: return
+    trace_span = span(kind, model.name if model is not None else None)
+    if trace_span is not _NULL_SPAN: context['invox_trace_span'] = trace_span.__enter__()
+
+def _after_boto_call(http_response=None, context=None, **kwargs):
+    trace_span = context.pop('invox_trace_span', None) if context is not None else None
+    if trace_span is None: return
+    status_code = getattr(http_response, 'status_code', None)
+    if status_code is not None: trace_span.set(status=status_code)
+    trace_span.finish()
+
+def _after_boto_call_error(exception=None, context=None, **kwargs):
+    trace_span = context.pop('invox_trace_span', None) if context is not None else None
+    if trace_span is not None: trace_span.set(error=type(exception).__name__); trace_span.finish()
+
+def instrument_boto_client(client, kind):
+    """Registers span hooks on a boto3 client (each API call is one span of `kind`). Returns the client."""
+    if client is None: return client
+    events = client.meta.events
+    events.register('before-call.*.*', partial(_before_boto_call, kind))
+    events.register('after-call.*.*', _after_boto_call)
+    events.register('after-call-error.*.*', _after_boto_call_error)
+    return client
+
+class LogSpanExporter:
+    """Default exporter: one WARNING line per slow span, on the tracing logger."""
+
+    def export(self, trace_record):
+        for slow_span in trace_record["slow_spans"]:
+            attrs = " ".join(f"{key}={value}" for key, value in slow_span["attrs"].items())
+            logger.warning(f"Slow span [{trace_record['request_id']}] {trace_record['name']}: {slow_span['kind']} {slow_span['name']} took {slow_span['duration_ms']:.0f} ms {attrs}".rstrip())
+
+def load_exporter(spec, app_config=None):
+    """
+    Builds the exporter named by TRACE_EXPORTER: 'log', 'none' (None), or 'package.module:factory', where factory(app_config)
+    returns an object with export(trace_record).
+    """
+    spec = (spec or 'log').strip()
+    if spec.lower() == 'none': return None
+    if spec.lower() == 'log': return LogSpanExporter()
+    module_name, _, factory_name = spec.partition(':')
+    if not factory_name: raise ValueError(f"TRACE_EXPORTER must be 'log', 'none' or 'module:factory', got '{spec}'.")
+    return getattr(importlib.import_module(module_name), factory_name)(app_config)
+
+class Tracer:
+    def __init__(self, app_config):
+        self.config = app_config
+        self.enabled = bool(self.config.get('TRACING_ENABLED', True))
+        self.sample_rate = min(1.0, max(0.0, float(self.config.get('TRACE_SAMPLE_RATE', 0.1))))
+        self.slow_span_ms = float(self.config.get('TRACE_SLOW_SPAN_MS', 500))
+        self.server_timing = bool(self.config.get('TRACE_SERVER_TIMING', True))
+        self.exporter = load_exporter(self.config.get('TRACE_EXPORTER', 'log'), app_config)
+        self._stats_lock = threading.Lock()
+        self._stats = {"traces": 0, "sampled": 0, "slow_spans_exported": 0, "export_errors": 0}
+
+    def init_app(self, app):
+        global _active_tracer
+        _active_tracer = self
+        if not self.enabled: return
+        from flask import request, g
+
+        @app.before_request
+        def _start_request_trace():
+            incoming_id = request.headers.get('X-Request-ID', '')
+            request_id = incoming_id if _REQUEST_ID.fullmatch(incoming_id) else uuid.uuid4().hex
+            trace = self.start(request_id, f"{request.method} {request.url_rule.rule if request.url_rule else request.path}")
+            g.trace_token = _current_trace.set(trace)
+
+        @app.after_request
+        def _add_trace_headers(response):
+            trace = _current_trace.get()
+            if trace is None: return response
+            response.headers['X-Request-ID'] = trace.request_id
+            if self.server_timing: response.headers['Server-Timing'] = trace.server_timing()
+            return response
+
+        @app.teardown_request
+        def _finish_request_trace(exc=None):
+            trace = _current_trace.get(); token = g.pop('trace_token', None)
+            if trace is not None: self.finish(trace)
+            if token is not None:
+                try: _current_trace.reset(token)
+                except ValueError: _current_trace.set(None) # Token from another context (streamed response)
+
+    def start(self, request_id, name):
+        sampled = self.sample_rate >= 1.0 or (self.sample_rate > 0.0 and random.random() < self.sample_rate)
+        with self._stats_lock:
+            self._stats["traces"] += 1
+            if sampled: self._stats["sampled"] += 1
+        return Trace(request_id, name, sampled, self.slow_span_ms)
+
+    def finish(self, trace):
+        duration_ms = trace.elapsed_ms(); trace.finished = True
+        if not trace.slow_spans or self.exporter is None: return
+        try:
+            self.exporter.export(trace.to_dict(duration_ms))
+            with self._stats_lock: self._stats["slow_spans_exported"] += len(trace.slow_spans)
+        except Exception as e:
+            with self._stats_lock: self._stats["export_errors"] += 1
+            logger.error(f"Tracer: Exporter {type(self.exporter).__name__} failed for trace {trace.request_id}: {e}")
+
+    def stats(self):
+        with self._stats_lock: counters = dict(self._stats)
+        return {"enabled": self.enabled, "sample_rate": self.sample_rate, "slow_span_ms": self.slow_span_ms,
+                "exporter": type(self.exporter).__name__ if self.exporter else None, **counters}
+
+@contextmanager
+def background_trace(request_id, name):
+    """Traces work outside a request (ingestion stages, Textract checks) with the app's tracer; a no-op without one."""
+    tracer = _active_tracer
+    if tracer is None or not tracer.enabled or _current_trace.get() is not None:
+        yield None; return
+    trace = tracer.start(request_id, name); token = _current_trace.set(trace)
+    try: yield trace
+    finally:
+        _current_trace.reset(token); tracer.finish(trace)
@@ -0,0 +1,111 @@
+# backend/services/vendor_index.py
+# Resolves the vendor strings Textract returns ("DELL INC.", "Dell, Inc", "Dell") to one canonical vendor id
+# (tables vendors / vendor_aliases, migration 011). Names are first reduced to a normalised key (case, accents,
+# punctuation and trailing legal-form suffixes dropped); an exact key hit is a dict lookup, otherwise the closest known
+# key by trigram similarity is taken if it clears the threshold. Business words ("Technologies", "Group") stay in the
+# key: "United Technologies" and "United Group" are different companies, and only the fuzzy match may merge such names. Everything is in memory, so resolving
+# a name at ingest costs microseconds; only a new vendor or alias needs a DB write (see DbService.resolve_vendor_id).
+import re
+import math
+import threading
+import unicodedata
+from collections import defaultdict
+
+# Dropped from the end of a name only, and never the last remaining word ("Services Inc" -> 'services')
+LEGAL_FORM_WORDS = frozenset("""inc incorporated llc llp lp ltd limited corp corporation co company plc gmbh ag kg sa sas sarl srl spa bv nv
+ab as oy pty pvt kk ulc and""".split()) # 'and': left over from '& Co.'
+PLACEHOLDER_NAMES = frozenset(['', 'n/a', 'na', 'none', 'unknown', 'null']) # What the parser (or a user) writes when there is no vendor
+MAX_KEY_LENGTH = 255 # vendors.normalized_key / vendor_aliases.alias_key
+
+_NON_WORD = re.compile(r'[^\w]+', re.UNICODE)
+
+def normalize_vendor_name(name):
+    """
+    The matching key of a vendor name, e.g. 'DELL INC.', 'Dell, Inc' and 'Dell GmbH' -> 'dell'. Dotted
+    initials are joined ('L.L.C.' -> 'llc', 'A.B.C. Corp' -> 'abc'). Returns None for empty / placeholder names.
+    """
+    if not name or str(name).strip().lower() in PLACEHOLDER_NAMES: return None
+    text = unicodedata.normalize('NFKD', str(name).replace('&', ' and ')).encode('ascii', 'ignore').decode('ascii').lower()
+    words = []; after_initial = False
+    for word in _NON_WORD.sub(' ', text.replace('_', ' ')).split():
+        if len(word) == 1 and after_initial: words[-1] += word # Run of initials
+        else: words.append(word)
+        after_initial = len(word) == 1
+    while len(words) > 1 and words[-1] in LEGAL_FORM_WORDS: words.pop()
+    if len(words) > 1 and words[0] == 'the': words.pop(0)
+    return " ".join(words)[:MAX_KEY_LENGTH] or None
+
+def trigrams(key):
+    """Word trigrams of a key, each word padded like pg_trgm ('  d', ' de', 'del', 'ell', 'll ' for 'dell')."""
+    grams = set()
+    for word in key.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+class VendorIndex:
+    """
+    In-memory key -> vendor id map plus a trigram inverted index over the keys, for fuzzy matches.
+    Loaded from vendor_aliases (every vendor's own key is an alias too); add() keeps it current as vendors are created.
+    A fuzzy lookup only walks the posting lists of the key's rarest trigrams: a key with Jaccard similarity >= threshold
+    must share at least one of them (prefix filtering), so common trigrams like ' co' never cost a full list scan.
+    """
+
+    def __init__(self, match_threshold=0.7):
+        self.match_threshold = float(match_threshold)
+        self._lock = threading.Lock()
+        self._vendor_by_key = {}
+        self._keys = [] # Position -> key, for the posting lists
+        self._key_trigrams = [] # Position -> frozenset of the key's trigrams
+        self._postings = defaultdict(list) # trigram -> [key position]
+
+    def __len__(self):
+        return len(self._vendor_by_key)
+
+    def load(self, aliases):
+        """Replaces the index with [(alias_key, vendor_id)]."""
+        vendor_by_key = {}; keys = []; key_trigrams = []; postings = defaultdict(list)
+        for key, vendor_id in aliases:
+            if not key or key in vendor_by_key: continue
+            vendor_by_key[key] = vendor_id; grams = frozenset(trigrams(key))
+            for gram in grams: postings[gram].append(len(keys))
+            keys.append(key); key_trigrams.append(grams)
+        with self._lock: self._vendor_by_key, self._keys, self._key_trigrams, self._postings = vendor_by_key, keys, key_trigrams, postings
+
+    def add(self, key, vendor_id):
+        with self._lock:
+            if key in self._vendor_by_key: return
+            grams = frozenset(trigrams(key)); position = len(self._keys)
+            self._keys.append(key); self._key_trigrams.append(grams) # Before the postings: match() reads them without the lock
+            for gram in grams: self._postings[gram].append(position)
+            self._vendor_by_key[key] = vendor_id
+
+    def get(self, key):
+        """Vendor id of an exact key, or None."""
+        return self._vendor_by_key.get(key)
+
+    def match(self, key):
+        """
+        Best match for a normalised key.
+        :return: (vendor_id, matched key, similarity) with similarity 1.0 for an exact hit, or (None, None, best similarity).
+        """
+        vendor_id = self._vendor_by_key.get(key)
+        if vendor_id is not None: return vendor_id, key, 1.0
+        grams = trigrams(key)
+        if not grams: return None, None, 0.0
+        with self._lock: keys, key_trigrams, postings = self._keys, self._key_trigrams, self._postings
+        threshold = self.match_threshold
+        rarest = sorted(grams, key=lambda gram: len(postings.get(gram, ())))
+        candidates = set()
+        for gram in rarest[:len(grams) - math.ceil(threshold * len(grams)) + 1]: candidates.update(postings.get(gram, ()))
+        best_position = None; best_score = 0.0
+        for position in candidates:
+            candidate_grams = key_trigrams[position]
+            if not threshold * len(grams) <= len(candidate_grams) <= len(grams) / threshold: continue # Can't reach the threshold
+            shared = len(grams & candidate_grams)
+            score = shared / (len(grams) + len(candidate_grams) - shared) # Jaccard similarity of the trigram sets
+            if score > best_score or (score == best_score and best_position is not None and len(keys[position]) < len(keys[best_position])):
+                best_position, best_score = position, score
+        if best_position is None or best_score < threshold: return None, None, best_score
+        best_key = keys[best_position]
+        return self._vendor_by_key[best_key], best_key, best_score
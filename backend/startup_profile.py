@@ -0,0 +1,80 @@
+# backend/startup_profile.py
+# Startup profiling, enabled with STARTUP_PROFILE=true: create_app logs how long each module took to import and each
+# service took to initialise. backend/benchmarks/startup_budget.py uses the same timers to enforce an import budget.
+import sys
+import time
+import builtins
+import logging
+
+class ImportTimer:
+    """
+    Records the wall time of every first-time import made through the import statement (like `python -X importtime`,
+    but readable from inside the process). Self time excludes nested imports. Meant for the single-threaded startup phase.
+    """
+
+    def __init__(self):
+        self.timings = {} # module name -> (self_seconds, cumulative_seconds)
+        self._original_import = None
+        self._child_seconds = [] # Stack: time spent in nested imports of the import being measured
+
+    def start(self):
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._timed_import
+        return self
+
+    def stop(self):
+        if self._original_import is not None and builtins.__import__ == self._timed_import: builtins.__import__ = self._original_import
+        self._original_import = None
+
+    @staticmethod
+    def _absolute_name(name, globals_, level):
+        if level == 0 or not globals_: return name
+        package = globals_.get('__package__') or ''
+        base = package.rsplit('.', level - 1)[0] if level > 1 else package
+        return f"{base}.{name}" if name else base
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        module_name = self._absolute_name(name, globals, level)
+        if module_name in sys.modules: return self._original_import(name, globals, locals, fromlist, level)
+        self._child_seconds.append(0.0); started_at = time.perf_counter()
+        try: return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started_at; nested = self._child_seconds.pop()
+            if self._child_seconds: self._child_seconds[-1] += elapsed
+            self.timings[module_name] = (elapsed - nested, elapsed)
+
+    def by_package(self):
+        """{top-level package: seconds} (self times summed), slowest first."""
+        totals = {}
+        for module_name, (self_seconds, _) in self.timings.items():
+            package = module_name.split('.')[0]; totals[package] = totals.get(package, 0.0) + self_seconds
+        return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+    def total_seconds(self):
+        return sum(self_seconds for self_seconds, _ in self.timings.values())
+
+class StartupProfiler:
+    """Times the steps of create_app: call mark(label) after each step; report() logs steps and import times."""
+
+    def __init__(self, enabled=False, import_timer=None):
+        self.enabled = bool(enabled)
+        self.import_timer = import_timer
+        self.steps = [] # (label, seconds)
+        self._started_at = self._last_mark = time.perf_counter()
+
+    def mark(self, label):
+        now = time.perf_counter()
+        self.steps.append((label, now - self._last_mark)); self._last_mark = now
+
+    def total_seconds(self):
+        return time.perf_counter() - self._started_at
+
+    def report(self, logger=None, top=15):
+        if not self.enabled: return
+        logger = logger or logging.getLogger(__name__)
+        if self.import_timer is not None:
+            self.import_timer.stop()
+            logger.info(f"Startup profile: imports took {self.import_timer.total_seconds() * 1000:.0f} ms (self time by package, top {top}):")
+            for package, seconds in list(self.import_timer.by_package().items())[:top]: logger.info(f"  import {package:<32} {seconds * 1000:8.1f} ms")
+        logger.info(f"Startup profile: create_app took {self.total_seconds() * 1000:.0f} ms:")
+        for label, seconds in self.steps: logger.info(f"  init   {label:<32} {seconds * 1000:8.1f} ms")
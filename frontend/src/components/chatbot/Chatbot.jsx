@@ -34,6 +34,9 @@ const Chatbot = () => {
 
   const messagesEndRef = useRef(null);
   const inputRef = useRef(null); // Ref for the input field
+  const streamAbortRef = useRef(null); // Cancels an in-flight streamed reply
+
+  useEffect(() => () => streamAbortRef.current?.abort(), []);
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
@@ -48,6 +51,7 @@ const Chatbot = () => {
 
   const toggleChat = () => {
     setIsOpen(!isOpen);
+    if (isOpen) streamAbortRef.current?.abort(); // Closing the window stops the generation server-side too
     if (!isOpen) {
       setError(''); 
       // Optionally reset messages if desired on every open:
@@ -70,17 +74,30 @@ const Chatbot = () => {
     setIsLoading(true);
     setError(''); // Clear previous general errors
 
+    const botMessageId = Date.now() + 1;
+    const updateBotMessage = (changes) => setMessages(prevMessages => (
+      prevMessages.some(m => m.id === botMessageId)
+        ? prevMessages.map(m => (m.id === botMessageId ? { ...m, ...changes(m) } : m))
+        : [...prevMessages, { id: botMessageId, sender: 'bot', text: '', ...changes({ text: '' }) }]
+    ));
+    const abortController = new AbortController();
+    streamAbortRef.current = abortController;
+
     try {
-      const response = await chatService.sendMessage(userMessage.text);
-      const botMessage = { id: Date.now() + 1, sender: 'bot', text: response.reply || "I'm not sure how to respond to that." };
-      setMessages(prevMessages => [...prevMessages, botMessage]);
+      await chatService.streamMessage(userMessage.text, {
+        onToken: (text) => { setIsLoading(false); updateBotMessage(m => ({ text: m.text + text })); },
+        onDone: (payload) => updateBotMessage(() => ({ text: payload.reply || "I'm not sure how to respond to that." })),
+        onError: (message) => updateBotMessage(() => ({ text: message, isError: true })),
+      }, { signal: abortController.signal });
     } catch (err) {
+      if (err.name === 'AbortError') return;
       console.error("Chatbot frontend error:", err);
       const errorMessageText = err.message || "Sorry, I couldn't connect to the assistant or an error occurred.";
       const errorBotMessage = { id: Date.now() + 1, sender: 'bot', text: errorMessageText, isError: true };
       setMessages(prevMessages => [...prevMessages, errorBotMessage]);
       // setError(errorMessageText); // Optionally display a more prominent error
     } finally {
+      if (streamAbortRef.current === abortController) streamAbortRef.current = null;
       setIsLoading(false);
       inputRef.current?.focus(); // Re-focus input after sending
     }
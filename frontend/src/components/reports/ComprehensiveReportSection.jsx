@@ -17,15 +17,11 @@ const ComprehensiveReportSection = () => {
     setMessage('');
     setReportMarkdown('');
     try {
-      const result = await reportService.generateComprehensiveOverviewReport();
-      if (result.report_markdown) {
-        setReportMarkdown(result.report_markdown);
-        setMessage(result.message || 'Comprehensive report generated successfully.');
-      } else if (result.error) {
-        setError(result.error + (result.details ? ` (${result.details})` : ''));
-      } else {
-        setError('Unexpected response from server when generating comprehensive report.');
-      }
+      await reportService.streamReport('comprehensive-overview', {}, {
+        onSection: ({ markdown }) => setReportMarkdown(prev => (prev ? `${prev}\n\n${markdown}` : markdown)),
+        onDone: (result) => { setReportMarkdown(result.report_markdown); setMessage('Comprehensive report generated successfully.'); },
+        onError: (errorMessage) => setError(errorMessage),
+      });
     } catch (err) {
       console.error("Comprehensive report generation error:", err);
       setError(err.message || err.error || 'Failed to generate comprehensive report.');
@@ -45,15 +45,12 @@ const MonthlyExpenseReportForm = () => {
       if (vendorFilter.trim()) filters.vendor_name = vendorFilter.trim();
       if (categoryFilter.trim()) filters.category = categoryFilter.trim();
 
-      const result = await reportService.generateMonthlyExpenseReport(year, month, filters);
-      if (result.report_markdown) {
-        setReportMarkdown(result.report_markdown);
-        setMessage(result.message || 'Report generated successfully.');
-      } else if (result.error) {
-        setError(result.error + (result.details ? ` (${result.details})` : ''));
-      } else {
-        setError('Unexpected response from server.');
-      }
+      // Sections render as the model writes them; the final event carries the complete (persisted) report
+      await reportService.streamReport('monthly-expense', { year, month, ...filters }, {
+        onSection: ({ markdown }) => setReportMarkdown(prev => (prev ? `${prev}\n\n${markdown}` : markdown)),
+        onDone: (result) => { setReportMarkdown(result.report_markdown); setMessage('Report generated successfully.'); },
+        onError: (errorMessage) => setError(errorMessage),
+      });
     } catch (err) {
       console.error("Report generation error:", err);
       setError(err.message || err.error || 'Failed to generate report.');
@@ -40,15 +40,18 @@ const DashboardPage = () => {
       console.log("DashboardPage: Initiating data fetch...");
 
       const results = await Promise.allSettled([
-        analyticsService.getSummary(),
-        analyticsService.getExpensesByVendor(5),
-        analyticsService.getExpensesByCategory(5),
-        analyticsService.getMonthlySpend(),
+        analyticsService.getDashboard({ top: 5 }),
         analyticsService.getOpenAIDashboardSummary(),
       ]);
 
       console.log("DashboardPage: Promise.allSettled results:", JSON.parse(JSON.stringify(results)));
-      const [summaryRes, vendorRes, categoryRes, monthlyRes, aiSummaryRes] = results;
+      const [dashboardRes, aiSummaryRes] = results;
+      // One dashboard response carries every block; split it back into per-block results for the handlers below
+      const dashboardBlock = (key) => dashboardRes.status === 'fulfilled' ? { status: 'fulfilled', value: dashboardRes.value?.[key] } : dashboardRes;
+      const summaryRes = dashboardBlock('summary');
+      const vendorRes = dashboardBlock('expenses_by_vendor');
+      const categoryRes = dashboardBlock('expenses_by_category');
+      const monthlyRes = dashboardBlock('monthly_spend');
 
       // Process Summary
       if (summaryRes.status === 'fulfilled' && summaryRes.value) {
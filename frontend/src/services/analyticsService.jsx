@@ -4,6 +4,20 @@ import axios from 'axios';
 const API_BASE_URL = 'http://localhost:5000/api/analytics';
 
 const analyticsService = {
+  // Summary, top vendors/categories, monthly trend and status counts in one request. from/to: 'YYYY-MM' or 'YYYY-MM-DD'.
+  getDashboard: async ({ from = null, to = null, top = 5 } = {}) => {
+    try {
+      const params = { top };
+      if (from) params.from = from;
+      if (to) params.to = to;
+      const response = await axios.get(`${API_BASE_URL}/dashboard`, { params });
+      return response.data;
+    } catch (error) {
+      console.error('Error fetching dashboard analytics:', error);
+      throw error.response?.data || error;
+    }
+  },
+
   getSummary: async () => {
     try {
       const response = await axios.get(`${API_BASE_URL}/summary`);
@@ -1,5 +1,6 @@
 // frontend/src/services/chatService.js
 import axios from 'axios';
+import { postEventStream } from './eventStream';
 
 const API_BASE_URL = 'http://localhost:5000/api'; // Your Flask backend URL
 
@@ -20,6 +21,15 @@ const chatService = {
       throw new Error(error.message || 'Failed to send message or get reply from chat assistant.');
     }
   },
+
+  // Streams the reply as server-sent events. handlers: { onNlu, onContext, onToken(text), onDone(payload), onError(message) }.
+  // Pass an AbortController's signal to cancel; the backend then stops the OpenAI generation as well.
+  streamMessage: (message, handlers = {}, { signal, sessionId = 'default_session' } = {}) => postEventStream(
+    `${API_BASE_URL}/chat/`,
+    { message, session_id: sessionId },
+    { nlu: handlers.onNlu, context: handlers.onContext, token: (data) => handlers.onToken?.(data.text), done: handlers.onDone, error: (data) => handlers.onError?.(data.message) },
+    { signal },
+  ),
 };
 
 export default chatService;
\ No newline at end of file
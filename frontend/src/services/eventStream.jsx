@@ -0,0 +1,36 @@
+// frontend/src/services/eventStream.js
+// Minimal server-sent events reader for POST endpoints (EventSource only supports GET).
+
+// Posts `body` to `url` and calls handlers[eventName](data) for every event (data is parsed JSON).
+// Resolves when the stream ends; pass an AbortController's signal to cancel.
+export const postEventStream = async (url, body, handlers = {}, { signal } = {}) => {
+  const response = await fetch(url, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+    body: JSON.stringify({ ...body, stream: true }),
+    signal,
+  });
+  if (!response.ok || !response.body) {
+    const data = await response.json().catch(() => ({}));
+    throw new Error(data.error || data.reply || `Request failed (${response.status}).`);
+  }
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = 'message'; let data = '';
+      frame.split('\n').forEach((line) => {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      });
+      if (data) handlers[event]?.(JSON.parse(data));
+    }
+  }
+};
@@ -22,6 +22,23 @@ const invoiceService = {
     }
   },
 
+  // Keyset-paginated list: pass the nextCursor from the previous page to get the next one (null when there are no more)
+  getInvoicesPage: async ({ cursor = null, limit = 100, fields = null } = {}) => {
+    try {
+      const params = { limit };
+      if (cursor) params.cursor = cursor;
+      if (fields) params.fields = Array.isArray(fields) ? fields.join(',') : fields;
+      const response = await axios.get(`${API_BASE_URL}/invoices/`, { params });
+      return {
+        invoices: Array.isArray(response.data) ? response.data : [],
+        nextCursor: response.headers['x-next-cursor'] || null,
+      };
+    } catch (error) {
+      console.error('Error fetching invoice page from invoiceService:', error.response || error);
+      throw error.response?.data || error;
+    }
+  },
+
   getInvoiceById: async (id) => {
     try {
       const response = await axios.get(`${API_BASE_URL}/invoices/${id}`);
@@ -1,5 +1,6 @@
 // frontend/src/services/reportService.js
 import axios from 'axios';
+import { postEventStream } from './eventStream';
 
 const API_BASE_URL = 'http://localhost:5000/api/reports'; // Base URL for report endpoints
 
@@ -37,6 +38,21 @@ const reportService = {
   }
   // --- END ADDED FUNCTION ---
 
+  // Streams a report as it is written. reportType: 'monthly-expense' (payload: year, month, filters) or 'comprehensive-overview'.
+  // handlers: { onSection({ index, markdown }), onHeartbeat, onDone({ report_id, report_markdown }), onError(message) }.
+  streamReport: (reportType, payload = {}, handlers = {}, { signal } = {}) => postEventStream(
+    `${API_BASE_URL}/generate/${reportType}`,
+    payload,
+    { section: handlers.onSection, heartbeat: handlers.onHeartbeat, done: handlers.onDone, error: (data) => handlers.onError?.(data.details ? `${data.message} (${data.details})` : data.message) },
+    { signal },
+  ),
+
+  // Fetches a previously generated report by id
+  getReport: async (reportId) => {
+    const response = await axios.get(`${API_BASE_URL}/${reportId}`);
+    return response.data;
+  },
+
   // Placeholder for PDF export later
   // downloadMonthlyExpenseReportPDF: async (year, month, filters = {}) => { /* ... */ }
 };
@@ -0,0 +1,27 @@
+# tests/test_startup_budget.py
+# Startup regression checks, run from the project root with: python -m pytest tests
+# Each check starts a fresh interpreter, so modules imported by pytest itself or by other tests can't hide a regression.
+import os
+import sys
+import subprocess
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+STARTUP_BUDGET_MS = os.environ.get('STARTUP_BUDGET_MS', '600') # Raise on slow CI machines instead of editing the check
+
+def run_python(*args):
+    env = {**os.environ, 'FLASK_ENV': 'testing', 'PRELOAD_CLIENTS': 'false'}
+    return subprocess.run([sys.executable, *args], cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, timeout=120)
+
+def test_create_app_does_not_import_deferred_sdks():
+    """`-X importtime` lists every module the interpreter imported while building the app."""
+    from backend.benchmarks.startup_budget import DEFERRED_MODULES
+    result = run_python('-X', 'importtime', '-c', 'from backend.app import create_app; create_app()')
+    assert result.returncode == 0, result.stderr[-2000:]
+    imported = {line.rsplit('|', 1)[-1].strip() for line in result.stderr.splitlines() if line.startswith('import time:')}
+    eager = [name for name in DEFERRED_MODULES if name in imported]
+    assert not eager, f"imported at startup but should be deferred to first use: {', '.join(eager)}"
+
+def test_startup_within_budget():
+    result = run_python('-m', 'backend.benchmarks.startup_budget', '--budget-ms', STARTUP_BUDGET_MS)
+    assert result.returncode == 0, result.stdout + result.stderr[-2000:]